@@ -0,0 +1,92 @@
+"""
+Auth Cache
+Short-lived in-process cache of users and OAuth sessions for get_current_user.
+
+get_current_user runs on almost every request and used to read the user
+(and for OAuth session tokens, the session and then the user) from MongoDB
+each time. AuthCache keeps both in bounded TTL caches:
+
+    users:     user_id -> user fields (only the fields of the User model)
+    sessions:  session_token -> (user_id, expires_at)
+
+Write-through invalidation: every write to a cached user field (profile,
+subscription, usage counters, deletion) calls invalidate_user(), and logout
+calls invalidate_session(), so this process never serves a value older than
+its own last write. A lookup that started before an invalidation does not
+store its (possibly old) result. Other server processes only see the write
+once their entry expires, which bounds staleness there to the TTL.
+
+Misses (unknown user, unknown or expired session) are not cached, so a
+newly created user or session is found on the next request.
+"""
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, Optional
+
+from cachetools import TTLCache
+
+DEFAULT_TTL_SECONDS = 30
+DEFAULT_MAX_ENTRIES = 10_000
+
+
+class AuthCache:
+    """TTL cache of users and sessions, read through from MongoDB"""
+
+    def __init__(
+        self,
+        db,
+        fields: Iterable[str],
+        ttl: float = DEFAULT_TTL_SECONDS,
+        maxsize: int = DEFAULT_MAX_ENTRIES,
+    ):
+        self.db = db
+        self.projection = {"_id": 0, **{field: 1 for field in fields}}
+        self.users: TTLCache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.sessions: TTLCache = TTLCache(maxsize=maxsize, ttl=ttl)
+        # Bumped by every invalidation; lookups that overlap one are not stored
+        self._generation = 0
+
+    async def user(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """The user's fields, or None if there is no such user. Treat the result as read-only."""
+        cached = self.users.get(user_id)
+        if cached is not None:
+            return cached
+        generation = self._generation
+        user = await self.db.users.find_one({"user_id": user_id}, self.projection)
+        if user is not None and generation == self._generation:
+            self.users[user_id] = user
+        return user
+
+    async def session_user_id(self, token: str) -> Optional[str]:
+        """user_id of an unexpired OAuth session, or None"""
+        session = self.sessions.get(token)
+        if session is None:
+            generation = self._generation
+            row = await self.db.user_sessions.find_one(
+                {"session_token": token}, {"_id": 0, "user_id": 1, "expires_at": 1}
+            )
+            if not row or not row.get("expires_at"):
+                return None
+            expires_at = row["expires_at"]
+            if expires_at.tzinfo is None:
+                expires_at = expires_at.replace(tzinfo=timezone.utc)
+            session = (row["user_id"], expires_at)
+            if generation == self._generation:
+                self.sessions[token] = session
+        user_id, expires_at = session
+        if expires_at <= datetime.now(timezone.utc):
+            self.sessions.pop(token, None)
+            return None
+        return user_id
+
+    def invalidate_user(self, user_id: str) -> None:
+        self._generation += 1
+        self.users.pop(user_id, None)
+
+    def invalidate_session(self, token: str) -> None:
+        self._generation += 1
+        self.sessions.pop(token, None)
+
+    def clear(self) -> None:
+        self._generation += 1
+        self.users.clear()
+        self.sessions.clear()
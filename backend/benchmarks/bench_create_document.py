@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Benchmark: create_document page processing, serial vs. concurrent.
+
+Uses real thumbnail generation on synthetic scans and a fake object store
+with fixed upload latency, so document-create latency can be compared
+against page count without MongoDB or S3. Blob metadata (BlobStore) lives
+in mongomock.
+
+Usage:
+    python benchmarks/bench_create_document.py [--pages 1 5 20] [--latency-ms 40]
+"""
+import argparse
+import asyncio
+import base64
+import os
+import sys
+import time
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+
+import mongomock
+import numpy as np
+from PIL import Image
+
+import server
+from blob_store import BlobStore
+from storage import MemoryStorage
+
+
+class SlowMemoryStorage(MemoryStorage):
+    """In-memory backend with simulated network latency per upload"""
+
+    def __init__(self, latency: float):
+        super().__init__(base_url="https://bench.invalid")
+        self.latency = latency
+
+    async def put_object(self, key, data, content_type="image/jpeg"):
+        await asyncio.sleep(self.latency)
+        return await super().put_object(key, data, content_type)
+
+
+class MemoryCollection:
+    """mongomock collection with the awaitable methods BlobStore uses"""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def __getattr__(self, name):
+        method = getattr(self.collection, name)
+
+        async def call(*args, **kwargs):
+            return method(*args, **kwargs)
+        return call
+
+
+class MemoryDB:
+    def __init__(self):
+        self._db = mongomock.MongoClient().bench
+
+    def __getattr__(self, name):
+        return MemoryCollection(self._db[name])
+
+
+def make_scan(seed=0, width=1700, height=2200) -> str:
+    noise = np.random.default_rng(seed).integers(0, 255, (height // 8, width // 8, 3), dtype=np.uint8)
+    image = Image.fromarray(noise).resize((width, height))
+    buffer = BytesIO()
+    image.save(buffer, format="JPEG", quality=85)
+    return base64.b64encode(buffer.getvalue()).decode()
+
+
+async def process_serial(pages, user_id, document_id):
+    # Previous behaviour: thumbnail inline, uploads one after another
+    for i, page in enumerate(pages):
+        thumb = server.create_thumbnail(page.image_base64)
+        await server.upload_to_s3(page.image_base64, user_id, document_id, f"p{i}", "page")
+        await server.upload_to_s3(thumb, user_id, document_id, f"p{i}", "thumbnail")
+
+
+async def process_concurrent(pages, user_id, document_id):
+    semaphore = asyncio.Semaphore(server.PAGE_PROCESSING_CONCURRENCY)
+
+    async def bounded(i, page):
+        async with semaphore:
+            return await server.process_new_page(page, i, user_id, document_id)
+
+    return await asyncio.gather(*(bounded(i, page) for i, page in enumerate(pages)))
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, nargs="+", default=[1, 5, 10, 20])
+    parser.add_argument("--latency-ms", type=float, default=40.0)
+    args = parser.parse_args()
+
+    server.object_storage = SlowMemoryStorage(args.latency_ms / 1000)
+    server.blob_store = BlobStore(MemoryDB(), server.object_storage)
+    seeds = iter(range(1_000_000))
+    print(f"S3 latency {args.latency_ms:.0f}ms, image pool={server.IMAGE_PROCESSING_WORKERS}, "
+          f"page concurrency={server.PAGE_PROCESSING_CONCURRENCY}")
+    print(f"{'pages':>5} {'serial':>10} {'concurrent':>12}")
+    for count in args.pages:
+        # Distinct scans per run: identical bytes would only be uploaded once
+        pages = [server.PageData(image_base64=make_scan(next(seeds))) for _ in range(count)]
+        start = time.perf_counter()
+        await process_serial(pages, "bench", "doc")
+        serial = time.perf_counter() - start
+        pages = [server.PageData(image_base64=make_scan(next(seeds))) for _ in range(count)]
+        start = time.perf_counter()
+        await process_concurrent(pages, "bench", "doc")
+        concurrent = time.perf_counter() - start
+        print(f"{count:>5} {serial * 1000:>8.0f}ms {concurrent * 1000:>10.0f}ms")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Benchmark: GET /folders latency against folder count.
+
+Compares the old listing (find folders, then count_documents per folder)
+with folders.list_folders() (find folders and one $group aggregation,
+concurrently). Runs on mongomock with a simulated round-trip time per
+database call, so the number of sequential round trips shows up as it
+would against a remote MongoDB; pass --mongo-url to measure a real server
+instead (uses a scratch database that is dropped afterwards). mongomock's
+aggregation runs in Python and is far slower than the server's, so keep
+--documents small there and read the round-trip column.
+
+Usage:
+    python benchmarks/bench_folders.py [--folders 1 10 50 200] [--documents 300] [--rtt-ms 2] [--repeat 5]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from folders import list_folders
+
+USER_ID = "user_bench"
+
+
+class SlowCursor:
+    def __init__(self, cursor, rtt: float):
+        self.cursor = cursor
+        self.rtt = rtt
+
+    async def to_list(self, length=None):
+        await asyncio.sleep(self.rtt)
+        return list(self.cursor)
+
+    def __aiter__(self):
+        return self._rows()
+
+    async def _rows(self):
+        await asyncio.sleep(self.rtt)
+        for row in self.cursor:
+            yield row
+
+
+class SlowCollection:
+    """mongomock collection with a simulated network round trip per call"""
+
+    def __init__(self, collection, rtt: float):
+        self.collection = collection
+        self.rtt = rtt
+
+    def find(self, *args, **kwargs):
+        return SlowCursor(self.collection.find(*args, **kwargs), self.rtt)
+
+    def aggregate(self, pipeline):
+        return SlowCursor(self.collection.aggregate(pipeline), self.rtt)
+
+    async def count_documents(self, query):
+        await asyncio.sleep(self.rtt)
+        return self.collection.count_documents(query)
+
+
+class SlowDB:
+    def __init__(self, db, rtt: float):
+        self._db = db
+        self.rtt = rtt
+        self.calls = 0
+
+    def __getattr__(self, name):
+        self.calls += 1
+        return SlowCollection(self._db[name], self.rtt)
+
+
+async def old_listing(db, user_id: str):
+    folders = await db.folders.find({"user_id": user_id}, {"_id": 0}).to_list(1000)
+    for folder in folders:
+        folder["document_count"] = await db.documents.count_documents(
+            {"user_id": user_id, "folder_id": folder["folder_id"]}
+        )
+    return folders
+
+
+def seed(raw, document_count: int, folder_count: int):
+    """Folders for one user; every fifth document sits at the root"""
+    raw.folders.delete_many({})
+    raw.documents.delete_many({})
+    raw.folders.insert_many([
+        {"folder_id": f"folder_{i}", "user_id": USER_ID, "name": f"Folder {i}"} for i in range(folder_count)
+    ])
+    raw.documents.insert_many([
+        {"document_id": f"doc_{i}", "user_id": USER_ID, "folder_id": f"folder_{i % folder_count}" if i % 5 else None}
+        for i in range(document_count)
+    ])
+
+
+async def timed(fn, db, repeat: int):
+    calls = getattr(db, "calls", 0)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = await fn(db, USER_ID)
+    elapsed = (time.perf_counter() - start) / repeat * 1000
+    return result, elapsed, (getattr(db, "calls", 0) - calls) // repeat
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--folders", type=int, nargs="+", default=[1, 10, 50, 200])
+    parser.add_argument("--documents", type=int, default=300)
+    parser.add_argument("--rtt-ms", type=float, default=2.0, help="simulated round trip per database call")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--mongo-url", help="measure against a real MongoDB instead of mongomock")
+    args = parser.parse_args()
+
+    if args.mongo_url:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        client = AsyncIOMotorClient(args.mongo_url)
+        db = client["bench_folders"]
+        await db.documents.create_index([("user_id", 1), ("folder_id", 1), ("updated_at", -1)])
+        await db.folders.create_index("user_id")
+        raw = client.delegate["bench_folders"]
+        print(f"MongoDB at {args.mongo_url}, {args.documents} documents")
+    else:
+        import mongomock
+        raw = mongomock.MongoClient().db
+        db = SlowDB(raw, args.rtt_ms / 1000)
+        print(f"mongomock with {args.rtt_ms} ms simulated round trip, {args.documents} documents")
+
+    print(f"\n{'folders':>8} {'per-folder count':>24} {'one aggregation':>24} {'speedup':>8}")
+    try:
+        for folder_count in args.folders:
+            seed(raw, args.documents, folder_count)
+            old, old_ms, old_calls = await timed(old_listing, db, args.repeat)
+            new, new_ms, new_calls = await timed(list_folders, db, args.repeat)
+            assert {f["folder_id"]: f["document_count"] for f in old} == {f["folder_id"]: f["document_count"] for f in new}
+            print(
+                f"{folder_count:>8} {old_ms:>10.1f} ms {old_calls:>5} calls "
+                f"{new_ms:>10.1f} ms {new_calls:>5} calls {old_ms / new_ms:>7.1f}x"
+            )
+    finally:
+        if args.mongo_url:
+            await client.drop_database("bench_folders")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
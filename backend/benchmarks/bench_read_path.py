@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Benchmark: CPU and allocations per request on the document read paths.
+
+Compares the old path (Document(**row), then FastAPI's response_model
+validation and serialization, then rendering) with trusted_response()
+(shape the row to the model, render directly) on rows as they come out of
+MongoDB, without a database:
+
+- GET /documents/{id}            one document, pages with inline base64 images
+- GET /documents?include...      a document list, page metadata only
+- POST /documents/batch          50 documents with thumbnails
+
+Reports CPU time (process_time) and peak traced allocations per request.
+
+Usage:
+    python benchmarks/bench_read_path.py [--documents 200] [--pages 5] [--image-kb 300] [--repeat 10]
+"""
+import argparse
+import asyncio
+import base64
+import os
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from typing import List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+
+import server
+from http_encoding import FastJSONResponse
+from trusted_models import trusted_response
+
+
+def document_row(i: int, pages: int, image_kb: int = 0, thumbnails: bool = False):
+    # Naive datetimes, _id and search fields: a row as Motor returns it
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    image = base64.b64encode(os.urandom(image_kb * 1024)).decode() if image_kb else None
+    thumbnail = base64.b64encode(os.urandom(8 * 1024)).decode() if thumbnails else None
+    return {
+        "_id": f"{i:024x}", "document_id": f"doc_{i:08x}", "user_id": "user_bench", "name": f"Scan {i}",
+        "folder_id": None, "tags": ["receipts"], "ocr_full_text": "Lorem ipsum dolor sit amet " * 20,
+        "search_grams": ["lor", "ore", "rem"], "pages_split": True, "is_password_protected": False,
+        "storage_type": "s3", "has_watermark": False, "version": 3, "created_at": now, "updated_at": now,
+        "pages": [
+            {
+                "page_id": f"page_{i}_{p}", "image_base64": image, "thumbnail_base64": thumbnail,
+                "image_url": None if image else f"https://cdn.example.com/blobs/sha256/ab/{i:064x}.jpg",
+                "ocr_text": "Lorem ipsum dolor sit amet, total 123.45 EUR " * 8,
+                "ocr_words": {"v": 1, "w": [["total", 10, 20, 30, 40]] * 40},
+                "filter_applied": "original", "rotation": 0, "order": p, "created_at": now,
+            }
+            for p in range(pages)
+        ],
+    }
+
+
+async def old_path(field, rows):
+    if isinstance(rows, list):
+        content = [server.Document(**row) for row in rows]
+    else:
+        content = server.Document(**rows)
+    return FastJSONResponse(await serialize_response(field=field, response_content=content)).body
+
+
+async def new_path(field, rows):
+    return trusted_response(server.Document, rows).body
+
+
+async def measure(fn, field, rows, repeat: int):
+    start = time.process_time()
+    for _ in range(repeat):
+        body = await fn(field, rows)
+    cpu_ms = (time.process_time() - start) / repeat * 1000
+    tracemalloc.start()
+    await fn(field, rows)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return body, cpu_ms, peak
+
+
+async def bench(label: str, rows, repeat: int):
+    many = isinstance(rows, list)
+    field = create_response_field(name="response", type_=List[server.Document] if many else server.Document)
+    old_body, old_ms, old_peak = await measure(old_path, field, rows, repeat)
+    new_body, new_ms, new_peak = await measure(new_path, field, rows, repeat)
+    print(f"\n{label}: {len(new_body) / 1024:,.0f} KB JSON")
+    print(f"  response_model validation  {old_ms:8.2f} ms CPU  {old_peak / 1024 / 1024:8.1f} MB peak")
+    print(f"  trusted_response           {new_ms:8.2f} ms CPU  {new_peak / 1024 / 1024:8.1f} MB peak")
+    print(f"  {old_ms / new_ms:.1f}x less CPU, {old_peak / max(new_peak, 1):.1f}x less allocation")
+    if len(old_body) != len(new_body):
+        print(f"  ! body sizes differ: {len(old_body)} vs {len(new_body)}")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--documents", type=int, default=200, help="documents in the list")
+    parser.add_argument("--pages", type=int, default=5, help="pages per document")
+    parser.add_argument("--image-kb", type=int, default=300, help="decoded image size of inline pages")
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    await bench(
+        f"GET /documents/{{id}} ({args.pages} pages x {args.image_kb} KB inline)",
+        document_row(0, args.pages, args.image_kb), args.repeat,
+    )
+    await bench(
+        f"GET /documents ({args.documents} documents x {args.pages} pages, image URLs)",
+        [document_row(i, args.pages) for i in range(args.documents)], args.repeat,
+    )
+    await bench(
+        f"POST /documents/batch (50 documents x {args.pages} pages, thumbnails)",
+        [document_row(i, args.pages, thumbnails=True) for i in range(50)], args.repeat,
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
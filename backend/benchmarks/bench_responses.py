@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Benchmark: JSON rendering and compression of the largest API responses.
+
+Builds realistic payloads without MongoDB: the sync manifest, a document
+list (Document models with page metadata, as returned by GET /documents
+with include_images=false) and the full /translations bundle. For each it
+compares stdlib JSONResponse rendering with FastJSONResponse and reports
+compressed size and time for gzip and (if installed) brotli.
+
+Usage:
+    python benchmarks/bench_responses.py [--documents 1000] [--pages 5] [--repeat 20]
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+
+from fastapi.encoders import jsonable_encoder
+from starlette.responses import JSONResponse
+
+import http_encoding
+import server
+from http_encoding import FastJSONResponse, compress
+
+
+def manifest(documents: int):
+    now = datetime.now(timezone.utc)
+    return {
+        "server_time": now.isoformat(),
+        "count": documents,
+        "documents": [
+            {
+                "document_id": f"doc_{i:08x}", "name": f"Invoice {i}", "folder_id": f"folder_{i % 7}",
+                "updated_at": now - timedelta(minutes=i), "created_at": now - timedelta(days=1),
+                "page_count": 3, "tags": ["work", "tax"], "is_password_protected": False,
+            }
+            for i in range(documents)
+        ],
+    }
+
+
+def document_list(documents: int, pages: int):
+    now = datetime.now(timezone.utc)
+    return [
+        server.Document(
+            document_id=f"doc_{i:08x}", user_id="user_bench", name=f"Scan {i}", tags=["receipts"],
+            pages=[
+                server.PageData(
+                    page_id=f"page_{i}_{p}", image_url=f"https://cdn.example.com/blobs/sha256/ab/{i:064x}.jpg",
+                    thumbnail_url=f"https://cdn.example.com/blobs/sha256/cd/{p:064x}.jpg",
+                    ocr_text="Lorem ipsum dolor sit amet, total 123.45 EUR " * 8, order=p,
+                )
+                for p in range(pages)
+            ],
+            ocr_full_text="Lorem ipsum dolor sit amet " * 20, created_at=now, updated_at=now,
+        )
+        for i in range(documents)
+    ]
+
+
+def timed(fn, repeat: int):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return result, (time.perf_counter() - start) / repeat * 1000
+
+
+def bench(label: str, content, repeat: int):
+    encoded, encode_ms = timed(lambda: jsonable_encoder(content), repeat)
+    std_body, std_ms = timed(lambda: JSONResponse(encoded).body, repeat)
+    fast_body, fast_ms = timed(lambda: FastJSONResponse(encoded).body, repeat)
+    print(f"\n{label}: {len(std_body) / 1024:,.0f} KB JSON")
+    print(f"  jsonable_encoder      {encode_ms:8.2f} ms")
+    print(f"  render stdlib         {std_ms:8.2f} ms")
+    print(f"  render FastJSON       {fast_ms:8.2f} ms  ({'orjson' if http_encoding.orjson else 'stdlib fallback'})")
+    encodings = ["gzip"] + (["br"] if http_encoding.brotli else [])
+    for encoding in encodings:
+        compressed, ms = timed(lambda: compress(fast_body, encoding), max(1, repeat // 4))
+        print(f"  {encoding:<5} {len(compressed) / 1024:8,.0f} KB ({len(compressed) / len(fast_body):5.1%})  {ms:8.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--documents", type=int, default=1000, help="documents in manifest / list")
+    parser.add_argument("--pages", type=int, default=5, help="pages per listed document")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    bench(f"GET /documents/manifest ({args.documents} documents)", manifest(args.documents), args.repeat)
+    bench(
+        f"GET /documents ({args.documents} documents x {args.pages} pages, no images)",
+        document_list(args.documents, args.pages), max(1, args.repeat // 4),
+    )
+    bench("GET /translations (all languages)", {
+        "languages": list(server.DEFAULT_TRANSLATIONS),
+        "default_language": "en",
+        "translations": server.DEFAULT_TRANSLATIONS,
+    }, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
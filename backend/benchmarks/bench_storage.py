@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Benchmark: blocking boto3 calls vs. the async object-storage layer
+under concurrent document creation.
+
+Runs offline against a fake S3 client with fixed per-request latency, so the
+numbers isolate event-loop behaviour rather than network variance.
+
+Usage:
+    python benchmarks/bench_storage.py [--docs 20] [--pages 10] [--latency-ms 40]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage import S3Storage
+
+
+class FakeS3Client:
+    """Stands in for boto3's S3 client; each call blocks for `latency` seconds"""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    def put_object(self, **kwargs):
+        time.sleep(self.latency)
+        return {"ETag": '"fake"'}
+
+
+async def measure_loop_lag(stop: asyncio.Event, samples: list, interval: float = 0.005):
+    """Record how late the event loop wakes a periodic task"""
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        start = loop.time()
+        await asyncio.sleep(interval)
+        samples.append(loop.time() - start - interval)
+
+
+async def create_document_blocking(client: FakeS3Client, pages: int):
+    # Old path: synchronous boto3 call directly inside the async handler
+    for i in range(pages):
+        client.put_object(Key=f"page_{i}.jpg", Body=b"x")
+        client.put_object(Key=f"thumbnail_{i}.jpg", Body=b"x")
+
+
+async def create_document_async(storage: S3Storage, pages: int):
+    for i in range(pages):
+        await storage.put_object(f"page_{i}.jpg", b"x")
+        await storage.put_object(f"thumbnail_{i}.jpg", b"x")
+
+
+async def run(label: str, make_coro, docs: int):
+    stop = asyncio.Event()
+    lag: list = []
+    monitor = asyncio.create_task(measure_loop_lag(stop, lag))
+    start = time.perf_counter()
+    await asyncio.gather(*(make_coro() for _ in range(docs)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await monitor
+    worst_lag = max(lag) * 1000 if lag else float("nan")
+    print(f"{label:<10} total={elapsed:7.3f}s  per-doc={elapsed / docs * 1000:8.1f}ms  max loop lag={worst_lag:8.1f}ms")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--docs", type=int, default=20, help="concurrent document creations")
+    parser.add_argument("--pages", type=int, default=10, help="pages per document")
+    parser.add_argument("--latency-ms", type=float, default=40.0, help="simulated S3 round trip")
+    parser.add_argument("--pool", type=int, default=50, help="connection pool size")
+    args = parser.parse_args()
+
+    fake = FakeS3Client(args.latency_ms / 1000)
+    storage = S3Storage("bench", "us-east-1", "x", "x", max_connections=args.pool)
+    storage.client = fake
+
+    print(f"{args.docs} concurrent documents x {args.pages} pages, {args.latency_ms:.0f}ms per S3 call")
+    await run("blocking", lambda: create_document_blocking(fake, args.pages), args.docs)
+    await run("async", lambda: create_document_async(storage, args.pages), args.docs)
+    storage.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,319 @@
+"""
+Blob Store
+Content-addressed, reference-counted page image storage.
+
+Images are stored once per SHA-256 digest under blob_key(digest). Every use
+of an image is a reference: one row per (document, page, role), where role is
+page / thumbnail / original. Storing bytes that already exist is a metadata
+update only, and re-storing the same page (sync retries) is a no-op.
+Writes that change or clear a role's URL without store() (base64 fallback,
+client-supplied pages, watermark removal) call sync_refs() afterwards.
+
+Collections:
+    blobs:     {hash, key, size, content_type, ref_count, state, created_at, last_used_at}
+    blob_refs: {ref_id, hash, user_id, document_id, page_id, role, created_at}
+
+Safety: releasing references never deletes objects directly. A blob whose
+ref_count reached 0 is only collected after GRACE_PERIOD without use, and
+collection first flips it to state "deleting" under the condition that it is
+still unreferenced. store() only reuses blobs in state "active", so a blob
+can never gain a reference while its object is being removed.
+"""
+import asyncio
+import hashlib
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from storage import ObjectStorage, blob_key
+
+logger = logging.getLogger(__name__)
+
+ACTIVE = "active"
+DELETING = "deleting"
+
+GRACE_PERIOD = timedelta(hours=1)
+GC_INTERVAL_SECONDS = 600
+GC_BATCH_SIZE = 1000
+# How long store() waits for a blob that is being garbage collected
+DELETING_WAIT_SECONDS = 5.0
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+# Reference role -> page field holding that role's URL
+ROLE_URLS = {"page": "image_url", "thumbnail": "thumbnail_url", "original": "original_image_url"}
+
+
+def _ref_id(document_id: str, page_id: str, role: str) -> str:
+    return f"{document_id}:{page_id}:{role}"
+
+
+class BlobStore:
+    """Stores page images by content hash and tracks who references them"""
+
+    def __init__(self, db, storage: ObjectStorage):
+        self.db = db
+        self.storage = storage
+        self._task: Optional[asyncio.Task] = None
+        self.uploads = 0
+        self.dedup_hits = 0
+        self.bytes_deduplicated = 0
+
+    # ---------- storing ----------
+
+    async def _ensure_blob(self, digest: str, data: bytes, content_type: str) -> str:
+        """Make sure the object for `digest` exists. Returns its key."""
+        key = blob_key(digest)
+        waited = 0.0
+        while True:
+            now = _now()
+            existing = await self.db.blobs.find_one_and_update(
+                {"hash": digest, "state": ACTIVE},
+                {"$set": {"last_used_at": now}},
+                projection={"_id": 0, "key": 1},
+            )
+            if existing:
+                self.dedup_hits += 1
+                self.bytes_deduplicated += len(data)
+                return existing["key"]
+
+            if not await self.db.blobs.find_one({"hash": digest, "state": DELETING}, {"_id": 1}):
+                break
+            # Being garbage collected right now: wait for the record to disappear
+            if waited >= DELETING_WAIT_SECONDS:
+                raise RuntimeError(f"Blob {digest} is being deleted")
+            await asyncio.sleep(0.1)
+            waited += 0.1
+
+        # New content: upload first, then publish the record
+        await self.storage.put_object(key, data, content_type)
+        self.uploads += 1
+        now = _now()
+        try:
+            await self.db.blobs.update_one(
+                {"hash": digest},
+                {
+                    "$set": {"last_used_at": now},
+                    "$setOnInsert": {
+                        "hash": digest, "key": key, "size": len(data), "content_type": content_type,
+                        "ref_count": 0, "state": ACTIVE, "created_at": now,
+                    },
+                },
+                upsert=True,
+            )
+        except DuplicateKeyError:
+            # Another request inserted the same blob concurrently
+            await self.db.blobs.update_one({"hash": digest}, {"$set": {"last_used_at": now}})
+        return key
+
+    async def store(
+        self,
+        data: bytes,
+        user_id: str,
+        document_id: str,
+        page_id: str,
+        role: str = "page",
+        content_type: str = "image/jpeg",
+    ) -> str:
+        """Store an image for one page role and return its public URL"""
+        digest = hashlib.sha256(data).hexdigest()
+        key = await self._ensure_blob(digest, data, content_type)
+
+        await self._point(user_id, document_id, page_id, role, digest)
+        return self.storage.public_url(key)
+
+    async def _point(self, user_id: str, document_id: str, page_id: str, role: str, digest: str) -> None:
+        """Point one page role's reference at `digest`, adjusting both blobs' counts"""
+        ref_id = _ref_id(document_id, page_id, role)
+        previous = await self.db.blob_refs.find_one_and_update(
+            {"ref_id": ref_id},
+            {
+                "$set": {"hash": digest},
+                "$setOnInsert": {
+                    "ref_id": ref_id, "user_id": user_id, "document_id": document_id,
+                    "page_id": page_id, "role": role, "created_at": _now(),
+                },
+            },
+            upsert=True,
+            return_document=ReturnDocument.BEFORE,
+        )
+        if previous is None:
+            await self._adjust({digest: 1})
+        elif previous["hash"] != digest:
+            # The page role now points at different content
+            await self._adjust({digest: 1, previous["hash"]: -1})
+
+    async def sync_refs(self, user_id: str, document_id: str, pages: Iterable[Dict[str, Any]]) -> None:
+        """Make the references of `pages` match their URLs (see ROLE_URLS).
+
+        Call after writing pages whose URLs may have changed without store():
+        a role whose URL was cleared (base64 fallback, dropped original) is
+        released, and a role now showing another blob is re-pointed at it.
+        """
+        wanted: Dict[str, Any] = {}
+        for page in pages:
+            for role, field in ROLE_URLS.items():
+                ref = (page["page_id"], role)
+                wanted[_ref_id(document_id, *ref)] = (ref, self.hash_from_url(page.get(field)))
+        if not wanted:
+            return
+        current = {
+            row["ref_id"]: row["hash"]
+            async for row in self.db.blob_refs.find(
+                {"ref_id": {"$in": list(wanted)}}, {"_id": 0, "ref_id": 1, "hash": 1}
+            )
+        }
+        stale = []
+        for ref_id, ((page_id, role), digest) in wanted.items():
+            if current.get(ref_id) == digest:
+                continue
+            if digest:
+                await self._point(user_id, document_id, page_id, role, digest)
+            elif ref_id in current:
+                stale.append({"ref_id": ref_id, "hash": current[ref_id]})
+        if stale:
+            await self._release({"$or": stale})
+
+    async def _adjust(self, deltas: Dict[str, int]) -> None:
+        for digest, delta in deltas.items():
+            if delta:
+                await self.db.blobs.update_one({"hash": digest}, {"$inc": {"ref_count": delta}})
+
+    def hash_from_url(self, url: Optional[str]) -> Optional[str]:
+        """Digest for a blob URL; None for non-blob URLs (legacy per-page keys)"""
+        key = self.storage.key_from_url(url)
+        if not key or not key.startswith("blobs/sha256/"):
+            return None
+        return key.rsplit("/", 1)[-1].split(".", 1)[0]
+
+    # ---------- releasing ----------
+
+    async def _release(self, query: Dict[str, Any]) -> int:
+        """Delete matching references and decrement their blobs"""
+        counts: Dict[str, int] = {}
+        async for row in self.db.blob_refs.aggregate([
+            {"$match": query},
+            {"$group": {"_id": "$hash", "count": {"$sum": 1}}},
+        ]):
+            counts[row["_id"]] = row["count"]
+        if not counts:
+            return 0
+        # Delete only refs still pointing at the counted hashes so concurrent
+        # re-pointing (store() on the same ref) is never double-decremented
+        result = await self.db.blob_refs.delete_many({**query, "hash": {"$in": list(counts)}})
+        if result.deleted_count != sum(counts.values()):
+            logger.warning(f"⚠️ Blob refs changed during release of {query}; counts will be reconciled")
+        await self._adjust({digest: -count for digest, count in counts.items()})
+        return result.deleted_count
+
+    async def release_pages(self, document_id: str, page_ids: List[str]) -> int:
+        if not page_ids:
+            return 0
+        return await self._release({"document_id": document_id, "page_id": {"$in": list(page_ids)}})
+
+    async def release_document(self, document_id: str) -> int:
+        return await self._release({"document_id": document_id})
+
+    async def release_user(self, user_id: str) -> int:
+        return await self._release({"user_id": user_id})
+
+    async def release_all(self) -> None:
+        await self.db.blob_refs.delete_many({})
+        await self.db.blobs.update_many({}, {"$set": {"ref_count": 0}})
+
+    async def reconcile(self) -> int:
+        """Recompute ref_count from blob_refs. Returns the number of corrected blobs."""
+        actual: Dict[str, int] = {}
+        async for row in self.db.blob_refs.aggregate([{"$group": {"_id": "$hash", "count": {"$sum": 1}}}]):
+            actual[row["_id"]] = row["count"]
+        corrected = 0
+        async for blob in self.db.blobs.find({}, {"_id": 0, "hash": 1, "ref_count": 1}):
+            expected = actual.get(blob["hash"], 0)
+            if blob.get("ref_count") != expected:
+                await self.db.blobs.update_one({"hash": blob["hash"]}, {"$set": {"ref_count": expected}})
+                corrected += 1
+        return corrected
+
+    # ---------- garbage collection ----------
+
+    async def collect_garbage(self) -> int:
+        """Delete objects of blobs unreferenced for longer than GRACE_PERIOD"""
+        cutoff = _now() - GRACE_PERIOD
+        candidates = await self.db.blobs.find(
+            {"state": ACTIVE, "ref_count": {"$lte": 0}, "last_used_at": {"$lt": cutoff}},
+            {"_id": 0, "hash": 1, "key": 1},
+        ).limit(GC_BATCH_SIZE).to_list(None)
+
+        claimed = []
+        for blob in candidates:
+            # Conditional claim: fails if a reference was added in the meantime
+            result = await self.db.blobs.update_one(
+                {"hash": blob["hash"], "state": ACTIVE, "ref_count": {"$lte": 0}, "last_used_at": {"$lt": cutoff}},
+                {"$set": {"state": DELETING}},
+            )
+            if result.modified_count:
+                claimed.append(blob)
+        if not claimed:
+            return 0
+
+        failed = set(await self.storage.delete_objects([blob["key"] for blob in claimed]))
+        deleted = [blob["hash"] for blob in claimed if blob["key"] not in failed]
+        await self.db.blobs.delete_many({"hash": {"$in": deleted}, "state": DELETING})
+        if failed:
+            # Put them back so the next run retries
+            await self.db.blobs.update_many(
+                {"key": {"$in": list(failed)}, "state": DELETING},
+                {"$set": {"state": ACTIVE}},
+            )
+        logger.info(f"✅ Blob GC removed {len(deleted)} unreferenced images")
+        return len(deleted)
+
+    def start(self) -> None:
+        if not self._task:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                # Keep going while full batches come back
+                while await self.collect_garbage() >= GC_BATCH_SIZE:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Blob GC error: {e}")
+            await asyncio.sleep(GC_INTERVAL_SECONDS)
+
+    async def stats(self) -> Dict[str, Any]:
+        totals = {"blobs": 0, "stored_bytes": 0, "references": 0, "referenced_bytes": 0, "unreferenced": 0}
+        async for row in self.db.blobs.aggregate([{"$group": {
+            "_id": None,
+            "blobs": {"$sum": 1},
+            "stored_bytes": {"$sum": "$size"},
+            "references": {"$sum": "$ref_count"},
+            "referenced_bytes": {"$sum": {"$multiply": ["$size", {"$max": ["$ref_count", 0]}]}},
+            "unreferenced": {"$sum": {"$cond": [{"$lte": ["$ref_count", 0]}, 1, 0]}},
+        }}]):
+            totals.update({k: v for k, v in row.items() if k != "_id"})
+        totals["bytes_saved"] = max(totals["referenced_bytes"] - totals["stored_bytes"], 0)
+        totals["process"] = {
+            "uploads": self.uploads,
+            "dedup_hits": self.dedup_hits,
+            "bytes_deduplicated": self.bytes_deduplicated,
+        }
+        return totals
@@ -0,0 +1,282 @@
+"""
+Bulk Jobs
+Resumable background jobs that rewrite every matching row of a user's library.
+
+A BulkHandler describes one kind of rewrite: which rows to walk (collection,
+query, projection) and what to do with each one (process() returns a write
+operation or None). BulkJobRunner queues at most one active job per user and
+kind, and drains the queue in the background:
+
+- rows are walked in _id order, one batch at a time from the saved cursor
+  (the last _id of the previous batch): no cap on library size, and rows
+  that stop matching the query do not shift later pages
+- the rows of a batch are processed concurrently (`concurrency` at a time),
+  so slow per-row work (storage downloads, thumbnails, uploads) overlaps
+- their writes are sent in one unordered bulk_write per batch, followed by
+  the handler's after_batch() hook (timestamps, covers, sync log)
+- progress (processed, updated, failed, cursor) is saved after every batch
+  and is what GET /bulk-jobs/{job_id} reports
+- a running job whose lease expired (worker crashed or restarted) is picked
+  up again and continues from its cursor; a batch that was interrupted is
+  processed again, so handlers must be idempotent (their query should stop
+  matching rows that are done, and their writes should be conditional)
+
+Collection:
+    bulk_jobs: {job_id, kind, user_id, active, status, cursor, total, processed,
+                updated, failed, attempts, next_attempt_at, lease_until,
+                last_error, created_at, updated_at, completed_at}
+"""
+import asyncio
+import logging
+import uuid
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+# Job statuses
+PENDING = "pending"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+
+JOB_LEASE = timedelta(minutes=5)
+MAX_ATTEMPTS = 5
+RETRY_BASE_SECONDS = 10
+IDLE_POLL_SECONDS = 30
+
+# Fields returned to clients
+PUBLIC_FIELDS = ("job_id", "kind", "status", "total", "processed", "updated", "failed", "created_at", "completed_at")
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+class BulkHandler(ABC):
+    """One kind of bulk rewrite; subclasses set `kind` and `collection` and implement process()"""
+
+    kind: str = ""
+    collection: str = ""
+    projection: Optional[Dict[str, Any]] = None
+    batch_size: int = 50
+    concurrency: int = 8
+
+    def query(self, user_id: str) -> Dict[str, Any]:
+        """Rows still to be rewritten for `user_id`"""
+        return {"user_id": user_id}
+
+    @abstractmethod
+    async def process(self, job: Dict[str, Any], row: Dict[str, Any]) -> Optional[Any]:
+        """Work for one row; returns a pymongo write operation, or None to skip it"""
+
+    async def after_batch(self, job: Dict[str, Any], rows: List[Dict[str, Any]]) -> None:
+        """Called after the writes of a batch, with the rows that were written"""
+
+
+class BulkJobRunner:
+    """Queues bulk jobs per user and runs them one after another in the background"""
+
+    def __init__(self, db):
+        self.db = db
+        self.handlers: Dict[str, BulkHandler] = {}
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def register(self, handler: BulkHandler) -> None:
+        self.handlers[handler.kind] = handler
+
+    # ---------- enqueue ----------
+
+    async def enqueue(self, kind: str, user_id: str) -> Dict[str, Any]:
+        """Queue a job, or return the user's active job of this kind if there is one"""
+        handler = self.handlers[kind]
+        now = _now()
+        active = {"kind": kind, "user_id": user_id, "active": True}
+        try:
+            job = await self._upsert_active(active, now)
+        except DuplicateKeyError:
+            # A concurrent request created it first (unique partial index on active jobs)
+            job = await self.db.bulk_jobs.find_one(active, {"_id": 0})
+        if job["total"] is None:
+            # Estimate for progress reporting; rows added later are still processed
+            total = await self.db[handler.collection].count_documents(handler.query(user_id))
+            job["total"] = total
+            update: Dict[str, Any] = {"total": total}
+            if total == 0:
+                update.update({"status": COMPLETED, "active": False, "completed_at": now})
+                job.update(update)
+            await self.db.bulk_jobs.update_one({"job_id": job["job_id"], "total": None}, {"$set": update})
+        if job["status"] == PENDING:
+            self._wakeup.set()
+        return job
+
+    async def _upsert_active(self, active: Dict[str, Any], now: datetime) -> Dict[str, Any]:
+        return await self.db.bulk_jobs.find_one_and_update(
+            active,
+            {"$setOnInsert": {
+                "job_id": f"bulk_{uuid.uuid4().hex[:12]}",
+                "status": PENDING,
+                "cursor": None,
+                "total": None,
+                "processed": 0,
+                "updated": 0,
+                "failed": 0,
+                "attempts": 0,
+                "next_attempt_at": now,
+                "lease_until": None,
+                "last_error": None,
+                "created_at": now,
+                "updated_at": now,
+                "completed_at": None,
+            }},
+            upsert=True,
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return await self.db.bulk_jobs.find_one({"job_id": job_id}, {"_id": 0, "cursor": 0})
+
+    # ---------- worker ----------
+
+    def start(self) -> None:
+        """Start draining jobs; jobs left over from a previous run are resumed"""
+        if not self._task:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        logger.info("✅ Bulk job worker started")
+        while True:
+            try:
+                job = await self._claim()
+                if job:
+                    await self.process(job)
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Bulk job worker error: {e}")
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=IDLE_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _claim(self) -> Optional[Dict[str, Any]]:
+        """Atomically take the oldest due job (or one whose lease expired)"""
+        now = _now()
+        return await self.db.bulk_jobs.find_one_and_update(
+            {"$or": [
+                {"status": PENDING, "next_attempt_at": {"$lte": now}},
+                {"status": RUNNING, "lease_until": {"$lte": now}},
+            ]},
+            {"$set": {"status": RUNNING, "lease_until": now + JOB_LEASE, "updated_at": now}},
+            sort=[("next_attempt_at", 1)],
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def _process_row(self, handler: BulkHandler, job: Dict[str, Any], row: Dict[str, Any], slots: asyncio.Semaphore):
+        async with slots:
+            try:
+                return await handler.process(job, row), None
+            except Exception as e:
+                return None, f"{row.get('_id')}: {e}"
+
+    async def process(self, job: Dict[str, Any]) -> None:
+        """Walk the job's rows batch by batch, saving the cursor after every batch"""
+        job_id = job["job_id"]
+        handler = self.handlers.get(job["kind"])
+        if handler is None:
+            await self._finish(job, FAILED, f"Unknown job kind {job['kind']}")
+            return
+        collection = self.db[handler.collection]
+        slots = asyncio.Semaphore(handler.concurrency)
+        cursor = job.get("cursor")
+        try:
+            while True:
+                query = handler.query(job["user_id"])
+                if cursor is not None:
+                    query["_id"] = {"$gt": cursor}
+                rows = await collection.find(query, handler.projection).sort("_id", 1).limit(handler.batch_size).to_list(None)
+                if not rows:
+                    break
+
+                results = await asyncio.gather(*(self._process_row(handler, job, row, slots) for row in rows))
+                operations = [operation for operation, _ in results if operation is not None]
+                errors = [error for _, error in results if error]
+                if operations:
+                    await collection.bulk_write(operations, ordered=False)
+                    await handler.after_batch(job, [row for row, (operation, _) in zip(rows, results) if operation is not None])
+
+                cursor = rows[-1]["_id"]
+                now = _now()
+                update: Dict[str, Any] = {
+                    "$set": {"cursor": cursor, "updated_at": now, "lease_until": now + JOB_LEASE},
+                    "$inc": {"processed": len(rows), "updated": len(operations), "failed": len(errors)},
+                }
+                if errors:
+                    update["$set"]["last_error"] = errors[-1]
+                    logger.warning(f"⚠️ Bulk job {job_id} ({job['kind']}): {len(errors)} rows failed, last: {errors[-1]}")
+                await self.db.bulk_jobs.update_one({"job_id": job_id}, update)
+        except Exception as e:
+            await self._retry(job, str(e))
+            return
+
+        await self._finish(job, COMPLETED)
+
+    async def _finish(self, job: Dict[str, Any], status: str, error: Optional[str] = None) -> None:
+        now = _now()
+        update = {"status": status, "active": False, "lease_until": None, "completed_at": now, "updated_at": now}
+        if error:
+            update["last_error"] = error
+        await self.db.bulk_jobs.update_one({"job_id": job["job_id"]}, {"$set": update})
+        if status == COMPLETED:
+            finished = await self.get_job(job["job_id"])
+            logger.info(
+                f"✅ Bulk job {job['job_id']} ({job['kind']}) completed: "
+                f"{finished.get('updated', 0)} updated, {finished.get('failed', 0)} failed"
+            )
+        else:
+            logger.error(f"❌ Bulk job {job['job_id']} ({job['kind']}) failed: {error}")
+
+    async def _retry(self, job: Dict[str, Any], error: str) -> None:
+        """Reschedule with exponential backoff; the next attempt continues from the saved cursor"""
+        attempts = job.get("attempts", 0) + 1
+        if attempts >= MAX_ATTEMPTS:
+            await self.db.bulk_jobs.update_one({"job_id": job["job_id"]}, {"$set": {"attempts": attempts}})
+            await self._finish(job, FAILED, error)
+            return
+        delay = RETRY_BASE_SECONDS * (2 ** (attempts - 1))
+        now = _now()
+        await self.db.bulk_jobs.update_one(
+            {"job_id": job["job_id"]},
+            {"$set": {
+                "status": PENDING,
+                "attempts": attempts,
+                "next_attempt_at": now + timedelta(seconds=delay),
+                "lease_until": None,
+                "last_error": error,
+                "updated_at": now,
+            }},
+        )
+        logger.warning(f"⚠️ Bulk job {job['job_id']} attempt {attempts} failed, retrying in {delay}s: {error}")
+
+
+def public_job(job: Dict[str, Any]) -> Dict[str, Any]:
+    """The fields of a job clients see"""
+    return {field: job.get(field) for field in PUBLIC_FIELDS}
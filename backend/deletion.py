@@ -0,0 +1,223 @@
+"""
+Background Deletion
+Tombstones plus a resumable job queue for removing stored objects.
+
+Deleting a document or an account only writes a tombstone and a deletion job,
+then returns. A background worker drains the jobs:
+
+- every prefix is listed page by page (continuation tokens, no 1000-key cap)
+- each page is removed with one batch delete call of up to 1000 keys
+- keys that fail are retried with exponential backoff
+- progress (objects deleted, prefixes remaining, attempts) is written to the
+  job after every batch, so it can be reported and resumed after a restart
+
+Collections:
+    tombstones:    {tombstone_id, kind, user_id, document_id, deleted_at, deleted_by}
+    deletion_jobs: {job_id, kind, user_id, document_id, prefixes, keys, status,
+                    deleted_objects, failed_keys, attempts, next_attempt_at,
+                    lease_until, last_error, created_at, updated_at, completed_at}
+"""
+import asyncio
+import logging
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+from pymongo import ReturnDocument
+
+from storage import ObjectStorage, DELETE_BATCH_SIZE
+
+logger = logging.getLogger(__name__)
+
+# Job statuses
+PENDING = "pending"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+
+# A running job whose lease expired (worker crashed or restarted) is picked up again
+JOB_LEASE = timedelta(minutes=5)
+MAX_ATTEMPTS = 6
+RETRY_BASE_SECONDS = 5
+IDLE_POLL_SECONDS = 30
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+class DeletionWorker:
+    """Writes tombstones, queues deletion jobs and drains them in the background"""
+
+    def __init__(self, db, storage: Optional[ObjectStorage], batch_size: int = DELETE_BATCH_SIZE):
+        self.db = db
+        self.storage = storage
+        self.batch_size = min(batch_size, DELETE_BATCH_SIZE)
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    # ---------- enqueue ----------
+
+    async def tombstone(self, kind: str, user_id: str, document_id: Optional[str] = None, deleted_by: str = "user") -> None:
+        await self.db.tombstones.insert_one({
+            "tombstone_id": f"tomb_{uuid.uuid4().hex[:12]}",
+            "kind": kind,
+            "user_id": user_id,
+            "document_id": document_id,
+            "deleted_at": _now(),
+            "deleted_by": deleted_by,
+        })
+
+    async def enqueue(
+        self,
+        kind: str,
+        user_id: Optional[str] = None,
+        document_id: Optional[str] = None,
+        prefixes: Optional[List[str]] = None,
+        keys: Optional[List[str]] = None,
+    ) -> Optional[str]:
+        """Queue storage cleanup. Returns the job ID, or None when there is no object storage."""
+        if not self.storage:
+            return None
+        now = _now()
+        job = {
+            "job_id": f"del_{uuid.uuid4().hex[:12]}",
+            "kind": kind,
+            "user_id": user_id,
+            "document_id": document_id,
+            "prefixes": list(prefixes or []),
+            "keys": list(keys or []),
+            "status": PENDING,
+            "deleted_objects": 0,
+            "failed_keys": [],
+            "attempts": 0,
+            "next_attempt_at": now,
+            "lease_until": None,
+            "last_error": None,
+            "created_at": now,
+            "updated_at": now,
+            "completed_at": None,
+        }
+        await self.db.deletion_jobs.insert_one(job)
+        self._wakeup.set()
+        return job["job_id"]
+
+    async def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return await self.db.deletion_jobs.find_one({"job_id": job_id}, {"_id": 0})
+
+    # ---------- worker ----------
+
+    def start(self) -> None:
+        """Start draining jobs; jobs left over from a previous run are resumed"""
+        if self.storage and not self._task:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        logger.info("✅ Deletion worker started")
+        while True:
+            try:
+                job = await self._claim()
+                if job:
+                    await self.process(job)
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Deletion worker error: {e}")
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=IDLE_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _claim(self) -> Optional[Dict[str, Any]]:
+        """Atomically take the oldest due job (or one whose lease expired)"""
+        now = _now()
+        return await self.db.deletion_jobs.find_one_and_update(
+            {"$or": [
+                {"status": PENDING, "next_attempt_at": {"$lte": now}},
+                {"status": RUNNING, "lease_until": {"$lte": now}},
+            ]},
+            {"$set": {"status": RUNNING, "lease_until": now + JOB_LEASE, "updated_at": now}},
+            sort=[("next_attempt_at", 1)],
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def _progress(self, job_id: str, update: Dict[str, Any]) -> None:
+        now = _now()
+        update.setdefault("$set", {}).update({"updated_at": now, "lease_until": now + JOB_LEASE})
+        await self.db.deletion_jobs.update_one({"job_id": job_id}, update)
+
+    async def process(self, job: Dict[str, Any]) -> None:
+        """Delete everything a job covers, saving progress after every batch"""
+        job_id = job["job_id"]
+        failed: List[str] = []
+        try:
+            # Explicit keys first (retries from earlier attempts, avatars, ...)
+            keys = job.get("keys") or []
+            for start in range(0, len(keys), self.batch_size):
+                batch = keys[start:start + self.batch_size]
+                batch_failed = await self.storage.delete_objects(batch)
+                failed.extend(batch_failed)
+                await self._progress(job_id, {"$inc": {"deleted_objects": len(batch) - len(batch_failed)}})
+            if keys:
+                await self._progress(job_id, {"$set": {"keys": []}})
+
+            # Then each prefix, one listing page (<= 1000 keys) per batch delete
+            for prefix in job.get("prefixes") or []:
+                async for batch in self.storage.iter_keys(prefix, page_size=self.batch_size):
+                    batch_failed = await self.storage.delete_objects(batch)
+                    failed.extend(batch_failed)
+                    await self._progress(job_id, {"$inc": {"deleted_objects": len(batch) - len(batch_failed)}})
+                await self._progress(job_id, {"$pull": {"prefixes": prefix}})
+        except Exception as e:
+            await self._retry(job, failed, str(e))
+            return
+
+        if failed:
+            await self._retry(job, failed, f"{len(failed)} keys failed to delete")
+            return
+
+        now = _now()
+        await self.db.deletion_jobs.update_one(
+            {"job_id": job_id},
+            {"$set": {"status": COMPLETED, "failed_keys": [], "lease_until": None, "completed_at": now, "updated_at": now}},
+        )
+        finished = await self.get_job(job_id)
+        logger.info(f"✅ Deletion job {job_id} ({job['kind']}) completed: {finished.get('deleted_objects', 0)} objects")
+
+    async def _retry(self, job: Dict[str, Any], failed: List[str], error: str) -> None:
+        """Reschedule with exponential backoff; failed keys are retried on the next attempt"""
+        attempts = job.get("attempts", 0) + 1
+        status = FAILED if attempts >= MAX_ATTEMPTS else PENDING
+        delay = RETRY_BASE_SECONDS * (2 ** (attempts - 1))
+        now = _now()
+        await self.db.deletion_jobs.update_one(
+            {"job_id": job["job_id"]},
+            {
+                "$set": {
+                    "status": status,
+                    "attempts": attempts,
+                    "failed_keys": failed,
+                    "next_attempt_at": now + timedelta(seconds=delay),
+                    "lease_until": None,
+                    "last_error": error,
+                    "updated_at": now,
+                },
+                "$addToSet": {"keys": {"$each": failed}},
+            },
+        )
+        if status == FAILED:
+            logger.error(f"❌ Deletion job {job['job_id']} gave up after {attempts} attempts: {error}")
+        else:
+            logger.warning(f"⚠️ Deletion job {job['job_id']} attempt {attempts} failed, retrying in {delay}s: {error}")
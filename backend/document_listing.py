@@ -0,0 +1,111 @@
+"""
+Document Listing
+Keyset-paginated document summaries for the document grid.
+
+Summaries carry only what the grid renders (name, counts, first-page
+thumbnail URL, tags, timestamps), never pages or OCR text. Pages are ordered
+newest first by (updated_at, document_id); the cursor is an opaque token
+holding the last row's sort key, so each page is an index range scan no
+matter how deep the client scrolls.
+
+SUMMARY_INDEX starts with the sort key and also holds every scalar summary
+field, so a listing that does not ask for tags (an array, which cannot be
+covered) is answered from the index alone.
+"""
+import base64
+import json
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+SUMMARY_FIELDS = (
+    "document_id", "name", "folder_id", "page_count", "thumbnail_url",
+    "tags", "is_password_protected", "created_at", "updated_at",
+)
+# Always returned: needed to build the next cursor
+KEY_FIELDS = ("document_id", "updated_at")
+
+SUMMARY_INDEX = [
+    ("user_id", 1), ("updated_at", -1), ("document_id", -1),
+    ("folder_id", 1), ("name", 1), ("page_count", 1), ("thumbnail_url", 1),
+    ("is_password_protected", 1), ("created_at", 1),
+]
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 200
+
+
+def encode_cursor(document: Dict[str, Any]) -> str:
+    updated_at = document["updated_at"]
+    if updated_at.tzinfo is None:
+        updated_at = updated_at.replace(tzinfo=timezone.utc)
+    raw = json.dumps({"u": updated_at.isoformat(), "d": document["document_id"]}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    """Raises ValueError for anything that is not a cursor we issued"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        data = json.loads(raw)
+        return datetime.fromisoformat(data["u"]), str(data["d"])
+    except (ValueError, KeyError, TypeError) as e:
+        raise ValueError("Invalid cursor") from e
+
+
+def select_fields(fields: Optional[Iterable[str]]) -> List[str]:
+    """Requested summary fields plus the cursor key; None selects everything"""
+    if not fields:
+        return list(SUMMARY_FIELDS)
+    requested = [field.strip() for field in fields if field.strip()]
+    unknown = [field for field in requested if field not in SUMMARY_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return list(dict.fromkeys([*KEY_FIELDS, *requested]))
+
+
+def build_query(
+    user_id: str,
+    cursor: Optional[str] = None,
+    folder_id: Optional[str] = None,
+    tag: Optional[str] = None,
+) -> Dict[str, Any]:
+    query: Dict[str, Any] = {"user_id": user_id}
+    if folder_id:
+        query["folder_id"] = folder_id
+    if tag:
+        query["tags"] = tag
+    if cursor:
+        updated_at, document_id = decode_cursor(cursor)
+        # The top-level bound gives the index scan a tight range; $or breaks ties
+        query["updated_at"] = {"$lte": updated_at}
+        query["$or"] = [
+            {"updated_at": {"$lt": updated_at}},
+            {"updated_at": updated_at, "document_id": {"$lt": document_id}},
+        ]
+    return query
+
+
+async def list_summaries(
+    collection,
+    user_id: str,
+    cursor: Optional[str] = None,
+    limit: int = DEFAULT_LIMIT,
+    fields: Optional[Iterable[str]] = None,
+    folder_id: Optional[str] = None,
+    tag: Optional[str] = None,
+) -> Dict[str, Any]:
+    """One page of summaries and the cursor for the next page (None at the end)"""
+    limit = max(1, min(limit, MAX_LIMIT))
+    selected = select_fields(fields)
+    projection = {"_id": 0, **{field: 1 for field in selected}}
+    rows = await collection.find(
+        build_query(user_id, cursor, folder_id, tag), projection
+    ).sort([("updated_at", -1), ("document_id", -1)]).limit(limit + 1).to_list(limit + 1)
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return {
+        "documents": rows,
+        "next_cursor": encode_cursor(rows[-1]) if has_more else None,
+        "has_more": has_more,
+    }
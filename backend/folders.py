@@ -0,0 +1,250 @@
+"""
+Folders
+Nested folders and folder listing with document counts.
+
+Folders nest through `parent_id`. Every folder also carries `ancestors`, the
+folder IDs from the top level down to its parent, indexed together with
+user_id. A subtree is then one indexed query at any depth:
+
+    {"user_id": ..., "ancestors": folder_id}      every folder below folder_id
+
+- Moving a folder rewrites its own ancestors (only if they are still the
+  ones it read, else FolderConflict) and replaces the old prefix with the
+  new one on every descendant, in one ordered bulk_write ($pullAll the old
+  prefix, then $push the new one at position 0).
+- Deleting a folder moves the documents inside to the deleted folder's
+  parent in one update_many, then deletes its subtree with one delete_many.
+- parent_id is the source of truth. Folders created before ancestors existed
+  are backfilled from their parent chains at startup (backfill_ancestors).
+
+The folder screen shows every folder with the number of documents in it.
+Counting per folder (count_documents for each one) cost one round trip per
+folder. Instead, document_counts() groups the user's documents by folder_id
+in one aggregation, served from the {user_id, folder_id, updated_at} index
+without fetching documents, and list_folders() runs it concurrently with the
+folder query, so the listing takes one round trip whatever the folder count.
+Subtree totals are summed from the same result in memory.
+"""
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from pymongo import UpdateMany, UpdateOne
+
+logger = logging.getLogger(__name__)
+
+MAX_FOLDERS = 1000
+MAX_DEPTH = 20
+
+# migrations entry marking the ancestors backfill as done
+BACKFILL_ID = "folder_ancestors"
+
+
+class FolderTreeError(ValueError):
+    """The folder operation would break the tree (cycle, too deep)"""
+
+
+class FolderNotFound(FolderTreeError):
+    """The folder (or the new parent) does not exist for this user"""
+
+
+class FolderConflict(FolderTreeError):
+    """The folder was moved by another request while this one ran"""
+
+
+async def document_counts(db, user_id: str) -> Dict[str, int]:
+    """{folder_id: number of documents} for every folder of the user that has any"""
+    counts: Dict[str, int] = {}
+    async for row in db.documents.aggregate([
+        {"$match": {"user_id": user_id, "folder_id": {"$type": "string"}}},
+        {"$group": {"_id": "$folder_id", "count": {"$sum": 1}}},
+    ]):
+        counts[row["_id"]] = row["count"]
+    return counts
+
+
+async def list_folders(db, user_id: str) -> List[Dict[str, Any]]:
+    """The user's folders, each with `document_count` and `total_document_count` (with subfolders)"""
+    folders, counts = await asyncio.gather(
+        db.folders.find({"user_id": user_id}, {"_id": 0}).to_list(MAX_FOLDERS),
+        document_counts(db, user_id),
+    )
+    totals: Dict[str, int] = {}
+    for folder in folders:
+        count = counts.get(folder["folder_id"], 0)
+        folder["document_count"] = count
+        for folder_id in [*(folder.get("ancestors") or []), folder["folder_id"]]:
+            totals[folder_id] = totals.get(folder_id, 0) + count
+    for folder in folders:
+        folder["total_document_count"] = totals[folder["folder_id"]]
+    return folders
+
+
+def ancestor_paths(parents: Dict[str, Optional[str]]) -> Dict[str, List[str]]:
+    """Ancestors of every folder from {folder_id: parent_id}.
+
+    A folder whose parent is unknown becomes top level, and so does the
+    folder that closes a parent cycle.
+    """
+    paths: Dict[str, List[str]] = {}
+    for folder_id in parents:
+        chain = [folder_id]
+        while chain[-1] not in paths:
+            parent_id = parents[chain[-1]]
+            if parent_id not in parents or parent_id in chain:
+                paths[chain[-1]] = []
+                break
+            chain.append(parent_id)
+        # chain[-1] has a path; every folder before it in the chain sits below it
+        for child, parent_id in zip(reversed(chain[:-1]), reversed(chain[1:])):
+            paths[child] = [*paths[parent_id], parent_id]
+    return paths
+
+
+def subtree_query(user_id: str, folder_id: str) -> Dict[str, Any]:
+    """A folder and every folder below it"""
+    return {"user_id": user_id, "$or": [{"folder_id": folder_id}, {"ancestors": folder_id}]}
+
+
+class FolderTree:
+    """Maintains ancestors of nested folders and runs subtree operations"""
+
+    def __init__(self, db):
+        self.db = db
+        self._task: Optional[asyncio.Task] = None
+
+    async def _folder(self, user_id: str, folder_id: str) -> Dict[str, Any]:
+        folder = await self.db.folders.find_one(
+            {"folder_id": folder_id, "user_id": user_id}, {"_id": 0, "folder_id": 1, "parent_id": 1, "ancestors": 1}
+        )
+        if not folder:
+            raise FolderNotFound(f"Folder {folder_id} not found")
+        return folder
+
+    async def ancestors_for(self, user_id: str, parent_id: Optional[str]) -> List[str]:
+        """Ancestors of a folder placed under parent_id (None: top level)"""
+        if not parent_id:
+            return []
+        parent = await self._folder(user_id, parent_id)
+        ancestors = [*(parent.get("ancestors") or []), parent_id]
+        if len(ancestors) >= MAX_DEPTH:
+            raise FolderTreeError(f"Folders can be nested at most {MAX_DEPTH} levels deep")
+        return ancestors
+
+    async def subtree_ids(self, user_id: str, folder_id: str) -> List[str]:
+        """folder_id and the IDs of every folder below it"""
+        return [
+            folder["folder_id"]
+            async for folder in self.db.folders.find(subtree_query(user_id, folder_id), {"_id": 0, "folder_id": 1})
+        ]
+
+    async def subtree(self, user_id: str, folder_id: str) -> Tuple[List[Dict[str, Any]], int]:
+        """(folders of the subtree, number of documents in it)"""
+        folders = await self.db.folders.find(subtree_query(user_id, folder_id), {"_id": 0}).to_list(MAX_FOLDERS)
+        if not folders:
+            raise FolderNotFound(f"Folder {folder_id} not found")
+        documents = await self.db.documents.count_documents(
+            {"user_id": user_id, "folder_id": {"$in": [folder["folder_id"] for folder in folders]}}
+        )
+        return folders, documents
+
+    async def move(self, user_id: str, folder_id: str, parent_id: Optional[str]) -> List[str]:
+        """Move a folder (with its subtree) under parent_id. Returns the IDs of moved folders."""
+        folder = await self._folder(user_id, folder_id)
+        new_prefix = await self.ancestors_for(user_id, parent_id)
+        if folder_id in new_prefix:
+            raise FolderTreeError("A folder cannot be moved into itself or one of its subfolders")
+        old_prefix = folder.get("ancestors") or []
+        if new_prefix == old_prefix:
+            return []
+        # Depth of the deepest descendant below this folder
+        deepest = await self.db.folders.find_one(
+            {"user_id": user_id, "ancestors": folder_id}, {"_id": 0, "ancestors": 1}, sort=[("depth", -1)]
+        )
+        below = len((deepest or {}).get("ancestors") or []) - len(old_prefix) if deepest else 0
+        if len(new_prefix) + below >= MAX_DEPTH:
+            raise FolderTreeError(f"Folders can be nested at most {MAX_DEPTH} levels deep")
+
+        # Only from where we read it: a concurrent move of the same folder loses
+        claimed = await self.db.folders.update_one(
+            {"folder_id": folder_id, "user_id": user_id, "ancestors": folder.get("ancestors")},
+            {"$set": {"parent_id": parent_id, "ancestors": new_prefix, "depth": len(new_prefix)}},
+        )
+        if not claimed.matched_count:
+            raise FolderConflict(f"Folder {folder_id} was moved concurrently")
+        descendants = {"user_id": user_id, "ancestors": folder_id}
+        operations = []
+        if old_prefix:
+            operations.append(UpdateMany(descendants, {"$pullAll": {"ancestors": old_prefix}}))
+        operations.append(UpdateMany(
+            descendants,
+            {"$push": {"ancestors": {"$each": new_prefix, "$position": 0}}, "$inc": {"depth": len(new_prefix) - len(old_prefix)}},
+        ))
+        await self.db.folders.bulk_write(operations, ordered=True)
+        return await self.subtree_ids(user_id, folder_id)
+
+    async def delete(self, user_id: str, folder_id: str) -> Tuple[List[str], List[str]]:
+        """Delete a folder and its subtree; their documents move to the folder's parent.
+        Returns (deleted folder IDs, moved document IDs)."""
+        folder = await self._folder(user_id, folder_id)
+        folder_ids = await self.subtree_ids(user_id, folder_id)
+        # Documents first: if this stops halfway, no document points at a deleted folder
+        in_subtree = {"user_id": user_id, "folder_id": {"$in": folder_ids}}
+        moved = await self.db.documents.distinct("document_id", in_subtree)
+        if moved:
+            await self.db.documents.update_many(in_subtree, {"$set": {"folder_id": folder.get("parent_id")}})
+        await self.db.folders.delete_many({"user_id": user_id, "folder_id": {"$in": folder_ids}})
+        return folder_ids, moved
+
+    # ---------- backfill ----------
+
+    async def backfill_ancestors(self) -> int:
+        """Set ancestors on folders that predate them. Returns how many were set."""
+        user_ids = await self.db.folders.distinct("user_id", {"ancestors": {"$exists": False}})
+        filled = 0
+        for user_id in user_ids:
+            parents = {
+                folder["folder_id"]: folder.get("parent_id")
+                async for folder in self.db.folders.find({"user_id": user_id}, {"_id": 0, "folder_id": 1, "parent_id": 1})
+            }
+            paths = ancestor_paths(parents)
+            await self.db.folders.bulk_write([
+                UpdateOne(
+                    {"folder_id": folder_id},
+                    {"$set": {"parent_id": path[-1] if path else None, "ancestors": path, "depth": len(path)}},
+                )
+                for folder_id, path in paths.items()
+            ], ordered=False)
+            filled += len(paths)
+        if filled:
+            logger.info(f"✅ Set ancestors on {filled} folders")
+        return filled
+
+    def start(self) -> None:
+        if not self._task:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        if await self.db.migrations.find_one({"migration_id": BACKFILL_ID, "status": "completed"}):
+            return
+        try:
+            await self.backfill_ancestors()
+            await self.db.migrations.update_one(
+                {"migration_id": BACKFILL_ID},
+                {"$set": {"status": "completed", "completed_at": datetime.now(timezone.utc)}},
+                upsert=True,
+            )
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"❌ Folder ancestors backfill error: {e}")
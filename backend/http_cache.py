@@ -0,0 +1,62 @@
+"""
+HTTP Caching
+Strong ETags and conditional GET for endpoints the app polls.
+
+Handlers compute the ETag from a cheap version source (document version /
+updated_at, the user's sync sequence, translation updated_at) before
+loading the full payload. If the client's If-None-Match matches, they
+return not_modified() right away: one indexed lookup, no body. Otherwise
+they set the same ETag and Cache-Control on the full response.
+
+- PRIVATE: per-user data. Clients and proxies must revalidate every time
+  (no-cache), which is cheap because of the ETag.
+- PUBLIC: translations and other content shared by all users; short max-age,
+  then revalidate.
+"""
+import hashlib
+import json
+from typing import Any, Dict, Optional
+
+from fastapi import Request, Response
+
+PRIVATE = "private, no-cache"
+PUBLIC = "public, max-age=300"
+
+
+def make_etag(*parts: Any) -> str:
+    """Strong ETag from the values that determine a response"""
+    payload = json.dumps(parts, default=str, sort_keys=True, separators=(",", ":"))
+    return '"' + hashlib.sha256(payload.encode()).hexdigest()[:32] + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match uses weak comparison: W/ prefixes are ignored"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return etag in (tag[2:] if tag.startswith("W/") else tag for tag in candidates)
+
+
+def not_modified(request: Request, etag: str, cache_control: str = PRIVATE) -> Optional[Response]:
+    """A 304 response if the client already has `etag`, else None"""
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": cache_control})
+    return None
+
+
+def cache_headers(etag: str, cache_control: str = PRIVATE) -> Dict[str, str]:
+    """The headers for a response the handler builds itself"""
+    return {"ETag": etag, "Cache-Control": cache_control}
+
+
+def set_cache_headers(response: Response, etag: str, cache_control: str = PRIVATE) -> None:
+    response.headers.update(cache_headers(etag, cache_control))
+
+
+def set_uncacheable(response: Response) -> None:
+    """For fallback bodies served after an error: never store them under an ETag"""
+    if "etag" in response.headers:
+        del response.headers["etag"]
+    response.headers["Cache-Control"] = "no-store"
@@ -0,0 +1,208 @@
+"""
+HTTP Encoding
+How API responses are serialized and compressed on the wire.
+
+- FastJSONResponse renders with orjson when it is installed (several times
+  faster than the stdlib encoder on large document lists; native datetime
+  support) and falls back to Starlette's JSONResponse rendering otherwise.
+  It is the default response class of the /api router.
+- CompressionMiddleware compresses text-like responses (JSON, HTML, JS,
+  CSS, SVG) of at least `minimum_size` bytes with brotli when the client
+  accepts it and the `brotli` package is installed, else gzip. Images, PDFs
+  and other binary payloads are passed through untouched, as are responses
+  that are already encoded or marked no-transform.
+- Bodies (or streamed chunks) above OFFLOAD_SIZE are compressed in a worker thread so a large
+  document list never stalls the event loop (zlib and brotli release the GIL).
+- A compressed response's ETag is made weak (W/"..."): the bytes differ per
+  encoding, and If-None-Match uses weak comparison (see http_cache.py).
+"""
+import asyncio
+import json
+import zlib
+from typing import Any, Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import orjson
+except ImportError:  # optional: stdlib json fallback
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # optional: gzip only
+    brotli = None
+
+MINIMUM_SIZE = 1024
+OFFLOAD_SIZE = 256 * 1024
+GZIP_LEVEL = 6
+# Dynamic content: quality 4 compresses better than gzip -6 at similar speed
+BROTLI_QUALITY = 4
+
+COMPRESSIBLE_TYPES = (
+    "application/json", "application/javascript", "application/xml",
+    "application/x-ndjson", "image/svg+xml", "text/",
+)
+
+
+def dumps(content: Any) -> bytes:
+    """Compact UTF-8 JSON; UTC datetimes end in Z, as pydantic writes them"""
+    if orjson is not None:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_UTC_Z)
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def choose_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """'br', 'gzip' or None from an Accept-Encoding header (q=0 excludes)"""
+    accepted = {}
+    for item in (accept_encoding or "").split(","):
+        name, _, params = item.strip().partition(";")
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if name:
+            accepted[name.strip().lower()] = quality
+    wildcard = accepted.get("*", 0.0)
+    for encoding in ("br", "gzip"):
+        if encoding == "br" and brotli is None:
+            continue
+        if accepted.get(encoding, wildcard) > 0:
+            return encoding
+    return None
+
+
+def is_compressible(content_type: str) -> bool:
+    return content_type.lower().startswith(COMPRESSIBLE_TYPES)
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+    return compressor.compress(body) + compressor.flush()
+
+
+class _StreamCompressor:
+    def __init__(self, encoding: str):
+        if encoding == "br":
+            self._brotli = brotli.Compressor(quality=BROTLI_QUALITY)
+            self._zlib = None
+        else:
+            self._brotli = None
+            self._zlib = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def write(self, data: bytes, final: bool) -> bytes:
+        if self._brotli is not None:
+            out = self._brotli.process(data)
+            return out + (self._brotli.finish() if final else self._brotli.flush())
+        out = self._zlib.compress(data)
+        return out + self._zlib.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+
+
+class CompressionMiddleware:
+    def __init__(self, app: ASGIApp, minimum_size: int = MINIMUM_SIZE) -> None:
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding"))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        await _CompressionResponder(self.app, encoding, self.minimum_size)(scope, receive, send)
+
+
+class _CompressionResponder:
+    def __init__(self, app: ASGIApp, encoding: str, minimum_size: int) -> None:
+        self.app = app
+        self.encoding = encoding
+        self.minimum_size = minimum_size
+        self.send: Send = None
+        self.start_message: Optional[Message] = None
+        self.passthrough = False
+        self.buffer = b""
+        self.stream: Optional[_StreamCompressor] = None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        self.send = send
+        await self.app(scope, receive, self.send_compressed)
+
+    def _encoded_headers(self) -> MutableHeaders:
+        headers = MutableHeaders(raw=self.start_message["headers"])
+        headers["Content-Encoding"] = self.encoding
+        headers.add_vary_header("Accept-Encoding")
+        etag = headers.get("etag")
+        if etag and not etag.startswith("W/"):
+            headers["ETag"] = f"W/{etag}"
+        return headers
+
+    async def send_compressed(self, message: Message) -> None:
+        if message["type"] == "http.response.start":
+            self.start_message = message
+            headers = Headers(raw=message["headers"])
+            self.passthrough = (
+                message["status"] in (204, 304)
+                or "content-encoding" in headers
+                or "no-transform" in headers.get("cache-control", "")
+                or not is_compressible(headers.get("content-type", ""))
+            )
+            if self.passthrough:
+                await self.send(message)
+            return
+
+        if message["type"] != "http.response.body" or self.passthrough:
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if self.stream is None:
+            # Hold back chunks until the size decides (middlewares re-stream small bodies too)
+            self.buffer += body
+            if more_body and len(self.buffer) < self.minimum_size:
+                return
+            body, self.buffer = self.buffer, b""
+            if not more_body:
+                await self._send_whole(body)
+                return
+            headers = self._encoded_headers()
+            if "content-length" in headers:
+                del headers["Content-Length"]
+            self.stream = _StreamCompressor(self.encoding)
+            await self.send(self.start_message)
+
+        if len(body) > OFFLOAD_SIZE:
+            body = await asyncio.to_thread(self.stream.write, body, not more_body)
+        else:
+            body = self.stream.write(body, not more_body)
+        await self.send({"type": "http.response.body", "body": body, "more_body": more_body})
+
+    async def _send_whole(self, body: bytes) -> None:
+        if len(body) < self.minimum_size:
+            await self.send(self.start_message)
+            await self.send({"type": "http.response.body", "body": body})
+            return
+        if len(body) > OFFLOAD_SIZE:
+            body = await asyncio.to_thread(compress, body, self.encoding)
+        else:
+            body = compress(body, self.encoding)
+        headers = self._encoded_headers()
+        headers["Content-Length"] = str(len(body))
+        await self.send(self.start_message)
+        await self.send({"type": "http.response.body", "body": body})
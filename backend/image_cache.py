@@ -0,0 +1,164 @@
+"""
+Image Cache
+Bounded on-disk read-through cache for object-storage reads.
+
+Exports, PDF downloads and thumbnail regeneration read the same page images
+over and over. Entries are keyed by object key + ETag: every read does a
+cheap HEAD, and the body is only downloaded when that exact version is not
+cached yet. Overwritten pages therefore never serve stale bytes.
+
+- LRU eviction once the cache exceeds max_bytes
+- cached files are read with mmap (no extra buffering, shared page cache
+  across workers)
+- concurrent reads of the same object share one download
+- hit rate, bytes saved and evictions are tracked for reporting
+"""
+import asyncio
+import hashlib
+import logging
+import mmap
+import os
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, Optional
+
+from storage import ObjectStorage
+
+logger = logging.getLogger(__name__)
+
+
+class DiskImageCache:
+    """Read-through LRU cache in front of an ObjectStorage backend"""
+
+    def __init__(self, storage: ObjectStorage, directory: str, max_bytes: int = 1024 * 1024 * 1024):
+        self.storage = storage
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, int]" = OrderedDict()  # filename -> size, oldest first
+        self._size = 0
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.bytes_saved = 0
+        self._load_existing()
+
+    def _load_existing(self) -> None:
+        """Rebuild the LRU from files left by a previous run, least recently used first"""
+        files = [p for p in self.directory.iterdir() if p.is_file() and not p.name.endswith(".tmp")]
+        for path in sorted(files, key=lambda p: p.stat().st_atime):
+            size = path.stat().st_size
+            self._entries[path.name] = size
+            self._size += size
+        self._evict()
+
+    @staticmethod
+    def _filename(key: str, etag: Optional[str]) -> str:
+        return hashlib.sha256(f"{key}\0{etag or ''}".encode()).hexdigest()
+
+    def _evict(self) -> None:
+        while self._size > self.max_bytes and self._entries:
+            name, size = self._entries.popitem(last=False)
+            self._size -= size
+            self.evictions += 1
+            try:
+                (self.directory / name).unlink()
+            except FileNotFoundError:
+                pass
+
+    def _store(self, name: str, data: bytes) -> None:
+        path = self.directory / name
+        tmp = path.with_name(name + ".tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+
+    @staticmethod
+    def _read_mapped(path: Path) -> bytes:
+        with open(path, "rb") as handle:
+            with mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                return mapped[:]
+
+    async def _fetch(self, key: str, name: str) -> None:
+        """Download one object into the cache (shared by concurrent callers)"""
+        data = await self.storage.get_object(key)
+        if len(data) <= self.max_bytes:
+            await asyncio.to_thread(self._store, name, data)
+            self._entries[name] = len(data)
+            self._size += len(data)
+            self._evict()
+
+    async def _ensure(self, key: str) -> Path:
+        """Make sure the current version of `key` is on disk and return its path"""
+        head = await self.storage.head_object(key)
+        if head is None:
+            raise KeyError(key)
+        name = self._filename(key, head.get("ETag"))
+
+        if name in self._entries and (self.directory / name).exists():
+            self._entries.move_to_end(name)
+            self.hits += 1
+            self.bytes_saved += self._entries[name]
+            return self.directory / name
+
+        inflight = self._inflight.get(name)
+        if inflight:
+            self.coalesced += 1
+            self.bytes_saved += head.get("ContentLength") or 0
+            await asyncio.shield(inflight)
+        else:
+            self.misses += 1
+            future = asyncio.get_running_loop().create_future()
+            self._inflight[name] = future
+            try:
+                await self._fetch(key, name)
+                future.set_result(None)
+            except BaseException as e:
+                future.set_exception(e)
+                # Mark retrieved so an unawaited failure is not logged
+                future.exception()
+                raise
+            finally:
+                self._inflight.pop(name, None)
+        return self.directory / name
+
+    async def get(self, key: str) -> bytes:
+        """Object bytes, from the cache when the stored version is unchanged"""
+        path = await self._ensure(key)
+        try:
+            return await asyncio.to_thread(self._read_mapped, path)
+        except (FileNotFoundError, ValueError):
+            # Evicted between check and read (or too large to cache)
+            return await self.storage.get_object(key)
+
+    @asynccontextmanager
+    async def mapped(self, key: str) -> AsyncIterator[memoryview]:
+        """Zero-copy view of a cached object; valid only inside the block"""
+        path = await self._ensure(key)
+        try:
+            handle = open(path, "rb")
+        except FileNotFoundError:
+            yield memoryview(await self.storage.get_object(key))
+            return
+        with handle, mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            view = memoryview(mapped)
+            try:
+                yield view
+            finally:
+                view.release()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "entries": len(self._entries),
+            "size_bytes": self._size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_rate": round((self.hits + self.coalesced) / lookups, 4) if lookups else None,
+            "bytes_saved": self.bytes_saved,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,174 @@
+"""
+Index Registry
+Every MongoDB index the backend relies on, declared next to the query
+shape it serves.
+
+Each entry is (keys, options): keys is a field name or a list of
+(field, direction) pairs, options are passed to create_index. Compound
+indexes follow equality → sort → range, so `{user_id, folder_id}` sorted by
+updated_at is one index range scan without an in-memory sort.
+
+ensure_indexes() runs in the background at startup. MongoDB builds indexes
+without blocking reads or writes (4.2+), and a failing build (e.g. a unique
+index over existing duplicates) is logged without stopping the others.
+tests/test_indexes.py runs explain() on the hot queries against a real
+server to make sure none of them falls back to a collection scan.
+"""
+import asyncio
+import logging
+from typing import Any, Dict, List, Tuple, Union
+
+from document_listing import SUMMARY_INDEX
+from search import GRAMS_INDEX, TEXT_INDEX, TEXT_INDEX_OPTIONS
+
+logger = logging.getLogger(__name__)
+
+Keys = Union[str, List[Tuple[str, Any]]]
+
+DAY = 24 * 60 * 60
+
+INDEXES: Dict[str, List[Tuple[Keys, Dict[str, Any]]]] = {
+    "users": [
+        ("user_id", {"unique": True}),
+        ("email", {"unique": True}),
+        ("apple_id", {"sparse": True}),                # Sign in with Apple
+        ("push_token", {"sparse": True}),              # token re-assignment, notification sends
+        ([("created_at", -1)], {}),                    # admin user list / growth stats
+    ],
+    "user_sessions": [
+        ("session_token", {"unique": True}),           # get_current_user cookie auth
+        ("expires_at", {"expireAfterSeconds": 0}),     # TTL
+    ],
+    "web_access_sessions": [
+        ("session_id", {}),
+        ([("user_id", 1), ("status", 1), ("expires_at", 1)], {}),   # pending / approved lookups
+        # TTL a day after expiry so polling clients still see "expired" first
+        ("expires_at", {"expireAfterSeconds": DAY}),
+    ],
+    "documents": [
+        ("document_id", {"unique": True}),
+        # {user_id} sorted by updated_at, manifest {user_id, updated_at > since}, summaries
+        (SUMMARY_INDEX, {}),
+        ([("user_id", 1), ("folder_id", 1), ("updated_at", -1)], {}),
+        ([("user_id", 1), ("tags", 1), ("updated_at", -1)], {}),
+        (TEXT_INDEX, TEXT_INDEX_OPTIONS),              # full-text search
+        (GRAMS_INDEX, {}),                             # partial-word search
+        # Bulk create idempotency keys
+        ([("user_id", 1), ("client_id", 1)], {"unique": True, "partialFilterExpression": {"client_id": {"$type": "string"}}}),
+    ],
+    "pages": [
+        ([("document_id", 1), ("page_id", 1)], {"unique": True}),
+        ([("document_id", 1), ("order", 1)], {}),
+        # watermark removal job (walks _id order), account deletion
+        ([("user_id", 1), ("has_watermark", 1), ("_id", 1)], {}),
+    ],
+    "folders": [
+        ("folder_id", {"unique": True}),
+        ("user_id", {}),
+        # subtrees of nested folders (multikey); deepest descendant first
+        ([("user_id", 1), ("ancestors", 1), ("depth", -1)], {}),
+    ],
+    "signatures": [
+        ("signature_id", {"unique": True}),
+        ("user_id", {}),
+    ],
+    "upload_sessions": [
+        ("upload_id", {"unique": True}),
+        ("user_id", {}),
+        ([("status", 1), ("expires_at", 1)], {}),      # sweep of uncommitted uploads (uploads.py)
+        # TTL a day after expiry; the sweep deletes uncommitted objects well before that
+        ("expires_at", {"expireAfterSeconds": DAY}),
+    ],
+    "tombstones": [
+        ("tombstone_id", {"unique": True}),
+        ("user_id", {}),
+    ],
+    "sync_counters": [
+        ("user_id", {"unique": True}),
+    ],
+    "sync_changes": [
+        ([("user_id", 1), ("entity_id", 1)], {"unique": True}),
+        ([("user_id", 1), ("seq", 1)], {}),            # changes since seq
+        ([("user_id", 1), ("document_id", 1)], {}),    # drop page rows of a deleted document
+        ("changed_at", {"partialFilterExpression": {"deleted": True}}),  # tombstone purge
+    ],
+    "blobs": [
+        ("hash", {"unique": True}),
+        ([("state", 1), ("ref_count", 1), ("last_used_at", 1)], {}),
+    ],
+    "blob_refs": [
+        ("ref_id", {"unique": True}),
+        ("document_id", {}),
+        ("user_id", {}),
+    ],
+    "storage_usage": [
+        ("user_id", {"unique": True}),
+        ([("bytes", -1)], {}),                         # largest users (admin)
+    ],
+    "deletion_jobs": [
+        ("job_id", {"unique": True}),
+        ([("status", 1), ("next_attempt_at", 1)], {}),
+        ([("created_at", -1)], {}),                    # admin job list
+        ("completed_at", {"expireAfterSeconds": 30 * DAY}),  # TTL; unset until completed
+    ],
+    "bulk_jobs": [
+        ("job_id", {"unique": True}),
+        ([("status", 1), ("next_attempt_at", 1)], {}),
+        # At most one active job per user and kind
+        ([("user_id", 1), ("kind", 1)], {"unique": True, "partialFilterExpression": {"active": True}}),
+        ("completed_at", {"expireAfterSeconds": 30 * DAY}),  # TTL; unset until completed
+    ],
+    "migrations": [
+        ("migration_id", {"unique": True}),
+    ],
+    "settings": [
+        ("key", {}),
+    ],
+    "admin_users": [
+        ("email", {}),
+        ("admin_id", {}),
+    ],
+    "languages": [
+        ("code", {}),
+    ],
+    "translations": [
+        ("language_code", {}),
+    ],
+    "legal_pages": [
+        ([("page_type", 1), ("language_code", 1)], {}),
+    ],
+}
+
+
+def _describe(keys: Keys) -> str:
+    if isinstance(keys, str):
+        return keys
+    return ", ".join(f"{field}:{direction}" for field, direction in keys)
+
+
+async def ensure_indexes(db) -> Dict[str, int]:
+    """Create every registered index. Returns counts of built and failed indexes."""
+    built = failed = 0
+    for collection_name, indexes in INDEXES.items():
+        collection = db[collection_name]
+        for keys, options in indexes:
+            try:
+                await collection.create_index(keys, **options)
+                built += 1
+            except Exception as e:
+                failed += 1
+                logger.warning(f"  ⚠️ Index {collection_name}({_describe(keys)}) not built: {e}")
+    logger.info(f"✅ Indexes ensured: {built} ok, {failed} failed")
+    return {"built": built, "failed": failed}
+
+
+_builds = set()
+
+
+def start_index_build(db) -> asyncio.Task:
+    """Build indexes without delaying startup"""
+    task = asyncio.create_task(ensure_indexes(db))
+    # Keep a reference until done so the task is not garbage collected
+    _builds.add(task)
+    task.add_done_callback(_builds.discard)
+    return task
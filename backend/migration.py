@@ -0,0 +1,241 @@
+"""
+Page Storage Migration
+Moves base64 page images stored inside MongoDB documents into object storage.
+
+Older documents (storage_type "mongodb") and pages whose upload fell back to
+base64 carry image_base64 / thumbnail_base64 / original_image_base64 inline.
+The migrator walks the `pages` collection, uploads each blob to its regular
+page key and rewrites the page to the matching *_url field. Once no page of
+a document holds base64 any more, the document's storage_type is updated.
+
+- Resumable: progress and the last processed page _id are stored in the
+  `migrations` collection after every page; a restart continues there.
+  Legacy documents with embedded pages are split into `pages` first.
+- Deduplicated: with a BlobStore, images go through content-addressed
+  storage, so identical image / original copies are uploaded once.
+- Idempotent: keys are deterministic and a page is only rewritten if it still
+  holds the exact base64 that was uploaded, so concurrent edits win and
+  re-running the job is safe. A blob reference taken for an upload that
+  lost to a concurrent edit is released again.
+- Throttled: an images-per-second limit keeps load on MongoDB and storage low.
+"""
+import asyncio
+import base64
+import logging
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+from storage import ObjectStorage, page_key
+from storage_usage import IMAGE_ROLES
+
+logger = logging.getLogger(__name__)
+
+MIGRATION_ID = "pages_to_object_storage"
+
+# page field holding base64 -> (image type used in the key, url field)
+BASE64_FIELDS = {
+    "image_base64": ("page", "image_url"),
+    "thumbnail_base64": ("thumbnail", "thumbnail_url"),
+    "original_image_base64": ("original", "original_image_url"),
+}
+
+# page field holding base64 -> field recording its decoded size
+SIZE_FIELDS = {inline: size for inline, _, size in IMAGE_ROLES.values()}
+
+BASE64_QUERY = {"$or": [{field: {"$type": "string", "$ne": ""}} for field in BASE64_FIELDS]}
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _decode(value: str) -> bytes:
+    if "," in value[:100]:
+        value = value.split(",", 1)[1]
+    return base64.b64decode(value)
+
+
+class PageStorageMigrator:
+    """Background job copying inline base64 page images to object storage"""
+
+    def __init__(self, db, storage: Optional[ObjectStorage], page_store, blob_store=None, batch_size: int = 20):
+        self.db = db
+        self.storage = storage
+        self.page_store = page_store
+        self.blob_store = blob_store
+        self.batch_size = batch_size
+        self.images_per_second = 5.0
+        self._task: Optional[asyncio.Task] = None
+        self._next_slot = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def status(self) -> Dict[str, Any]:
+        state = await self.db.migrations.find_one({"migration_id": MIGRATION_ID}, {"_id": 0}) or {
+            "migration_id": MIGRATION_ID, "status": "not_started",
+        }
+        if state.get("last_id") is not None:
+            state["last_id"] = str(state["last_id"])
+        state["remaining_pages"] = await self.db.pages.count_documents(BASE64_QUERY)
+        state["running"] = self.running
+        return state
+
+    async def start(self, images_per_second: Optional[float] = None, restart: bool = False) -> Dict[str, Any]:
+        if not self.storage:
+            raise RuntimeError("Object storage is not configured")
+        if images_per_second:
+            self.images_per_second = images_per_second
+
+        now = _now()
+        reset = {
+            "last_id": None, "pages_migrated": 0, "images_migrated": 0,
+            "bytes_moved": 0, "errors": 0, "last_error": None, "started_at": now,
+        }
+        update: Dict[str, Any] = {"$set": {"status": "running", "images_per_second": self.images_per_second, "updated_at": now}}
+        if restart:
+            update["$set"].update(reset)
+        else:
+            update["$setOnInsert"] = reset
+        await self.db.migrations.update_one({"migration_id": MIGRATION_ID}, update, upsert=True)
+        if not self.running:
+            self._task = asyncio.create_task(self._run())
+        return await self.status()
+
+    async def pause(self) -> Dict[str, Any]:
+        await self.db.migrations.update_one(
+            {"migration_id": MIGRATION_ID},
+            {"$set": {"status": "paused", "updated_at": _now()}},
+        )
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        return await self.status()
+
+    async def stop(self) -> None:
+        """Shutdown: stop without changing the stored status, so it resumes on next start"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def resume_if_running(self) -> None:
+        """Called at startup: continue a migration that was running before a restart"""
+        state = await self.db.migrations.find_one({"migration_id": MIGRATION_ID})
+        if state and state.get("status") == "running" and self.storage:
+            self.images_per_second = state.get("images_per_second") or self.images_per_second
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"✅ Resuming page storage migration after {state.get('pages_migrated', 0)} pages")
+
+    async def _throttle(self) -> None:
+        """Space uploads evenly at images_per_second"""
+        interval = 1.0 / self.images_per_second
+        now = time.monotonic()
+        if self._next_slot > now:
+            await asyncio.sleep(self._next_slot - now)
+        self._next_slot = max(now, self._next_slot) + interval
+
+    async def _run(self) -> None:
+        try:
+            # Embedded legacy pages are only visible to the migration once split
+            await self.page_store.split_legacy()
+            while True:
+                state = await self.db.migrations.find_one({"migration_id": MIGRATION_ID})
+                query = dict(BASE64_QUERY)
+                if state.get("last_id"):
+                    query["_id"] = {"$gt": state["last_id"]}
+
+                pages = await self.db.pages.find(
+                    query, {"_id": 1, "document_id": 1, "user_id": 1, "page_id": 1, **{f: 1 for f in BASE64_FIELDS}}
+                ).sort("_id", 1).limit(self.batch_size).to_list(None)
+                if not pages:
+                    break
+
+                for page in pages:
+                    await self.migrate_page(page)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"❌ Page storage migration stopped: {e}")
+            await self.db.migrations.update_one(
+                {"migration_id": MIGRATION_ID},
+                {"$set": {"status": "failed", "last_error": str(e), "updated_at": _now()}},
+            )
+            return
+
+        await self.db.migrations.update_one(
+            {"migration_id": MIGRATION_ID},
+            {"$set": {"status": "completed", "completed_at": _now(), "updated_at": _now()}},
+        )
+        logger.info("✅ Page storage migration completed")
+
+    async def _sync_refs(self, page: Dict[str, Any]) -> None:
+        current = await self.db.pages.find_one(
+            {"_id": page["_id"]}, {"_id": 0, "page_id": 1, **{url: 1 for _, url in BASE64_FIELDS.values()}}
+        )
+        if current:
+            await self.blob_store.sync_refs(page["user_id"], page["document_id"], [current])
+        else:
+            await self.blob_store.release_pages(page["document_id"], [page["page_id"]])
+
+    async def migrate_page(self, page: Dict[str, Any]) -> None:
+        """Upload every inline blob of one page and record progress"""
+        user_id, document_id, page_id = page["user_id"], page["document_id"], page.get("page_id")
+        images_migrated = bytes_moved = errors = 0
+        last_error = None
+
+        for field, (image_type, url_field) in BASE64_FIELDS.items():
+            value = page.get(field)
+            if not value or not page_id:
+                continue
+            await self._throttle()
+            try:
+                data = _decode(value)
+                if self.blob_store:
+                    url = await self.blob_store.store(data, user_id, document_id, page_id, image_type)
+                else:
+                    key = page_key(user_id, document_id, page_id, image_type)
+                    await self.storage.put_object(key, data, content_type="image/jpeg")
+                    url = self.storage.public_url(key)
+                # Only rewrite if the page still holds exactly what was uploaded.
+                # The size is unchanged; recording it spares the reconciler a HEAD request.
+                result = await self.db.pages.update_one(
+                    {"_id": page["_id"], field: value},
+                    {"$set": {url_field: url, SIZE_FIELDS[field]: len(data)}, "$unset": {field: ""}},
+                )
+                if result.modified_count:
+                    images_migrated += 1
+                    bytes_moved += len(data)
+                elif self.blob_store:
+                    # The page changed meanwhile: drop or re-point the reference store() just made
+                    await self._sync_refs(page)
+            except Exception as e:
+                errors += 1
+                last_error = f"{document_id}/{page_id}/{field}: {e}"
+                logger.warning(f"⚠️ Migration failed for {last_error}")
+
+        if images_migrated:
+            await self.page_store.refresh_cover(document_id)
+            # Same images, new URLs: invalidate cached document responses (ETag)
+            await self.db.documents.update_one({"document_id": document_id}, {"$inc": {"cache_rev": 1}})
+
+        # Last inline page of the document: it now lives in object storage
+        if not await self.db.pages.find_one({"document_id": document_id, **BASE64_QUERY}, {"_id": 1}):
+            await self.db.documents.update_one(
+                {"document_id": document_id},
+                {"$set": {"storage_type": self.storage.storage_type}},
+            )
+
+        update: Dict[str, Any] = {
+            "$set": {"last_id": page["_id"], "updated_at": _now()},
+            "$inc": {"pages_migrated": 1, "images_migrated": images_migrated,
+                     "bytes_moved": bytes_moved, "errors": errors},
+        }
+        if last_error:
+            update["$set"]["last_error"] = last_error
+        await self.db.migrations.update_one({"migration_id": MIGRATION_ID}, update)
@@ -0,0 +1,211 @@
+"""
+OCR Word Geometry
+Compact, array-backed word boxes for OCR results.
+
+Geometry is produced once when a page is OCR'd and stored next to the page
+(`pages[].ocr_words`) so search highlighting and searchable PDF export can
+reuse it without running OCR again.
+
+Stored format (version 1):
+    {
+        "v": 1,
+        "size": [width, height],   # image size the boxes refer to
+        "words": "word word ...",   # space separated tokens
+        "boxes": "<base64>",        # uint16 little-endian, 4 per word: x, y, w, h
+        "conf": "<base64>",         # uint8, 0-100 per word
+        "lines": "<base64>",        # uint16 line number per word
+    }
+"""
+import base64
+import logging
+import re
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+GEOMETRY_VERSION = 1
+
+_BOX_DTYPE = np.dtype("<u2")
+_CONF_DTYPE = np.dtype("u1")
+_LINE_DTYPE = np.dtype("<u2")
+_UINT16_MAX = 65535
+
+_PUNCTUATION = re.compile(r"^\W+|\W+$", re.UNICODE)
+
+
+def _encode_array(values: np.ndarray, dtype: np.dtype) -> str:
+    return base64.b64encode(np.ascontiguousarray(values, dtype=dtype).tobytes()).decode("ascii")
+
+
+def _decode_array(data: str, dtype: np.dtype) -> np.ndarray:
+    return np.frombuffer(base64.b64decode(data), dtype=dtype)
+
+
+def _normalize_token(token: str) -> str:
+    return _PUNCTUATION.sub("", token.lower())
+
+
+class WordGeometry:
+    """Word boxes, confidences and line numbers for one OCR'd page"""
+
+    __slots__ = ("width", "height", "words", "boxes", "conf", "lines")
+
+    def __init__(
+        self,
+        width: int,
+        height: int,
+        words: List[str],
+        boxes: np.ndarray,
+        conf: np.ndarray,
+        lines: np.ndarray,
+    ):
+        self.width = int(width)
+        self.height = int(height)
+        self.words = words
+        self.boxes = boxes.reshape(-1, 4)
+        self.conf = conf
+        self.lines = lines
+
+    def __len__(self) -> int:
+        return len(self.words)
+
+    @classmethod
+    def from_tesseract(cls, data: Dict[str, List[Any]], width: int, height: int) -> "WordGeometry":
+        """Build geometry from `pytesseract.image_to_data(..., output_type=Output.DICT)`"""
+        words: List[str] = []
+        boxes: List[int] = []
+        conf: List[int] = []
+        lines: List[int] = []
+
+        line_keys: Dict[tuple, int] = {}
+        for i, raw in enumerate(data.get("text", [])):
+            token = "".join((raw or "").split())
+            if not token:
+                continue
+            try:
+                word_conf = float(data["conf"][i])
+            except (TypeError, ValueError):
+                word_conf = -1
+            if word_conf < 0:
+                continue
+
+            line_key = (data["page_num"][i], data["block_num"][i], data["par_num"][i], data["line_num"][i])
+            line_no = line_keys.setdefault(line_key, len(line_keys))
+
+            words.append(token)
+            boxes.extend((data["left"][i], data["top"][i], data["width"][i], data["height"][i]))
+            conf.append(int(round(word_conf)))
+            lines.append(line_no)
+
+        return cls(
+            width,
+            height,
+            words,
+            np.clip(np.array(boxes, dtype=np.int64), 0, _UINT16_MAX).astype(_BOX_DTYPE),
+            np.clip(np.array(conf, dtype=np.int64), 0, 100).astype(_CONF_DTYPE),
+            np.clip(np.array(lines, dtype=np.int64), 0, _UINT16_MAX).astype(_LINE_DTYPE),
+        )
+
+    @classmethod
+    def from_dict(cls, stored: Optional[Dict[str, Any]]) -> Optional["WordGeometry"]:
+        """Decode stored geometry. Returns None for missing or malformed data."""
+        if not stored or stored.get("v") != GEOMETRY_VERSION:
+            return None
+        try:
+            width, height = stored["size"]
+            words = stored["words"].split(" ") if stored.get("words") else []
+            boxes = _decode_array(stored.get("boxes", ""), _BOX_DTYPE)
+            conf = _decode_array(stored.get("conf", ""), _CONF_DTYPE)
+            lines = _decode_array(stored.get("lines", ""), _LINE_DTYPE)
+            if len(boxes) != 4 * len(words) or len(conf) != len(words) or len(lines) != len(words):
+                raise ValueError("array lengths do not match word count")
+            return cls(width, height, words, boxes, conf, lines)
+        except Exception as e:
+            logger.warning(f"Invalid OCR geometry: {e}")
+            return None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "v": GEOMETRY_VERSION,
+            "size": [self.width, self.height],
+            "words": " ".join(self.words),
+            "boxes": _encode_array(self.boxes.reshape(-1), _BOX_DTYPE),
+            "conf": _encode_array(self.conf, _CONF_DTYPE),
+            "lines": _encode_array(self.lines, _LINE_DTYPE),
+        }
+
+    def text(self) -> str:
+        """Reconstruct plain text, one OCR line per text line"""
+        out_lines: List[str] = []
+        current_line = None
+        for word, line_no in zip(self.words, self.lines.tolist()):
+            if line_no != current_line:
+                out_lines.append(word)
+                current_line = line_no
+            else:
+                out_lines[-1] += " " + word
+        return "\n".join(out_lines)
+
+    def mean_confidence(self) -> Optional[float]:
+        """Mean word confidence in the 0-1 range"""
+        if not len(self.conf):
+            return None
+        return round(float(self.conf.mean()) / 100.0, 4)
+
+    def find(self, query: str) -> List[List[int]]:
+        """
+        Find a word or phrase. Returns one list of word indices per hit.
+        Each query token must be contained in the matching word (case-insensitive),
+        and multi-word queries must match consecutive words.
+        """
+        tokens = [t for t in (_normalize_token(q) for q in query.split()) if t]
+        if not tokens or not self.words:
+            return []
+
+        normalized = [_normalize_token(w) for w in self.words]
+        span = len(tokens)
+        hits = []
+        for start in range(len(normalized) - span + 1):
+            if all(tokens[k] in normalized[start + k] for k in range(span)):
+                hits.append(list(range(start, start + span)))
+        return hits
+
+    def normalized_boxes(self, indices: List[int]) -> List[List[float]]:
+        """Boxes for the given words as [x, y, w, h] fractions of the image size"""
+        if not indices or not self.width or not self.height:
+            return []
+        scale = np.array([self.width, self.height, self.width, self.height], dtype=np.float64)
+        selected = self.boxes[np.asarray(indices, dtype=np.intp)].astype(np.float64) / scale
+        return np.round(selected, 5).tolist()
+
+
+def draw_text_layer(pdf_canvas, geometry: WordGeometry, x: float, y: float, draw_width: float, draw_height: float):
+    """
+    Draw invisible OCR text over an image placed at (x, y, draw_width, draw_height)
+    on a reportlab canvas, making the exported PDF searchable and selectable.
+    """
+    if not geometry or not len(geometry) or not geometry.width or not geometry.height:
+        return
+
+    scale_x = draw_width / geometry.width
+    scale_y = draw_height / geometry.height
+
+    text = pdf_canvas.beginText()
+    text.setTextRenderMode(3)  # Invisible
+    for word, (left, top, width, height) in zip(geometry.words, geometry.boxes.tolist()):
+        if width <= 0 or height <= 0:
+            continue
+        try:
+            font_size = max(1.0, height * scale_y)
+            text.setFont("Helvetica", font_size)
+            natural_width = pdf_canvas.stringWidth(word, "Helvetica", font_size)
+            if natural_width > 0:
+                text.setHorizScale(100.0 * (width * scale_x) / natural_width)
+            # PDF origin is bottom-left; place baseline at the bottom of the box
+            text.setTextOrigin(x + left * scale_x, y + draw_height - (top + height) * scale_y)
+            text.textOut(word)
+        except Exception as e:
+            logger.debug(f"Skipping OCR word in PDF text layer: {e}")
+    pdf_canvas.drawText(text)
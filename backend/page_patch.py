@@ -0,0 +1,149 @@
+"""
+Page Patch
+Validates a list of page operations and turns it into a plan.
+
+Operations are applied in order to the document's page list:
+
+    {"op": "reorder", "order": [page_id, ...]}          full new order
+    {"op": "insert", "page": {...}, "index": 2}          index defaults to the end
+    {"op": "delete", "page_id": "..."}
+    {"op": "replace", "page_id": "...", "page": {...}}   new image for one page
+    {"op": "rotate", "page_id": "...", "degrees": 90}    clockwise, multiples of 90
+    {"op": "set_filter", "page_id": "...", "filter": "grayscale"}
+
+The plan lists, per page, the image steps to run (only pages that are
+inserted, replaced, rotated or filtered are touched) plus the final order.
+Planning never touches the database or images, so a bad patch is rejected
+before anything is written.
+
+render_page() runs a page's steps non-destructively: filters are applied to
+the page's unfiltered original (rotated along with the page), never to the
+filtered image, so filters do not compound and "original" restores it.
+"""
+import uuid
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+MAX_OPERATIONS = 100
+FILTERS = ("original", "grayscale", "bw", "enhanced", "document")
+
+Step = Tuple[str, Any]
+
+
+class PagePatchError(ValueError):
+    """The patch does not apply to the current pages"""
+
+
+class PatchPlan:
+    def __init__(self, order: List[str], steps: Dict[str, List[Step]], inserted: List[str], deleted: List[str]):
+        self.order = order          # final page order
+        self.steps = steps          # page_id -> image steps, for touched pages only
+        self.inserted = inserted    # new page IDs
+        self.deleted = deleted      # existing page IDs removed by the patch
+
+    @property
+    def touched(self) -> List[str]:
+        return [page_id for page_id in self.order if page_id in self.steps]
+
+
+def new_page_id() -> str:
+    return f"page_{uuid.uuid4().hex[:8]}"
+
+
+def _require(operation: Dict[str, Any], field: str) -> Any:
+    value = operation.get(field)
+    if value is None:
+        raise PagePatchError(f"'{operation.get('op')}' needs '{field}'")
+    return value
+
+
+def plan_patch(page_ids: List[str], operations: List[Dict[str, Any]]) -> PatchPlan:
+    """Apply `operations` to `page_ids` (current order) and return the plan"""
+    if not operations:
+        raise PagePatchError("No operations")
+    if len(operations) > MAX_OPERATIONS:
+        raise PagePatchError(f"At most {MAX_OPERATIONS} operations per patch")
+
+    existing = set(page_ids)
+    order = list(page_ids)
+    steps: Dict[str, List[Step]] = {}
+    inserted: List[str] = []
+    deleted: List[str] = []
+
+    def locate(operation: Dict[str, Any]) -> str:
+        page_id = _require(operation, "page_id")
+        if page_id not in order:
+            raise PagePatchError(f"Page {page_id} not found")
+        return page_id
+
+    for position, operation in enumerate(operations):
+        op = operation.get("op")
+        if op == "reorder":
+            new_order = list(_require(operation, "order"))
+            if len(new_order) != len(order) or set(new_order) != set(order):
+                raise PagePatchError("'reorder' must list every current page exactly once")
+            order = new_order
+        elif op == "insert":
+            page = _require(operation, "page")
+            index: Optional[int] = operation.get("index")
+            index = len(order) if index is None else index
+            if not 0 <= index <= len(order):
+                raise PagePatchError(f"Insert index {index} out of range")
+            page_id = new_page_id()
+            order.insert(index, page_id)
+            steps[page_id] = [("insert", page)]
+            inserted.append(page_id)
+        elif op == "delete":
+            page_id = locate(operation)
+            order.remove(page_id)
+            steps.pop(page_id, None)
+            if page_id in existing:
+                deleted.append(page_id)
+            else:
+                inserted.remove(page_id)
+        elif op == "replace":
+            page_id = locate(operation)
+            # A new image makes earlier steps on this page irrelevant
+            first = "insert" if page_id in inserted else "replace"
+            steps[page_id] = [(first, _require(operation, "page"))]
+        elif op == "rotate":
+            page_id = locate(operation)
+            degrees = _require(operation, "degrees")
+            if not isinstance(degrees, int) or degrees % 90:
+                raise PagePatchError("'rotate' degrees must be a multiple of 90")
+            if degrees % 360:
+                steps.setdefault(page_id, []).append(("rotate", degrees % 360))
+        elif op == "set_filter":
+            page_id = locate(operation)
+            filter_type = _require(operation, "filter")
+            if filter_type not in FILTERS:
+                raise PagePatchError(f"Unknown filter '{filter_type}'")
+            steps.setdefault(page_id, []).append(("filter", filter_type))
+        else:
+            raise PagePatchError(f"Unknown operation '{op}' at position {position}")
+
+    return PatchPlan(order, steps, inserted, deleted)
+
+
+def render_page(
+    original: Optional[str],
+    current: str,
+    filter_applied: str,
+    steps: List[Step],
+    rotate: Callable[[str, int], str],
+    apply_filter: Callable[[str, str], str],
+) -> Tuple[str, Optional[str]]:
+    """Run rotate / filter steps on a page. Returns (image, original).
+
+    Without a stored original, an unfiltered current image stands in for it;
+    a filtered one can only be filtered further, and no original is returned.
+    """
+    unfiltered = original or (current if filter_applied == "original" else None)
+    base = unfiltered or current
+    filter_type = filter_applied if unfiltered else None
+    for kind, value in steps:
+        if kind == "rotate":
+            base = rotate(base, value)
+        elif kind == "filter":
+            filter_type = value
+    image = apply_filter(base, filter_type) if filter_type and filter_type != "original" else base
+    return image, base if unfiltered else None
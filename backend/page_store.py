@@ -0,0 +1,424 @@
+"""
+Page Store
+Document pages in their own collection instead of embedded in documents.
+
+Embedding pages made every document read pull every page (including base64
+images for MongoDB-stored documents) and put large documents at risk of the
+16 MB document limit. Pages now live in `pages`, one row per page, indexed
+by (document_id, order) and unique on (document_id, page_id). The document
+keeps only metadata plus `page_count`.
+
+- METADATA_PROJECTION excludes image payloads; images are fetched only when
+  a caller asks for them (include_images=True or a single-page read).
+- The document carries `thumbnail_url` of its first page so listings never
+  need to touch the pages collection (refresh_cover keeps it current).
+- Every page row carries the byte size of each of its images (see
+  storage_usage.IMAGE_ROLES), and every write applies the size difference
+  to the per-user and global storage counters (StorageUsage).
+- Every page row carries `content_hash`, the SHA-256 of its image bytes
+  (taken from the blob URL for content-addressed images), so sync clients
+  can skip downloading images they already have. Moving an image from
+  base64 to object storage keeps the hash.
+- Documents created before the split carry `pages` inline. They are moved
+  lazily on first access (ensure_split) and in the background at startup
+  (split_legacy); split documents are marked `pages_split: True`.
+"""
+import asyncio
+import base64
+import binascii
+import hashlib
+import logging
+import re
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional
+
+from pymongo import DeleteMany, ReplaceOne, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from storage_usage import SIZE_FIELDS, page_bytes, size_changes, with_sizes
+
+logger = logging.getLogger(__name__)
+
+# migrations entry marking the legacy split / cover backfill as done
+BACKFILL_ID = "split_embedded_pages"
+
+IMAGE_FIELDS = ("image_base64", "thumbnail_base64", "original_image_base64")
+
+# Projection for documents: never load embedded legacy pages by accident
+DOCUMENT_PROJECTION = {"_id": 0, "pages": 0}
+# Page projections (document_id / user_id are implied by the parent document)
+FULL_PROJECTION = {"_id": 0, "document_id": 0, "user_id": 0}
+METADATA_PROJECTION = {**FULL_PROJECTION, **{field: 0 for field in IMAGE_FIELDS}}
+# What a page adds to its owner's storage usage
+SIZE_PROJECTION = {"_id": 0, "page_id": 1, "user_id": 1, **{field: 1 for field in SIZE_FIELDS}}
+
+_BLOB_DIGEST = re.compile(r"blobs/sha256/[0-9a-f]{2}/([0-9a-f]{64})\.")
+
+
+def content_hash(page: Dict[str, Any]) -> Optional[str]:
+    """SHA-256 of the page image; None for a page without an image"""
+    value = page.get("image_base64")
+    if value:
+        try:
+            data = base64.b64decode(value)
+        except (binascii.Error, ValueError):
+            data = value.encode()
+        return hashlib.sha256(data).hexdigest()
+    url = page.get("image_url")
+    if url:
+        match = _BLOB_DIGEST.search(url)
+        # Legacy per-page keys are not content-addressed; their URL changes with the image
+        return match.group(1) if match else hashlib.sha256(url.encode()).hexdigest()
+    return None
+
+
+class PageStore:
+    """Reads and writes pages stored in their own collection"""
+
+    def __init__(self, db, usage=None):
+        self.db = db
+        self.usage = usage
+        self._task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def _projection(include_images: bool) -> Dict[str, int]:
+        return FULL_PROJECTION if include_images else METADATA_PROJECTION
+
+    @staticmethod
+    def _rows(document_id: str, user_id: str, pages: Iterable[Dict[str, Any]], start: int = 0) -> List[Dict[str, Any]]:
+        rows = []
+        for offset, page in enumerate(pages):
+            row = {k: v for k, v in page.items() if k not in ("_id", "document_id", "user_id")}
+            row.update({
+                "document_id": document_id, "user_id": user_id, "order": start + offset,
+                "content_hash": content_hash(row),
+            })
+            rows.append(with_sizes(row))
+        return rows
+
+    async def _count(self, user_id: str, delta_bytes: int, delta_pages: int = 0) -> None:
+        if self.usage:
+            await self.usage.add(user_id, delta_bytes, delta_pages)
+
+    async def _count_rows(self, rows: List[Dict[str, Any]], sign: int = 1) -> None:
+        """Add (or with sign=-1 subtract) rows to their owners' usage"""
+        per_user: Dict[str, List[int]] = {}
+        for row in rows:
+            totals = per_user.setdefault(row["user_id"], [0, 0])
+            totals[0] += page_bytes(row)
+            totals[1] += 1
+        for user_id, (delta_bytes, delta_pages) in per_user.items():
+            await self._count(user_id, sign * delta_bytes, sign * delta_pages)
+
+    # ---------- legacy embedded pages ----------
+
+    async def split_document(self, document_id: str) -> None:
+        """Move embedded pages of one legacy document into the pages collection"""
+        document = await self.db.documents.find_one(
+            {"document_id": document_id, "pages_split": {"$ne": True}},
+            {"_id": 0, "user_id": 1, "pages": 1},
+        )
+        if not document:
+            return
+        pages = document.get("pages") or []
+        if pages:
+            rows = self._rows(document_id, document["user_id"], pages)
+            try:
+                await self.db.pages.insert_many(rows, ordered=False)
+                await self._count_rows(rows)
+            except BulkWriteError as e:
+                # A concurrent split already inserted some rows (and counts them); anything else is real
+                if any(err.get("code") != 11000 for err in e.details.get("writeErrors", [])):
+                    raise
+        await self.db.documents.update_one(
+            {"document_id": document_id, "pages_split": {"$ne": True}},
+            {"$set": {"pages_split": True, "page_count": len(pages)}, "$unset": {"pages": ""}},
+        )
+        await self.refresh_cover(document_id)
+
+    async def ensure_split(self, documents: Iterable[Dict[str, Any]]) -> None:
+        """Split any legacy documents among `documents` (loaded with DOCUMENT_PROJECTION)"""
+        for document in documents:
+            if document and not document.get("pages_split"):
+                await self.split_document(document["document_id"])
+                document["pages_split"] = True
+                document["page_count"] = await self.db.pages.count_documents({"document_id": document["document_id"]})
+
+    async def split_legacy(self, batch_size: int = 100, pause: float = 0.05) -> int:
+        """Background: split every legacy document. Returns how many were split."""
+        split = 0
+        while True:
+            batch = await self.db.documents.find(
+                {"pages_split": {"$ne": True}}, {"_id": 0, "document_id": 1}
+            ).limit(batch_size).to_list(batch_size)
+            if not batch:
+                break
+            for document in batch:
+                await self.split_document(document["document_id"])
+                split += 1
+                await asyncio.sleep(pause)
+        if split:
+            logger.info(f"✅ Moved pages of {split} documents into the pages collection")
+        return split
+
+    async def backfill_covers(self, batch_size: int = 100) -> int:
+        """Background: set thumbnail_url on split documents that predate it"""
+        filled = 0
+        while True:
+            batch = await self.db.documents.find(
+                {"pages_split": True, "thumbnail_url": {"$exists": False}}, {"_id": 0, "document_id": 1}
+            ).limit(batch_size).to_list(batch_size)
+            if not batch:
+                break
+            for document in batch:
+                await self.refresh_cover(document["document_id"])
+                filled += 1
+        return filled
+
+    def start(self) -> None:
+        """Split legacy documents in the background"""
+        if not self._task:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        # One-shot: every document written since this release is already split
+        if await self.db.migrations.find_one({"migration_id": BACKFILL_ID, "status": "completed"}):
+            return
+        try:
+            await self.split_legacy()
+            await self.backfill_covers()
+            await self.db.migrations.update_one(
+                {"migration_id": BACKFILL_ID},
+                {"$set": {"status": "completed", "completed_at": datetime.now(timezone.utc)}},
+                upsert=True,
+            )
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"❌ Legacy page split error: {e}")
+
+    # ---------- reads ----------
+
+    async def list_pages(self, document_id: str, include_images: bool = True) -> List[Dict[str, Any]]:
+        return await self.db.pages.find(
+            {"document_id": document_id}, self._projection(include_images)
+        ).sort("order", 1).to_list(None)
+
+    async def list_many(self, document_ids: List[str], include_images: bool = True) -> Dict[str, List[Dict[str, Any]]]:
+        """Pages for several documents in one query, grouped by document"""
+        grouped: Dict[str, List[Dict[str, Any]]] = {document_id: [] for document_id in document_ids}
+        if not document_ids:
+            return grouped
+        projection = {**self._projection(include_images)}
+        projection.pop("document_id")
+        async for page in self.db.pages.find(
+            {"document_id": {"$in": document_ids}}, projection
+        ).sort([("document_id", 1), ("order", 1)]):
+            grouped[page.pop("document_id")].append(page)
+        return grouped
+
+    async def get(self, document_id: str, page_id: str, include_images: bool = True) -> Optional[Dict[str, Any]]:
+        return await self.db.pages.find_one(
+            {"document_id": document_id, "page_id": page_id}, self._projection(include_images)
+        )
+
+    async def attach(self, documents: List[Dict[str, Any]], include_images: bool = True) -> List[Dict[str, Any]]:
+        """Fill `pages` on documents loaded with DOCUMENT_PROJECTION"""
+        await self.ensure_split(documents)
+        grouped = await self.list_many([d["document_id"] for d in documents], include_images)
+        for document in documents:
+            document["pages"] = grouped.get(document["document_id"], [])
+        return documents
+
+    # ---------- writes ----------
+
+    @staticmethod
+    def cover(first_page: Optional[Dict[str, Any]]) -> Optional[str]:
+        """The document's thumbnail_url for a given first page"""
+        return (first_page or {}).get("thumbnail_url") or (first_page or {}).get("image_url")
+
+    async def refresh_cover(self, document_id: str) -> None:
+        """Copy the first page's thumbnail URL onto the document (None for inline images)"""
+        first = await self.db.pages.find_one(
+            {"document_id": document_id}, {"_id": 0, "thumbnail_url": 1, "image_url": 1}, sort=[("order", 1)]
+        )
+        await self.db.documents.update_one({"document_id": document_id}, {"$set": {"thumbnail_url": self.cover(first)}})
+
+    async def insert(self, document_id: str, user_id: str, pages: List[Dict[str, Any]], start: int = 0) -> None:
+        if pages:
+            rows = self._rows(document_id, user_id, pages, start)
+            await self.db.pages.insert_many(rows)
+            await self._count_rows(rows)
+            if start == 0:
+                await self.refresh_cover(document_id)
+
+    async def insert_documents(self, documents: List[Dict[str, Any]]) -> None:
+        """Insert the pages of several new documents with one insert_many.
+        Covers are not refreshed: new documents get theirs from cover() when created."""
+        rows = [
+            row for document in documents
+            for row in self._rows(document["document_id"], document["user_id"], document.get("pages", []))
+        ]
+        if rows:
+            await self.db.pages.insert_many(rows)
+            await self._count_rows(rows)
+
+    async def append(self, document_id: str, user_id: str, page: Dict[str, Any]) -> int:
+        """Append a page after the current last page. Returns its order."""
+        updated = await self.db.documents.find_one_and_update(
+            {"document_id": document_id},
+            {"$inc": {"page_count": 1}},
+            projection={"_id": 0, "page_count": 1},
+        )
+        order = (updated or {}).get("page_count", 0)
+        await self.insert(document_id, user_id, [page], start=order)
+        return order
+
+    async def replace(self, document_id: str, user_id: str, pages: List[Dict[str, Any]]) -> List[str]:
+        """Replace all pages of a document. Returns the IDs of pages that were removed.
+
+        Pages are upserted in place by page_id before the removed ones are
+        deleted, so a concurrent read sees old or new rows, never no pages.
+        """
+        existing = await self.db.pages.find({"document_id": document_id}, SIZE_PROJECTION).to_list(None)
+        rows = self._rows(document_id, user_id, pages)
+        kept = {row.get("page_id") for row in rows}
+        removed = [page["page_id"] for page in existing if page["page_id"] not in kept]
+        operations: List[Any] = [
+            ReplaceOne({"document_id": document_id, "page_id": row.get("page_id")}, row, upsert=True)
+            for row in rows
+        ]
+        if removed:
+            operations.append(DeleteMany({"document_id": document_id, "page_id": {"$in": removed}}))
+        if operations:
+            await self.db.pages.bulk_write(operations, ordered=True)
+            await self._count_rows(existing, -1)
+            await self._count_rows(rows)
+        await self.db.documents.update_one(
+            {"document_id": document_id}, {"$set": {"page_count": len(pages)}}
+        )
+        await self.refresh_cover(document_id)
+        return removed
+
+    async def apply_patch(
+        self,
+        document_id: str,
+        user_id: str,
+        order: List[str],
+        pages: Dict[str, Dict[str, Any]],
+        deleted: List[str],
+        current_order: Dict[str, int],
+    ) -> None:
+        """Write a page patch in one bulk_write.
+
+        `pages` holds full rows for inserted / rewritten pages; every other
+        page only gets its `order` updated, and only if it moved.
+        """
+        operations: List[Any] = []
+        # Rows this patch removes or overwrites, for the storage counters
+        previous = await self.db.pages.find(
+            {"document_id": document_id, "page_id": {"$in": list(deleted) + list(pages)}}, SIZE_PROJECTION
+        ).to_list(None)
+        rows: List[Dict[str, Any]] = []
+        if deleted:
+            operations.append(DeleteMany({"document_id": document_id, "page_id": {"$in": deleted}}))
+        for index, page_id in enumerate(order):
+            selector = {"document_id": document_id, "page_id": page_id}
+            if page_id in pages:
+                row = self._rows(document_id, user_id, [pages[page_id]], start=index)[0]
+                rows.append(row)
+                operations.append(ReplaceOne(selector, row, upsert=True))
+            elif current_order.get(page_id) != index:
+                operations.append(UpdateOne(selector, {"$set": {"order": index}}))
+        if operations:
+            await self.db.pages.bulk_write(operations, ordered=True)
+            await self._count_rows(previous, -1)
+            await self._count_rows(rows)
+
+    async def update(
+        self,
+        document_id: str,
+        page_id: str,
+        fields: Optional[Dict[str, Any]] = None,
+        unset: Iterable[str] = (),
+    ) -> bool:
+        fields = dict(fields or {})
+        unset = list(unset)
+        sizes = size_changes(fields, unset)
+        fields.update({size: value for size, value in sizes.items() if value is not None})
+        unset += [size for size, value in sizes.items() if value is None and size not in unset]
+        update: Dict[str, Any] = {}
+        if fields:
+            update["$set"] = fields
+        if unset:
+            update["$unset"] = {field: "" for field in unset}
+        if not update:
+            return False
+        changed = set(fields) | set(unset)
+        selector = {"document_id": document_id, "page_id": page_id}
+        if sizes:
+            # The previous sizes, to count only the difference
+            before = await self.db.pages.find_one_and_update(selector, update, projection=SIZE_PROJECTION)
+            matched = before is not None
+            if matched:
+                delta = sum((value or 0) - (before.get(size) or 0) for size, value in sizes.items())
+                await self._count(before["user_id"], delta)
+        else:
+            matched = (await self.db.pages.update_one(selector, update)).matched_count > 0
+        if matched and {"image_base64", "image_url"} & changed:
+            await self.fill_hashes(document_id, [page_id])
+        if matched and {"thumbnail_url", "image_url"} & changed:
+            await self.refresh_cover(document_id)
+        return matched
+
+    async def fill_hashes(self, document_id: str, page_ids: List[str]) -> Dict[str, Optional[str]]:
+        """(Re)compute content_hash from the stored image fields"""
+        hashes: Dict[str, Optional[str]] = {}
+        async for page in self.db.pages.find(
+            {"document_id": document_id, "page_id": {"$in": page_ids}},
+            {"_id": 0, "page_id": 1, "image_base64": 1, "image_url": 1},
+        ):
+            hashes[page["page_id"]] = content_hash(page)
+            await self.db.pages.update_one(
+                {"document_id": document_id, "page_id": page["page_id"]},
+                {"$set": {"content_hash": hashes[page["page_id"]]}},
+            )
+        return hashes
+
+    async def delete_document(self, document_id: str) -> int:
+        return await self.delete_documents([document_id])
+
+    async def delete_documents(self, document_ids: List[str]) -> int:
+        rows = await self.db.pages.find({"document_id": {"$in": document_ids}}, SIZE_PROJECTION).to_list(None)
+        deleted = (await self.db.pages.delete_many({"document_id": {"$in": document_ids}})).deleted_count
+        await self._count_rows(rows, -1)
+        return deleted
+
+    async def delete_user(self, user_id: str) -> int:
+        deleted = (await self.db.pages.delete_many({"user_id": user_id})).deleted_count
+        if self.usage:
+            await self.usage.remove_user(user_id)
+        return deleted
+
+    async def delete_all(self) -> int:
+        deleted = (await self.db.pages.delete_many({})).deleted_count
+        if self.usage:
+            await self.usage.reset()
+        return deleted
+
+    async def count_all(self) -> int:
+        return await self.db.pages.count_documents({})
+
+
+def new_document_fields(page_count: int) -> Dict[str, Any]:
+    """Fields every newly created document carries"""
+    return {"pages_split": True, "page_count": page_count, "thumbnail_url": None}
@@ -0,0 +1,168 @@
+"""
+Quota
+Daily and monthly usage allowances (scans, OCR) kept as counters on the user.
+
+Each quota is a pair of counters on the users row: a count and the day (or
+month) it belongs to, e.g. scans_today / last_scan_date. A count from an
+earlier day or month is stale and reads as 0.
+
+reserve() checks and spends an allowance in one conditional atomic update:
+
+- the filter ($expr) only matches while enough of the allowance is left,
+  counting a stale day or month as 0, so concurrent requests can never
+  spend the same remainder
+- the update is a pipeline that rolls stale counters over to the current
+  day / month and adds the reservation in the same write
+- the row as it was before the write comes back with it, so the amount
+  granted is known without another read (a denied reservation reads the
+  counters once more, to say which limit was hit)
+
+A reservation can cover several units (bulk create) and, with partial=True,
+grant whatever is left instead of nothing. Work that then fails gives its
+units back with release(), which only touches counters still on the
+reserved day / month.
+"""
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+from pymongo import ReturnDocument
+
+
+class Quota:
+    """A usage counter with a daily and optionally a monthly allowance"""
+
+    def __init__(
+        self,
+        day_count: str,
+        day_key: str,
+        per_day: int,
+        day_message: str,
+        month_count: Optional[str] = None,
+        month_key: Optional[str] = None,
+        per_month: Optional[int] = None,
+        month_message: str = "",
+    ):
+        self.day_count = day_count
+        self.day_key = day_key
+        self.per_day = per_day
+        self.day_message = day_message
+        self.month_count = month_count
+        self.month_key = month_key
+        self.per_month = per_month
+        self.month_message = month_message
+
+    @property
+    def fields(self) -> Dict[str, int]:
+        names = [self.day_count, self.day_key] + ([self.month_count, self.month_key] if self.month_count else [])
+        return {name: 1 for name in names}
+
+    def used(self, user: Dict[str, Any], today: str, month: str):
+        """(used today, used this month) from a users row; stale periods count 0"""
+        day = (user.get(self.day_count) or 0) if user.get(self.day_key) == today else 0
+        if not self.month_count:
+            return day, 0
+        return day, (user.get(self.month_count) or 0) if user.get(self.month_key) == month else 0
+
+    def remaining(self, user: Dict[str, Any], today: str, month: str) -> int:
+        day, month_used = self.used(user, today, month)
+        left = self.per_day - day
+        if self.month_count:
+            left = min(left, self.per_month - month_used)
+        return max(left, 0)
+
+    def limit_message(self, user: Dict[str, Any], today: str, month: str, count: int = 1) -> str:
+        """Which allowance stops `count` more units"""
+        day, month_used = self.used(user, today, month)
+        if self.month_count and self.per_month - month_used < min(count, self.per_day - day):
+            return self.month_message
+        return self.day_message
+
+
+class Reservation:
+    """Units granted by reserve(); pass it to release() for units that were not used"""
+
+    def __init__(self, granted: int, day: str, month: str, message: str = ""):
+        self.granted = granted
+        self.day = day          # period the units were counted in
+        self.month = month
+        self.message = message  # why fewer units than requested were granted
+
+
+def _periods(now: datetime):
+    return now.strftime("%Y-%m-%d"), now.strftime("%Y-%m")
+
+
+def _current(count: str, key: str, period: str) -> Dict[str, Any]:
+    """Expression: the counter's value, or 0 if it belongs to an earlier period"""
+    return {"$cond": [{"$eq": [f"${key}", period]}, {"$ifNull": [f"${count}", 0]}, 0]}
+
+
+async def reserve(
+    db, quota: Quota, user_id: str, count: int = 1, unlimited: bool = False, partial: bool = False
+) -> Reservation:
+    """Spend `count` units of the user's allowance in one atomic update.
+
+    Unlimited users are counted but never refused. With partial=True a
+    shortfall grants what is left; otherwise it grants nothing.
+    """
+    now = datetime.now(timezone.utc)
+    today, month = _periods(now)
+    if count <= 0:
+        return Reservation(0, today, month)
+
+    day_used = _current(quota.day_count, quota.day_key, today)
+    remaining = [{"$subtract": [quota.per_day, day_used]}]
+    if quota.month_count:
+        month_used = _current(quota.month_count, quota.month_key, month)
+        remaining.append({"$subtract": [quota.per_month, month_used]})
+
+    query: Dict[str, Any] = {"user_id": user_id}
+    grant: Any = count
+    if not unlimited:
+        needed = 1 if partial else count
+        query["$expr"] = {"$and": [{"$gte": [left, needed]} for left in remaining]}
+        if partial:
+            grant = {"$min": [count, *remaining]}
+
+    fields: Dict[str, Any] = {
+        quota.day_count: {"$add": [day_used, grant]},
+        quota.day_key: today,
+        "updated_at": now,
+    }
+    if quota.month_count:
+        fields[quota.month_count] = {"$add": [month_used, grant]}
+        fields[quota.month_key] = month
+
+    projection = {"_id": 0, "user_id": 1, **quota.fields}
+    before = await db.users.find_one_and_update(
+        query, [{"$set": fields}], projection=projection, return_document=ReturnDocument.BEFORE
+    )
+    if before is None:
+        user = await db.users.find_one({"user_id": user_id}, projection)
+        message = quota.limit_message(user, today, month, count) if user else "User not found"
+        return Reservation(0, today, month, message)
+    if unlimited:
+        return Reservation(count, today, month)
+    granted = min(count, quota.remaining(before, today, month))
+    message = "" if granted == count else quota.limit_message(before, today, month, count)
+    return Reservation(granted, today, month, message)
+
+
+async def release(db, quota: Quota, user_id: str, reservation: Reservation, count: Optional[int] = None) -> None:
+    """Give back `count` (default: all) units of a reservation, in one update.
+    Counters that have rolled over to a new day / month since are left alone."""
+    count = reservation.granted if count is None else min(count, reservation.granted)
+    if count <= 0:
+        return
+
+    def give_back(count_field: str, key: str, period: str) -> Dict[str, Any]:
+        return {"$cond": [
+            {"$eq": [f"${key}", period]},
+            {"$max": [0, {"$subtract": [{"$ifNull": [f"${count_field}", 0]}, count]}]},
+            f"${count_field}",
+        ]}
+
+    fields = {quota.day_count: give_back(quota.day_count, quota.day_key, reservation.day)}
+    if quota.month_count:
+        fields[quota.month_count] = give_back(quota.month_count, quota.month_key, reservation.month)
+    await db.users.update_one({"user_id": user_id}, [{"$set": fields}])
@@ -0,0 +1,259 @@
+"""
+Document Search
+Indexed full-text search over document names and OCR text.
+
+Two indexes, both prefixed with user_id so every lookup is scoped to one
+user's documents and stays flat as other libraries grow:
+
+- TEXT_INDEX: MongoDB text index on name (weight 10) and ocr_full_text.
+  Finds whole words anywhere in a document and ranks them by textScore.
+  default_language "none" because OCR text comes in many languages and
+  stemming / stop words for one language would drop matches in the others.
+- GRAMS_INDEX: multikey index on `search_grams`, the trigrams of every word
+  of name + OCR text. It answers partial-word queries ("invo" → "Invoice");
+  candidates are verified against the text, so trigram collisions never
+  show up as results.
+
+search_fields() computes `search_grams` and must be $set whenever name or
+ocr_full_text changes (reindex() does that for an existing document).
+User input is never turned into a regex pattern without re.escape.
+"""
+import asyncio
+import logging
+import re
+import unicodedata
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+TEXT_INDEX = [("user_id", 1), ("name", "text"), ("ocr_full_text", "text")]
+TEXT_INDEX_OPTIONS = {
+    "name": "document_text_search",
+    "weights": {"name": 10, "ocr_full_text": 1},
+    "default_language": "none",
+}
+GRAMS_INDEX = [("user_id", 1), ("search_grams", 1)]
+
+# migrations entry marking the search_grams backfill as done
+BACKFILL_ID = "search_grams"
+
+# Upper bound of stored trigrams per document (name first, then OCR text in reading order)
+MAX_GRAMS = 5000
+SNIPPET_WIDTH = 160
+MAX_RESULTS = 100
+
+_WORD = re.compile(r"\w+")
+
+
+def normalize(text: str) -> str:
+    """Case- and accent-insensitive form used for trigrams and verification"""
+    decomposed = unicodedata.normalize("NFKD", text.casefold())
+    return "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+
+
+def word_grams(word: str) -> List[str]:
+    return [word[i:i + 3] for i in range(len(word) - 2)]
+
+
+def trigrams(*texts: Optional[str], limit: int = MAX_GRAMS) -> List[str]:
+    grams: Dict[str, None] = {}
+    for text in texts:
+        for word in _WORD.findall(normalize(text or "")):
+            for gram in word_grams(word):
+                grams[gram] = None
+                if len(grams) >= limit:
+                    return list(grams)
+    return list(grams)
+
+
+def search_fields(name: Optional[str], ocr_full_text: Optional[str]) -> Dict[str, Any]:
+    """Fields to $set on a document whenever its name or OCR text changes"""
+    return {"search_grams": trigrams(name, ocr_full_text)}
+
+
+def query_terms(q: str) -> List[str]:
+    return list(dict.fromkeys(_WORD.findall(q)))
+
+
+def snippet(text: Optional[str], terms: List[str], width: int = SNIPPET_WIDTH) -> Tuple[Optional[str], List[List[int]]]:
+    """Excerpt around the first match and [start, end) offsets of matches inside it"""
+    if not text:
+        return None, []
+    pattern = re.compile("|".join(re.escape(term) for term in sorted(terms, key=len, reverse=True)), re.IGNORECASE) if terms else None
+    first = pattern.search(text) if pattern else None
+    if not first:
+        start = 0
+    else:
+        start = max(0, first.start() - width // 3)
+        # Do not start in the middle of a word
+        space = text.rfind(" ", 0, start)
+        if start and space != -1 and start - space < 20:
+            start = space + 1
+    end = min(len(text), start + width)
+    excerpt = text[start:end]
+    prefix = "…" if start > 0 else ""
+    suffix = "…" if end < len(text) else ""
+    highlights = [
+        [match.start() + len(prefix), match.end() + len(prefix)]
+        for match in (pattern.finditer(excerpt) if pattern else [])
+    ]
+    return f"{prefix}{excerpt}{suffix}", highlights
+
+
+def highlight(text: Optional[str], terms: List[str]) -> List[List[int]]:
+    if not text or not terms:
+        return []
+    pattern = re.compile("|".join(re.escape(term) for term in sorted(terms, key=len, reverse=True)), re.IGNORECASE)
+    return [[match.start(), match.end()] for match in pattern.finditer(text)]
+
+
+class DocumentSearch:
+    """Ranked, per-user search over the documents collection"""
+
+    RESULT_PROJECTION = {
+        "_id": 0, "document_id": 1, "name": 1, "folder_id": 1, "tags": 1,
+        "page_count": 1, "thumbnail_url": 1, "updated_at": 1, "ocr_full_text": 1,
+    }
+
+    def __init__(self, db):
+        self.db = db
+        self._task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def _scope(user_id: str, folder_id: Optional[str], tag: Optional[str]) -> Dict[str, Any]:
+        query: Dict[str, Any] = {"user_id": user_id}
+        if folder_id:
+            query["folder_id"] = folder_id
+        if tag:
+            query["tags"] = tag
+        return query
+
+    async def _text_matches(self, scope: Dict[str, Any], q: str, limit: int) -> List[Dict[str, Any]]:
+        return await self.db.documents.find(
+            {**scope, "$text": {"$search": q}},
+            {**self.RESULT_PROJECTION, "score": {"$meta": "textScore"}},
+        ).sort([("score", {"$meta": "textScore"})]).limit(limit).to_list(limit)
+
+    async def _partial_matches(
+        self, scope: Dict[str, Any], terms: List[str], exclude: List[str], limit: int
+    ) -> List[Dict[str, Any]]:
+        """Documents containing every term as a substring (via trigram candidates)"""
+        normalized = [normalize(term) for term in terms]
+        grams = list(dict.fromkeys(g for term in normalized for g in word_grams(term)))
+        if not grams or any(len(term) < 3 for term in normalized):
+            return []
+        candidates = await self.db.documents.find(
+            {**scope, "search_grams": {"$all": grams}, "document_id": {"$nin": exclude}},
+            self.RESULT_PROJECTION,
+        ).limit(limit * 3).to_list(limit * 3)
+
+        matches = []
+        for document in candidates:
+            name = normalize(document.get("name") or "")
+            text = normalize(document.get("ocr_full_text") or "")
+            if all(term in name or term in text for term in normalized):
+                # Below any whole-word match; name hits outrank OCR-only hits
+                hits = sum(2 if term in name else 1 for term in normalized)
+                document["score"] = round(hits / (2 * len(normalized)) * 0.5, 4)
+                matches.append(document)
+        matches.sort(key=lambda d: d["score"], reverse=True)
+        return matches[:limit]
+
+    async def matches(
+        self,
+        user_id: str,
+        q: str,
+        limit: int = 20,
+        folder_id: Optional[str] = None,
+        tag: Optional[str] = None,
+    ) -> List[Dict[str, Any]]:
+        """Ranked documents: whole-word text matches first, then partial-word matches"""
+        terms = query_terms(q)
+        if not terms:
+            return []
+        scope = self._scope(user_id, folder_id, tag)
+        results = await self._text_matches(scope, q, limit)
+        if len(results) < limit:
+            found = [document["document_id"] for document in results]
+            results += await self._partial_matches(scope, terms, found, limit - len(results))
+        return results
+
+    async def search(
+        self,
+        user_id: str,
+        q: str,
+        limit: int = 20,
+        folder_id: Optional[str] = None,
+        tag: Optional[str] = None,
+    ) -> List[Dict[str, Any]]:
+        """Search results with snippets; highlights are [start, end) offsets"""
+        limit = max(1, min(limit, MAX_RESULTS))
+        terms = query_terms(q)
+        results = []
+        for document in await self.matches(user_id, q, limit, folder_id, tag):
+            text = document.pop("ocr_full_text", None)
+            document["snippet"], document["snippet_highlights"] = snippet(text, terms)
+            document["name_highlights"] = highlight(document.get("name"), terms)
+            results.append(document)
+        return results
+
+    async def reindex(self, document_id: str) -> None:
+        """Recompute search fields after name or OCR text changed"""
+        document = await self.db.documents.find_one(
+            {"document_id": document_id}, {"_id": 0, "name": 1, "ocr_full_text": 1}
+        )
+        if document:
+            await self.db.documents.update_one(
+                {"document_id": document_id},
+                {"$set": search_fields(document.get("name"), document.get("ocr_full_text"))},
+            )
+
+    async def backfill(self, batch_size: int = 100) -> int:
+        """Background: index documents created before search_grams existed"""
+        indexed = 0
+        while True:
+            batch = await self.db.documents.find(
+                {"search_grams": {"$exists": False}}, {"_id": 0, "document_id": 1, "name": 1, "ocr_full_text": 1}
+            ).limit(batch_size).to_list(batch_size)
+            if not batch:
+                break
+            for document in batch:
+                await self.db.documents.update_one(
+                    {"document_id": document["document_id"]},
+                    {"$set": search_fields(document.get("name"), document.get("ocr_full_text"))},
+                )
+                indexed += 1
+            await asyncio.sleep(0)
+        if indexed:
+            logger.info(f"✅ Indexed {indexed} documents for search")
+        return indexed
+
+    def start(self) -> None:
+        if not self._task:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        # One-shot: new and edited documents are indexed as they are written
+        if await self.db.migrations.find_one({"migration_id": BACKFILL_ID, "status": "completed"}):
+            return
+        try:
+            await self.backfill()
+            await self.db.migrations.update_one(
+                {"migration_id": BACKFILL_ID},
+                {"$set": {"status": "completed", "completed_at": datetime.now(timezone.utc)}},
+                upsert=True,
+            )
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"❌ Search backfill error: {e}")
@@ -1,15 +1,20 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, Request, Response
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Request, Response, Body, BackgroundTasks
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse, JSONResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
 import os
+import asyncio
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 from pathlib import Path
 from pydantic import BaseModel, Field, EmailStr
-from typing import List, Optional, Dict, Any, Tuple
+from typing import List, Literal, Optional, Dict, Any, Tuple
 import uuid
 from datetime import datetime, timezone, timedelta
 import httpx
@@ -22,6 +27,7 @@ import re
 import cv2
 import numpy as np
 import hashlib
+import hmac
 
 # Import translations for all languages
 from translations import ALL_TRANSLATIONS
@@ -36,6 +42,7 @@ from email_service import (
     generate_verification_code,
     generate_reset_code
 )
+from ocr_geometry import WordGeometry, draw_text_layer
 # Note: emergentintegrations was removed for Railway deployment compatibility
 # Using pytesseract (Tesseract OCR) as a public alternative
 try:
@@ -43,8 +50,29 @@ try:
     TESSERACT_AVAILABLE = True
 except ImportError:
     TESSERACT_AVAILABLE = False
-import boto3
-from botocore.exceptions import ClientError
+from storage import (
+    ObjectStorage, SignedUrlMixin, create_storage,
+    upload_key, document_prefix, user_prefix, avatar_key,
+)
+from deletion import DeletionWorker
+from uploads import COMMIT_LEASE_SECONDS, UploadRejected, UploadSweeper, check_objects, read_upload
+from bulk_jobs import BulkHandler, BulkJobRunner, public_job
+from migration import PageStorageMigrator
+from image_cache import DiskImageCache
+from blob_store import ROLE_URLS as BLOB_ROLE_URLS, BlobStore
+from page_store import PageStore, DOCUMENT_PROJECTION, content_hash, new_document_fields
+from storage_usage import GLOBAL as STORAGE_USAGE_GLOBAL, SIZE_FIELDS, StorageUsage, base64_size, page_bytes
+from document_listing import DEFAULT_LIMIT as SUMMARY_DEFAULT_LIMIT, list_summaries
+from search import DocumentSearch, search_fields
+from indexes import start_index_build
+from page_patch import PagePatchError, plan_patch, render_page
+from sync_log import SyncLog
+from http_encoding import CompressionMiddleware, FastJSONResponse
+from http_cache import PUBLIC, cache_headers, make_etag, not_modified, set_cache_headers, set_uncacheable
+from trusted_models import shape, trusted_response
+from folders import FolderConflict, FolderNotFound, FolderTree, FolderTreeError, list_folders
+from quota import Quota, Reservation, release, reserve
+from auth_cache import AuthCache
 import certifi
 import bcrypt
 
@@ -67,9 +95,29 @@ AWS_SECRET_ACCESS_KEY = os.environ.get("AWS_SECRET_ACCESS_KEY", "")
 AWS_S3_BUCKET_NAME = os.environ.get("AWS_S3_BUCKET_NAME", os.environ.get("AWS_BUCKET_NAME", "scanup-documents"))
 # Support both AWS_REGION and AWS_S3_REGION for flexibility
 AWS_REGION = os.environ.get("AWS_REGION", os.environ.get("AWS_S3_REGION", "us-east-1"))
-
-# S3 client will be initialized after logger
-s3_client = None
+# Optional S3-compatible endpoint (MinIO, moto server) for local testing
+AWS_S3_ENDPOINT_URL = os.environ.get("AWS_S3_ENDPOINT_URL") or None
+# Connection pool size for concurrent S3 calls
+AWS_S3_MAX_CONNECTIONS = int(os.environ.get("AWS_S3_MAX_CONNECTIONS", "50"))
+
+# Storage backend: "s3", "local" or "memory". Defaults to s3 when AWS credentials are set,
+# otherwise images are stored as base64 in MongoDB.
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "s3" if os.environ.get("AWS_ACCESS_KEY_ID") and os.environ.get("AWS_SECRET_ACCESS_KEY") else "")
+# Local backend: directory for files and the public base URL of the API's /api/storage route
+STORAGE_LOCAL_ROOT = os.environ.get("STORAGE_LOCAL_ROOT", str(Path(__file__).parent / "storage_data"))
+STORAGE_PUBLIC_BASE_URL = os.environ.get("STORAGE_PUBLIC_BASE_URL", "http://localhost:8001/api/storage")
+# Read-through disk cache for stored page images (exports, PDF downloads, thumbnails)
+IMAGE_CACHE_DIR = os.environ.get("IMAGE_CACHE_DIR", "/tmp/scanup-image-cache")
+IMAGE_CACHE_MAX_MB = int(os.environ.get("IMAGE_CACHE_MAX_MB", "1024"))
+
+# Page processing: CPU work (thumbnails) runs on a bounded pool, and each
+# document processes at most PAGE_PROCESSING_CONCURRENCY pages at once
+IMAGE_PROCESSING_WORKERS = int(os.environ.get("IMAGE_PROCESSING_WORKERS", str(os.cpu_count() or 4)))
+PAGE_PROCESSING_CONCURRENCY = int(os.environ.get("PAGE_PROCESSING_CONCURRENCY", "8"))
+image_executor = ThreadPoolExecutor(max_workers=IMAGE_PROCESSING_WORKERS, thread_name_prefix="image")
+
+# Object storage will be initialized after logger
+object_storage: Optional[ObjectStorage] = None
 
 # Rate limiting imports
 from slowapi import Limiter, _rate_limit_exceeded_handler
@@ -112,14 +160,21 @@ async def validation_exception_handler(request: Request, exc: RequestValidationE
         content={"detail": exc.errors()}
     )
 
-# Create a router with the /api prefix
-api_router = APIRouter(prefix="/api")
+# Create a router with the /api prefix (orjson rendering when available, see http_encoding.py)
+api_router = APIRouter(prefix="/api", default_response_class=FastJSONResponse)
 
 # Security
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 JWT_SECRET = os.environ.get("JWT_SECRET", "your-super-secret-key-change-in-production")
 JWT_ALGORITHM = "HS256"
+# Presigned /storage URLs (local and memory backends) get a key of their own; without
+# STORAGE_SIGNING_SECRET one is derived from JWT_SECRET, never JWT_SECRET itself
+STORAGE_SIGNING_SECRET = os.environ.get("STORAGE_SIGNING_SECRET") or hmac.new(
+    JWT_SECRET.encode(), b"storage-url-signing", hashlib.sha256
+).hexdigest()
 JWT_EXPIRATION_DAYS = 7
+# Users and sessions seen by get_current_user are cached this long (see auth_cache.py)
+AUTH_CACHE_TTL_SECONDS = float(os.environ.get("AUTH_CACHE_TTL_SECONDS", "30"))
 
 security = HTTPBearer(auto_error=False)
 
@@ -130,17 +185,58 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Initialize S3 client after logger is configured
-if AWS_ACCESS_KEY_ID and AWS_SECRET_ACCESS_KEY:
-    s3_client = boto3.client(
-        's3',
-        aws_access_key_id=AWS_ACCESS_KEY_ID,
-        aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-        region_name=AWS_REGION
+# Initialize object storage after logger is configured
+try:
+    object_storage = create_storage(
+        STORAGE_BACKEND,
+        bucket=AWS_S3_BUCKET_NAME,
+        region=AWS_REGION,
+        access_key_id=AWS_ACCESS_KEY_ID,
+        secret_access_key=AWS_SECRET_ACCESS_KEY,
+        endpoint_url=AWS_S3_ENDPOINT_URL,
+        max_connections=AWS_S3_MAX_CONNECTIONS,
+        root=STORAGE_LOCAL_ROOT,
+        base_url=STORAGE_PUBLIC_BASE_URL,
+        signing_secret=STORAGE_SIGNING_SECRET,
     )
-    logger.info(f"✅ AWS S3 initialized: bucket={AWS_S3_BUCKET_NAME}, region={AWS_REGION}")
+except (KeyError, ValueError) as e:
+    logger.error(f"❌ Storage backend '{STORAGE_BACKEND}' could not be initialized: {e}")
+    object_storage = None
+
+if object_storage:
+    logger.info(f"✅ Object storage initialized: backend={object_storage.storage_type}")
 else:
-    logger.warning("⚠️ AWS S3 not configured - images will be stored in MongoDB")
+    logger.warning("⚠️ Object storage not configured - images will be stored in MongoDB")
+
+image_cache: Optional[DiskImageCache] = None
+if object_storage and IMAGE_CACHE_MAX_MB > 0:
+    try:
+        image_cache = DiskImageCache(object_storage, IMAGE_CACHE_DIR, max_bytes=IMAGE_CACHE_MAX_MB * 1024 * 1024)
+        logger.info(f"✅ Image cache at {IMAGE_CACHE_DIR} ({IMAGE_CACHE_MAX_MB} MB)")
+    except OSError as e:
+        logger.warning(f"⚠️ Image cache disabled: {e}")
+
+# Byte counters per user and in total, kept current by every page write
+storage_usage = StorageUsage(db, object_storage)
+# Pages live in their own collection (see page_store.py)
+page_store = PageStore(db, storage_usage)
+document_search = DocumentSearch(db)
+# Nested folders: ancestors arrays and subtree operations (see folders.py)
+folder_tree = FolderTree(db)
+# Per-user change feed for incremental sync (see sync_log.py)
+sync_log = SyncLog(db, page_store)
+
+# Page images are stored once per content hash and reference counted
+blob_store: Optional[BlobStore] = BlobStore(db, object_storage) if object_storage else None
+
+# Storage cleanup runs in the background; deletes only write tombstones and jobs
+deletion_worker = DeletionWorker(db, object_storage)
+# Objects of direct uploads that were never committed are queued for deletion
+upload_sweeper = UploadSweeper(db, deletion_worker)
+# Per-user library rewrites (watermark removal, ...) run as resumable background jobs
+bulk_jobs = BulkJobRunner(db)
+# Admin-triggered move of inline base64 pages into object storage
+page_storage_migrator = PageStorageMigrator(db, object_storage, page_store, blob_store)
 
 # ==================== MODELS ====================
 
@@ -180,16 +276,34 @@ class User(BaseModel):
     trial_used: bool = False
     # Email verification
     email_verified: bool = False
+    # One-time "remove ads" purchase (no watermarks either)
+    has_removed_ads: bool = False
     # Timestamps
     created_at: datetime
     updated_at: Optional[datetime] = None
 
+# Users are read through this cache on every authenticated request; writes to
+# User fields must call auth_cache.invalidate_user
+auth_cache = AuthCache(db, User.model_fields, ttl=AUTH_CACHE_TTL_SECONDS)
+
 # Free tier limits
 FREE_SCANS_PER_DAY = 10
 FREE_SCANS_PER_MONTH = 100
 FREE_OCR_PER_DAY = 3
 TRIAL_DURATION_DAYS = 7
 
+# Counters on the users row, spent atomically (see quota.py)
+SCAN_QUOTA = Quota(
+    day_count="scans_today", day_key="last_scan_date", per_day=FREE_SCANS_PER_DAY,
+    day_message=f"Daily scan limit reached ({FREE_SCANS_PER_DAY} scans/day). Upgrade to Premium for unlimited scans.",
+    month_count="scans_this_month", month_key="scan_month", per_month=FREE_SCANS_PER_MONTH,
+    month_message=f"Monthly scan limit reached ({FREE_SCANS_PER_MONTH} scans/month). Upgrade to Premium for unlimited scans.",
+)
+OCR_QUOTA = Quota(
+    day_count="ocr_usage_today", day_key="ocr_usage_date", per_day=FREE_OCR_PER_DAY,
+    day_message=f"Daily OCR limit reached ({FREE_OCR_PER_DAY} per day). Upgrade to Premium for unlimited OCR.",
+)
+
 class UserResponse(BaseModel):
     user_id: str
     email: str
@@ -218,6 +332,7 @@ class PageData(BaseModel):
     thumbnail_url: Optional[str] = None  # S3 thumbnail URL
     original_image_base64: Optional[str] = None  # For non-destructive editing
     ocr_text: Optional[str] = None
+    ocr_words: Optional[Dict[str, Any]] = None  # Compact word boxes (see ocr_geometry.py)
     filter_applied: str = "original"  # original, grayscale, bw, enhanced
     rotation: int = 0
     order: int = 0
@@ -229,6 +344,35 @@ class DocumentCreate(BaseModel):
     tags: List[str] = []
     pages: List[PageData] = []
 
+# Bulk create (offline sync)
+MAX_BULK_DOCUMENTS = 50
+
+class BulkDocumentItem(DocumentCreate):
+    client_id: str = Field(min_length=1, max_length=128)  # Idempotency key chosen by the device
+
+class BulkDocumentCreate(BaseModel):
+    documents: List[BulkDocumentItem] = Field(min_length=1, max_length=MAX_BULK_DOCUMENTS)
+
+# Direct-to-storage upload models
+MAX_UPLOAD_PAGES = 200
+UPLOAD_URL_EXPIRY_SECONDS = 900
+
+class UploadSessionRequest(BaseModel):
+    page_count: int = Field(ge=1, le=MAX_UPLOAD_PAGES)
+    content_type: Literal["image/jpeg", "image/png"] = "image/jpeg"  # see uploads.CONTENT_TYPES
+
+class UploadCommitPage(BaseModel):
+    page_id: str
+    ocr_text: Optional[str] = None
+    filter_applied: str = "original"
+    rotation: int = 0
+
+class UploadCommitRequest(BaseModel):
+    name: str
+    folder_id: Optional[str] = None
+    tags: List[str] = []
+    pages: Optional[List[UploadCommitPage]] = None  # None = all pages in upload order
+
 class DocumentUpdate(BaseModel):
     name: Optional[str] = None
     folder_id: Optional[str] = None
@@ -246,8 +390,9 @@ class Document(BaseModel):
     pages: List[PageData] = []
     ocr_full_text: Optional[str] = None
     is_password_protected: bool = False
-    storage_type: Optional[str] = None  # 's3' or 'mongodb'
+    storage_type: Optional[str] = None  # 's3', 'disk', 'memory' or 'mongodb'
     has_watermark: Optional[bool] = None
+    version: int = 0  # incremented on every page change
     created_at: datetime
     updated_at: datetime
 
@@ -263,6 +408,7 @@ class Folder(BaseModel):
     name: str
     color: str
     parent_id: Optional[str] = None
+    ancestors: List[str] = []  # folder IDs from the top level down to parent_id
     is_protected: bool = False
     password_hash: Optional[str] = None
     created_at: datetime
@@ -271,10 +417,14 @@ class Folder(BaseModel):
 class OCRRequest(BaseModel):
     image_base64: str
     language: str = "en"
+    # Optional: store the result (text + word boxes) on this page
+    document_id: Optional[str] = None
+    page_id: Optional[str] = None
 
 class OCRResponse(BaseModel):
     text: str
     confidence: Optional[float] = None
+    words: Optional[Dict[str, Any]] = None  # Compact word boxes (see ocr_geometry.py)
 
 # Image Processing Models
 class ImageProcessRequest(BaseModel):
@@ -360,21 +510,16 @@ async def get_current_user(request: Request, credentials: Optional[HTTPAuthoriza
     user_id = decode_jwt_token(token)
     
     if user_id:
-        user_doc = await db.users.find_one({"user_id": user_id}, {"_id": 0})
+        user_doc = await auth_cache.user(user_id)
         if user_doc:
             return User(**user_doc)
     
     # Then try session token (OAuth)
-    session = await db.user_sessions.find_one({"session_token": token}, {"_id": 0})
-    if session:
-        expires_at = session.get("expires_at")
-        if expires_at:
-            if expires_at.tzinfo is None:
-                expires_at = expires_at.replace(tzinfo=timezone.utc)
-            if expires_at > datetime.now(timezone.utc):
-                user_doc = await db.users.find_one({"user_id": session["user_id"]}, {"_id": 0})
-                if user_doc:
-                    return User(**user_doc)
+    session_user_id = await auth_cache.session_user_id(token)
+    if session_user_id:
+        user_doc = await auth_cache.user(session_user_id)
+        if user_doc:
+            return User(**user_doc)
     
     raise HTTPException(status_code=401, detail="Invalid or expired token")
 
@@ -495,7 +640,7 @@ def add_watermark(image_base64: str, watermark_text: str = "ScanUp") -> str:
 
 # ==================== AWS S3 FUNCTIONS ====================
 
-def upload_to_s3(image_base64: str, user_id: str, document_id: str, page_id: str, image_type: str = "page") -> Optional[str]:
+async def upload_to_s3(image_base64: str, user_id: str, document_id: str, page_id: str, image_type: str = "page") -> Optional[str]:
     """
     Upload image to S3 and return the URL.
     
@@ -509,7 +654,7 @@ def upload_to_s3(image_base64: str, user_id: str, document_id: str, page_id: str
     Returns:
         S3 URL or None if upload fails
     """
-    if not s3_client:
+    if not object_storage:
         logger.warning("S3 not configured, returning None")
         return None
     
@@ -521,67 +666,35 @@ def upload_to_s3(image_base64: str, user_id: str, document_id: str, page_id: str
         # Decode image
         image_data = base64.b64decode(image_base64)
         
-        # Generate S3 key
-        s3_key = f"users/{user_id}/documents/{document_id}/{image_type}_{page_id}.jpg"
-        
-        # Upload to S3
-        s3_client.put_object(
-            Bucket=AWS_S3_BUCKET_NAME,
-            Key=s3_key,
-            Body=image_data,
-            ContentType='image/jpeg'
-        )
-        
-        # Generate URL
-        s3_url = f"https://{AWS_S3_BUCKET_NAME}.s3.{AWS_REGION}.amazonaws.com/{s3_key}"
-        logger.info(f"✅ Uploaded to S3: {s3_key}")
+        # Content-addressed: identical bytes are stored once and only referenced again
+        s3_url = await blob_store.store(image_data, user_id, document_id, page_id, image_type)
+        logger.info(f"✅ Stored {image_type} {page_id} for document {document_id}")
         
         return s3_url
-    except ClientError as e:
-        logger.error(f"❌ S3 upload error: {e}")
-        return None
     except Exception as e:
         logger.error(f"❌ S3 upload error: {e}")
         return None
 
 
-def delete_from_s3(user_id: str, document_id: str, page_id: Optional[str] = None) -> bool:
+async def read_stored_image(url: Optional[str]) -> Optional[bytes]:
     """
-    Delete image(s) from S3.
-    
-    Args:
-        user_id: User ID
-        document_id: Document ID
-        page_id: Page ID (if None, deletes all pages for document)
-    
-    Returns:
-        True if successful
+    Fetch a stored image by its URL through the disk cache. Only URLs of our
+    own store are read: page URLs can come from clients, and fetching any
+    other URL would let them make the server request arbitrary addresses.
     """
-    if not s3_client:
-        return False
-    
+    if not url:
+        return None
+    key = object_storage.key_from_url(url) if object_storage else None
+    if not key:
+        logger.warning(f"Refusing to read image outside object storage: {url[:100]}")
+        return None
     try:
-        if page_id:
-            # Delete specific page
-            s3_key = f"users/{user_id}/documents/{document_id}/page_{page_id}.jpg"
-            s3_client.delete_object(Bucket=AWS_S3_BUCKET_NAME, Key=s3_key)
-            # Also delete thumbnail
-            thumb_key = f"users/{user_id}/documents/{document_id}/thumbnail_{page_id}.jpg"
-            s3_client.delete_object(Bucket=AWS_S3_BUCKET_NAME, Key=thumb_key)
-        else:
-            # Delete all objects for document
-            prefix = f"users/{user_id}/documents/{document_id}/"
-            response = s3_client.list_objects_v2(Bucket=AWS_S3_BUCKET_NAME, Prefix=prefix)
-            
-            if 'Contents' in response:
-                for obj in response['Contents']:
-                    s3_client.delete_object(Bucket=AWS_S3_BUCKET_NAME, Key=obj['Key'])
-        
-        logger.info(f"✅ Deleted from S3: {user_id}/{document_id}/{page_id or 'all'}")
-        return True
+        if image_cache:
+            return await image_cache.get(key)
+        return await object_storage.get_object(key)
     except Exception as e:
-        logger.error(f"❌ S3 delete error: {e}")
-        return False
+        logger.error(f"Failed to read stored image {url[:100]}: {e}")
+    return None
 
 
 def create_thumbnail(image_base64: str, max_size: int = 300) -> str:
@@ -611,65 +724,45 @@ def create_thumbnail(image_base64: str, max_size: int = 300) -> str:
         return image_base64[:1000]  # Return truncated original as fallback
 
 
-async def check_scan_limits(user: User) -> Tuple[bool, str]:
-    """Check if user can scan. Returns (can_scan, message)"""
-    today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
-    current_month = datetime.now(timezone.utc).strftime("%Y-%m")
-    
-    # Premium users have no limits
+def has_unlimited_scans(user: User) -> bool:
+    """Premium users and users in an active trial have no scan limits"""
     is_premium = user.subscription_type in ["premium", "trial"]
     if is_premium:
         if user.subscription_type == "trial" and user.trial_start_date:
             trial_end = user.trial_start_date + timedelta(days=TRIAL_DURATION_DAYS)
             if datetime.now(timezone.utc) >= trial_end.replace(tzinfo=timezone.utc):
                 is_premium = False
-    
-    if is_premium:
+    return is_premium
+
+async def check_scan_limits(user: User) -> Tuple[bool, str]:
+    """Advisory check from the loaded user, before any work starts. Returns (can_scan, message).
+    Scans are only counted by reserve_scans."""
+    if has_unlimited_scans(user):
         return True, ""
-    
-    # Check daily limit
-    scans_today = user.scans_today if user.last_scan_date == today else 0
-    if scans_today >= FREE_SCANS_PER_DAY:
-        return False, f"Daily scan limit reached ({FREE_SCANS_PER_DAY} scans/day). Upgrade to Premium for unlimited scans."
-    
-    # Check monthly limit
-    scans_month = user.scans_this_month if user.scan_month == current_month else 0
-    if scans_month >= FREE_SCANS_PER_MONTH:
-        return False, f"Monthly scan limit reached ({FREE_SCANS_PER_MONTH} scans/month). Upgrade to Premium for unlimited scans."
-    
+    now = datetime.now(timezone.utc)
+    today, current_month = now.strftime("%Y-%m-%d"), now.strftime("%Y-%m")
+    counters = user.model_dump(include=set(SCAN_QUOTA.fields))
+    if SCAN_QUOTA.remaining(counters, today, current_month) < 1:
+        return False, SCAN_QUOTA.limit_message(counters, today, current_month)
     return True, ""
 
-async def increment_scan_count(user_id: str):
-    """Increment user's scan count"""
-    today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
-    current_month = datetime.now(timezone.utc).strftime("%Y-%m")
-    
-    user = await db.users.find_one({"user_id": user_id})
-    if not user:
-        return
-    
-    # Reset daily count if new day
-    scans_today = user.get("scans_today", 0)
-    if user.get("last_scan_date") != today:
-        scans_today = 0
-    
-    # Reset monthly count if new month
-    scans_month = user.get("scans_this_month", 0)
-    if user.get("scan_month") != current_month:
-        scans_month = 0
+async def reserve_scans(user: User, count: int = 1, partial: bool = False) -> Reservation:
+    """
+    Count `count` scans in one atomic update (see quota.py).
     
-    await db.users.update_one(
-        {"user_id": user_id},
-        {
-            "$set": {
-                "scans_today": scans_today + 1,
-                "last_scan_date": today,
-                "scans_this_month": scans_month + 1,
-                "scan_month": current_month,
-                "updated_at": datetime.now(timezone.utc)
-            }
-        }
-    )
+    Free users are refused once today's or this month's allowance is spent;
+    with partial=True (bulk create) they get what is left of it instead.
+    Pass the reservation to release_scans for documents that then fail.
+    """
+    reservation = await reserve(db, SCAN_QUOTA, user.user_id, count, unlimited=has_unlimited_scans(user), partial=partial)
+    if reservation.granted:
+        auth_cache.invalidate_user(user.user_id)
+    return reservation
+
+async def release_scans(user_id: str, reservation: Reservation, count: Optional[int] = None):
+    """Give back scans of a reservation (default: all of them) that produced no document"""
+    await release(db, SCAN_QUOTA, user_id, reservation, count)
+    auth_cache.invalidate_user(user_id)
 
 def create_thumbnail(image_base64: str, max_size: int = 200) -> str:
     """Create a thumbnail from base64 image"""
@@ -698,6 +791,28 @@ def create_thumbnail(image_base64: str, max_size: int = 200) -> str:
         logger.error(f"Error creating thumbnail: {e}")
         return image_base64
 
+async def run_in_image_pool(func, *args):
+    """Run CPU-bound image work (decode/resize/encode) off the event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(image_executor, func, *args)
+
+
+async def gather_or_cancel(*aws) -> list:
+    """
+    Like asyncio.gather, but if one awaitable fails the others are cancelled
+    and awaited before the error is raised. Page builders store images and
+    take blob refs as they go; cleanup after a failure must not race ones
+    that are still running.
+    """
+    tasks = [asyncio.ensure_future(aw) for aw in aws]
+    try:
+        return list(await asyncio.gather(*tasks))
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
 def convert_to_rgb(image: Image.Image) -> Image.Image:
     """Convert image to RGB mode"""
     if image.mode == 'RGBA':
@@ -1278,14 +1393,22 @@ def perspective_crop(image_base64: str, corners: List[Dict]) -> str:
         logger.error(traceback.format_exc())
         return image_base64
 
-async def perform_ocr_with_tesseract(image_base64: str) -> str:
-    """Perform OCR using Tesseract OCR (public, free alternative)
+class OCRError(Exception):
+    """OCR could not run on the image (HTTP status for the client in status_code)"""
+    status_code = 422
+
+class OCRUnavailable(OCRError):
+    status_code = 503
+
+async def perform_ocr_with_geometry(image_base64: str) -> Tuple[str, Optional[WordGeometry]]:
+    """Perform OCR using Tesseract OCR and keep word-level geometry
     
-    This function uses pytesseract which works with the Tesseract OCR engine.
-    It's a robust, free, and widely-used OCR solution that works on any platform.
+    Returns the extracted text and the word boxes/confidences it was built from,
+    so callers can store the geometry with the page instead of re-running OCR.
+    Raises OCRError if OCR could not run (OCRUnavailable without Tesseract).
     """
     if not TESSERACT_AVAILABLE:
-        return "OCR service not available. Tesseract OCR is not installed."
+        raise OCRUnavailable("OCR service not available. Tesseract OCR is not installed.")
     
     try:
         if "," in image_base64:
@@ -1324,21 +1447,37 @@ async def perform_ocr_with_tesseract(image_base64: str) -> str:
         # Configure Tesseract for best document scanning results
         custom_config = r'--oem 3 --psm 6'  # OEM 3 = default, PSM 6 = uniform block of text
         
-        extracted_text = pytesseract.image_to_string(processed_image, config=custom_config)
+        # image_to_data returns words with boxes and confidences in one pass;
+        # the plain text is rebuilt from it line by line
+        data = pytesseract.image_to_data(processed_image, config=custom_config, output_type=pytesseract.Output.DICT)
+        geometry = WordGeometry.from_tesseract(data, image.width, image.height)
         
-        # Clean up the extracted text
-        extracted_text = extracted_text.strip()
-        
-        if not extracted_text:
+        if not len(geometry):
             # Try again with original image (sometimes preprocessing hurts)
-            extracted_text = pytesseract.image_to_string(image, config=custom_config)
-            extracted_text = extracted_text.strip()
+            data = pytesseract.image_to_data(image, config=custom_config, output_type=pytesseract.Output.DICT)
+            geometry = WordGeometry.from_tesseract(data, image.width, image.height)
+        
+        if not len(geometry):
+            return "No text detected", None
         
-        return extracted_text if extracted_text else "No text detected"
+        return geometry.text(), geometry
     
     except Exception as e:
         logger.error(f"OCR error: {e}")
-        return f"OCR error: {str(e)}"
+        raise OCRError(f"OCR error: {str(e)}") from e
+
+
+async def perform_ocr_with_tesseract(image_base64: str) -> str:
+    """Perform OCR using Tesseract OCR (public, free alternative)
+    
+    This function uses pytesseract which works with the Tesseract OCR engine.
+    It's a robust, free, and widely-used OCR solution that works on any platform.
+    """
+    try:
+        extracted_text, _ = await perform_ocr_with_geometry(image_base64)
+    except OCRError as e:
+        return str(e)
+    return extracted_text
 
 
 # Alias for backward compatibility
@@ -1513,6 +1652,7 @@ async def google_auth(data: GoogleAuthRequest):
                     {"$set": update_fields}
                 )
                 user_id = existing_user["user_id"]
+                auth_cache.invalidate_user(user_id)
                 is_new = False
             else:
                 # Create new user
@@ -1726,6 +1866,7 @@ async def verify_email(data: VerifyEmailRequest):
             "updated_at": now
         }}
     )
+    auth_cache.invalidate_user(user_doc["user_id"])
     
     return {"message": "Email verified successfully"}
 
@@ -1894,6 +2035,7 @@ async def google_native_login(request: Request, response: Response):
                 {"user_id": user_id},
                 {"$set": {"picture": photo, "updated_at": datetime.now(timezone.utc)}}
             )
+            auth_cache.invalidate_user(user_id)
     else:
         # Create new user
         user_id = f"user_{uuid.uuid4().hex[:12]}"
@@ -2019,9 +2161,15 @@ async def apple_native_login(request: Request, response: Response):
     return {"user": user_to_response(user), "token": session_token}
 
 @api_router.get("/auth/me", response_model=UserResponse)
-async def get_me(current_user: User = Depends(get_current_user)):
-    """Get current user profile"""
-    return user_to_response(current_user)
+async def get_me(request: Request, response: Response, current_user: User = Depends(get_current_user)):
+    """Get current user profile (ETag: 304 when unchanged)"""
+    profile = user_to_response(current_user)
+    etag = make_etag("me", profile.model_dump(mode="json"))
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+    set_cache_headers(response, etag)
+    return profile
 
 @api_router.post("/auth/logout")
 async def logout(request: Request, response: Response):
@@ -2029,6 +2177,7 @@ async def logout(request: Request, response: Response):
     token = request.cookies.get("session_token")
     if token:
         await db.user_sessions.delete_one({"session_token": token})
+        auth_cache.invalidate_session(token)
     
     response.delete_cookie(key="session_token", path="/")
     return {"message": "Logged out successfully"}
@@ -2260,7 +2409,7 @@ async def check_has_approved_session(
     approved_session = await db.web_access_sessions.find_one({
         "user_id": current_user.user_id,
         "status": "approved",
-        "browser_info": {"$regex": user_agent[:50]},  # Match browser type
+        "browser_info": {"$regex": re.escape(user_agent[:50])},  # Match browser type
         "expires_at": {"$gt": datetime.now(timezone.utc)}
     })
     
@@ -2323,6 +2472,7 @@ async def update_subscription(
             "updated_at": datetime.now(timezone.utc)
         }}
     )
+    auth_cache.invalidate_user(current_user.user_id)
     
     logger.info(f"✅ User {current_user.user_id} subscription updated: {subscription.subscription_type}, is_premium={is_premium}")
     
@@ -2344,6 +2494,7 @@ async def update_profile(
         {"user_id": current_user.user_id},
         {"$set": update_data}
     )
+    auth_cache.invalidate_user(current_user.user_id)
     
     user_doc = await db.users.find_one({"user_id": current_user.user_id}, {"_id": 0})
     user = User(**{k: v for k, v in user_doc.items() if k != "password_hash"})
@@ -2360,58 +2511,41 @@ async def delete_user_account(
     - All documents and their pages
     - All folders
     - All signatures
-    - All S3 stored images
+    - All S3 stored images (removed in the background)
     """
     user_id = current_user.user_id
     logger.info(f"[Account Delete] Starting deletion for user: {user_id}")
     
     try:
-        # 1. Get all documents for S3 cleanup
-        documents = await db.documents.find({"user_id": user_id}).to_list(None)
-        
-        # 2. Delete from S3 (if configured)
-        if s3_client and AWS_S3_BUCKET_NAME:
-            for doc in documents:
-                try:
-                    delete_from_s3(user_id, doc.get("document_id", ""))
-                except Exception as e:
-                    logger.warning(f"[Account Delete] S3 delete failed for doc {doc.get('document_id')}: {e}")
-            
-            # Also try to delete user folder entirely
-            try:
-                response = s3_client.list_objects_v2(
-                    Bucket=AWS_S3_BUCKET_NAME,
-                    Prefix=f"{user_id}/"
-                )
-                if 'Contents' in response:
-                    objects = [{'Key': obj['Key']} for obj in response['Contents']]
-                    if objects:
-                        s3_client.delete_objects(
-                            Bucket=AWS_S3_BUCKET_NAME,
-                            Delete={'Objects': objects}
-                        )
-                        logger.info(f"[Account Delete] Deleted {len(objects)} S3 objects for user {user_id}")
-            except Exception as e:
-                logger.warning(f"[Account Delete] S3 folder cleanup failed: {e}")
+        # 1. Tombstone the account and queue storage cleanup (runs in the background)
+        await deletion_worker.tombstone("user", user_id)
+        if blob_store:
+            await blob_store.release_user(user_id)
+        job_id = await deletion_worker.enqueue(
+            "user", user_id=user_id, prefixes=[user_prefix(user_id)], keys=[avatar_key(user_id)]
+        )
         
-        # 3. Delete all documents from database
+        # 2. Delete all documents from database
         docs_result = await db.documents.delete_many({"user_id": user_id})
+        await page_store.delete_user(user_id)
+        await sync_log.delete_user(user_id)
         logger.info(f"[Account Delete] Deleted {docs_result.deleted_count} documents")
         
-        # 4. Delete all folders
+        # 3. Delete all folders
         folders_result = await db.folders.delete_many({"user_id": user_id})
         logger.info(f"[Account Delete] Deleted {folders_result.deleted_count} folders")
         
-        # 5. Delete all signatures
+        # 4. Delete all signatures
         sigs_result = await db.signatures.delete_many({"user_id": user_id})
         logger.info(f"[Account Delete] Deleted {sigs_result.deleted_count} signatures")
         
-        # 6. Delete web access sessions
+        # 5. Delete web access sessions
         sessions_result = await db.web_access_sessions.delete_many({"user_id": user_id})
         logger.info(f"[Account Delete] Deleted {sessions_result.deleted_count} web sessions")
         
-        # 7. Finally, delete the user account
+        # 6. Finally, delete the user account
         user_result = await db.users.delete_one({"user_id": user_id})
+        auth_cache.invalidate_user(user_id)
         
         if user_result.deleted_count == 0:
             raise HTTPException(status_code=404, detail="User not found")
@@ -2420,6 +2554,7 @@ async def delete_user_account(
         
         return {
             "message": "Account deleted successfully",
+            "storage_cleanup_job_id": job_id,
             "deleted": {
                 "documents": docs_result.deleted_count,
                 "folders": folders_result.deleted_count,
@@ -2456,6 +2591,7 @@ async def start_trial(
             "updated_at": datetime.now(timezone.utc)
         }}
     )
+    auth_cache.invalidate_user(current_user.user_id)
     
     user_doc = await db.users.find_one({"user_id": current_user.user_id}, {"_id": 0})
     user = User(**{k: v for k, v in user_doc.items() if k != "password_hash"})
@@ -2474,11 +2610,14 @@ async def get_usage_stats(
     ocr_today = current_user.ocr_usage_today if current_user.ocr_usage_date == today else 0
     
     is_premium = current_user.subscription_type in ["premium", "trial"]
+    storage = await storage_usage.get(current_user.user_id)
     
     return {
         "scans_today": scans_today,
         "scans_this_month": scans_month,
         "ocr_today": ocr_today,
+        "storage_bytes": storage["bytes"],
+        "page_count": storage["pages"],
         "limits": {
             "scans_per_day": FREE_SCANS_PER_DAY if not is_premium else None,
             "scans_per_month": FREE_SCANS_PER_MONTH if not is_premium else None,
@@ -2526,6 +2665,7 @@ async def update_premium_status(
             {"user_id": current_user.user_id},
             {"$set": update_data}
         )
+        auth_cache.invalidate_user(current_user.user_id)
         logger.info(f"Updated premium status for user {current_user.user_id}: {update_data}")
     
     return {"success": True, "updated": update_data}
@@ -2551,22 +2691,17 @@ async def upload_avatar(
         avatar_url = None
         
         # Try to upload to S3
-        if s3_client:
+        if object_storage:
             try:
                 # Generate avatar key
-                avatar_key = f"avatars/{current_user.user_id}/avatar.jpg"
+                key = avatar_key(current_user.user_id)
                 
                 # Decode and upload
                 image_data = base64.b64decode(avatar_base64)
                 
-                s3_client.put_object(
-                    Bucket=AWS_S3_BUCKET_NAME,
-                    Key=avatar_key,
-                    Body=image_data,
-                    ContentType='image/jpeg',
-                )
+                await object_storage.put_object(key, image_data, content_type='image/jpeg')
                 
-                avatar_url = f"https://{AWS_S3_BUCKET_NAME}.s3.amazonaws.com/{avatar_key}?t={int(datetime.now().timestamp())}"
+                avatar_url = f"{object_storage.public_url(key)}?t={int(datetime.now().timestamp())}"
                 logger.info(f"✅ Avatar uploaded to S3 for user {current_user.user_id}")
             except Exception as s3_err:
                 logger.warning(f"S3 avatar upload failed: {s3_err}")
@@ -2587,6 +2722,7 @@ async def upload_avatar(
                 "updated_at": datetime.now(timezone.utc).isoformat()
             }}
         )
+        auth_cache.invalidate_user(current_user.user_id)
         
         return {"success": True, "avatar_url": avatar_url}
         
@@ -2597,13 +2733,109 @@ async def upload_avatar(
         raise HTTPException(status_code=500, detail="Failed to upload avatar")
 
 
+class WatermarkRemoval(BulkHandler):
+    """Bulk job: replace watermarked page images with their originals"""
+    
+    kind = "remove_watermarks"
+    collection = "pages"
+    # The watermarked images are replaced, never read
+    projection = {"image_base64": 0, "thumbnail_base64": 0, "ocr_words": 0}
+    
+    def query(self, user_id: str) -> Dict[str, Any]:
+        # Rewritten pages drop out, so an interrupted batch is safe to repeat
+        return {"user_id": user_id, "has_watermark": True}
+    
+    async def process(self, job: Dict[str, Any], page: Dict[str, Any]) -> Optional[UpdateOne]:
+        document_id = page["document_id"]
+        # S3 storage: Replace image_url with original_image_url
+        if page.get("original_image_url"):
+            original_url = page["original_image_url"]
+            fields = {
+                "image_url": original_url,
+                "content_hash": content_hash({"image_url": original_url}),
+                "has_watermark": False,
+            }
+            unset = ["original_image_url", "original_bytes"]
+            if page.get("original_bytes") is not None:
+                fields["image_bytes"] = page["original_bytes"]
+            else:
+                # Unknown until the storage reconciler sizes it
+                unset.append("image_bytes")
+            # Generate new thumbnail from original
+            try:
+                s3_key = object_storage.key_from_url(original_url) if object_storage else None
+                if s3_key:
+                    image_data = await (image_cache.get(s3_key) if image_cache else object_storage.get_object(s3_key))
+                    thumbnail_base64 = await run_in_image_pool(
+                        create_thumbnail, base64.b64encode(image_data).decode('utf-8')
+                    )
+                    thumbnail_url = await upload_to_s3(
+                        thumbnail_base64, job["user_id"], document_id, page["page_id"], "thumbnail"
+                    )
+                    if thumbnail_url:
+                        fields["thumbnail_url"] = thumbnail_url
+                        fields["thumbnail_bytes"] = base64_size(thumbnail_base64)
+            except Exception as e:
+                logger.warning(f"Failed to update thumbnail for page {page.get('page_id')}: {e}")
+        
+        # Base64 storage: Replace image_base64 with original_image_base64
+        elif page.get("original_image_base64"):
+            original = page["original_image_base64"]
+            thumbnail_base64 = await run_in_image_pool(create_thumbnail, original)
+            fields = {
+                "image_base64": original,
+                "image_bytes": base64_size(original),
+                "content_hash": content_hash({"image_base64": original}),
+                "thumbnail_base64": thumbnail_base64,
+                "thumbnail_bytes": base64_size(thumbnail_base64),
+                "has_watermark": False,
+            }
+            unset = ["original_image_base64", "original_bytes"]
+        else:
+            return None
+        
+        return UpdateOne(
+            {"_id": page["_id"], "has_watermark": True},
+            {"$set": fields, "$unset": {field: "" for field in unset}}
+        )
+    
+    async def after_batch(self, job: Dict[str, Any], pages: List[Dict[str, Any]]) -> None:
+        # Storage usage: the rewritten pages' sizes against the sizes they had
+        rewritten = await db.pages.find(
+            {"_id": {"$in": [page["_id"] for page in pages]}}, {"_id": 0, **{size: 1 for size in SIZE_FIELDS}}
+        ).to_list(None)
+        await storage_usage.add(
+            job["user_id"], sum(page_bytes(page) for page in rewritten) - sum(page_bytes(page) for page in pages)
+        )
+        updated_documents: Dict[str, List[str]] = {}
+        for page in pages:
+            updated_documents.setdefault(page["document_id"], []).append(page["page_id"])
+        await db.documents.update_many(
+            {"document_id": {"$in": list(updated_documents)}},
+            {"$set": {"updated_at": datetime.now(timezone.utc)}}
+        )
+        await asyncio.gather(*(page_store.refresh_cover(document_id) for document_id in updated_documents))
+        if blob_store:
+            # The page role now shows the original's blob; the original role is gone
+            async for page in db.pages.find(
+                {"_id": {"$in": [page["_id"] for page in pages]}},
+                {"_id": 0, "document_id": 1, "page_id": 1, **{field: 1 for field in BLOB_ROLE_URLS.values()}},
+            ):
+                await blob_store.sync_refs(job["user_id"], page["document_id"], [page])
+        for document_id, page_ids in updated_documents.items():
+            await sync_log.pages_changed(job["user_id"], document_id, page_ids)
+
+bulk_jobs.register(WatermarkRemoval())
+
 @api_router.post("/documents/remove-watermarks")
 async def remove_watermarks_from_documents(
     current_user: User = Depends(get_current_user)
 ):
     """
     Remove watermarks from all user's documents after becoming premium.
-    Replaces watermarked images with original (non-watermarked) versions.
+    Replaces watermarked images with original (non-watermarked) versions in a
+    background job; poll /bulk-jobs/{job_id} for progress. Calling it again
+    while the job runs returns the same job.
     """
     # Check if user is premium
     is_premium = current_user.subscription_type in ["premium", "trial"]
@@ -2613,109 +2845,176 @@ async def remove_watermarks_from_documents(
             is_premium = False
     
     # Also check has_removed_ads flag (one-time purchase)
-    user_data = await db.users.find_one({"user_id": current_user.user_id})
-    has_removed_ads = user_data.get("has_removed_ads", False) if user_data else False
-    
-    if not is_premium and not has_removed_ads:
+    if not is_premium and not current_user.has_removed_ads:
         raise HTTPException(status_code=403, detail="Only premium users can remove watermarks")
     
-    # Get all user's documents
-    documents = await db.documents.find({"user_id": current_user.user_id}).to_list(length=1000)
-    
-    updated_count = 0
-    pages_updated = 0
-    
-    for doc in documents:
-        doc_updated = False
-        updated_pages = []
-        
-        for page in doc.get("pages", []):
-            page_updated = False
-            
-            # Check if page has watermark
-            if page.get("has_watermark", False):
-                # S3 storage: Replace image_url with original_image_url
-                if page.get("original_image_url"):
-                    page["image_url"] = page["original_image_url"]
-                    # Generate new thumbnail from original
-                    try:
-                        # Download original from S3
-                        original_url = page["original_image_url"]
-                        if s3_client and original_url:
-                            # Extract S3 key from URL
-                            s3_key = original_url.split(f"{AWS_S3_BUCKET_NAME}/")[-1] if AWS_S3_BUCKET_NAME in original_url else None
-                            if s3_key:
-                                response = s3_client.get_object(Bucket=AWS_S3_BUCKET_NAME, Key=s3_key)
-                                image_data = response['Body'].read()
-                                image_base64 = base64.b64encode(image_data).decode('utf-8')
-                                
-                                # Create new thumbnail
-                                new_thumbnail_base64 = create_thumbnail(image_base64)
-                                
-                                # Upload new thumbnail
-                                new_thumbnail_url = upload_to_s3(
-                                    new_thumbnail_base64, 
-                                    current_user.user_id, 
-                                    doc["document_id"], 
-                                    page["page_id"], 
-                                    "thumbnail"
-                                )
-                                if new_thumbnail_url:
-                                    page["thumbnail_url"] = new_thumbnail_url
-                    except Exception as e:
-                        logger.warning(f"Failed to update thumbnail for page {page.get('page_id')}: {e}")
-                    
-                    # Clean up original_image_url field
-                    page.pop("original_image_url", None)
-                    page["has_watermark"] = False
-                    page_updated = True
-                    pages_updated += 1
-                
-                # Base64 storage: Replace image_base64 with original_image_base64
-                elif page.get("original_image_base64"):
-                    page["image_base64"] = page["original_image_base64"]
-                    # Create new thumbnail
-                    page["thumbnail_base64"] = create_thumbnail(page["original_image_base64"])
-                    # Clean up
-                    page.pop("original_image_base64", None)
-                    page["has_watermark"] = False
-                    page_updated = True
-                    pages_updated += 1
-            
-            updated_pages.append(page)
-            if page_updated:
-                doc_updated = True
-        
-        # Update document in database if any page was updated
-        if doc_updated:
-            await db.documents.update_one(
-                {"document_id": doc["document_id"]},
-                {"$set": {"pages": updated_pages}}
-            )
-            updated_count += 1
-    
-    logger.info(f"✅ Removed watermarks for user {current_user.user_id}: {updated_count} documents, {pages_updated} pages")
+    job = await bulk_jobs.enqueue(WatermarkRemoval.kind, current_user.user_id)
+    logger.info(f"✅ Watermark removal job {job['job_id']} for user {current_user.user_id}: {job['total']} pages")
     
     return {
         "success": True,
-        "documents_updated": updated_count,
-        "pages_updated": pages_updated,
-        "message": f"Watermarks removed from {pages_updated} pages across {updated_count} documents"
+        **public_job(job),
+        "message": f"Removing watermarks from {job['total']} pages in the background"
     }
 
+@api_router.get("/bulk-jobs/{job_id}")
+async def get_bulk_job(
+    job_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    """Progress of a background rewrite (e.g. watermark removal) started by the user"""
+    job = await bulk_jobs.get_job(job_id)
+    if not job or job.get("user_id") != current_user.user_id:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return public_job(job)
+
 
 # ==================== DOCUMENT ENDPOINTS ====================
 
+def document_record(document: dict) -> dict:
+    """The documents row of a new document (its pages are stored separately)"""
+    pages = document.get("pages", [])
+    record = {k: v for k, v in document.items() if k != "pages"}
+    record.update(new_document_fields(len(pages)))
+    record.update(search_fields(record.get("name"), record.get("ocr_full_text")))
+    return record
+
+async def insert_document_with_pages(document: dict) -> None:
+    """Insert a new document; its pages go to the pages collection"""
+    pages = document.get("pages", [])
+    await db.documents.insert_one(document_record(document))
+    try:
+        await page_store.insert(document["document_id"], document["user_id"], pages)
+    except Exception:
+        await db.documents.delete_one({"document_id": document["document_id"]})
+        await page_store.delete_document(document["document_id"])
+        raise
+    await sync_log.pages_changed(document["user_id"], document["document_id"], [page["page_id"] for page in pages])
+
+async def insert_documents_with_pages(documents: List[dict]) -> Tuple[List[dict], List[dict]]:
+    """
+    Insert several new documents of one user with one insert_many per collection.
+    
+    Returns (inserted, duplicates): documents whose client_id already exists
+    (a concurrent retry of the same batch) are not inserted.
+    """
+    if not documents:
+        return [], []
+    records = []
+    for document in documents:
+        record = document_record(document)
+        record["thumbnail_url"] = PageStore.cover((document.get("pages") or [None])[0])
+        records.append(record)
+    
+    duplicate_indexes = set()
+    try:
+        await db.documents.insert_many(records, ordered=False)
+    except BulkWriteError as e:
+        errors = e.details.get("writeErrors", [])
+        if any(err.get("code") != 11000 for err in errors):
+            raise
+        duplicate_indexes = {err["index"] for err in errors}
+    inserted = [d for i, d in enumerate(documents) if i not in duplicate_indexes]
+    duplicates = [d for i, d in enumerate(documents) if i in duplicate_indexes]
+    
+    try:
+        await page_store.insert_documents(inserted)
+    except Exception:
+        inserted_ids = [d["document_id"] for d in inserted]
+        await db.documents.delete_many({"document_id": {"$in": inserted_ids}})
+        # Not page_store.delete_documents: a failed insert never reached the storage counters
+        await db.pages.delete_many({"document_id": {"$in": inserted_ids}})
+        raise
+    if inserted:
+        await sync_log.documents_created(
+            inserted[0]["user_id"], {d["document_id"]: [p["page_id"] for p in d.get("pages", [])] for d in inserted}
+        )
+    return inserted, duplicates
+
+async def process_new_page(
+    page: PageData, index: int, user_id: str, document_id: str, page_id: Optional[str] = None
+) -> dict:
+    """Thumbnail and upload one page of a new document.
+    
+    Falls back to base64 storage in MongoDB for this page only if S3 is not
+    configured or its upload fails. Pass page_id to rewrite an existing page.
+    """
+    page_dict = page.dict()
+    page_id = page_id or f"page_{uuid.uuid4().hex[:8]}"
+    page_dict["page_id"] = page_id
+    page_dict["order"] = index
+    
+    # Unfiltered original for non-destructive editing, kept when it differs from the image
+    image_base64 = page.image_base64
+    original_image_base64 = page.original_image_base64 if page.original_image_base64 != image_base64 else None
+    page_dict.pop("original_image_base64", None)
+    has_watermark = False
+    
+    # WATERMARK COMPLETELY DISABLED - No watermarks for any user
+    # if not skip_watermark:
+    #     original_image_base64 = original_image_base64 or image_base64
+    #     image_base64 = add_watermark(image_base64, "ScanUp")
+    #     has_watermark = True
+    
+    # Create thumbnail (from watermarked image if applicable)
+    thumbnail_base64 = await run_in_image_pool(create_thumbnail, image_base64)
+    # Sizes stay on the page wherever the images end up (storage accounting)
+    page_dict["image_bytes"] = base64_size(image_base64)
+    page_dict["thumbnail_bytes"] = base64_size(thumbnail_base64)
+    if original_image_base64:
+        page_dict["original_bytes"] = base64_size(original_image_base64)
+    
+    # Upload to S3 if configured
+    if object_storage:
+        # Upload main image, thumbnail and the original (if any) together
+        uploads = [
+            upload_to_s3(image_base64, user_id, document_id, page_id, "page"),
+            upload_to_s3(thumbnail_base64, user_id, document_id, page_id, "thumbnail")
+        ]
+        if original_image_base64:
+            uploads.append(upload_to_s3(original_image_base64, user_id, document_id, page_id, "original"))
+        results = await asyncio.gather(*uploads)
+        image_url, thumbnail_url = results[0], results[1]
+        original_image_url = results[2] if original_image_base64 else None
+        
+        if image_url and thumbnail_url and (original_image_url or not original_image_base64):
+            # Store URLs instead of base64
+            page_dict["image_url"] = image_url
+            page_dict["thumbnail_url"] = thumbnail_url
+            page_dict["has_watermark"] = has_watermark
+            if original_image_url:
+                page_dict["original_image_url"] = original_image_url
+            page_dict.pop("image_base64", None)
+            page_dict.pop("thumbnail_base64", None)
+            logger.info(f"✅ Page {page_id} uploaded to S3 (watermark: {has_watermark})")
+        else:
+            # Fallback to base64 if S3 upload fails
+            page_dict["image_base64"] = image_base64
+            page_dict["thumbnail_base64"] = thumbnail_base64
+            page_dict["has_watermark"] = has_watermark
+            if original_image_base64:
+                page_dict["original_image_base64"] = original_image_base64
+            logger.warning(f"⚠️ S3 upload failed, storing base64 for page {page_id}")
+    else:
+        # No S3, store base64 in MongoDB
+        page_dict["image_base64"] = image_base64
+        page_dict["thumbnail_base64"] = thumbnail_base64
+        page_dict["has_watermark"] = has_watermark
+        if original_image_base64:
+            page_dict["original_image_base64"] = original_image_base64
+    
+    return page_dict
+
 @api_router.post("/documents", response_model=Document)
 async def create_document(
     doc_data: DocumentCreate,
     current_user: User = Depends(get_current_user)
 ):
     """Create a new document"""
-    # Check scan limits for free users
-    can_scan, limit_message = await check_scan_limits(current_user)
-    if not can_scan:
-        raise HTTPException(status_code=403, detail=limit_message)
+    # Count the scan up front (free users: within their limits); given back if creation fails
+    reservation = await reserve_scans(current_user)
+    if not reservation.granted:
+        raise HTTPException(status_code=403, detail=reservation.message)
     
     document_id = f"doc_{uuid.uuid4().hex[:12]}"
     now = datetime.now(timezone.utc)
@@ -2727,110 +3026,461 @@ async def create_document(
         if datetime.now(timezone.utc) >= trial_end.replace(tzinfo=timezone.utc):
             is_premium = False
     
-    # Also check if user has removed ads (they shouldn't get watermarks either)
-    user_data = await db.users.find_one({"user_id": current_user.user_id})
-    has_removed_ads = user_data.get("has_removed_ads", False) if user_data else False
+    # No watermark if premium OR has removed ads (one-time purchase)
+    skip_watermark = is_premium or current_user.has_removed_ads
+    
+    # Process pages concurrently (bounded) - thumbnails on the image pool,
+    # uploads on the storage pool. gather() keeps the original page order.
+    semaphore = asyncio.Semaphore(PAGE_PROCESSING_CONCURRENCY)
+    
+    async def process_page_bounded(i: int, page: PageData) -> dict:
+        async with semaphore:
+            return await process_new_page(page, i, current_user.user_id, document_id)
+    
+    try:
+        processed_pages = await gather_or_cancel(
+            *(process_page_bounded(i, page) for i, page in enumerate(doc_data.pages))
+        )
+        
+        document = {
+            "document_id": document_id,
+            "user_id": current_user.user_id,
+            "name": doc_data.name,
+            "folder_id": doc_data.folder_id,
+            "tags": doc_data.tags,
+            "pages": processed_pages,
+            "ocr_full_text": None,
+            "is_password_protected": False,
+            "has_watermark": False,  # WATERMARK COMPLETELY DISABLED
+            "storage_type": object_storage.storage_type if object_storage else "mongodb",  # Track storage type
+            "created_at": now,
+            "updated_at": now
+        }
+        
+        await insert_document_with_pages(document)
+    except Exception:
+        await release_scans(current_user.user_id, reservation)
+        # Drop the refs process_new_page took for images that were stored
+        if blob_store:
+            await blob_store.release_document(document_id)
+        raise
+    return trusted_response(Document, document)
+
+# ⭐ BULK CREATE - Many documents in one request (offline sync, guest uploads)
+@api_router.post("/documents/bulk")
+async def create_documents_bulk(
+    request: BulkDocumentCreate,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Create up to MAX_BULK_DOCUMENTS documents in one request.
+    
+    Every document carries a client_id chosen by the device. A client_id that
+    already exists returns the existing document instead of a copy, so a
+    retried batch never duplicates documents or spends quota twice. Scan quota
+    is reserved once for the whole batch; documents beyond what is left come
+    back as limit_reached, and documents that fail give their scan back.
+    Pages of all documents are processed concurrently and stored with one
+    insert_many per collection.
+    
+    Returns per-document results in request order:
+    {client_id, status: created | existing | limit_reached | failed, document_id, page_ids, error}
+    """
+    user_id = current_user.user_id
+    client_ids = [item.client_id for item in request.documents]
+    if len(set(client_ids)) != len(client_ids):
+        raise HTTPException(status_code=400, detail="Duplicate client_id in batch")
+    
+    results: Dict[str, dict] = {}
+    
+    async def mark_existing(ids: List[str]):
+        existing = await db.documents.find(
+            # $type matches the partial unique index on client_id
+            {"user_id": user_id, "client_id": {"$in": ids, "$type": "string"}},
+            {"_id": 0, "document_id": 1, "client_id": 1}
+        ).to_list(None)
+        pages = await page_store.list_many([d["document_id"] for d in existing], include_images=False)
+        for document in existing:
+            results[document["client_id"]] = {
+                "status": "existing",
+                "document_id": document["document_id"],
+                "page_ids": [page["page_id"] for page in pages.get(document["document_id"], [])],
+            }
+    
+    # Retries: documents created by an earlier attempt of this batch
+    await mark_existing(client_ids)
+    new_items = [item for item in request.documents if item.client_id not in results]
+    
+    # One atomic quota reservation for the whole batch
+    reservation = await reserve_scans(current_user, len(new_items), partial=True)
+    for item in new_items[reservation.granted:]:
+        results[item.client_id] = {"status": "limit_reached", "error": reservation.message}
+    accepted = new_items[:reservation.granted]
+    
+    # Pages of all documents share one concurrency limit
+    semaphore = asyncio.Semaphore(PAGE_PROCESSING_CONCURRENCY)
+    now = datetime.now(timezone.utc)
+    
+    async def process_page_bounded(i: int, page: PageData, document_id: str) -> dict:
+        async with semaphore:
+            return await process_new_page(page, i, user_id, document_id)
+    
+    async def process_document(item: BulkDocumentItem, document_id: str) -> dict:
+        pages = await gather_or_cancel(
+            *(process_page_bounded(i, page, document_id) for i, page in enumerate(item.pages))
+        )
+        return {
+            "document_id": document_id,
+            "user_id": user_id,
+            "client_id": item.client_id,
+            "name": item.name,
+            "folder_id": item.folder_id,
+            "tags": item.tags,
+            "pages": list(pages),
+            "ocr_full_text": None,
+            "is_password_protected": False,
+            "has_watermark": False,  # WATERMARK COMPLETELY DISABLED
+            "storage_type": object_storage.storage_type if object_storage else "mongodb",
+            "created_at": now,
+            "updated_at": now
+        }
+    
+    document_ids = [f"doc_{uuid.uuid4().hex[:12]}" for _ in accepted]
+    processed = await asyncio.gather(
+        *(process_document(item, document_id) for item, document_id in zip(accepted, document_ids)),
+        return_exceptions=True
+    )
+    documents = []
+    failed_ids = []
+    for item, document_id, outcome in zip(accepted, document_ids, processed):
+        if isinstance(outcome, Exception):
+            logger.warning(f"⚠️ Bulk create: document {item.client_id} failed: {outcome}")
+            results[item.client_id] = {"status": "failed", "error": "Failed to process pages"}
+            failed_ids.append(document_id)
+        else:
+            documents.append(outcome)
+    
+    try:
+        inserted, duplicates = await insert_documents_with_pages(documents)
+    except Exception as e:
+        logger.error(f"❌ Bulk create insert failed for user {user_id}: {e}")
+        inserted, duplicates = [], []
+        for document in documents:
+            results[document["client_id"]] = {"status": "failed", "error": "Failed to save document"}
+            failed_ids.append(document["document_id"])
+    
+    for document in inserted:
+        results[document["client_id"]] = {
+            "status": "created",
+            "document_id": document["document_id"],
+            "page_ids": [page["page_id"] for page in document["pages"]],
+        }
+    # A concurrent retry of the same batch created these first
+    await mark_existing([document["client_id"] for document in duplicates])
+    failed_ids += [document["document_id"] for document in duplicates]
+    
+    # Only created documents count as scans; drop images uploaded for the rest
+    await release_scans(user_id, reservation, reservation.granted - len(inserted))
+    if blob_store:
+        for document_id in failed_ids:
+            await blob_store.release_document(document_id)
+    
+    logger.info(f"✅ Bulk create for user {user_id}: {len(inserted)} of {len(client_ids)} documents created")
+    return {
+        "results": [{"client_id": client_id, **results[client_id]} for client_id in client_ids],
+        "created": len(inserted),
+    }
+
+# ⭐ LOCAL STORAGE ROUTE - Serves objects for the local-disk / in-memory backends
+# Reads are open like public S3 URLs (keys contain random IDs); writes need a presigned URL.
+MAX_STORAGE_PUT_BYTES = 50 * 1024 * 1024
+
+def get_signed_storage() -> SignedUrlMixin:
+    if not isinstance(object_storage, SignedUrlMixin):
+        raise HTTPException(status_code=404, detail="Not found")
+    return object_storage
+
+@api_router.get("/storage/{key:path}")
+async def read_storage_object(key: str):
+    storage = get_signed_storage()
+    try:
+        head = await storage.head_object(key)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid storage key")
+    if not head:
+        raise HTTPException(status_code=404, detail="Not found")
+    from fastapi.responses import StreamingResponse
+    return StreamingResponse(
+        storage.open_stream(key),
+        media_type=head["ContentType"],
+        headers={"Content-Length": str(head["ContentLength"]), "ETag": f'"{head["ETag"]}"'}
+    )
+
+@api_router.put("/storage/{key:path}")
+async def write_storage_object(key: str, request: Request, expires: int, signature: str):
+    storage = get_signed_storage()
+    if not storage.verify_signature("PUT", key, expires, signature):
+        raise HTTPException(status_code=403, detail="Invalid or expired upload URL")
+    
+    async def body():
+        received = 0
+        async for chunk in request.stream():
+            received += len(chunk)
+            if received > MAX_STORAGE_PUT_BYTES:
+                raise HTTPException(status_code=413, detail="Object too large")
+            yield chunk
     
-    # No watermark if premium OR has_removed_ads
-    skip_watermark = is_premium or has_removed_ads
+    try:
+        etag = await storage.put_stream(key, body(), request.headers.get("content-type", "application/octet-stream"))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid storage key")
+    return Response(status_code=200, headers={"ETag": f'"{etag}"'})
+
+# ⭐ DIRECT UPLOADS - Client PUTs page images straight to object storage
+@api_router.post("/documents/uploads")
+async def create_upload_session(
+    upload_request: UploadSessionRequest,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Start a direct upload: returns one presigned PUT URL per page.
+    The client uploads each image to its URL, then calls
+    POST /documents/uploads/{upload_id}/commit with the document metadata.
+    """
+    if not object_storage:
+        raise HTTPException(status_code=503, detail="Direct uploads require object storage")
+    
+    can_scan, limit_message = await check_scan_limits(current_user)
+    if not can_scan:
+        raise HTTPException(status_code=403, detail=limit_message)
+    
+    upload_id = f"upl_{uuid.uuid4().hex[:16]}"
+    document_id = f"doc_{uuid.uuid4().hex[:12]}"
+    now = datetime.now(timezone.utc)
+    expires_at = now + timedelta(seconds=UPLOAD_URL_EXPIRY_SECONDS)
+    
+    pages = []
+    response_pages = []
+    for _ in range(upload_request.page_count):
+        page_id = f"page_{uuid.uuid4().hex[:8]}"
+        key = upload_key(current_user.user_id, upload_id, page_id)
+        pages.append({"page_id": page_id, "key": key})
+        response_pages.append({
+            "page_id": page_id,
+            "upload_url": object_storage.presigned_put_url(
+                key, upload_request.content_type, UPLOAD_URL_EXPIRY_SECONDS
+            ),
+            "headers": {"Content-Type": upload_request.content_type}
+        })
+    
+    await db.upload_sessions.insert_one({
+        "upload_id": upload_id,
+        "user_id": current_user.user_id,
+        "document_id": document_id,
+        "pages": pages,
+        "status": "pending",
+        "created_at": now,
+        "expires_at": expires_at
+    })
+    
+    return {
+        "upload_id": upload_id,
+        "document_id": document_id,
+        "expires_at": expires_at.isoformat(),
+        "pages": response_pages
+    }
+
+@api_router.post("/documents/uploads/{upload_id}/commit", response_model=Document)
+async def commit_upload_session(
+    upload_id: str,
+    commit: UploadCommitRequest,
+    background_tasks: BackgroundTasks,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Create the document for a finished direct upload. Every page must already
+    exist in storage. Each object is read once, checked, and stored under a
+    server-owned key, so replacing it through the still-valid PUT URL changes
+    nothing. Committing again returns the same document. Thumbnails are
+    generated afterwards in the background.
+    """
+    if not object_storage:
+        raise HTTPException(status_code=503, detail="Direct uploads require object storage")
+    
+    session = await db.upload_sessions.find_one(
+        {"upload_id": upload_id, "user_id": current_user.user_id},
+        {"_id": 0}
+    )
+    if not session:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    
+    # A retried commit (e.g. after a lost response) gets the document the first one created
+    existing = await db.documents.find_one(
+        {"document_id": session["document_id"], "user_id": current_user.user_id},
+        DOCUMENT_PROJECTION
+    )
+    if existing:
+        await page_store.attach([existing])
+        return trusted_response(Document, existing)
+    
+    if session["status"] == "committed":
+        # ...and has since been deleted
+        raise HTTPException(status_code=409, detail="Upload already committed")
+    
+    now = datetime.now(timezone.utc)
+    if session["status"] == "expired":
+        raise HTTPException(status_code=410, detail="Upload expired")
+    expires_at = session["expires_at"]
+    if expires_at.tzinfo is None:
+        expires_at = expires_at.replace(tzinfo=timezone.utc)
+    if expires_at <= now:
+        raise HTTPException(status_code=410, detail="Upload expired")
+    
+    keys = {p["page_id"]: p["key"] for p in session["pages"]}
+    commit_pages = commit.pages or [UploadCommitPage(page_id=p["page_id"]) for p in session["pages"]]
+    unknown = [p.page_id for p in commit_pages if p.page_id not in keys]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown pages: {unknown}")
+    
+    # Quick reject before reading anything: every object landed, within the size and type limits
+    heads = await asyncio.gather(*(object_storage.head_object(keys[p.page_id]) for p in commit_pages))
+    problem = check_objects([p.page_id for p in commit_pages], heads)
+    if problem:
+        raise HTTPException(status_code=problem[0], detail=problem[1])
+    
+    reservation = await reserve_scans(current_user)
+    if not reservation.granted:
+        raise HTTPException(status_code=403, detail=reservation.message)
+    
+    # Claim the session so concurrent commits can't create a second document;
+    # a claim left behind by a commit that died runs out after the lease
+    claimed = await db.upload_sessions.update_one(
+        {"upload_id": upload_id, "$or": [
+            {"status": "pending"},
+            {"status": "committing", "commit_lease_until": {"$lte": now}},
+        ]},
+        {"$set": {"status": "committing", "commit_lease_until": now + timedelta(seconds=COMMIT_LEASE_SECONDS)}}
+    )
+    if claimed.modified_count == 0:
+        await release_scans(current_user.user_id, reservation)
+        raise HTTPException(status_code=409, detail="Upload is being committed")
+    
+    semaphore = asyncio.Semaphore(PAGE_PROCESSING_CONCURRENCY)
+    
+    async def adopt_page(i: int, commit_page: UploadCommitPage) -> dict:
+        """Read the uploaded object and store the checked bytes under a server-owned key"""
+        async with semaphore:
+            data, content_type = await read_upload(object_storage, commit_page.page_id, keys[commit_page.page_id])
+            image_url = await blob_store.store(
+                data, current_user.user_id, session["document_id"], commit_page.page_id, "page", content_type
+            )
+        page_dict = PageData(
+            page_id=commit_page.page_id,
+            image_url=image_url,
+            ocr_text=commit_page.ocr_text,
+            filter_applied=commit_page.filter_applied,
+            rotation=commit_page.rotation,
+            order=i
+        ).dict()
+        page_dict["has_watermark"] = False
+        page_dict["image_bytes"] = len(data)
+        return page_dict
+    
+    try:
+        pages = await gather_or_cancel(*(adopt_page(i, p) for i, p in enumerate(commit_pages)))
+        document = {
+            "document_id": session["document_id"],
+            "user_id": current_user.user_id,
+            "name": commit.name,
+            "folder_id": commit.folder_id,
+            "tags": commit.tags,
+            "pages": pages,
+            "ocr_full_text": None,
+            "is_password_protected": False,
+            "has_watermark": False,
+            "storage_type": object_storage.storage_type,
+            "created_at": now,
+            "updated_at": now
+        }
+        await insert_document_with_pages(document)
+    except BaseException as e:
+        await release_scans(current_user.user_id, reservation)
+        await blob_store.release_document(session["document_id"])
+        # Hand the session back so the client can fix the upload and commit again
+        await db.upload_sessions.update_one(
+            {"upload_id": upload_id, "status": "committing"},
+            {"$set": {"status": "pending"}, "$unset": {"commit_lease_until": ""}}
+        )
+        if isinstance(e, UploadRejected):
+            raise HTTPException(status_code=e.status_code, detail=e.detail)
+        raise
     
-    # Process pages - create thumbnails, add watermark for free users, upload to S3
-    processed_pages = []
-    for i, page in enumerate(doc_data.pages):
-        page_dict = page.dict()
-        page_id = f"page_{uuid.uuid4().hex[:8]}"
-        page_dict["page_id"] = page_id
-        page_dict["order"] = i
-        
-        # Store original image - NO WATERMARK (completely disabled)
-        original_image_base64 = page.image_base64
-        image_base64 = page.image_base64
-        has_watermark = False
-        
-        # WATERMARK COMPLETELY DISABLED - No watermarks for any user
-        # if not skip_watermark:
-        #     image_base64 = add_watermark(image_base64, "ScanUp")
-        #     has_watermark = True
-        
-        # Create thumbnail (from watermarked image if applicable)
-        thumbnail_base64 = create_thumbnail(image_base64)
-        
-        # Upload to S3 if configured
-        if s3_client:
-            # Upload main image (watermarked for free users)
-            image_url = upload_to_s3(image_base64, current_user.user_id, document_id, page_id, "page")
-            thumbnail_url = upload_to_s3(thumbnail_base64, current_user.user_id, document_id, page_id, "thumbnail")
-            
-            # Also upload original (non-watermarked) for free users
-            original_image_url = None
-            if has_watermark:
-                original_image_url = upload_to_s3(original_image_base64, current_user.user_id, document_id, page_id, "original")
-            
-            if image_url and thumbnail_url:
-                # Store URLs instead of base64
-                page_dict["image_url"] = image_url
-                page_dict["thumbnail_url"] = thumbnail_url
-                page_dict["has_watermark"] = has_watermark
-                if original_image_url:
-                    page_dict["original_image_url"] = original_image_url
-                page_dict.pop("image_base64", None)
-                page_dict.pop("thumbnail_base64", None)
-                logger.info(f"✅ Page {page_id} uploaded to S3 (watermark: {has_watermark})")
-            else:
-                # Fallback to base64 if S3 upload fails
-                page_dict["image_base64"] = image_base64
-                page_dict["thumbnail_base64"] = thumbnail_base64
-                page_dict["has_watermark"] = has_watermark
-                if has_watermark:
-                    page_dict["original_image_base64"] = original_image_base64
-                logger.warning(f"⚠️ S3 upload failed, storing base64 for page {page_id}")
-        else:
-            # No S3, store base64 in MongoDB
-            page_dict["image_base64"] = image_base64
-            page_dict["thumbnail_base64"] = thumbnail_base64
-            page_dict["has_watermark"] = has_watermark
-            if has_watermark:
-                page_dict["original_image_base64"] = original_image_base64
-        
-        processed_pages.append(page_dict)
+    await db.upload_sessions.update_one(
+        {"upload_id": upload_id},
+        {"$set": {"status": "committed", "committed_at": datetime.now(timezone.utc)},
+         "$unset": {"commit_lease_until": ""}}
+    )
+    # The document only points at blobs; every staging object can go, used or not
+    await deletion_worker.enqueue(
+        "upload", user_id=current_user.user_id, document_id=session["document_id"], keys=list(keys.values())
+    )
     
-    document = {
-        "document_id": document_id,
-        "user_id": current_user.user_id,
-        "name": doc_data.name,
-        "folder_id": doc_data.folder_id,
-        "tags": doc_data.tags,
-        "pages": processed_pages,
-        "ocr_full_text": None,
-        "is_password_protected": False,
-        "has_watermark": False,  # WATERMARK COMPLETELY DISABLED
-        "storage_type": "s3" if s3_client else "mongodb",  # Track storage type
-        "created_at": now,
-        "updated_at": now
-    }
+    background_tasks.add_task(
+        generate_thumbnails_from_storage,
+        current_user.user_id,
+        session["document_id"],
+        [(p["page_id"], object_storage.key_from_url(p["image_url"])) for p in pages]
+    )
     
-    await db.documents.insert_one(document)
+    return trusted_response(Document, document)
+
+async def generate_thumbnails_from_storage(user_id: str, document_id: str, pages: List[Tuple[str, str]]):
+    """Background task: build thumbnails for directly uploaded pages from storage"""
+    semaphore = asyncio.Semaphore(PAGE_PROCESSING_CONCURRENCY)
     
-    # Increment scan count for this user
-    await increment_scan_count(current_user.user_id)
+    async def thumbnail_page(page_id: str, key: str):
+        async with semaphore:
+            try:
+                image_data = await (image_cache.get(key) if image_cache else object_storage.get_object(key))
+                image_base64 = base64.b64encode(image_data).decode('utf-8')
+                thumbnail_base64 = await run_in_image_pool(create_thumbnail, image_base64)
+                thumbnail_url = await upload_to_s3(thumbnail_base64, user_id, document_id, page_id, "thumbnail")
+                if thumbnail_url:
+                    await page_store.update(document_id, page_id, {
+                        "thumbnail_url": thumbnail_url, "thumbnail_bytes": base64_size(thumbnail_base64)
+                    })
+            except Exception as e:
+                logger.error(f"Thumbnail generation failed for {document_id}/{page_id}: {e}")
     
-    # Remove _id before returning
-    document.pop("_id", None)
-    return Document(**document)
+    await asyncio.gather(*(thumbnail_page(page_id, key) for page_id, key in pages))
+    # Page thumbnails changed without a new document version
+    await db.documents.update_one({"document_id": document_id}, {"$inc": {"cache_rev": 1}})
+    await sync_log.pages_changed(user_id, document_id, [page_id for page_id, _ in pages])
+    logger.info(f"✅ Generated {len(pages)} thumbnails from storage for {document_id}")
 
 # ⭐ MANIFEST-BASED SYNC - Lightweight document metadata for efficient sync
 @api_router.get("/documents/manifest")
 async def get_documents_manifest(
+    request: Request,
+    response: Response,
     since: Optional[str] = None,  # ISO timestamp for incremental sync
     current_user: User = Depends(get_current_user)
 ):
     """
     Get lightweight manifest of all documents for efficient sync.
     Returns only metadata (no images/content) for fast comparison.
+    Capped at 1000 documents and blind to deletes; new clients use /sync/changes.
+    The ETag follows the user's sync sequence, so an unchanged library is a 304.
     
     Query params:
     - since: ISO timestamp to get only documents changed after this time
     """
+    etag = make_etag("manifest", await sync_log.current_seq(current_user.user_id), since)
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+    set_cache_headers(response, etag)
+    
     query = {"user_id": current_user.user_id}
     
     # If 'since' provided, only return documents changed after that time
@@ -2841,20 +3491,8 @@ async def get_documents_manifest(
         except:
             pass  # Invalid date, ignore filter
     
-    # Only fetch lightweight fields - no images, no OCR text
-    projection = {
-        "_id": 0,
-        "document_id": 1,
-        "name": 1,
-        "folder_id": 1,
-        "updated_at": 1,
-        "created_at": 1,
-        "page_count": {"$size": {"$ifNull": ["$pages", []]}},
-        "tags": 1,
-        "is_password_protected": 1
-    }
-    
-    # Use aggregation for page_count calculation
+    # Only fetch lightweight fields - no images, no OCR text.
+    # page_count is stored on split documents; legacy documents still count embedded pages.
     pipeline = [
         {"$match": query},
         {"$project": {
@@ -2864,7 +3502,7 @@ async def get_documents_manifest(
             "folder_id": 1,
             "updated_at": 1,
             "created_at": 1,
-            "page_count": {"$size": {"$ifNull": ["$pages", []]}},
+            "page_count": {"$ifNull": ["$page_count", {"$size": {"$ifNull": ["$pages", []]}}]},
             "tags": 1,
             "is_password_protected": 1
         }},
@@ -2882,6 +3520,76 @@ async def get_documents_manifest(
         "documents": manifests
     }
 
+@api_router.get("/sync/changes")
+async def get_sync_changes(
+    since: int = 0,
+    limit: int = 200,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Incremental sync: document, page and folder changes after sequence number `since`.
+    
+    Each change carries its `seq`, kind (document / page / folder) and either the
+    current metadata (`data`, never images) or `deleted: true`. Page data
+    includes `content_hash`; clients download an image only when it differs
+    from the hash they hold. Call again with `since=next_seq` while
+    `has_more` is true. `reset: true` means `since` is older than retained
+    tombstones: drop local state and sync again from 0.
+    """
+    if since < 0:
+        raise HTTPException(status_code=400, detail="since must be >= 0")
+    return await sync_log.changes_since(current_user.user_id, since, limit)
+
+@api_router.get("/documents/search")
+async def search_documents(
+    q: str,
+    limit: int = 20,
+    folder_id: Optional[str] = None,
+    tag: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Ranked full-text search over document names and OCR text.
+    Whole-word matches rank first (name matches above OCR matches), followed by
+    partial-word matches. Each result carries a snippet of the OCR text;
+    snippet_highlights / name_highlights are [start, end) character offsets.
+    """
+    if not q.strip():
+        raise HTTPException(status_code=400, detail="Search query is required")
+    results = await document_search.search(current_user.user_id, q, limit, folder_id, tag)
+    return {"query": q, "count": len(results), "results": results}
+
+@api_router.get("/documents/summaries")
+async def get_document_summaries(
+    cursor: Optional[str] = None,
+    limit: int = SUMMARY_DEFAULT_LIMIT,
+    fields: Optional[str] = None,  # comma-separated, e.g. "name,thumbnail_url"
+    folder_id: Optional[str] = None,
+    tag: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Lightweight, paginated document listing for the document grid.
+    Returns summaries only (no pages, no OCR text), newest first.
+    
+    Query params:
+    - cursor: next_cursor from the previous response
+    - limit: page size (max 200)
+    - fields: subset of summary fields; document_id and updated_at are always included
+    """
+    try:
+        return await list_summaries(
+            db.documents,
+            current_user.user_id,
+            cursor=cursor,
+            limit=limit,
+            fields=fields.split(",") if fields else None,
+            folder_id=folder_id,
+            tag=tag,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 @api_router.get("/documents", response_model=List[Document])
 async def get_documents(
     folder_id: Optional[str] = None,
@@ -2899,13 +3607,12 @@ async def get_documents(
         query["tags"] = tag
     
     if search:
-        query["$or"] = [
-            {"name": {"$regex": search, "$options": "i"}},
-            {"ocr_full_text": {"$regex": search, "$options": "i"}}
-        ]
+        matches = await document_search.matches(current_user.user_id, search, 1000, folder_id, tag)
+        query["document_id"] = {"$in": [match["document_id"] for match in matches]}
     
-    documents = await db.documents.find(query, {"_id": 0}).sort("updated_at", -1).to_list(1000)
-    return [Document(**doc) for doc in documents]
+    documents = await db.documents.find(query, DOCUMENT_PROJECTION).sort("updated_at", -1).to_list(1000)
+    await page_store.attach(documents)
+    return trusted_response(Document, documents)
 
 # ⭐ BATCH FETCH - Get multiple documents by IDs (for efficient sync)
 class BatchDocumentRequest(BaseModel):
@@ -2931,26 +3638,139 @@ async def get_documents_batch(
             "document_id": {"$in": doc_ids},
             "user_id": current_user.user_id
         },
-        {"_id": 0}
+        DOCUMENT_PROJECTION
     ).to_list(50)
+    await page_store.attach(documents)
     
-    return [Document(**doc) for doc in documents]
+    return trusted_response(Document, documents)
+
+def document_etag(document: dict, include_images: bool) -> str:
+    """ETag of a document response; every write bumps version, updated_at or cache_rev"""
+    return make_etag(
+        "document", document["document_id"], document.get("version"), document.get("updated_at"),
+        document.get("cache_rev"), document.get("thumbnail_url"), document.get("storage_type"), include_images,
+    )
 
 @api_router.get("/documents/{document_id}", response_model=Document)
 async def get_document(
     document_id: str,
+    request: Request,
+    include_images: bool = True,
     current_user: User = Depends(get_current_user)
 ):
-    """Get a specific document"""
+    """
+    Get a specific document.
+    include_images=false returns page metadata only; images are then fetched
+    per page from /documents/{document_id}/pages/{page_id}/image.
+    Sends an ETag; If-None-Match with it returns 304 without loading pages.
+    """
     document = await db.documents.find_one(
         {"document_id": document_id, "user_id": current_user.user_id},
-        {"_id": 0}
+        DOCUMENT_PROJECTION
+    )
+    
+    if not document:
+        raise HTTPException(status_code=404, detail="Document not found")
+    
+    etag = document_etag(document, include_images)
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+    await page_store.attach([document], include_images=include_images)
+    return trusted_response(Document, document, headers=cache_headers(etag))
+
+@api_router.get("/documents/{document_id}/pages")
+async def get_document_pages(
+    document_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    """Page metadata (IDs, order, URLs, OCR text, filters) without image payloads"""
+    document = await db.documents.find_one(
+        {"document_id": document_id, "user_id": current_user.user_id},
+        {"_id": 0, "document_id": 1, "pages_split": 1}
     )
+    if not document:
+        raise HTTPException(status_code=404, detail="Document not found")
+    
+    await page_store.ensure_split([document])
+    pages = await page_store.list_pages(document_id, include_images=False)
+    return {"document_id": document_id, "page_count": len(pages), "pages": pages}
+
+@api_router.get("/documents/{document_id}/pages/{page_id}/image")
+async def get_document_page_image(
+    document_id: str,
+    page_id: str,
+    variant: str = "page",
+    current_user: User = Depends(get_current_user)
+):
+    """Image of one page on demand. variant: page, thumbnail or original."""
+    fields = {
+        "page": ("image_base64", "image_url"),
+        "thumbnail": ("thumbnail_base64", "thumbnail_url"),
+        "original": ("original_image_base64", "original_image_url"),
+    }
+    if variant not in fields:
+        raise HTTPException(status_code=400, detail="variant must be page, thumbnail or original")
     
+    document = await db.documents.find_one(
+        {"document_id": document_id, "user_id": current_user.user_id},
+        {"_id": 0, "document_id": 1, "pages_split": 1}
+    )
     if not document:
         raise HTTPException(status_code=404, detail="Document not found")
+    await page_store.ensure_split([document])
+    
+    base64_field, url_field = fields[variant]
+    page = await page_store.get(document_id, page_id)
+    if not page:
+        raise HTTPException(status_code=404, detail="Page not found")
     
-    return Document(**document)
+    image_data = None
+    if page.get(base64_field):
+        value = page[base64_field]
+        image_data = base64.b64decode(value.split(",", 1)[1] if "," in value[:100] else value)
+    elif page.get(url_field):
+        image_data = await read_stored_image(page[url_field])
+    if not image_data:
+        raise HTTPException(status_code=404, detail="Image not available")
+    
+    return Response(content=image_data, media_type="image/jpeg", headers={"Cache-Control": "private, max-age=300"})
+
+# ⭐ PAGE LEASE - One writer of a document's pages at a time
+# Page writers read pages, do their work, then write rows back; the lease
+# keeps a patch, a full update, an added page and an OCR save from
+# interleaving and overwriting each other.
+PAGE_LEASE_SECONDS = 120
+
+def version_filter(version: int) -> dict:
+    """Match a document version (documents from before versioning count as 0)"""
+    return {"version": version} if version else {"version": {"$in": [None, 0]}}
+
+@asynccontextmanager
+async def page_lease(document_id: str, version: Optional[int] = None):
+    """
+    Hold the document's page lease for the body of the block. Raises 409 if
+    another writer holds it or, when `version` is given, if the document is
+    no longer at that version.
+    """
+    now = datetime.now(timezone.utc)
+    lease_id = uuid.uuid4().hex
+    query = {"document_id": document_id, "page_lease_until": {"$not": {"$gt": now}}}
+    if version is not None:
+        query.update(version_filter(version))
+    claimed = await db.documents.update_one(query, {"$set": {
+        "page_lease_id": lease_id, "page_lease_until": now + timedelta(seconds=PAGE_LEASE_SECONDS)
+    }})
+    if not claimed.modified_count:
+        raise HTTPException(status_code=409, detail="Document is being edited or has changed")
+    try:
+        yield
+    finally:
+        # Only our own lease: an expired one may have been claimed by someone else
+        await db.documents.update_one(
+            {"document_id": document_id, "page_lease_id": lease_id},
+            {"$unset": {"page_lease_id": "", "page_lease_until": ""}}
+        )
 
 @api_router.put("/documents/{document_id}", response_model=Document)
 async def update_document(
@@ -2961,16 +3781,19 @@ async def update_document(
     """Update a document"""
     document = await db.documents.find_one(
         {"document_id": document_id, "user_id": current_user.user_id},
-        {"_id": 0}
+        DOCUMENT_PROJECTION
     )
     
     if not document:
         raise HTTPException(status_code=404, detail="Document not found")
+    await page_store.ensure_split([document])
     
     update_data = {"updated_at": datetime.now(timezone.utc)}
+    new_pages = None
     
     if doc_update.name is not None:
         update_data["name"] = doc_update.name
+        update_data.update(search_fields(doc_update.name, document.get("ocr_full_text")))
     if doc_update.folder_id is not None:
         update_data["folder_id"] = doc_update.folder_id
     if doc_update.tags is not None:
@@ -2980,26 +3803,46 @@ async def update_document(
         for i, page in enumerate(doc_update.pages):
             page_dict = page.dict()
             page_dict["order"] = i
-            # Always regenerate thumbnail to ensure it matches the current image
-            page_dict["thumbnail_base64"] = create_thumbnail(page.image_base64)
+            # Regenerate inline thumbnails so they match the current image;
+            # stored pages (image_url) keep their stored thumbnail
+            if page.image_base64:
+                page_dict["thumbnail_base64"] = create_thumbnail(page.image_base64)
             processed_pages.append(page_dict)
-        update_data["pages"] = processed_pages
+        new_pages = processed_pages
         
         # Update document thumbnail to first page's thumbnail
-        if processed_pages:
+        if processed_pages and processed_pages[0].get("thumbnail_base64"):
             update_data["thumbnail_base64"] = processed_pages[0].get("thumbnail_base64")
     if doc_update.is_password_protected is not None:
         update_data["is_password_protected"] = doc_update.is_password_protected
     if doc_update.password_hash is not None:
         update_data["password_hash"] = hash_password(doc_update.password_hash)
     
-    await db.documents.update_one(
-        {"document_id": document_id},
-        {"$set": update_data}
-    )
+    if new_pages is not None:
+        async with page_lease(document_id):
+            await db.documents.update_one(
+                {"document_id": document_id},
+                {"$set": update_data, "$inc": {"version": 1}}
+            )
+            removed = await page_store.replace(document_id, current_user.user_id, new_pages)
+            # Drop image references of pages that are no longer part of the document,
+            # and of roles whose URL the client cleared or changed
+            if blob_store:
+                await blob_store.release_pages(document_id, removed)
+                await blob_store.sync_refs(current_user.user_id, document_id, new_pages)
+        await sync_log.pages_changed(
+            current_user.user_id, document_id, [page["page_id"] for page in new_pages], removed
+        )
+    else:
+        await db.documents.update_one(
+            {"document_id": document_id},
+            {"$set": update_data, "$inc": {"version": 1}}
+        )
+        await sync_log.documents_changed(current_user.user_id, [document_id])
     
-    updated_doc = await db.documents.find_one({"document_id": document_id}, {"_id": 0})
-    return Document(**updated_doc)
+    updated_doc = await db.documents.find_one({"document_id": document_id}, DOCUMENT_PROJECTION)
+    await page_store.attach([updated_doc])
+    return trusted_response(Document, updated_doc)
 
 @api_router.delete("/documents/{document_id}")
 async def delete_document(
@@ -3010,21 +3853,12 @@ async def delete_document(
     # First get the document to check ownership
     document = await db.documents.find_one(
         {"document_id": document_id, "user_id": current_user.user_id},
-        {"_id": 0}
+        {"_id": 0, "document_id": 1}
     )
     
     if not document:
         raise HTTPException(status_code=404, detail="Document not found")
     
-    # Delete files from S3 if S3 is configured
-    if s3_client and AWS_S3_BUCKET_NAME:
-        try:
-            delete_from_s3(current_user.user_id, document_id)
-            logger.info(f"Deleted S3 files for document {document_id}")
-        except Exception as e:
-            logger.error(f"Failed to delete S3 files for document {document_id}: {e}")
-            # Continue with database deletion even if S3 fails
-    
     # Delete from database
     result = await db.documents.delete_one(
         {"document_id": document_id, "user_id": current_user.user_id}
@@ -3032,8 +3866,36 @@ async def delete_document(
     
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Document not found")
+    await page_store.delete_document(document_id)
+    await sync_log.documents_deleted(current_user.user_id, [document_id])
+    
+    # Tombstone and queue S3 cleanup in the background
+    await deletion_worker.tombstone("document", current_user.user_id, document_id)
+    if blob_store:
+        await blob_store.release_document(document_id)
+    job_id = await deletion_worker.enqueue(
+        "document", user_id=current_user.user_id, document_id=document_id,
+        prefixes=[document_prefix(current_user.user_id, document_id)]
+    )
     
-    return {"message": "Document deleted successfully"}
+    return {"message": "Document deleted successfully", "storage_cleanup_job_id": job_id}
+
+@api_router.get("/deletion-jobs/{job_id}")
+async def get_deletion_job(
+    job_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    """Progress of a background storage cleanup started by one of the user's deletes"""
+    job = await deletion_worker.get_job(job_id)
+    if not job or job.get("user_id") != current_user.user_id:
+        raise HTTPException(status_code=404, detail="Deletion job not found")
+    return {
+        "job_id": job["job_id"],
+        "status": job["status"],
+        "deleted_objects": job["deleted_objects"],
+        "attempts": job["attempts"],
+        "completed_at": job.get("completed_at"),
+    }
 
 @api_router.get("/documents/{document_id}/pdf")
 async def download_document_as_pdf(
@@ -3045,18 +3907,18 @@ async def download_document_as_pdf(
     from io import BytesIO
     from reportlab.lib.pagesizes import A4
     from reportlab.pdfgen import canvas
-    import requests
     import base64
     
     document = await db.documents.find_one(
         {"document_id": document_id, "user_id": current_user.user_id},
-        {"_id": 0}
+        DOCUMENT_PROJECTION
     )
     
     if not document:
         raise HTTPException(status_code=404, detail="Document not found")
+    await page_store.ensure_split([document])
     
-    pages = document.get("pages", [])
+    pages = await page_store.list_pages(document_id)
     if not pages:
         raise HTTPException(status_code=400, detail="Document has no pages")
     
@@ -3075,19 +3937,19 @@ async def download_document_as_pdf(
                 img_data = base64.b64decode(page["image_base64"])
                 img = Image.open(BytesIO(img_data))
             elif page.get("image_url"):
-                # From URL
-                response = requests.get(page["image_url"], timeout=30)
-                if response.status_code == 200:
-                    img = Image.open(BytesIO(response.content))
+                # From storage (cached)
+                img_data = await read_stored_image(page["image_url"])
+                if img_data:
+                    img = Image.open(BytesIO(img_data))
             elif page.get("thumbnail_base64"):
                 # Fallback to thumbnail
                 img_data = base64.b64decode(page["thumbnail_base64"])
                 img = Image.open(BytesIO(img_data))
             elif page.get("thumbnail_url"):
                 # From thumbnail URL
-                response = requests.get(page["thumbnail_url"], timeout=30)
-                if response.status_code == 200:
-                    img = Image.open(BytesIO(response.content))
+                img_data = await read_stored_image(page["thumbnail_url"])
+                if img_data:
+                    img = Image.open(BytesIO(img_data))
             
             if img:
                 # Convert to RGB if necessary
@@ -3125,6 +3987,11 @@ async def download_document_as_pdf(
                 from reportlab.lib.utils import ImageReader
                 img_reader = ImageReader(img_buffer)
                 c.drawImage(img_reader, x, y, width=new_width, height=new_height)
+                
+                # Searchable text layer from stored OCR geometry
+                geometry = WordGeometry.from_dict(page.get("ocr_words"))
+                if geometry:
+                    draw_text_layer(c, geometry, x, y, new_width, new_height)
             
             # Add new page if not last
             if i < len(pages) - 1:
@@ -3162,26 +4029,184 @@ async def add_page_to_document(
     """Add a page to an existing document"""
     document = await db.documents.find_one(
         {"document_id": document_id, "user_id": current_user.user_id},
-        {"_id": 0}
+        {"_id": 0, "document_id": 1, "pages_split": 1}
     )
     
     if not document:
         raise HTTPException(status_code=404, detail="Document not found")
+    await page_store.ensure_split([document])
     
     page_dict = page.dict()
-    page_dict["order"] = len(document.get("pages", []))
-    page_dict["thumbnail_base64"] = create_thumbnail(page.image_base64)
+    if page.image_base64:
+        page_dict["thumbnail_base64"] = create_thumbnail(page.image_base64)
+    
+    async with page_lease(document_id):
+        await page_store.append(document_id, current_user.user_id, page_dict)
+        await db.documents.update_one(
+            {"document_id": document_id},
+            {"$set": {"updated_at": datetime.now(timezone.utc)}, "$inc": {"version": 1}}
+        )
+    await sync_log.pages_changed(current_user.user_id, document_id, [page_dict["page_id"]])
+    
+    updated_doc = await db.documents.find_one({"document_id": document_id}, DOCUMENT_PROJECTION)
+    await page_store.attach([updated_doc])
+    return trusted_response(Document, updated_doc)
+
+# ⭐ PAGE PATCH - Edit single pages without rewriting the whole document
+
+class PageOperation(BaseModel):
+    op: str  # reorder, insert, delete, replace, rotate, set_filter (see page_patch.py)
+    page_id: Optional[str] = None
+    order: Optional[List[str]] = None   # reorder: every page_id in the new order
+    index: Optional[int] = None         # insert: position, default end
+    page: Optional[PageData] = None     # insert / replace: the new page image
+    degrees: Optional[int] = None       # rotate: clockwise, multiple of 90
+    filter: Optional[str] = None        # set_filter: original, grayscale, bw, enhanced, document
+
+class PagePatchRequest(BaseModel):
+    operations: List[PageOperation]
+    base_version: Optional[int] = None  # 409 if the document changed since this version
+
+def apply_page_steps(
+    original: Optional[str], current: str, filter_applied: str, steps: List[Tuple[str, Any]]
+) -> Tuple[str, Optional[str]]:
+    """Run rotate / filter steps on one page (image pool). Returns (image, original)."""
+    return render_page(original, current, filter_applied, steps, rotate_image, apply_image_filter)
+
+async def restore_page_refs(user_id: str, document_id: str, page_ids: List[str]) -> None:
+    """Make the blob refs of `page_ids` match the stored pages again after a failed write"""
+    if not blob_store or not page_ids:
+        return
+    stored = await db.pages.find(
+        {"document_id": document_id, "page_id": {"$in": page_ids}},
+        {"_id": 0, "page_id": 1, **{field: 1 for field in BLOB_ROLE_URLS.values()}}
+    ).to_list(None)
+    await blob_store.sync_refs(user_id, document_id, stored)
+    # Inserted pages that were never written
+    missing = set(page_ids) - {page["page_id"] for page in stored}
+    await blob_store.release_pages(document_id, [page_id for page_id in page_ids if page_id in missing])
+
+@api_router.patch("/documents/{document_id}/pages", response_model=Document)
+async def patch_document_pages(
+    document_id: str,
+    patch: PagePatchRequest,
+    include_images: bool = True,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Apply page operations (reorder, insert, delete, replace, rotate, set_filter).
+    Only inserted, replaced, rotated or filtered pages are re-encoded and
+    re-thumbnailed; moved pages only get a new order. The patch is rejected
+    before anything is written if any operation does not apply. Returns the
+    document at its new version.
+    """
+    document = await db.documents.find_one(
+        {"document_id": document_id, "user_id": current_user.user_id},
+        DOCUMENT_PROJECTION
+    )
+    if not document:
+        raise HTTPException(status_code=404, detail="Document not found")
+    await page_store.ensure_split([document])
     
-    await db.documents.update_one(
-        {"document_id": document_id},
-        {
-            "$push": {"pages": page_dict},
-            "$set": {"updated_at": datetime.now(timezone.utc)}
+    version = document.get("version") or 0
+    if patch.base_version is not None and patch.base_version != version:
+        raise HTTPException(status_code=409, detail="Document has changed")
+    
+    current = await page_store.list_pages(document_id, include_images=False)
+    current_order = {page["page_id"]: index for index, page in enumerate(current)}
+    try:
+        plan = plan_patch(list(current_order), [op.dict() for op in patch.operations])
+    except PagePatchError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    # Check every new image before taking the lease or storing anything
+    for page_id in plan.touched:
+        kind, payload = plan.steps[page_id][0]
+        if kind in ("insert", "replace") and not (payload or {}).get("image_base64"):
+            raise HTTPException(status_code=400, detail=f"'{kind}' needs page.image_base64")
+    
+    semaphore = asyncio.Semaphore(PAGE_PROCESSING_CONCURRENCY)
+    
+    async def build_page(page_id: str) -> dict:
+        steps = plan.steps[page_id]
+        kind, payload = steps[0]
+        async with semaphore:
+            if kind in ("insert", "replace"):
+                page = PageData(**payload)
+                transforms = steps[1:]
+            else:
+                stored = await page_store.get(document_id, page_id)
+                page = PageData(**stored)
+                transforms = steps
+                # Filters are rendered from the unfiltered original (see page_patch.render_page)
+                if not page.original_image_base64 and stored.get("original_image_url"):
+                    data = await read_stored_image(stored["original_image_url"])
+                    if data:
+                        page.original_image_base64 = base64.b64encode(data).decode("utf-8")
+                if not page.image_base64 and not page.original_image_base64:
+                    data = await read_stored_image(stored.get("image_url"))
+                    if not data:
+                        raise HTTPException(status_code=502, detail=f"Image of page {page_id} is not available")
+                    page.image_base64 = base64.b64encode(data).decode("utf-8")
+            
+            if transforms:
+                page.image_base64, page.original_image_base64 = await run_in_image_pool(
+                    apply_page_steps, page.original_image_base64, page.image_base64, page.filter_applied, transforms
+                )
+                for step, value in transforms:
+                    if step == "rotate":
+                        page.rotation = (page.rotation + value) % 360
+                        page.ocr_words = None  # word boxes no longer match the image
+                    else:
+                        page.filter_applied = value
+            # Rebuilt from the new image (and kept original) below
+            page.image_url = page.thumbnail_url = page.thumbnail_base64 = None
+            return await process_new_page(
+                page, plan.order.index(page_id), current_user.user_id, document_id, page_id=page_id
+            )
+    
+    # One page writer at a time per document, at the version we planned against
+    async with page_lease(document_id, version):
+        try:
+            built = {row["page_id"]: row for row in await gather_or_cancel(*(build_page(p) for p in plan.touched))}
+            await page_store.apply_patch(
+                document_id, current_user.user_id, plan.order, built, plan.deleted, current_order
+            )
+        except BaseException:
+            # Built pages already pointed their refs at new images; point them back at what is stored
+            await restore_page_refs(current_user.user_id, document_id, plan.touched)
+            raise
+        
+        by_id = {page["page_id"]: page for page in current}
+        final = [built.get(page_id) or by_id[page_id] for page_id in plan.order]
+        first = final[0] if final else {}
+        update_data = {
+            "page_count": len(final),
+            "thumbnail_url": first.get("thumbnail_url") or first.get("image_url"),
+            "updated_at": datetime.now(timezone.utc),
         }
-    )
+        full_text = " ".join(page["ocr_text"] for page in final if page.get("ocr_text"))
+        if full_text != (document.get("ocr_full_text") or ""):
+            update_data["ocr_full_text"] = full_text or None
+            update_data.update(search_fields(document.get("name"), full_text))
+        
+        # Commit: new version, return the new document
+        updated_doc = await db.documents.find_one_and_update(
+            {"document_id": document_id},
+            {"$set": update_data, "$inc": {"version": 1}},
+            projection=DOCUMENT_PROJECTION,
+            return_document=ReturnDocument.AFTER
+        )
+        if blob_store:
+            await blob_store.release_pages(document_id, plan.deleted)
+            # Rebuilt pages that fell back to base64 or dropped their original
+            await blob_store.sync_refs(current_user.user_id, document_id, built.values())
+    # Rebuilt pages plus pages that only moved
+    changed = [page_id for index, page_id in enumerate(plan.order) if page_id in built or current_order.get(page_id) != index]
+    await sync_log.pages_changed(current_user.user_id, document_id, changed, plan.deleted)
     
-    updated_doc = await db.documents.find_one({"document_id": document_id}, {"_id": 0})
-    return Document(**updated_doc)
+    await page_store.attach([updated_doc], include_images)
+    return trusted_response(Document, updated_doc)
 
 # ==================== FOLDER ENDPOINTS ====================
 
@@ -3190,16 +4215,24 @@ async def create_folder(
     folder_data: FolderCreate,
     current_user: User = Depends(get_current_user)
 ):
-    """Create a new folder"""
+    """Create a new folder, at the top level or inside parent_id"""
     folder_id = f"folder_{uuid.uuid4().hex[:12]}"
     now = datetime.now(timezone.utc)
+    try:
+        ancestors = await folder_tree.ancestors_for(current_user.user_id, folder_data.parent_id)
+    except FolderNotFound:
+        raise HTTPException(status_code=404, detail="Parent folder not found")
+    except FolderTreeError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
     folder = {
         "folder_id": folder_id,
         "user_id": current_user.user_id,
         "name": folder_data.name,
         "color": folder_data.color,
-        "parent_id": folder_data.parent_id,
+        "parent_id": folder_data.parent_id or None,
+        "ancestors": ancestors,
+        "depth": len(ancestors),
         "is_protected": False,
         "password_hash": None,
         "created_at": now
@@ -3207,31 +4240,61 @@ async def create_folder(
     
     await db.folders.insert_one(folder)
     folder.pop("_id", None)
+    await sync_log.folders_changed(current_user.user_id, [folder_id])
     return Folder(**folder)
 
 @api_router.get("/folders")
-async def get_folders(current_user: User = Depends(get_current_user)):
-    """Get all folders for current user with document counts"""
-    folders = await db.folders.find(
-        {"user_id": current_user.user_id},
-        {"_id": 0}
-    ).to_list(1000)
-    
-    # Add document count to each folder
-    result_folders = []
-    for f in folders:
-        folder_obj = Folder(**f)
-        # Count documents in this folder
-        doc_count = await db.documents.count_documents({
-            "user_id": current_user.user_id,
-            "folder_id": folder_obj.folder_id
-        })
-        # Convert to dict and add document_count
-        folder_dict = folder_obj.model_dump()
-        folder_dict["document_count"] = doc_count
-        result_folders.append(folder_dict)
-    
-    return result_folders
+async def get_folders(request: Request, response: Response, current_user: User = Depends(get_current_user)):
+    """Get all folders for current user with document counts (ETag: 304 when unchanged)"""
+    # Folder and document changes both advance the sync sequence
+    etag = make_etag("folders", await sync_log.current_seq(current_user.user_id))
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+    set_cache_headers(response, etag)
+    
+    # Folders and all their document counts in one round trip (see folders.py)
+    folders = await list_folders(db, current_user.user_id)
+    return [
+        {
+            **shape(Folder, folder),
+            "document_count": folder["document_count"],
+            "total_document_count": folder["total_document_count"],
+        }
+        for folder in folders
+    ]
+
+@api_router.get("/folders/{folder_id}/subtree")
+async def get_folder_subtree(folder_id: str, current_user: User = Depends(get_current_user)):
+    """A folder with every folder below it, and the number of documents in all of them"""
+    try:
+        folders, document_count = await folder_tree.subtree(current_user.user_id, folder_id)
+    except FolderNotFound:
+        raise HTTPException(status_code=404, detail="Folder not found")
+    return {"folders": [shape(Folder, folder) for folder in folders], "document_count": document_count}
+
+class FolderMove(BaseModel):
+    parent_id: Optional[str] = None  # None moves the folder to the top level
+
+@api_router.post("/folders/{folder_id}/move", response_model=Folder)
+async def move_folder(
+    folder_id: str,
+    move: FolderMove,
+    current_user: User = Depends(get_current_user)
+):
+    """Move a folder, with everything below it, into another folder"""
+    try:
+        moved = await folder_tree.move(current_user.user_id, folder_id, move.parent_id or None)
+    except FolderNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except FolderConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except FolderTreeError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if moved:
+        await sync_log.folders_changed(current_user.user_id, moved)
+    folder = await db.folders.find_one({"folder_id": folder_id}, {"_id": 0})
+    return Folder(**folder)
 
 class FolderUpdate(BaseModel):
     name: Optional[str] = None
@@ -3271,6 +4334,7 @@ async def update_folder(
     
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Folder not found")
+    await sync_log.folders_changed(current_user.user_id, [folder_id])
     
     folder = await db.folders.find_one(
         {"folder_id": folder_id},
@@ -3314,19 +4378,14 @@ async def delete_folder(
     folder_id: str,
     current_user: User = Depends(get_current_user)
 ):
-    """Delete a folder"""
-    result = await db.folders.delete_one(
-        {"folder_id": folder_id, "user_id": current_user.user_id}
-    )
-    
-    if result.deleted_count == 0:
+    """Delete a folder and its subfolders; their documents move to the folder's parent"""
+    try:
+        deleted, moved = await folder_tree.delete(current_user.user_id, folder_id)
+    except FolderNotFound:
         raise HTTPException(status_code=404, detail="Folder not found")
     
-    # Move documents to root
-    await db.documents.update_many(
-        {"folder_id": folder_id, "user_id": current_user.user_id},
-        {"$set": {"folder_id": None}}
-    )
+    await sync_log.documents_changed(current_user.user_id, moved)
+    await sync_log.folders_changed(current_user.user_id, deleted, deleted=True)
     
     return {"message": "Folder deleted successfully"}
 
@@ -4276,74 +5335,165 @@ async def extract_text(
     current_user: User = Depends(get_current_user)
 ):
     """Extract text from image using OpenAI Vision OCR"""
-    # Check OCR usage limits for free users
-    today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
-    is_premium = current_user.subscription_type == "premium"
+    # Count the OCR run (free users: within the daily limit) in one atomic update
+    reservation = await reserve(
+        db, OCR_QUOTA, current_user.user_id, unlimited=has_unlimited_scans(current_user)
+    )
+    if not reservation.granted:
+        raise HTTPException(status_code=429, detail=reservation.message)
+    auth_cache.invalidate_user(current_user.user_id)
     
-    if not is_premium:
-        if current_user.ocr_usage_date == today and current_user.ocr_usage_today >= 5:
-            raise HTTPException(
-                status_code=429,
-                detail="Daily OCR limit reached. Upgrade to Premium for unlimited OCR."
+    # Perform actual OCR (Tesseract), keeping word boxes; a run that fails is not counted
+    try:
+        extracted_text, geometry = await perform_ocr_with_geometry(ocr_request.image_base64)
+    except OCRError as e:
+        await release(db, OCR_QUOTA, current_user.user_id, reservation)
+        auth_cache.invalidate_user(current_user.user_id)
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    words = geometry.to_dict() if geometry else None
+    
+    # Store text and geometry with the page so search/export can reuse them
+    if ocr_request.document_id and ocr_request.page_id and geometry:
+        try:
+            await save_page_ocr(
+                ocr_request.document_id,
+                current_user.user_id,
+                ocr_request.page_id,
+                extracted_text,
+                words
             )
-    
-    # Update OCR usage
-    if current_user.ocr_usage_date == today:
-        await db.users.update_one(
-            {"user_id": current_user.user_id},
-            {"$inc": {"ocr_usage_today": 1}}
-        )
-    else:
-        await db.users.update_one(
-            {"user_id": current_user.user_id},
-            {"$set": {"ocr_usage_today": 1, "ocr_usage_date": today}}
-        )
-    
-    # Perform actual OCR using Emergent LLM
-    extracted_text = await perform_ocr_with_openai(ocr_request.image_base64)
+        except HTTPException as e:
+            # The page is being edited: the device still gets the text and can save it later
+            logger.warning(f"⚠️ OCR for page {ocr_request.page_id} not saved: {e.detail}")
     
     return OCRResponse(
         text=extracted_text,
-        confidence=0.95
+        confidence=geometry.mean_confidence() if geometry else None,
+        words=words
+    )
+
+async def save_page_ocr(
+    document_id: str,
+    user_id: str,
+    page_id: str,
+    ocr_text: str,
+    ocr_words: Optional[Dict[str, Any]] = None
+) -> Optional[str]:
+    """Store OCR text and word geometry on one page and refresh ocr_full_text.
+    
+    Returns the new full text, or None if the document/page was not found.
+    Raises 409 while another writer holds the document's page lease.
+    """
+    document = await db.documents.find_one(
+        {"document_id": document_id, "user_id": user_id},
+        {"_id": 0, "document_id": 1, "name": 1, "pages_split": 1}
     )
+    if not document:
+        return None
+    await page_store.ensure_split([document])
+    
+    async with page_lease(document_id):
+        if not await page_store.update(document_id, page_id, {"ocr_text": ocr_text, "ocr_words": ocr_words}):
+            return None
+        
+        texts = await db.pages.find(
+            {"document_id": document_id, "ocr_text": {"$nin": [None, ""]}},
+            {"_id": 0, "ocr_text": 1}
+        ).sort("order", 1).to_list(None)
+        full_text = " ".join(p["ocr_text"] for p in texts)
+        await db.documents.update_one(
+            {"document_id": document_id},
+            {"$set": {
+                "ocr_full_text": full_text,
+                **search_fields(document.get("name"), full_text),
+                "updated_at": datetime.now(timezone.utc)
+            }}
+        )
+    await sync_log.pages_changed(user_id, document_id, [page_id])
+    return full_text
 
 @api_router.post("/documents/{document_id}/ocr")
 async def run_document_ocr(
     document_id: str,
     ocr_text: str,
     page_index: int = 0,
+    ocr_words: Optional[Dict[str, Any]] = Body(None),
     current_user: User = Depends(get_current_user)
 ):
-    """Save OCR text for a document page (text extracted on device)"""
+    """Save OCR text for a document page (text extracted on device)
+    
+    Devices that have word boxes can send them in the body using the
+    format from ocr_geometry.py. Without it, stale geometry is cleared.
+    """
     document = await db.documents.find_one(
         {"document_id": document_id, "user_id": current_user.user_id},
-        {"_id": 0}
+        {"_id": 0, "document_id": 1, "pages_split": 1}
     )
     
     if not document:
         raise HTTPException(status_code=404, detail="Document not found")
+    await page_store.ensure_split([document])
     
-    pages = document.get("pages", [])
-    if page_index >= len(pages):
+    page = await db.pages.find_one(
+        {"document_id": document_id, "order": page_index},
+        {"_id": 0, "page_id": 1}
+    ) if page_index >= 0 else None
+    if not page:
         raise HTTPException(status_code=400, detail="Invalid page index")
     
-    # Update page OCR text
-    pages[page_index]["ocr_text"] = ocr_text
+    if ocr_words is not None and WordGeometry.from_dict(ocr_words) is None:
+        raise HTTPException(status_code=400, detail="Invalid OCR word geometry")
     
-    # Update full document OCR text
-    full_text = " ".join([p.get("ocr_text", "") for p in pages if p.get("ocr_text")])
-    
-    await db.documents.update_one(
-        {"document_id": document_id},
-        {"$set": {
-            "pages": pages,
-            "ocr_full_text": full_text,
-            "updated_at": datetime.now(timezone.utc)
-        }}
+    full_text = await save_page_ocr(
+        document_id,
+        current_user.user_id,
+        page["page_id"],
+        ocr_text,
+        ocr_words
     )
     
     return {"message": "OCR text saved successfully", "full_text": full_text}
 
+@api_router.get("/documents/{document_id}/search")
+async def search_document_pages(
+    document_id: str,
+    q: str,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Find a word or phrase inside a document using stored OCR geometry.
+    Returns highlight boxes per page as [x, y, w, h] fractions of the page image.
+    """
+    document = await db.documents.find_one(
+        {"document_id": document_id, "user_id": current_user.user_id},
+        {"_id": 0, "document_id": 1, "pages_split": 1}
+    )
+    
+    if not document:
+        raise HTTPException(status_code=404, detail="Document not found")
+    await page_store.ensure_split([document])
+    
+    pages = await db.pages.find(
+        {"document_id": document_id, "ocr_words": {"$ne": None}},
+        {"_id": 0, "page_id": 1, "order": 1, "ocr_words": 1}
+    ).sort("order", 1).to_list(None)
+    
+    results = []
+    for page in pages:
+        index = page.get("order", 0)
+        geometry = WordGeometry.from_dict(page.get("ocr_words"))
+        if not geometry:
+            continue
+        hits = geometry.find(q)
+        if hits:
+            results.append({
+                "page_id": page.get("page_id"),
+                "page_index": index,
+                "hits": [geometry.normalized_boxes(hit) for hit in hits]
+            })
+    
+    return {"query": q, "pages": results}
+
 # ==================== SIGNATURE ENDPOINTS ====================
 
 class SignatureOverlayRequest(BaseModel):
@@ -5010,8 +6160,16 @@ async def export_public_pdf(request: PublicExportRequest):
             "message": f"Export failed: {str(e)}"
         }
 
-def create_pdf_from_images(images_base64: List[str], include_text: List[str] = None) -> bytes:
-    """Create a PDF from base64 images"""
+def create_pdf_from_images(
+    images_base64: List[str],
+    include_text: List[str] = None,
+    text_layers: List[Optional[WordGeometry]] = None
+) -> bytes:
+    """Create a PDF from base64 images
+    
+    text_layers: optional stored OCR geometry per image; when present an
+    invisible text layer is added so the PDF is searchable.
+    """
     from reportlab.lib.pagesizes import A4
     from reportlab.pdfgen import canvas
     from reportlab.lib.utils import ImageReader
@@ -5047,6 +6205,10 @@ def create_pdf_from_images(images_base64: List[str], include_text: List[str] = N
         
         c.drawImage(ImageReader(img_buffer), x, y, new_width, new_height)
         
+        # Searchable text layer from stored OCR geometry
+        if text_layers and i < len(text_layers) and text_layers[i]:
+            draw_text_layer(c, text_layers[i], x, y, new_width, new_height)
+        
         # Add OCR text if available
         if include_text and i < len(include_text) and include_text[i]:
             c.setFont("Helvetica", 8)
@@ -5124,17 +6286,22 @@ async def export_document(
     """Export document in various formats"""
     document = await db.documents.find_one(
         {"document_id": document_id, "user_id": current_user.user_id},
-        {"_id": 0}
+        DOCUMENT_PROJECTION
     )
     
     if not document:
         raise HTTPException(status_code=404, detail="Document not found")
-    
-    pages = document.get("pages", [])
-    page_indices = export_request.page_indices or list(range(len(pages)))
-    
-    # Filter pages
-    selected_pages = [pages[i] for i in page_indices if i < len(pages)]
+    await page_store.ensure_split([document])
+    
+    # Only load the images of the selected pages
+    page_filter = {"document_id": document_id}
+    if export_request.page_indices:
+        page_filter["order"] = {"$in": export_request.page_indices}
+    selected_pages = await db.pages.find(page_filter, {"_id": 0}).sort("order", 1).to_list(None)
+    if export_request.page_indices:
+        # Keep the requested order
+        by_order = {page["order"]: page for page in selected_pages}
+        selected_pages = [by_order[i] for i in export_request.page_indices if i in by_order]
     
     if not selected_pages:
         raise HTTPException(status_code=400, detail="No pages to export")
@@ -5154,38 +6321,11 @@ async def export_document(
             if len(img_data) > 100:  # Should be more than 100 chars for a real image
                 return img_data
         
-        # Otherwise download from S3 URL
-        if page.get("image_url") and s3_client:
-            try:
-                import urllib.parse
-                import httpx
-                
-                url = page["image_url"]
-                logger.info(f"Downloading image from S3 URL: {url[:100]}...")
-                
-                # Try direct HTTP download first (simpler and works with pre-signed URLs)
-                async with httpx.AsyncClient() as client:
-                    response = await client.get(url, timeout=30.0)
-                    if response.status_code == 200:
-                        image_data = response.content
-                        logger.info(f"Downloaded {len(image_data)} bytes from S3")
-                        return base64.b64encode(image_data).decode('utf-8')
-                    else:
-                        logger.error(f"HTTP download failed: {response.status_code}")
-                
-                # Fallback to S3 SDK
-                parsed = urllib.parse.urlparse(url)
-                key = parsed.path.lstrip('/')
-                
-                # Download from S3
-                response = s3_client.get_object(Bucket=AWS_S3_BUCKET_NAME, Key=key)
-                image_data = response['Body'].read()
-                logger.info(f"Downloaded {len(image_data)} bytes from S3 SDK")
+        # Otherwise read from storage (through the disk cache)
+        if page.get("image_url"):
+            image_data = await read_stored_image(page["image_url"])
+            if image_data:
                 return base64.b64encode(image_data).decode('utf-8')
-            except Exception as e:
-                logger.error(f"Failed to download image from S3: {e}")
-                import traceback
-                traceback.print_exc()
         
         logger.error(f"No image data found for page. Has base64: {bool(page.get('image_base64'))}, Has URL: {bool(page.get('image_url'))}")
         return ""
@@ -5204,8 +6344,9 @@ async def export_document(
                 images.append(img_data)
             
             texts = [p.get("ocr_text", "") for p in selected_pages] if export_request.include_ocr else None
+            layers = [WordGeometry.from_dict(p.get("ocr_words")) for p in selected_pages]
             
-            pdf_bytes = create_pdf_from_images(images, texts)
+            pdf_bytes = create_pdf_from_images(images, texts, layers)
             
             return ExportResponse(
                 file_base64=base64.b64encode(pdf_bytes).decode(),
@@ -5327,6 +6468,9 @@ app.add_middleware(
 # Add security headers middleware (runs after CORS)
 app.add_middleware(SecurityHeadersMiddleware)
 
+# Outermost: br/gzip for large text and JSON responses
+app.add_middleware(CompressionMiddleware)
+
 @app.on_event("startup")
 async def startup_db_client():
     """Initialize MongoDB collections on startup"""
@@ -5339,43 +6483,26 @@ async def startup_db_client():
         existing_collections = await db.list_collection_names()
         logger.info(f"📋 Existing collections: {existing_collections}")
         
-        # Define required collections with their indexes
-        required_collections = {
-            'users': [
-                ('user_id', True),  # (field, unique)
-                ('email', True),
-            ],
-            'documents': [
-                ('document_id', True),
-                ('user_id', False),
-            ],
-            'folders': [
-                ('folder_id', True),
-                ('user_id', False),
-            ],
-            'signatures': [
-                ('signature_id', True),
-                ('user_id', False),
-            ],
-        }
-        
-        for collection_name, indexes in required_collections.items():
-            if collection_name not in existing_collections:
-                # Create collection
-                await db.create_collection(collection_name)
-                logger.info(f"✅ Created collection: {collection_name}")
-            
-            # Create indexes
-            collection = db[collection_name]
-            for field, unique in indexes:
-                try:
-                    await collection.create_index(field, unique=unique)
-                    logger.info(f"  📌 Index on {collection_name}.{field} (unique={unique})")
-                except Exception as idx_err:
-                    logger.warning(f"  ⚠️ Index {field} might already exist: {idx_err}")
+        # Indexes are declared in indexes.py and built in the background
+        start_index_build(db)
         
         logger.info("✅ MongoDB collections initialized successfully")
         
+        # Resume storage cleanup left over from previous runs
+        deletion_worker.start()
+        if object_storage:
+            upload_sweeper.start()
+        bulk_jobs.start()
+        if blob_store:
+            blob_store.start()
+        await page_storage_migrator.resume_if_running()
+        # Move pages of documents created before the pages collection existed
+        page_store.start()
+        storage_usage.start()
+        folder_tree.start()
+        document_search.start()
+        sync_log.start()
+        
         # Initialize content management collections (languages, translations, legal pages)
         await init_content_collections()
         
@@ -5395,7 +6522,21 @@ async def startup_db_client():
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    await deletion_worker.stop()
+    await upload_sweeper.stop()
+    await bulk_jobs.stop()
+    if blob_store:
+        await blob_store.stop()
+    await page_storage_migrator.stop()
+    await page_store.stop()
+    await storage_usage.stop()
+    await folder_tree.stop()
+    await document_search.stop()
+    await sync_log.stop()
     client.close()
+    if object_storage:
+        object_storage.close()
+    image_executor.shutdown(wait=False)
 
 
 # ==================== CONTENT MANAGEMENT & TRANSLATIONS ====================
@@ -6689,9 +7830,19 @@ async def get_languages():
 
 
 @api_router.get("/content/translations/{language_code}")
-async def get_translations(language_code: str):
-    """Get all translations for a language"""
+async def get_translations(language_code: str, request: Request, response: Response):
+    """Get all translations for a language (ETag from the stored updated_at)"""
     try:
+        # Version of whichever row will answer: the language itself or the English fallback
+        version_fields = {"_id": 0, "language_code": 1, "updated_at": 1}
+        source = await db.translations.find_one({"language_code": language_code}, version_fields) \
+            or await db.translations.find_one({"language_code": "en"}, version_fields)
+        etag = make_etag("content-translations", language_code, source, DEFAULT_TRANSLATIONS_ETAG)
+        cached = not_modified(request, etag, PUBLIC)
+        if cached:
+            return cached
+        set_cache_headers(response, etag, PUBLIC)
+        
         trans = await db.translations.find_one(
             {"language_code": language_code},
             {"_id": 0}
@@ -6728,6 +7879,7 @@ async def get_translations(language_code: str):
         
     except Exception as e:
         logger.error(f"Error fetching translations: {e}")
+        set_uncacheable(response)
         return {
             "language_code": language_code,
             "translations": DEFAULT_TRANSLATIONS,
@@ -7603,14 +8755,9 @@ async def get_admin_stats(admin: dict = Depends(get_admin_user)):
         week_ago = datetime.now(timezone.utc) - timedelta(days=7)
         new_users_week = await db.users.count_documents({"created_at": {"$gte": week_ago.isoformat()}})
         
-        # Calculate storage (approximate)
-        pipeline = [
-            {"$unwind": "$pages"},
-            {"$group": {"_id": None, "total_pages": {"$sum": 1}}}
-        ]
-        page_count_result = await db.documents.aggregate(pipeline).to_list(1)
-        total_pages = page_count_result[0]["total_pages"] if page_count_result else 0
-        storage_mb = total_pages * 0.5  # Estimate ~500KB per page
+        # Storage: maintained counters (see storage_usage.py), no page scan
+        storage = await storage_usage.totals()
+        storage_mb = storage["bytes"] / (1024 * 1024)
         
         # User growth data (last 30 days)
         user_growth = []
@@ -7641,6 +8788,8 @@ async def get_admin_stats(admin: dict = Depends(get_admin_user)):
             "total_users": total_users,
             "total_documents": total_documents,
             "storage_used": f"{storage_mb:.1f} MB",
+            "storage_bytes": storage["bytes"],
+            "total_pages": storage["pages"],
             "new_users_week": new_users_week,
             "users_change": f"+{new_users_week}" if new_users_week > 0 else "0",
             "docs_change": "+0%",
@@ -7671,8 +8820,8 @@ async def get_admin_users(
         
         if search:
             query["$or"] = [
-                {"email": {"$regex": search, "$options": "i"}},
-                {"name": {"$regex": search, "$options": "i"}}
+                {"email": {"$regex": re.escape(search), "$options": "i"}},
+                {"name": {"$regex": re.escape(search), "$options": "i"}}
             ]
         
         if filter == "premium":
@@ -7718,6 +8867,9 @@ async def get_admin_user_detail(user_id: str, admin: dict = Depends(get_admin_us
         
         # Add document and usage counts
         user["document_count"] = await db.documents.count_documents({"user_id": user_id})
+        storage = await storage_usage.get(user_id)
+        user["storage_bytes"] = storage["bytes"]
+        user["page_count"] = storage["pages"]
         
         # Check if user has password set (for OAuth users)
         full_user = await db.users.find_one({"user_id": user_id})
@@ -7739,15 +8891,10 @@ async def get_admin_user_detail(user_id: str, admin: dict = Depends(get_admin_us
 async def delete_admin_user(user_id: str, admin: dict = Depends(get_admin_user)):
     """Delete a user and all their data"""
     try:
-        # Delete user's documents from S3
-        if s3_client:
-            try:
-                delete_from_s3(user_id, "all")
-            except Exception as s3_err:
-                logger.warning(f"S3 cleanup failed: {s3_err}")
-        
         # Delete documents
         await db.documents.delete_many({"user_id": user_id})
+        await page_store.delete_user(user_id)
+        await sync_log.delete_user(user_id)
         
         # Delete folders
         await db.folders.delete_many({"user_id": user_id})
@@ -7757,11 +8904,20 @@ async def delete_admin_user(user_id: str, admin: dict = Depends(get_admin_user))
         
         # Delete user
         result = await db.users.delete_one({"user_id": user_id})
+        auth_cache.invalidate_user(user_id)
         
         if result.deleted_count == 0:
             raise HTTPException(status_code=404, detail="User not found")
         
-        return {"message": "User deleted successfully"}
+        # Tombstone and queue S3 cleanup for everything under the user's prefix
+        await deletion_worker.tombstone("user", user_id, deleted_by="admin")
+        if blob_store:
+            await blob_store.release_user(user_id)
+        job_id = await deletion_worker.enqueue(
+            "user", user_id=user_id, prefixes=[user_prefix(user_id)], keys=[avatar_key(user_id)]
+        )
+        
+        return {"message": "User deleted successfully", "storage_cleanup_job_id": job_id}
     except HTTPException:
         raise
     except Exception as e:
@@ -7824,6 +8980,7 @@ async def update_admin_user(user_id: str, update: AdminUserUpdate, admin: dict =
             {"user_id": user_id},
             {"$set": update_data}
         )
+        auth_cache.invalidate_user(user_id)
         
         # Fetch updated user
         updated_user = await db.users.find_one({"user_id": user_id}, {"_id": 0, "password_hash": 0})
@@ -7850,21 +9007,28 @@ async def get_admin_documents(
         query = {}
         
         if search:
-            query["name"] = {"$regex": search, "$options": "i"}
+            query["name"] = {"$regex": re.escape(search), "$options": "i"}
         
-        documents = await db.documents.find(query, {"_id": 0}).sort("created_at", -1).limit(limit).to_list(limit)
+        documents = await db.documents.find(query, DOCUMENT_PROJECTION).sort("created_at", -1).limit(limit).to_list(limit)
+        await page_store.ensure_split(documents)
+        
+        # First page of each document only (metadata, no image payloads)
+        first_pages = {}
+        async for page in db.pages.find(
+            {"document_id": {"$in": [doc["document_id"] for doc in documents]}, "order": 0},
+            {"_id": 0, "document_id": 1, "thumbnail_url": 1, "image_url": 1}
+        ):
+            first_pages[page["document_id"]] = page
         
         # Add user email and page count
         for doc in documents:
             user = await db.users.find_one({"user_id": doc.get("user_id")}, {"email": 1})
             doc["user_email"] = user.get("email") if user else "Unknown"
-            doc["page_count"] = len(doc.get("pages", []))
+            doc["page_count"] = doc.get("page_count", 0)
             # Get thumbnail from first page
-            if doc.get("pages") and len(doc["pages"]) > 0:
-                first_page = doc["pages"][0]
+            first_page = first_pages.get(doc["document_id"])
+            if first_page:
                 doc["thumbnail_url"] = first_page.get("thumbnail_url") or first_page.get("image_url")
-            # Remove full page data to reduce response size
-            doc.pop("pages", None)
         
         return {"documents": documents}
     except Exception as e:
@@ -7875,9 +9039,10 @@ async def get_admin_documents(
 async def get_admin_document_detail(document_id: str, admin: dict = Depends(get_admin_user)):
     """Get document details with pages for admin preview"""
     try:
-        doc = await db.documents.find_one({"document_id": document_id}, {"_id": 0})
+        doc = await db.documents.find_one({"document_id": document_id}, DOCUMENT_PROJECTION)
         if not doc:
             raise HTTPException(status_code=404, detail="Document not found")
+        await page_store.attach([doc])
         
         # Get user email
         user = await db.users.find_one({"user_id": doc.get("user_id")}, {"email": 1})
@@ -7898,6 +9063,76 @@ async def get_admin_document_detail(document_id: str, admin: dict = Depends(get_
         logger.error(f"Get document detail error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@api_router.get("/admin/deletion-jobs")
+async def get_admin_deletion_jobs(
+    status: Optional[str] = None,
+    limit: int = 50,
+    admin: dict = Depends(get_admin_user)
+):
+    """Background storage cleanup jobs, newest first"""
+    query = {"status": status} if status else {}
+    jobs = await db.deletion_jobs.find(query, {"_id": 0}).sort("created_at", -1).limit(min(limit, 200)).to_list(None)
+    counts = {}
+    async for row in db.deletion_jobs.aggregate([{"$group": {"_id": "$status", "count": {"$sum": 1}}}]):
+        counts[row["_id"]] = row["count"]
+    return {"jobs": jobs, "counts": counts}
+
+@api_router.get("/admin/image-cache")
+async def get_image_cache_stats(admin: dict = Depends(get_admin_user)):
+    """Disk cache hit rate and bytes saved for stored page image reads"""
+    if not image_cache:
+        return {"enabled": False}
+    return {"enabled": True, **image_cache.stats()}
+
+@api_router.get("/admin/blob-storage")
+async def get_blob_storage_stats(admin: dict = Depends(get_admin_user)):
+    """Deduplicated image storage: blobs, references and bytes saved"""
+    if not blob_store:
+        return {"enabled": False}
+    return {"enabled": True, **(await blob_store.stats())}
+
+@api_router.post("/admin/blob-storage/reconcile")
+async def reconcile_blob_storage(admin: dict = Depends(get_admin_user)):
+    """Recompute blob reference counts from the reference table"""
+    if not blob_store:
+        raise HTTPException(status_code=400, detail="Object storage is not configured")
+    return {"corrected": await blob_store.reconcile()}
+
+@api_router.get("/admin/storage-usage")
+async def get_storage_usage(admin: dict = Depends(get_admin_user)):
+    """Logical bytes and pages stored, in total and for the largest users"""
+    top_users = await db.storage_usage.find(
+        {"user_id": {"$ne": STORAGE_USAGE_GLOBAL}}, {"_id": 0}
+    ).sort("bytes", -1).limit(20).to_list(20)
+    return {**(await storage_usage.totals()), "top_users": top_users}
+
+@api_router.post("/admin/storage-usage/reconcile")
+async def reconcile_storage_usage(admin: dict = Depends(get_admin_user)):
+    """Size pages without recorded sizes and recompute every storage counter from the pages"""
+    return await storage_usage.reconcile()
+
+@api_router.get("/admin/migrations/page-storage")
+async def get_page_storage_migration(admin: dict = Depends(get_admin_user)):
+    """Progress of the base64 -> object storage page migration"""
+    return await page_storage_migrator.status()
+
+@api_router.post("/admin/migrations/page-storage/start")
+async def start_page_storage_migration(
+    images_per_second: float = 5.0,
+    restart: bool = False,
+    admin: dict = Depends(get_admin_user)
+):
+    """Start or resume the migration. restart=true begins again from the first document."""
+    if not object_storage:
+        raise HTTPException(status_code=400, detail="Object storage is not configured")
+    if not 0 < images_per_second <= 100:
+        raise HTTPException(status_code=400, detail="images_per_second must be between 0 and 100")
+    return await page_storage_migrator.start(images_per_second, restart=restart)
+
+@api_router.post("/admin/migrations/page-storage/pause")
+async def pause_page_storage_migration(admin: dict = Depends(get_admin_user)):
+    return await page_storage_migrator.pause()
+
 @api_router.delete("/admin/documents/{document_id}")
 async def delete_admin_document(document_id: str, admin: dict = Depends(get_admin_user)):
     """Delete a document"""
@@ -7906,15 +9141,19 @@ async def delete_admin_document(document_id: str, admin: dict = Depends(get_admi
         if not doc:
             raise HTTPException(status_code=404, detail="Document not found")
         
-        # Delete from S3
-        if s3_client:
-            try:
-                delete_from_s3(doc.get("user_id"), document_id)
-            except Exception as s3_err:
-                logger.warning(f"S3 cleanup failed: {s3_err}")
-        
         # Delete from DB
         await db.documents.delete_one({"document_id": document_id})
+        await page_store.delete_document(document_id)
+        await sync_log.documents_deleted(doc.get("user_id"), [document_id])
+        
+        # Tombstone and queue S3 cleanup in the background
+        await deletion_worker.tombstone("document", doc.get("user_id"), document_id, deleted_by="admin")
+        if blob_store:
+            await blob_store.release_document(document_id)
+        await deletion_worker.enqueue(
+            "document", user_id=doc.get("user_id"), document_id=document_id,
+            prefixes=[document_prefix(doc.get("user_id"), document_id)]
+        )
         
         return {"message": "Document deleted"}
     except HTTPException:
@@ -8348,10 +9587,26 @@ DEFAULT_TRANSLATIONS = {
     }
 }
 
+# Defaults only change with a deploy; hashed once for translation ETags
+DEFAULT_TRANSLATIONS_ETAG = make_etag(DEFAULT_TRANSLATIONS, DEFAULT_TRANSLATIONS_DE, DEFAULT_TRANSLATIONS_TR)
+
+async def localization_etag(request: Request, response: Response, *parts) -> Optional[Response]:
+    """Conditional GET for endpoints built from the `localization` setting and the defaults"""
+    version = await db.settings.find_one({"key": "localization"}, {"_id": 0, "updated_at": 1})
+    etag = make_etag("translations", (version or {}).get("updated_at"), DEFAULT_TRANSLATIONS_ETAG, *parts)
+    cached = not_modified(request, etag, PUBLIC)
+    if not cached:
+        set_cache_headers(response, etag, PUBLIC)
+    return cached
+
 @api_router.get("/translations/{lang}")
-async def get_translations(lang: str):
+async def get_translations(lang: str, request: Request, response: Response):
     """Get translations for a specific language (public endpoint)"""
     try:
+        cached = await localization_etag(request, response, lang)
+        if cached:
+            return cached
+        
         # First check if we have custom translations in the database
         data = await db.settings.find_one({"key": "localization"}, {"_id": 0})
         
@@ -8370,12 +9625,17 @@ async def get_translations(lang: str):
         return {"lang": "en", "translations": DEFAULT_TRANSLATIONS["en"]}
     except Exception as e:
         logger.error(f"Get translations error: {e}")
+        set_uncacheable(response)
         return {"lang": "en", "translations": DEFAULT_TRANSLATIONS["en"]}
 
 @api_router.get("/translations")
-async def get_all_translations():
+async def get_all_translations(request: Request, response: Response):
     """Get all available translations (public endpoint)"""
     try:
+        cached = await localization_etag(request, response)
+        if cached:
+            return cached
+        
         data = await db.settings.find_one({"key": "localization"}, {"_id": 0})
         
         if data and "value" in data:
@@ -8395,6 +9655,7 @@ async def get_all_translations():
         }
     except Exception as e:
         logger.error(f"Get all translations error: {e}")
+        set_uncacheable(response)
         return {
             "languages": ["en"],
             "default_language": "en",
@@ -8636,7 +9897,7 @@ async def save_localization(
     try:
         await db.settings.update_one(
             {"key": "localization"},
-            {"$set": {"key": "localization", "value": data}},
+            {"$set": {"key": "localization", "value": data, "updated_at": datetime.now(timezone.utc)}},
             upsert=True
         )
         return {"message": "Localization saved"}
@@ -8771,23 +10032,16 @@ async def clear_all_documents(admin: dict = Depends(get_admin_user)):
     try:
         # Delete all documents from database
         result = await db.documents.delete_many({})
+        await page_store.delete_all()
+        await sync_log.reset_all()
         deleted_count = result.deleted_count
         
-        # Also try to clear S3 storage (optional, may fail if many files)
-        try:
-            if s3_client and AWS_S3_BUCKET_NAME:
-                # List and delete all objects (up to 1000 at a time)
-                response = s3_client.list_objects_v2(Bucket=AWS_S3_BUCKET_NAME, MaxKeys=1000)
-                if 'Contents' in response:
-                    objects = [{'Key': obj['Key']} for obj in response['Contents']]
-                    if objects:
-                        s3_client.delete_objects(
-                            Bucket=AWS_S3_BUCKET_NAME,
-                            Delete={'Objects': objects}
-                        )
-                        logger.info(f"Deleted {len(objects)} S3 objects")
-        except Exception as s3_error:
-            logger.warning(f"S3 cleanup warning (non-critical): {s3_error}")
+        # Clear S3 storage in the background (1000 keys per batch)
+        await db.blob_refs.delete_many({})
+        await db.blobs.delete_many({})
+        job_id = await deletion_worker.enqueue("purge", prefixes=["users/", "blobs/"])
+        if job_id:
+            logger.info(f"Queued S3 cleanup job {job_id}")
         
         logger.warning(f"⚠️ DANGER ZONE: Cleared {deleted_count} documents from database")
         return {"message": f"Deleted {deleted_count} documents", "deleted_count": deleted_count}
@@ -8802,10 +10056,14 @@ async def reset_database(admin: dict = Depends(get_admin_user)):
         # Collections to clear
         collections_to_clear = [
             "documents",
+            "pages",
             "folders", 
             "signatures",
             "web_access_sessions",
-            "user_sessions"
+            "user_sessions",
+            "blobs",
+            "blob_refs",
+            "storage_usage"
         ]
         
         deleted_counts = {}
@@ -8819,28 +10077,18 @@ async def reset_database(admin: dict = Depends(get_admin_user)):
                 logger.error(f"Error clearing {collection_name}: {col_error}")
                 deleted_counts[collection_name] = f"error: {str(col_error)}"
         
+        await sync_log.reset_all()
+        
         # Reset user documents count but keep users
         await db.users.update_many(
             {},
             {"$set": {"document_count": 0, "ocr_pages_this_month": 0}}
         )
         
-        # Clear S3 bucket
-        try:
-            if s3_client and AWS_S3_BUCKET_NAME:
-                paginator = s3_client.get_paginator('list_objects_v2')
-                for page in paginator.paginate(Bucket=AWS_S3_BUCKET_NAME):
-                    if 'Contents' in page:
-                        objects = [{'Key': obj['Key']} for obj in page['Contents']]
-                        if objects:
-                            s3_client.delete_objects(
-                                Bucket=AWS_S3_BUCKET_NAME,
-                                Delete={'Objects': objects}
-                            )
-                deleted_counts["s3_storage"] = "cleared"
-        except Exception as s3_error:
-            logger.warning(f"S3 cleanup warning: {s3_error}")
-            deleted_counts["s3_storage"] = f"warning: {str(s3_error)}"
+        # Clear S3 bucket in the background
+        job_id = await deletion_worker.enqueue("purge", prefixes=[""])
+        if job_id:
+            deleted_counts["s3_storage"] = f"cleanup queued ({job_id})"
         
         logger.warning(f"⚠️ DANGER ZONE: Database reset completed: {deleted_counts}")
         return {"message": "Database reset completed", "details": deleted_counts}
@@ -8866,8 +10114,8 @@ async def get_system_status(admin: dict = Depends(get_admin_user)):
     
     try:
         # Check S3
-        if s3_client:
-            s3_client.head_bucket(Bucket=AWS_S3_BUCKET_NAME)
+        if object_storage:
+            await object_storage.check()
             status["storage"] = "connected"
     except:
         pass
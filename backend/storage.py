@@ -0,0 +1,612 @@
+"""
+Object Storage
+Pluggable async storage backends for ScanUp page images and avatars.
+
+Backends:
+- S3Storage:        AWS S3 or an S3-compatible endpoint (MinIO, moto server)
+- LocalDiskStorage: files under a local directory (development, offline load tests)
+- MemoryStorage:    in-process dict (tests, benchmarks)
+
+All backends share one interface: single and streaming reads/writes, batch
+deletes, paginated listing, public URLs and presigned upload/download URLs.
+Key layout lives here too (page_key, document_prefix, ...) so call sites
+never build keys or URLs by hand.
+
+S3 note: boto3 is synchronous, so every call runs on a dedicated, bounded
+thread pool sized to the botocore connection pool. Handlers await storage
+calls without stalling the event loop, connections are reused across
+requests, and each operation gets its own timeout on top of botocore's
+adaptive retries.
+"""
+import asyncio
+import hashlib
+import hmac
+import logging
+import os
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+from typing import Any, AsyncIterable, AsyncIterator, Dict, List, Optional
+from urllib.parse import quote, urlparse
+
+import boto3
+from botocore.config import Config as BotoConfig
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger(__name__)
+
+# Seconds allowed per operation (including botocore retries)
+DEFAULT_OPERATION_TIMEOUTS = {
+    "put": 60.0,
+    "get": 60.0,
+    "head": 10.0,
+    "delete": 30.0,
+    "list": 30.0,
+}
+
+# S3 DeleteObjects accepts at most 1000 keys per request
+DELETE_BATCH_SIZE = 1000
+
+# Chunk size for streaming reads and writes
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+
+# ==================== KEY LAYOUT ====================
+
+def user_prefix(user_id: str) -> str:
+    return f"users/{user_id}/"
+
+
+def document_prefix(user_id: str, document_id: str) -> str:
+    return f"users/{user_id}/documents/{document_id}/"
+
+
+def page_key(user_id: str, document_id: str, page_id: str, image_type: str = "page") -> str:
+    """image_type: page, thumbnail or original"""
+    return f"{document_prefix(user_id, document_id)}{image_type}_{page_id}.jpg"
+
+
+def upload_key(user_id: str, upload_id: str, page_id: str) -> str:
+    """Client-writable staging key for a direct upload (see uploads.py)"""
+    return f"{user_prefix(user_id)}uploads/{upload_id}/{page_id}"
+
+
+def avatar_key(user_id: str) -> str:
+    return f"avatars/{user_id}/avatar.jpg"
+
+
+def blob_key(digest: str) -> str:
+    """Content-addressed key for deduplicated page images (see blob_store.py)"""
+    return f"blobs/sha256/{digest[:2]}/{digest}.jpg"
+
+
+# ==================== INTERFACE ====================
+
+class StorageTimeoutError(Exception):
+    """Raised when a storage operation exceeds its timeout"""
+
+
+class ObjectStorage(ABC):
+    """Common interface for all storage backends"""
+
+    # Value recorded in documents.storage_type
+    storage_type = "object"
+
+    @abstractmethod
+    async def put_object(self, key: str, data: bytes, content_type: str = "image/jpeg") -> Optional[str]:
+        """Store bytes. Returns the object's ETag."""
+
+    @abstractmethod
+    async def get_object(self, key: str) -> bytes:
+        """Read a whole object. Raises KeyError if it does not exist."""
+
+    @abstractmethod
+    async def head_object(self, key: str) -> Optional[Dict[str, Any]]:
+        """Object metadata (ContentLength, ContentType, ETag), or None if missing"""
+
+    @abstractmethod
+    async def delete_objects(self, keys: List[str]) -> List[str]:
+        """Delete many keys. Returns keys that failed."""
+
+    @abstractmethod
+    def iter_keys(self, prefix: str = "", page_size: int = 1000) -> AsyncIterator[List[str]]:
+        """Yield pages of keys under a prefix"""
+
+    @abstractmethod
+    def public_url(self, key: str) -> str:
+        """URL stored on pages and handed to clients"""
+
+    @abstractmethod
+    def presigned_put_url(self, key: str, content_type: str = "image/jpeg", expires_in: int = 900) -> str:
+        """URL a client can PUT the object to directly"""
+
+    @abstractmethod
+    def presigned_get_url(self, key: str, expires_in: int = 3600) -> str:
+        """Time-limited download URL"""
+
+    async def put_stream(self, key: str, chunks: AsyncIterable[bytes], content_type: str = "image/jpeg") -> Optional[str]:
+        """Store an object from an async stream of chunks"""
+        parts = [chunk async for chunk in chunks]
+        return await self.put_object(key, b"".join(parts), content_type)
+
+    async def open_stream(self, key: str, chunk_size: int = STREAM_CHUNK_SIZE) -> AsyncIterator[bytes]:
+        """Read an object as an async stream of chunks"""
+        data = await self.get_object(key)
+        for start in range(0, len(data), chunk_size):
+            yield data[start:start + chunk_size]
+
+    async def delete_object(self, key: str) -> None:
+        await self.delete_objects([key])
+
+    async def delete_prefix(self, prefix: str) -> int:
+        """Delete everything under a prefix, page by page. Returns the number of keys deleted."""
+        deleted = 0
+        async for keys in self.iter_keys(prefix):
+            failed = await self.delete_objects(keys)
+            deleted += len(keys) - len(failed)
+        return deleted
+
+    async def get_many(self, keys: List[str], concurrency: int = 8) -> Dict[str, Optional[bytes]]:
+        """Read several objects concurrently. Missing objects map to None."""
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def _get(key: str) -> Optional[bytes]:
+            async with semaphore:
+                try:
+                    return await self.get_object(key)
+                except KeyError:
+                    return None
+
+        results = await asyncio.gather(*(_get(key) for key in keys))
+        return dict(zip(keys, results))
+
+    async def check(self) -> None:
+        """Health check. Raises if the backend is unreachable."""
+
+    def key_from_url(self, url: Optional[str]) -> Optional[str]:
+        """Reverse of public_url(). Returns None for URLs of other stores."""
+        if not url:
+            return None
+        base = self.public_url("")
+        if url.startswith(base):
+            return url[len(base):].split("?", 1)[0] or None
+        return None
+
+    def close(self) -> None:
+        pass
+
+
+# ==================== S3 ====================
+
+class S3Storage(ObjectStorage):
+    """Async facade over a pooled boto3 S3 client"""
+
+    storage_type = "s3"
+
+    def __init__(
+        self,
+        bucket: str,
+        region: str,
+        access_key_id: str,
+        secret_access_key: str,
+        endpoint_url: Optional[str] = None,
+        max_connections: int = 50,
+        connect_timeout: float = 5.0,
+        read_timeout: float = 30.0,
+        max_attempts: int = 4,
+        operation_timeouts: Optional[Dict[str, float]] = None,
+    ):
+        self.bucket = bucket
+        self.region = region
+        # Set for S3-compatible stand-ins (MinIO, moto server) used in local testing
+        self.endpoint_url = endpoint_url.rstrip("/") if endpoint_url else None
+        self.operation_timeouts = {**DEFAULT_OPERATION_TIMEOUTS, **(operation_timeouts or {})}
+
+        config = BotoConfig(
+            region_name=region,
+            max_pool_connections=max_connections,
+            connect_timeout=connect_timeout,
+            read_timeout=read_timeout,
+            retries={"max_attempts": max_attempts, "mode": "adaptive"},
+            tcp_keepalive=True,
+            s3={"addressing_style": "path"} if self.endpoint_url else None,
+        )
+        self.client = boto3.client(
+            "s3",
+            aws_access_key_id=access_key_id,
+            aws_secret_access_key=secret_access_key,
+            endpoint_url=self.endpoint_url,
+            config=config,
+        )
+        # One worker per pooled connection: never more in-flight calls than sockets
+        self._executor = ThreadPoolExecutor(max_workers=max_connections, thread_name_prefix="s3")
+
+    async def _run(self, operation: str, fn, *args, **kwargs) -> Any:
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._executor, partial(fn, *args, **kwargs))
+        try:
+            return await asyncio.wait_for(future, timeout=self.operation_timeouts[operation])
+        except asyncio.TimeoutError:
+            raise StorageTimeoutError(f"S3 {operation} timed out after {self.operation_timeouts[operation]}s")
+
+    def public_url(self, key: str) -> str:
+        if self.endpoint_url:
+            return f"{self.endpoint_url}/{self.bucket}/{key}"
+        return f"https://{self.bucket}.s3.{self.region}.amazonaws.com/{key}"
+
+    def key_from_url(self, url: Optional[str]) -> Optional[str]:
+        key = super().key_from_url(url)
+        if key or not url:
+            return key
+        # Older rows used the region-less virtual-hosted form
+        parsed = urlparse(url)
+        if parsed.netloc.startswith(f"{self.bucket}.s3.") and parsed.netloc.endswith(".amazonaws.com"):
+            return parsed.path.lstrip("/") or None
+        return None
+
+    def presigned_put_url(self, key: str, content_type: str = "image/jpeg", expires_in: int = 900) -> str:
+        """Signing is local, no network call"""
+        return self.client.generate_presigned_url(
+            "put_object",
+            Params={"Bucket": self.bucket, "Key": key, "ContentType": content_type},
+            ExpiresIn=expires_in,
+        )
+
+    def presigned_get_url(self, key: str, expires_in: int = 3600) -> str:
+        return self.client.generate_presigned_url(
+            "get_object",
+            Params={"Bucket": self.bucket, "Key": key},
+            ExpiresIn=expires_in,
+        )
+
+    async def put_object(self, key: str, data: bytes, content_type: str = "image/jpeg") -> Optional[str]:
+        response = await self._run(
+            "put", self.client.put_object,
+            Bucket=self.bucket, Key=key, Body=data, ContentType=content_type,
+        )
+        return (response.get("ETag") or "").strip('"') or None
+
+    async def put_stream(self, key: str, chunks: AsyncIterable[bytes], content_type: str = "image/jpeg") -> Optional[str]:
+        """Multipart upload so large objects are never fully buffered"""
+        upload = await self._run(
+            "put", self.client.create_multipart_upload,
+            Bucket=self.bucket, Key=key, ContentType=content_type,
+        )
+        upload_id = upload["UploadId"]
+        parts = []
+        buffer = b""
+        try:
+            async for chunk in chunks:
+                buffer += chunk
+                # S3 parts must be at least 5 MB, except the last one
+                if len(buffer) >= 5 * STREAM_CHUNK_SIZE:
+                    parts.append(await self._upload_part(key, upload_id, len(parts) + 1, buffer))
+                    buffer = b""
+            if buffer or not parts:
+                parts.append(await self._upload_part(key, upload_id, len(parts) + 1, buffer))
+            response = await self._run(
+                "put", self.client.complete_multipart_upload,
+                Bucket=self.bucket, Key=key, UploadId=upload_id,
+                MultipartUpload={"Parts": parts},
+            )
+            return (response.get("ETag") or "").strip('"') or None
+        except Exception:
+            await self._run("put", self.client.abort_multipart_upload, Bucket=self.bucket, Key=key, UploadId=upload_id)
+            raise
+
+    async def _upload_part(self, key: str, upload_id: str, number: int, data: bytes) -> Dict[str, Any]:
+        response = await self._run(
+            "put", self.client.upload_part,
+            Bucket=self.bucket, Key=key, UploadId=upload_id, PartNumber=number, Body=data,
+        )
+        return {"ETag": response["ETag"], "PartNumber": number}
+
+    async def get_object(self, key: str) -> bytes:
+        def _get() -> bytes:
+            try:
+                response = self.client.get_object(Bucket=self.bucket, Key=key)
+            except ClientError as e:
+                if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                    raise KeyError(key)
+                raise
+            return response["Body"].read()
+        return await self._run("get", _get)
+
+    async def open_stream(self, key: str, chunk_size: int = STREAM_CHUNK_SIZE) -> AsyncIterator[bytes]:
+        try:
+            response = await self._run("get", self.client.get_object, Bucket=self.bucket, Key=key)
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                raise KeyError(key)
+            raise
+        body = response["Body"]
+        try:
+            while True:
+                chunk = await self._run("get", body.read, chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            body.close()
+
+    async def head_object(self, key: str) -> Optional[Dict[str, Any]]:
+        try:
+            head = await self._run("head", self.client.head_object, Bucket=self.bucket, Key=key)
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+        return {
+            "ContentLength": head.get("ContentLength"),
+            "ContentType": head.get("ContentType"),
+            "ETag": (head.get("ETag") or "").strip('"') or None,
+        }
+
+    async def check(self) -> None:
+        await self._run("head", self.client.head_bucket, Bucket=self.bucket)
+
+    async def delete_object(self, key: str) -> None:
+        await self._run("delete", self.client.delete_object, Bucket=self.bucket, Key=key)
+
+    async def delete_objects(self, keys: List[str]) -> List[str]:
+        failed: List[str] = []
+        for start in range(0, len(keys), DELETE_BATCH_SIZE):
+            batch = keys[start:start + DELETE_BATCH_SIZE]
+            response = await self._run(
+                "delete", self.client.delete_objects,
+                Bucket=self.bucket,
+                Delete={"Objects": [{"Key": key} for key in batch], "Quiet": True},
+            )
+            failed.extend(error["Key"] for error in response.get("Errors", []))
+        return failed
+
+    async def iter_keys(self, prefix: str = "", page_size: int = 1000) -> AsyncIterator[List[str]]:
+        """Follows continuation tokens, so every key is returned"""
+        token = None
+        while True:
+            params = {"Bucket": self.bucket, "Prefix": prefix, "MaxKeys": page_size}
+            if token:
+                params["ContinuationToken"] = token
+            response = await self._run("list", self.client.list_objects_v2, **params)
+            keys = [obj["Key"] for obj in response.get("Contents", [])]
+            if keys:
+                yield keys
+            if not response.get("IsTruncated"):
+                break
+            token = response.get("NextContinuationToken")
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False)
+
+
+# ==================== SIGNED URLS (local backends) ====================
+
+class SignedUrlMixin:
+    """
+    Presigned URLs for backends without their own signing: the URL points at
+    the API's /storage route with an HMAC over method, key and expiry.
+    """
+
+    base_url: str
+    signing_secret: bytes
+
+    def _signature(self, method: str, key: str, expires: int) -> str:
+        message = f"{method}:{key}:{expires}".encode()
+        return hmac.new(self.signing_secret, message, hashlib.sha256).hexdigest()
+
+    def _signed_url(self, method: str, key: str, expires_in: int) -> str:
+        expires = int(time.time()) + expires_in
+        return f"{self.public_url(key)}?expires={expires}&signature={self._signature(method, key, expires)}"
+
+    def verify_signature(self, method: str, key: str, expires: int, signature: str) -> bool:
+        if expires < time.time():
+            return False
+        return hmac.compare_digest(self._signature(method, key, expires), signature)
+
+    def public_url(self, key: str) -> str:
+        return f"{self.base_url}/{quote(key)}"
+
+    def presigned_put_url(self, key: str, content_type: str = "image/jpeg", expires_in: int = 900) -> str:
+        return self._signed_url("PUT", key, expires_in)
+
+    def presigned_get_url(self, key: str, expires_in: int = 3600) -> str:
+        return self._signed_url("GET", key, expires_in)
+
+
+# ==================== LOCAL DISK ====================
+
+class LocalDiskStorage(SignedUrlMixin, ObjectStorage):
+    """Objects stored as files under `root`, served through the API's /storage route"""
+
+    storage_type = "disk"
+
+    def __init__(self, root: str, base_url: str, signing_secret: str, max_workers: int = 8):
+        self.root = Path(root).resolve()
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.base_url = base_url.rstrip("/")
+        self.signing_secret = signing_secret.encode()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="disk")
+
+    def _path(self, key: str) -> Path:
+        path = (self.root / key).resolve()
+        if self.root not in path.parents:
+            raise ValueError(f"Invalid storage key: {key}")
+        return path
+
+    async def _run(self, fn, *args) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def _write(self, key: str, data: bytes, content_type: str) -> str:
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(path.name + ".tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+        path.with_name(path.name + ".type").write_text(content_type)
+        return hashlib.md5(data).hexdigest()
+
+    async def put_object(self, key: str, data: bytes, content_type: str = "image/jpeg") -> Optional[str]:
+        return await self._run(self._write, key, data, content_type)
+
+    async def put_stream(self, key: str, chunks: AsyncIterable[bytes], content_type: str = "image/jpeg") -> Optional[str]:
+        path = self._path(key)
+        tmp = path.with_name(path.name + ".tmp")
+        await self._run(lambda: path.parent.mkdir(parents=True, exist_ok=True))
+        digest = hashlib.md5()
+        handle = await self._run(open, tmp, "wb")
+        try:
+            async for chunk in chunks:
+                digest.update(chunk)
+                await self._run(handle.write, chunk)
+        except BaseException:
+            await self._run(handle.close)
+            await self._run(partial(tmp.unlink, missing_ok=True))
+            raise
+        await self._run(handle.close)
+        await self._run(os.replace, tmp, path)
+        await self._run(path.with_name(path.name + ".type").write_text, content_type)
+        return digest.hexdigest()
+
+    async def get_object(self, key: str) -> bytes:
+        path = self._path(key)
+        try:
+            return await self._run(path.read_bytes)
+        except FileNotFoundError:
+            raise KeyError(key)
+
+    async def open_stream(self, key: str, chunk_size: int = STREAM_CHUNK_SIZE) -> AsyncIterator[bytes]:
+        try:
+            handle = await self._run(open, self._path(key), "rb")
+        except FileNotFoundError:
+            raise KeyError(key)
+        try:
+            while True:
+                chunk = await self._run(handle.read, chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            await self._run(handle.close)
+
+    def _head(self, key: str) -> Optional[Dict[str, Any]]:
+        path = self._path(key)
+        if not path.is_file():
+            return None
+        type_path = path.with_name(path.name + ".type")
+        data = path.read_bytes()
+        return {
+            "ContentLength": len(data),
+            "ContentType": type_path.read_text() if type_path.exists() else "application/octet-stream",
+            "ETag": hashlib.md5(data).hexdigest(),
+        }
+
+    async def head_object(self, key: str) -> Optional[Dict[str, Any]]:
+        return await self._run(self._head, key)
+
+    def _delete(self, keys: List[str]) -> List[str]:
+        failed = []
+        for key in keys:
+            try:
+                path = self._path(key)
+                path.unlink(missing_ok=True)
+                path.with_name(path.name + ".type").unlink(missing_ok=True)
+            except Exception as e:
+                logger.warning(f"Disk delete failed for {key}: {e}")
+                failed.append(key)
+        return failed
+
+    async def delete_objects(self, keys: List[str]) -> List[str]:
+        return await self._run(self._delete, keys)
+
+    def _list(self, prefix: str) -> List[str]:
+        keys = []
+        for path in self.root.rglob("*"):
+            if path.is_file() and not path.name.endswith((".type", ".tmp")):
+                key = path.relative_to(self.root).as_posix()
+                if key.startswith(prefix):
+                    keys.append(key)
+        return sorted(keys)
+
+    async def iter_keys(self, prefix: str = "", page_size: int = 1000) -> AsyncIterator[List[str]]:
+        keys = await self._run(self._list, prefix)
+        for start in range(0, len(keys), page_size):
+            yield keys[start:start + page_size]
+
+    async def check(self) -> None:
+        if not self.root.is_dir():
+            raise RuntimeError(f"Storage directory missing: {self.root}")
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False)
+
+
+# ==================== IN-MEMORY ====================
+
+class MemoryStorage(SignedUrlMixin, ObjectStorage):
+    """Objects kept in a dict; for tests, benchmarks and offline load tests"""
+
+    storage_type = "memory"
+
+    def __init__(self, base_url: str = "memory://objects", signing_secret: str = "memory"):
+        self.base_url = base_url.rstrip("/")
+        self.signing_secret = signing_secret.encode()
+        self.objects: Dict[str, Dict[str, Any]] = {}
+
+    async def put_object(self, key: str, data: bytes, content_type: str = "image/jpeg") -> Optional[str]:
+        etag = hashlib.md5(data).hexdigest()
+        self.objects[key] = {"data": bytes(data), "content_type": content_type, "etag": etag}
+        return etag
+
+    async def get_object(self, key: str) -> bytes:
+        return self.objects[key]["data"]
+
+    async def head_object(self, key: str) -> Optional[Dict[str, Any]]:
+        obj = self.objects.get(key)
+        if obj is None:
+            return None
+        return {"ContentLength": len(obj["data"]), "ContentType": obj["content_type"], "ETag": obj["etag"]}
+
+    async def delete_objects(self, keys: List[str]) -> List[str]:
+        for key in keys:
+            self.objects.pop(key, None)
+        return []
+
+    async def iter_keys(self, prefix: str = "", page_size: int = 1000) -> AsyncIterator[List[str]]:
+        keys = sorted(key for key in self.objects if key.startswith(prefix))
+        for start in range(0, len(keys), page_size):
+            yield keys[start:start + page_size]
+
+
+# ==================== FACTORY ====================
+
+def create_storage(backend: Optional[str], **settings) -> Optional[ObjectStorage]:
+    """
+    Build the configured backend. `backend` is "s3", "local" or "memory";
+    None/"" means no object storage (pages are stored as base64 in MongoDB).
+    """
+    backend = (backend or "").lower()
+    if not backend:
+        return None
+    if backend == "s3":
+        return S3Storage(
+            bucket=settings["bucket"],
+            region=settings["region"],
+            access_key_id=settings["access_key_id"],
+            secret_access_key=settings["secret_access_key"],
+            endpoint_url=settings.get("endpoint_url"),
+            max_connections=settings.get("max_connections", 50),
+        )
+    if backend == "local":
+        return LocalDiskStorage(
+            root=settings["root"],
+            base_url=settings["base_url"],
+            signing_secret=settings["signing_secret"],
+        )
+    if backend == "memory":
+        return MemoryStorage(
+            base_url=settings["base_url"],
+            signing_secret=settings["signing_secret"],
+        )
+    raise ValueError(f"Unknown storage backend: {backend}")
@@ -0,0 +1,251 @@
+"""
+Storage Usage
+Per-user and global byte counters for stored page images.
+
+Every page row records the decoded byte size of each of its images next to
+the image itself (image_bytes, thumbnail_bytes, original_bytes; see
+IMAGE_ROLES). The size belongs to the image, not to where it lives, so
+moving a page from base64 to object storage does not change it. PageStore
+computes sizes at write time and applies the difference to the counters
+with $inc:
+
+    storage_usage: {user_id, bytes, pages, updated_at, reconciled_at}
+
+One row per user plus one row with user_id GLOBAL for the whole system,
+so dashboards read usage with one indexed lookup instead of scanning pages.
+Sizes are logical (what the user stored); object storage deduplicates
+identical images, so physical bytes can be lower (see BlobStore.stats).
+
+The counters are updated outside the page write itself (no transactions),
+so a crash between the two can leave them off. The reconciler runs every
+RECONCILE_INTERVAL_SECONDS: it backfills sizes of pages written before
+sizes were recorded (base64 length, blob size, or a HEAD request for other
+stored objects) and then recomputes every counter from the pages.
+"""
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, Optional
+
+from pymongo import UpdateOne
+
+logger = logging.getLogger(__name__)
+
+GLOBAL = "__global__"
+
+# role -> (inline base64 field, object storage url field, size field)
+IMAGE_ROLES = {
+    "image": ("image_base64", "image_url", "image_bytes"),
+    "thumbnail": ("thumbnail_base64", "thumbnail_url", "thumbnail_bytes"),
+    "original": ("original_image_base64", "original_image_url", "original_bytes"),
+}
+SIZE_FIELDS = tuple(size for _, _, size in IMAGE_ROLES.values())
+
+RECONCILE_INTERVAL_SECONDS = 24 * 60 * 60
+BACKFILL_BATCH_SIZE = 100
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def base64_size(value: Optional[str]) -> int:
+    """Decoded byte length of a base64 string (or data URL) without decoding it"""
+    if not value:
+        return 0
+    if "," in value[:100]:
+        value = value.split(",", 1)[1]
+    value = value.strip()
+    padding = len(value) - len(value.rstrip("="))
+    return max(len(value) * 3 // 4 - padding, 0)
+
+
+def with_sizes(page: Dict[str, Any]) -> Dict[str, Any]:
+    """Fill in size fields for inline images that do not have one yet (in place)"""
+    for inline, _, size in IMAGE_ROLES.values():
+        if page.get(inline) and page.get(size) is None:
+            page[size] = base64_size(page[inline])
+    return page
+
+
+def page_bytes(page: Optional[Dict[str, Any]]) -> int:
+    return sum((page or {}).get(size) or 0 for size in SIZE_FIELDS)
+
+
+def size_changes(fields: Dict[str, Any], unset: Iterable[str]) -> Dict[str, Optional[int]]:
+    """Size fields implied by a page update: a new size per changed role, None for removed roles"""
+    unset = set(unset)
+    changes: Dict[str, Optional[int]] = {}
+    for inline, url, size in IMAGE_ROLES.values():
+        if size in fields:
+            changes[size] = fields[size]
+        elif fields.get(inline):
+            changes[size] = base64_size(fields[inline])
+        elif (inline in unset or url in unset) and not fields.get(inline) and not fields.get(url):
+            changes[size] = None
+    return changes
+
+
+class StorageUsage:
+    """Maintains and reconciles the storage_usage counters"""
+
+    def __init__(self, db, storage=None):
+        self.db = db
+        self.storage = storage
+        self._task: Optional[asyncio.Task] = None
+
+    async def add(self, user_id: str, delta_bytes: int, delta_pages: int = 0) -> None:
+        if not delta_bytes and not delta_pages:
+            return
+        now = _now()
+        for owner in (user_id, GLOBAL):
+            await self.db.storage_usage.update_one(
+                {"user_id": owner},
+                {"$inc": {"bytes": delta_bytes, "pages": delta_pages}, "$set": {"updated_at": now}},
+                upsert=True,
+            )
+
+    async def add_many(self, deltas: Dict[str, Any]) -> None:
+        """Apply {user_id: (delta_bytes, delta_pages)}"""
+        for user_id, (delta_bytes, delta_pages) in deltas.items():
+            await self.add(user_id, delta_bytes, delta_pages)
+
+    async def get(self, user_id: str) -> Dict[str, int]:
+        row = await self.db.storage_usage.find_one({"user_id": user_id}, {"_id": 0, "bytes": 1, "pages": 1})
+        return {"bytes": max((row or {}).get("bytes", 0), 0), "pages": max((row or {}).get("pages", 0), 0)}
+
+    async def totals(self) -> Dict[str, int]:
+        return await self.get(GLOBAL)
+
+    async def remove_user(self, user_id: str) -> None:
+        """The user's pages are gone: drop their counter and subtract it from the total"""
+        row = await self.db.storage_usage.find_one_and_delete({"user_id": user_id})
+        if row:
+            await self.db.storage_usage.update_one(
+                {"user_id": GLOBAL},
+                {"$inc": {"bytes": -row.get("bytes", 0), "pages": -row.get("pages", 0)}, "$set": {"updated_at": _now()}},
+            )
+
+    async def reset(self) -> None:
+        """All pages were deleted"""
+        await self.db.storage_usage.delete_many({})
+
+    # ---------- reconciliation ----------
+
+    async def _stored_size(self, url: str) -> int:
+        """Size of an object in storage: from the blob record, else a HEAD request"""
+        if not self.storage:
+            return 0
+        key = self.storage.key_from_url(url)
+        if not key:
+            return 0
+        if key.startswith("blobs/sha256/"):
+            digest = key.rsplit("/", 1)[-1].split(".", 1)[0]
+            blob = await self.db.blobs.find_one({"hash": digest}, {"_id": 0, "size": 1})
+            if blob and blob.get("size") is not None:
+                return blob["size"]
+        head = await self.storage.head_object(key)
+        return (head or {}).get("ContentLength") or 0
+
+    async def backfill(self) -> int:
+        """Record sizes on pages written before sizes were tracked. Returns pages updated."""
+        missing = {"$or": [
+            {field: {"$type": "string", "$ne": ""}, size: {"$exists": False}}
+            for inline, url, size in IMAGE_ROLES.values() for field in (inline, url)
+        ]}
+        updated = 0
+        last_id = None
+        while True:
+            query = dict(missing)
+            if last_id is not None:
+                query["_id"] = {"$gt": last_id}
+            pages = await self.db.pages.find(query).sort("_id", 1).limit(BACKFILL_BATCH_SIZE).to_list(None)
+            if not pages:
+                break
+            operations = []
+            for page in pages:
+                sizes = {}
+                for inline, url, size in IMAGE_ROLES.values():
+                    if page.get(size) is not None:
+                        continue
+                    if page.get(inline):
+                        sizes[size] = base64_size(page[inline])
+                    elif page.get(url):
+                        sizes[size] = await self._stored_size(page[url])
+                if sizes:
+                    operations.append(UpdateOne({"_id": page["_id"]}, {"$set": sizes}))
+            if operations:
+                await self.db.pages.bulk_write(operations, ordered=False)
+                updated += len(operations)
+            last_id = pages[-1]["_id"]
+            await asyncio.sleep(0)
+        return updated
+
+    async def reconcile(self) -> Dict[str, int]:
+        """Backfill sizes, then recompute every counter from the pages collection"""
+        backfilled = await self.backfill()
+        per_user: Dict[str, Dict[str, int]] = {}
+        async for row in self.db.pages.aggregate([
+            {"$group": {
+                "_id": "$user_id",
+                "bytes": {"$sum": {"$add": [{"$ifNull": [f"${size}", 0]} for size in SIZE_FIELDS]}},
+                "pages": {"$sum": 1},
+            }},
+        ]):
+            if row["_id"]:
+                per_user[row["_id"]] = {"bytes": row["bytes"], "pages": row["pages"]}
+
+        counted = {
+            counter["user_id"]: {"bytes": counter.get("bytes"), "pages": counter.get("pages")}
+            async for counter in self.db.storage_usage.find({"user_id": {"$ne": GLOBAL}}, {"_id": 0})
+        }
+        corrected = sum(
+            1 for user_id in set(counted) | set(per_user)
+            if counted.get(user_id) != per_user.get(user_id, {"bytes": 0, "pages": 0})
+        )
+        now = _now()
+        operations = [
+            UpdateOne(
+                {"user_id": user_id},
+                {"$set": {**counts, "updated_at": now, "reconciled_at": now}},
+                upsert=True,
+            )
+            for user_id, counts in per_user.items()
+        ]
+        operations.append(UpdateOne(
+            {"user_id": GLOBAL},
+            {"$set": {
+                "bytes": sum(c["bytes"] for c in per_user.values()),
+                "pages": sum(c["pages"] for c in per_user.values()),
+                "updated_at": now, "reconciled_at": now,
+            }},
+            upsert=True,
+        ))
+        await self.db.storage_usage.bulk_write(operations, ordered=False)
+        # Users without pages left
+        await self.db.storage_usage.delete_many({"user_id": {"$nin": list(per_user) + [GLOBAL]}})
+        logger.info(f"✅ Storage usage reconciled: {len(per_user)} users, {corrected} counters corrected, {backfilled} pages sized")
+        return {"users": len(per_user), "corrected": corrected, "backfilled": backfilled}
+
+    def start(self) -> None:
+        if not self._task:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.reconcile()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Storage usage reconcile error: {e}")
+            await asyncio.sleep(RECONCILE_INTERVAL_SECONDS)
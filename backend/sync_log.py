@@ -0,0 +1,344 @@
+"""
+Sync Log
+Per-user change feed for incremental client sync.
+
+Every change to a document, page or folder gets the next number of the
+user's monotonic sequence. The log is compacted: one row per entity that
+always carries the entity's latest sequence, so the log never
+grows beyond the user's live entities plus recent tombstones.
+
+    sync_counters: {user_id, seq, pending: [{seq, at}], floor_seq, seeded}
+    sync_changes:  {user_id, entity_id, kind, document_id, page_id, seq, deleted, changed_at}
+
+- Readers ask for changes after the last seq they applied. Rows are joined
+  with current metadata at read time (never images); pages carry a
+  content_hash so clients only download images that actually changed.
+- Sequence numbers are allocated before the row is written, so a reader
+  could otherwise see seq 7 before seq 6 lands. Allocations are listed as
+  pending (in the same write that allocates them) until written, and reads
+  stop below the oldest pending one
+  (entries older than PENDING_TIMEOUT are treated as abandoned).
+- Tombstones (deleted=True) are purged after TOMBSTONE_RETENTION. The
+  highest purged seq becomes the user's floor_seq; a client whose cursor
+  is below it is told to reset (full resync).
+- The first sync of a user seeds the log from their existing documents.
+- current_seq() is the version of the user's whole library; list endpoints
+  use it as their ETag source (see http_cache.py).
+"""
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from pymongo import ReturnDocument, UpdateOne
+
+from page_store import METADATA_PROJECTION
+
+logger = logging.getLogger(__name__)
+
+DOCUMENT = "document"
+PAGE = "page"
+FOLDER = "folder"
+
+PENDING_TIMEOUT = timedelta(seconds=30)
+TOMBSTONE_RETENTION = timedelta(days=90)
+PURGE_INTERVAL_SECONDS = 6 * 60 * 60
+MAX_CHANGES = 500
+
+DOCUMENT_FIELDS = (
+    "document_id", "name", "folder_id", "tags", "page_count", "thumbnail_url",
+    "is_password_protected", "version", "storage_type", "created_at", "updated_at",
+)
+
+FOLDER_PROJECTION = {"_id": 0, "user_id": 0, "password_hash": 0}
+
+# (entity_id, kind, document_id, page_id, deleted); folder rows carry the folder_id as document_id
+Entry = Tuple[str, str, str, Optional[str], bool]
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _page_entity(document_id: str, page_id: str) -> str:
+    return f"{document_id}:{page_id}"
+
+
+def _folder_entity(folder_id: str) -> str:
+    return f"folder:{folder_id}"
+
+
+class SyncLog:
+    """Records document / page changes and serves them by sequence number"""
+
+    def __init__(self, db, page_store):
+        self.db = db
+        self.page_store = page_store
+        self._task: Optional[asyncio.Task] = None
+
+    # ---------- recording ----------
+
+    async def _allocate(self, user_id: str, count: int) -> int:
+        """Reserve `count` sequence numbers. Returns the first one."""
+        # One write: a reader must never see the new seq without its pending entry
+        seq = {"$ifNull": ["$seq", 0]}
+        counter = await self.db.sync_counters.find_one_and_update(
+            {"user_id": user_id},
+            [{"$set": {
+                "seq": {"$add": [seq, count]},
+                # $map over one element builds the entry from the old seq
+                "pending": {"$concatArrays": [
+                    {"$ifNull": ["$pending", []]},
+                    {"$map": {"input": [0], "in": {"seq": {"$add": [seq, 1]}, "at": _now()}}},
+                ]},
+                "floor_seq": {"$ifNull": ["$floor_seq", 0]},
+                "seeded": {"$ifNull": ["$seeded", False]},
+            }}],
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        return counter["seq"] - count + 1
+
+    async def record(self, user_id: str, entries: List[Entry]) -> Optional[int]:
+        """Log changes; returns the highest sequence number used"""
+        entries = list({entry[0]: entry for entry in entries}.values())
+        if not entries:
+            return None
+        first = await self._allocate(user_id, len(entries))
+        now = _now()
+        try:
+            await self.db.sync_changes.bulk_write([
+                UpdateOne(
+                    {"user_id": user_id, "entity_id": entity_id},
+                    {"$set": {
+                        "kind": kind, "document_id": document_id, "page_id": page_id,
+                        "seq": first + offset, "deleted": deleted, "changed_at": now,
+                    }},
+                    upsert=True,
+                )
+                for offset, (entity_id, kind, document_id, page_id, deleted) in enumerate(entries)
+            ], ordered=False)
+        finally:
+            await self.db.sync_counters.update_one(
+                {"user_id": user_id}, {"$pull": {"pending": {"seq": first}}}
+            )
+        return first + len(entries) - 1
+
+    async def documents_changed(self, user_id: str, document_ids: Iterable[str]) -> None:
+        await self.record(user_id, [(d, DOCUMENT, d, None, False) for d in document_ids])
+
+    async def pages_changed(
+        self, user_id: str, document_id: str, page_ids: Iterable[str] = (), deleted_page_ids: Iterable[str] = ()
+    ) -> None:
+        """Log a document change together with changed and deleted pages"""
+        entries: List[Entry] = [(document_id, DOCUMENT, document_id, None, False)]
+        entries += [(_page_entity(document_id, p), PAGE, document_id, p, False) for p in page_ids]
+        entries += [(_page_entity(document_id, p), PAGE, document_id, p, True) for p in deleted_page_ids]
+        await self.record(user_id, entries)
+
+    async def documents_created(self, user_id: str, pages: Dict[str, List[str]]) -> None:
+        """Log several new documents ({document_id: page_ids}) with one allocation"""
+        entries: List[Entry] = []
+        for document_id, page_ids in pages.items():
+            entries.append((document_id, DOCUMENT, document_id, None, False))
+            entries += [(_page_entity(document_id, p), PAGE, document_id, p, False) for p in page_ids]
+        await self.record(user_id, entries)
+
+    async def documents_deleted(self, user_id: str, document_ids: Iterable[str]) -> None:
+        """Tombstone documents; their page rows are dropped (the document tombstone covers them)"""
+        document_ids = list(document_ids)
+        if not document_ids:
+            return
+        await self.record(user_id, [(d, DOCUMENT, d, None, True) for d in document_ids])
+        await self.db.sync_changes.delete_many(
+            {"user_id": user_id, "kind": PAGE, "document_id": {"$in": document_ids}}
+        )
+
+    async def folders_changed(self, user_id: str, folder_ids: Iterable[str], deleted: bool = False) -> None:
+        await self.record(user_id, [(_folder_entity(f), FOLDER, f, None, deleted) for f in folder_ids])
+
+    async def delete_user(self, user_id: str) -> None:
+        await self.db.sync_changes.delete_many({"user_id": user_id})
+        await self.db.sync_counters.delete_one({"user_id": user_id})
+
+    async def reset_all(self) -> None:
+        """After a bulk wipe: drop the log and send every client into a full resync"""
+        await self.db.sync_changes.delete_many({})
+        # Step every sequence past the wipe and make that the floor
+        await self.db.sync_counters.update_many({}, [
+            {"$set": {"seq": {"$add": ["$seq", 1]}, "floor_seq": {"$add": ["$seq", 1]}, "pending": []}},
+        ])
+
+    # ---------- reading ----------
+
+    async def _seed(self, user_id: str) -> None:
+        """First sync of a user: log every existing document and page"""
+        entries: List[Entry] = []
+        async for document in self.db.documents.find({"user_id": user_id}, {"_id": 0, "document_id": 1}):
+            entries.append((document["document_id"], DOCUMENT, document["document_id"], None, False))
+        async for page in self.db.pages.find({"user_id": user_id}, {"_id": 0, "document_id": 1, "page_id": 1}):
+            entries.append((_page_entity(page["document_id"], page["page_id"]), PAGE, page["document_id"], page["page_id"], False))
+        # Unseeded legacy documents still embed their pages
+        async for document in self.db.documents.find(
+            {"user_id": user_id, "pages_split": {"$ne": True}}, {"_id": 0, "document_id": 1, "pages.page_id": 1}
+        ):
+            for page in document.get("pages") or []:
+                entries.append((_page_entity(document["document_id"], page["page_id"]), PAGE, document["document_id"], page["page_id"], False))
+        async for folder in self.db.folders.find({"user_id": user_id}, {"_id": 0, "folder_id": 1}):
+            entries.append((_folder_entity(folder["folder_id"]), FOLDER, folder["folder_id"], None, False))
+        await self.record(user_id, entries)
+        await self.db.sync_counters.update_one(
+            {"user_id": user_id}, {"$set": {"seeded": True}}, upsert=True
+        )
+
+    async def current_seq(self, user_id: str) -> int:
+        """Latest sequence number of a user (0 before their first change)"""
+        counter = await self.db.sync_counters.find_one({"user_id": user_id}, {"_id": 0, "seq": 1})
+        return (counter or {}).get("seq", 0)
+
+    async def _counter(self, user_id: str) -> Dict[str, Any]:
+        counter = await self.db.sync_counters.find_one({"user_id": user_id}, {"_id": 0})
+        if not counter or not counter.get("seeded"):
+            await self._seed(user_id)
+            counter = await self.db.sync_counters.find_one({"user_id": user_id}, {"_id": 0})
+        return counter or {"seq": 0, "floor_seq": 0, "pending": []}
+
+    @staticmethod
+    def _stable_seq(counter: Dict[str, Any]) -> int:
+        """Highest seq below which every allocated change has been written"""
+        cutoff = _now() - PENDING_TIMEOUT
+        pending = []
+        for entry in counter.get("pending") or []:
+            at = entry["at"] if entry["at"].tzinfo else entry["at"].replace(tzinfo=timezone.utc)
+            if at > cutoff:
+                pending.append(entry["seq"])
+        return min(pending) - 1 if pending else counter.get("seq", 0)
+
+    async def changes_since(self, user_id: str, since: int = 0, limit: int = 200) -> Dict[str, Any]:
+        """Changes with seq > since, oldest first, joined with current metadata"""
+        limit = max(1, min(limit, MAX_CHANGES))
+        counter = await self._counter(user_id)
+        floor = counter.get("floor_seq", 0)
+        if since and since < floor:
+            return {"reset": True, "changes": [], "next_seq": 0, "current_seq": counter.get("seq", 0), "has_more": True}
+
+        stable = self._stable_seq(counter)
+        rows = await self.db.sync_changes.find(
+            {"user_id": user_id, "seq": {"$gt": since, "$lte": stable}},
+            {"_id": 0, "user_id": 0, "entity_id": 0},
+        ).sort("seq", 1).limit(limit + 1).to_list(limit + 1)
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+
+        documents, pages, folders = await self._load(rows)
+        changes = []
+        for row in rows:
+            if row["kind"] == FOLDER:
+                change = {"seq": row["seq"], "kind": FOLDER, "folder_id": row["document_id"], "deleted": row["deleted"]}
+                data = None if row["deleted"] else folders.get(row["document_id"])
+            elif row["kind"] == PAGE:
+                change = {"seq": row["seq"], "kind": PAGE, "document_id": row["document_id"], "deleted": row["deleted"]}
+                change["page_id"] = row["page_id"]
+                data = None if row["deleted"] else pages.get((row["document_id"], row["page_id"]))
+            else:
+                change = {"seq": row["seq"], "kind": DOCUMENT, "document_id": row["document_id"], "deleted": row["deleted"]}
+                data = None if row["deleted"] else documents.get(row["document_id"])
+            if not row["deleted"]:
+                if data is None:
+                    # Removed after this row was logged; its tombstone follows later
+                    continue
+                change["data"] = data
+            changes.append(change)
+
+        # Nothing left below the stable point: the client is caught up to it
+        next_seq = rows[-1]["seq"] if rows else max(since, stable)
+        return {
+            "reset": False,
+            "changes": changes,
+            "next_seq": next_seq,
+            "current_seq": counter.get("seq", 0),
+            "has_more": has_more,
+        }
+
+    async def _load(self, rows: List[Dict[str, Any]]):
+        document_ids = list({r["document_id"] for r in rows if r["kind"] == DOCUMENT and not r["deleted"]})
+        page_keys = [(r["document_id"], r["page_id"]) for r in rows if r["kind"] == PAGE and not r["deleted"]]
+
+        documents: Dict[str, Dict[str, Any]] = {}
+        if document_ids:
+            async for document in self.db.documents.find(
+                {"document_id": {"$in": document_ids}}, {"_id": 0, **{f: 1 for f in DOCUMENT_FIELDS}}
+            ):
+                documents[document["document_id"]] = document
+
+        pages: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        if page_keys:
+            projection = {**METADATA_PROJECTION}
+            projection.pop("document_id")
+            async for page in self.db.pages.find(
+                {"$or": [{"document_id": d, "page_id": p} for d, p in page_keys]}, projection
+            ):
+                pages[(page.pop("document_id"), page["page_id"])] = page
+            missing: Dict[str, List[str]] = {}
+            for (document_id, page_id), page in pages.items():
+                if "content_hash" not in page:
+                    missing.setdefault(document_id, []).append(page_id)
+            for document_id, page_ids in missing.items():
+                hashes = await self.page_store.fill_hashes(document_id, page_ids)
+                for page_id, digest in hashes.items():
+                    pages[(document_id, page_id)]["content_hash"] = digest
+
+        folders: Dict[str, Dict[str, Any]] = {}
+        folder_ids = [r["document_id"] for r in rows if r["kind"] == FOLDER and not r["deleted"]]
+        if folder_ids:
+            async for folder in self.db.folders.find({"folder_id": {"$in": folder_ids}}, FOLDER_PROJECTION):
+                folders[folder["folder_id"]] = folder
+        return documents, pages, folders
+
+    # ---------- tombstone retention ----------
+
+    async def purge_tombstones(self, batch_size: int = 1000) -> int:
+        """Delete old tombstones and raise each affected user's floor_seq"""
+        cutoff = _now() - TOMBSTONE_RETENTION
+        purged = 0
+        while True:
+            rows = await self.db.sync_changes.find(
+                {"deleted": True, "changed_at": {"$lt": cutoff}},
+                {"_id": 1, "user_id": 1, "seq": 1},
+            ).limit(batch_size).to_list(batch_size)
+            if not rows:
+                break
+            floors: Dict[str, int] = {}
+            for row in rows:
+                floors[row["user_id"]] = max(floors.get(row["user_id"], 0), row["seq"])
+            # Raise the floor first: a client must never miss a purged delete
+            for user_id, seq in floors.items():
+                await self.db.sync_counters.update_one({"user_id": user_id}, {"$max": {"floor_seq": seq}})
+            result = await self.db.sync_changes.delete_many({"_id": {"$in": [row["_id"] for row in rows]}})
+            purged += result.deleted_count
+        if purged:
+            logger.info(f"✅ Purged {purged} sync tombstones")
+        return purged
+
+    def start(self) -> None:
+        if not self._task:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.purge_tombstones()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Sync tombstone purge error: {e}")
+            await asyncio.sleep(PURGE_INTERVAL_SECONDS)
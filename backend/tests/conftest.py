@@ -0,0 +1,182 @@
+"""
+Shared test fixtures
+
+mongomock stands in for MongoDB; AsyncDB wraps it in the coroutine API of
+Motor that the modules under test use. Tests that need it get `mock_db`
+(the mongomock database, to seed and inspect) and `db` (the same database
+through AsyncDB); `make_db` builds more AsyncDB views of it, e.g. one with
+a hook that runs before every call. `api` runs the app itself over them,
+with MemoryStorage in place of S3. Modules that seed data override
+`mock_db`:
+
+    @pytest.fixture
+    def mock_db(mock_db):
+        mock_db.users.insert_one(...)
+        return mock_db
+
+Uses mongomock (`pip install mongomock`); tests that need it are skipped
+otherwise.
+"""
+import asyncio
+import inspect
+import os
+import sys
+from datetime import datetime, timezone
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pymongo import ReturnDocument
+
+
+class AsyncCursor:
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def sort(self, *args, **kwargs):
+        self.cursor = self.cursor.sort(*args, **kwargs)
+        return self
+
+    def limit(self, n):
+        self.cursor = self.cursor.limit(n)
+        return self
+
+    def skip(self, n):
+        self.cursor = self.cursor.skip(n)
+        return self
+
+    async def to_list(self, length=None):
+        return list(self.cursor)
+
+    def __aiter__(self):
+        self._iter = iter(self.cursor)
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._iter)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class AsyncCollection:
+    def __init__(self, collection, db):
+        self.collection = collection
+        self.db = db
+
+    def find(self, *args, **kwargs):
+        self.db.calls.append("find")
+        return AsyncCursor(self.collection.find(*args, **kwargs))
+
+    def aggregate(self, pipeline, **kwargs):
+        self.db.calls.append("aggregate")
+        return AsyncCursor(self.collection.aggregate(pipeline))
+
+    async def find_one_and_update(self, filter, update, projection=None,
+                                  return_document=ReturnDocument.BEFORE, **kwargs):
+        # mongomock updates the wrong row of a sorted match when _id is
+        # projected away, and reads an AFTER row back with the original filter,
+        # which a claim (e.g. status: pending -> running) no longer matches.
+        # Update with _id projected, then read the row back by _id.
+        await self.db.before("find_one_and_update")
+        fields = {k: v for k, v in (projection or {}).items() if k != "_id"} or None
+        if return_document == ReturnDocument.AFTER:
+            before = self.collection.find_one_and_update(filter, update, **kwargs)
+            if before is not None:
+                row = self.collection.find_one({"_id": before["_id"]}, fields)
+            else:
+                row = self.collection.find_one(filter, fields) if kwargs.get("upsert") else None
+        else:
+            row = self.collection.find_one_and_update(filter, update, projection=fields, **kwargs)
+        if row is not None and (projection or {}).get("_id") == 0:
+            row.pop("_id", None)
+        return row
+
+    def __getattr__(self, name):
+        method = getattr(self.collection, name)
+
+        async def call(*args, **kwargs):
+            await self.db.before(name)
+            return method(*args, **kwargs)
+        return call
+
+
+class AsyncDB:
+    """
+    A mongomock database with Motor's coroutine API. `calls` lists every
+    collection call by name. `hook`, if given, is called with the name
+    before each awaited call, as if another request ran in between; it may
+    be a coroutine function, and raising from it makes the call fail.
+    """
+
+    def __init__(self, db, hook=None):
+        self._db = db
+        self.calls = []
+        self.hook = hook
+
+    async def before(self, name):
+        self.calls.append(name)
+        if self.hook:
+            result = self.hook(name)
+            if inspect.isawaitable(result):
+                await result
+        # Yield so gathered calls interleave like real round trips
+        await asyncio.sleep(0)
+
+    def __getattr__(self, name):
+        return AsyncCollection(self._db[name], self)
+
+    def __getitem__(self, name):
+        return AsyncCollection(self._db[name], self)
+
+
+@pytest.fixture
+def mock_db():
+    mongomock = pytest.importorskip("mongomock")
+    return mongomock.MongoClient(tz_aware=True).db
+
+
+@pytest.fixture
+def make_db(mock_db):
+    def make(hook=None):
+        return AsyncDB(mock_db, hook)
+    return make
+
+
+@pytest.fixture
+def db(make_db):
+    return make_db()
+
+
+@pytest.fixture
+def api(mock_db, db, monkeypatch):
+    """The app over mongomock and MemoryStorage, signed in as u1"""
+    os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+    server = pytest.importorskip("server")
+    from starlette.testclient import TestClient
+
+    from blob_store import BlobStore
+    from deletion import DeletionWorker
+    from page_store import PageStore
+    from storage import MemoryStorage
+    from storage_usage import StorageUsage
+    from sync_log import SyncLog
+
+    storage = MemoryStorage()
+    usage = StorageUsage(db)
+    pages = PageStore(db, usage)
+    for name, value in {
+        "db": db, "object_storage": storage, "blob_store": BlobStore(db, storage), "image_cache": None,
+        "storage_usage": usage, "page_store": pages, "sync_log": SyncLog(db, pages),
+        "deletion_worker": DeletionWorker(db, storage),
+    }.items():
+        monkeypatch.setattr(server, name, value)
+
+    mock_db.users.insert_one({
+        "user_id": "u1", "email": "u1@example.com", "name": "U1",
+        "created_at": datetime.now(timezone.utc), "subscription_type": "free",
+    })
+    user = server.User(**mock_db.users.find_one({"user_id": "u1"}, {"_id": 0}))
+    monkeypatch.setitem(server.app.dependency_overrides, server.get_current_user, lambda: user)
+    return TestClient(server.app), storage
@@ -0,0 +1,103 @@
+"""
+Test the user / session cache behind get_current_user (auth_cache.py)
+
+Tests:
+1. Users are read once, then served from the cache with only User fields
+2. invalidate_user makes the next lookup read the write
+3. A lookup that overlaps an invalidation does not cache its result
+4. Sessions resolve to their user until they expire or are invalidated
+5. Unknown users and sessions are not cached
+
+Uses mongomock and cachetools; skipped otherwise.
+"""
+import asyncio
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytest.importorskip("cachetools")
+
+from auth_cache import AuthCache
+
+
+FIELDS = ["user_id", "email", "subscription_type"]
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+@pytest.fixture
+def mock_db(mock_db):
+    mock_db.users.insert_one({"user_id": "u1", "email": "u1@x.com", "subscription_type": "free", "password_hash": "h"})
+    return mock_db
+
+
+@pytest.fixture
+def cache(db):
+    return AuthCache(db, FIELDS)
+
+
+class TestUsers:
+    """Test cached user lookups"""
+
+    def test_read_once(self, db, cache):
+        user = run(cache.user("u1"))
+        assert user == {"user_id": "u1", "email": "u1@x.com", "subscription_type": "free"}
+        assert run(cache.user("u1")) == user
+        assert db.calls == ["find_one"]
+
+    def test_invalidate(self, mock_db, cache):
+        run(cache.user("u1"))
+        mock_db.users.update_one({"user_id": "u1"}, {"$set": {"subscription_type": "premium"}})
+        assert run(cache.user("u1"))["subscription_type"] == "free"
+        cache.invalidate_user("u1")
+        assert run(cache.user("u1"))["subscription_type"] == "premium"
+
+    def test_overlapping_invalidation(self, mock_db, db, cache):
+        async def lookup_during_write():
+            read = asyncio.ensure_future(cache.user("u1"))
+            await asyncio.sleep(0)  # the read is in flight
+            cache.invalidate_user("u1")
+            return await read
+
+        run(lookup_during_write())
+        assert "u1" not in cache.users
+        run(cache.user("u1"))
+        assert "u1" in cache.users
+
+    def test_unknown_not_cached(self, mock_db, db, cache):
+        assert run(cache.user("u2")) is None
+        mock_db.users.insert_one({"user_id": "u2", "email": "u2@x.com"})
+        assert run(cache.user("u2"))["email"] == "u2@x.com"
+
+
+class TestSessions:
+    """Test cached OAuth session lookups"""
+
+    def test_session(self, mock_db, db, cache):
+        now = datetime.now(timezone.utc)
+        mock_db.user_sessions.insert_many([
+            {"session_token": "live", "user_id": "u1", "expires_at": now + timedelta(days=1)},
+            {"session_token": "old", "user_id": "u1", "expires_at": now - timedelta(seconds=1)},
+        ])
+        assert run(cache.session_user_id("live")) == "u1"
+        assert run(cache.session_user_id("live")) == "u1"
+        assert db.calls == ["find_one"]
+        assert run(cache.session_user_id("old")) is None
+        assert run(cache.session_user_id("missing")) is None
+        assert set(cache.sessions) == {"live"}
+
+        # Logout
+        mock_db.user_sessions.delete_one({"session_token": "live"})
+        cache.invalidate_session("live")
+        assert run(cache.session_user_id("live")) is None
+
+    def test_expires_while_cached(self, cache):
+        cache.sessions["soon"] = ("u1", datetime.now(timezone.utc) - timedelta(seconds=1))
+        assert run(cache.session_user_id("soon")) is None
+        assert "soon" not in cache.sessions
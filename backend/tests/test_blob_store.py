@@ -0,0 +1,206 @@
+"""
+Test content-addressed, reference-counted image storage (blob_store.py)
+
+Tests:
+1. Identical bytes are uploaded once and referenced per page role
+2. Re-storing a page role is a no-op; new content re-points its reference
+3. sync_refs() releases cleared roles and re-points roles showing another blob
+4. Releasing pages, documents and users drops their refs and counts
+5. reconcile() repairs drifted ref counts
+6. GC only collects blobs unreferenced for longer than the grace period
+7. Failed deletes are put back; store() never reuses a blob being deleted
+
+Uses mongomock (`pip install mongomock`); skipped otherwise.
+"""
+import asyncio
+import hashlib
+import os
+import sys
+from datetime import timedelta
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import blob_store
+from blob_store import ACTIVE, DELETING, GRACE_PERIOD, BlobStore, _now
+from storage import MemoryStorage, blob_key
+
+
+class FlakyStorage(MemoryStorage):
+    """In-memory backend whose deletes of `failing` keys fail"""
+
+    def __init__(self):
+        super().__init__()
+        self.failing = set()
+
+    async def delete_objects(self, keys):
+        await super().delete_objects([key for key in keys if key not in self.failing])
+        return [key for key in keys if key in self.failing]
+
+
+def digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+@pytest.fixture
+def mock_db(mock_db):
+    mock_db.blobs.create_index("hash", unique=True)
+    mock_db.blob_refs.create_index("ref_id", unique=True)
+    return mock_db
+
+
+@pytest.fixture
+def storage():
+    return FlakyStorage()
+
+
+@pytest.fixture
+def blobs(db, storage):
+    return BlobStore(db, storage)
+
+
+def ref_counts(mock_db):
+    return {blob["hash"]: blob["ref_count"] for blob in mock_db.blobs.find()}
+
+
+def age(mock_db, data, by=GRACE_PERIOD + timedelta(minutes=1)):
+    """Pretend a blob was last used `by` ago"""
+    mock_db.blobs.update_one({"hash": digest(data)}, {"$set": {"last_used_at": _now() - by}})
+
+
+class TestStore:
+    """Test storing and deduplicating images"""
+
+    def test_dedup(self, mock_db, storage, blobs):
+        url = run(blobs.store(b"same", "u1", "d1", "p1"))
+        assert run(blobs.store(b"same", "u2", "d2", "p2")) == url
+        assert run(blobs.store(b"same", "u1", "d1", "p1", role="thumbnail")) == url
+        assert list(storage.objects) == [blob_key(digest(b"same"))]
+        assert ref_counts(mock_db) == {digest(b"same"): 3}
+        assert (blobs.uploads, blobs.dedup_hits, blobs.bytes_deduplicated) == (1, 2, 8)
+        assert blobs.hash_from_url(url) == digest(b"same")
+        assert blobs.hash_from_url(storage.public_url("users/u1/p1.jpg")) is None
+        assert blobs.hash_from_url("https://elsewhere/blobs/sha256/aa/x.jpg") is None
+
+    def test_repoint(self, mock_db, blobs):
+        run(blobs.store(b"old", "u1", "d1", "p1"))
+        run(blobs.store(b"old", "u1", "d1", "p1"))
+        assert ref_counts(mock_db) == {digest(b"old"): 1}
+        run(blobs.store(b"new", "u1", "d1", "p1"))
+        assert ref_counts(mock_db) == {digest(b"old"): 0, digest(b"new"): 1}
+        assert mock_db.blob_refs.find_one({"ref_id": "d1:p1:page"})["hash"] == digest(b"new")
+        assert mock_db.blob_refs.count_documents({}) == 1
+
+    def test_sync_refs(self, mock_db, storage, blobs):
+        image = run(blobs.store(b"marked", "u1", "d1", "p1"))
+        thumbnail = run(blobs.store(b"thumb", "u1", "d1", "p1", role="thumbnail"))
+        original = run(blobs.store(b"clean", "u1", "d1", "p1", role="original"))
+        run(blobs.store(b"other", "u1", "d1", "p2"))
+
+        # Unchanged pages are left alone
+        run(blobs.sync_refs("u1", "d1", [{
+            "page_id": "p1", "image_url": image, "thumbnail_url": thumbnail, "original_image_url": original,
+        }]))
+        assert ref_counts(mock_db) == {digest(d): 1 for d in (b"marked", b"thumb", b"clean", b"other")}
+
+        # Watermark removal: the image is now the original, which is no longer a role of its own
+        run(blobs.sync_refs("u1", "d1", [{"page_id": "p1", "image_url": original, "thumbnail_url": thumbnail}]))
+        assert mock_db.blob_refs.find_one({"ref_id": "d1:p1:page"})["hash"] == digest(b"clean")
+        assert mock_db.blob_refs.find_one({"ref_id": "d1:p1:original"}) is None
+        assert ref_counts(mock_db) == {digest(b"marked"): 0, digest(b"thumb"): 1, digest(b"clean"): 1, digest(b"other"): 1}
+
+        # Base64 fallback: every role is released; legacy keys do not count as blobs
+        run(blobs.sync_refs("u1", "d1", [
+            {"page_id": "p1", "image_base64": "aW1n"},
+            {"page_id": "p2", "image_url": storage.public_url("users/u1/p2.jpg")},
+        ]))
+        assert mock_db.blob_refs.count_documents({}) == 0
+        assert set(ref_counts(mock_db).values()) == {0}
+
+
+class TestRelease:
+    """Test dropping references"""
+
+    def test_release_counts(self, mock_db, blobs):
+        run(blobs.store(b"a", "u1", "d1", "p1"))
+        run(blobs.store(b"b", "u1", "d1", "p1", role="thumbnail"))
+        run(blobs.store(b"a", "u1", "d1", "p2"))
+        run(blobs.store(b"a", "u1", "d2", "p3"))
+        run(blobs.store(b"c", "u2", "d3", "p4"))
+
+        assert run(blobs.release_pages("d1", [])) == 0
+        assert run(blobs.release_pages("d1", ["p1"])) == 2
+        assert ref_counts(mock_db) == {digest(b"a"): 2, digest(b"b"): 0, digest(b"c"): 1}
+        assert run(blobs.release_document("d1")) == 1
+        assert run(blobs.release_user("u1")) == 1
+        assert run(blobs.release_document("d1")) == 0
+        assert ref_counts(mock_db) == {digest(b"a"): 0, digest(b"b"): 0, digest(b"c"): 1}
+
+        run(blobs.release_all())
+        assert mock_db.blob_refs.count_documents({}) == 0
+        assert set(ref_counts(mock_db).values()) == {0}
+
+    def test_reconcile(self, mock_db, blobs):
+        run(blobs.store(b"a", "u1", "d1", "p1"))
+        run(blobs.store(b"a", "u1", "d1", "p2"))
+        run(blobs.store(b"b", "u1", "d1", "p3"))
+        mock_db.blobs.update_one({"hash": digest(b"a")}, {"$set": {"ref_count": 7}})
+        mock_db.blobs.update_one({"hash": digest(b"b")}, {"$set": {"ref_count": -1}})
+        assert run(blobs.reconcile()) == 2
+        assert ref_counts(mock_db) == {digest(b"a"): 2, digest(b"b"): 1}
+        assert run(blobs.reconcile()) == 0
+
+
+class TestGarbageCollection:
+    """Test collecting unreferenced blobs"""
+
+    def test_grace_period(self, mock_db, storage, blobs):
+        run(blobs.store(b"kept", "u1", "d1", "p1"))
+        run(blobs.store(b"recent", "u1", "d1", "p2"))
+        run(blobs.store(b"old", "u1", "d1", "p3"))
+        run(blobs.release_pages("d1", ["p2", "p3"]))
+        age(mock_db, b"kept")
+        age(mock_db, b"old")
+        age(mock_db, b"recent", by=GRACE_PERIOD - timedelta(minutes=1))
+
+        assert run(blobs.collect_garbage()) == 1
+        assert set(ref_counts(mock_db)) == {digest(b"kept"), digest(b"recent")}
+        assert blob_key(digest(b"old")) not in storage.objects
+        assert run(blobs.collect_garbage()) == 0
+
+    def test_failed_delete_is_retried(self, mock_db, storage, blobs):
+        run(blobs.store(b"a", "u1", "d1", "p1"))
+        run(blobs.release_document("d1"))
+        age(mock_db, b"a")
+        storage.failing.add(blob_key(digest(b"a")))
+        assert run(blobs.collect_garbage()) == 0
+        assert mock_db.blobs.find_one({"hash": digest(b"a")})["state"] == ACTIVE
+        storage.failing.clear()
+        assert run(blobs.collect_garbage()) == 1
+        assert storage.objects == {}
+
+    def test_store_waits_for_deleting(self, mock_db, storage, blobs, monkeypatch):
+        monkeypatch.setattr(blob_store, "DELETING_WAIT_SECONDS", 0.2)
+        run(blobs.store(b"a", "u1", "d1", "p1"))
+        mock_db.blobs.update_one({"hash": digest(b"a")}, {"$set": {"state": DELETING}})
+        with pytest.raises(RuntimeError):
+            run(blobs.store(b"a", "u1", "d2", "p2"))
+        assert mock_db.blob_refs.count_documents({"document_id": "d2"}) == 0
+
+        # Once collection finishes, the same bytes are uploaded again
+        async def store_while_collected():
+            pending = asyncio.ensure_future(blobs.store(b"a", "u1", "d2", "p2"))
+            await asyncio.sleep(0.05)
+            mock_db.blobs.delete_one({"hash": digest(b"a")})
+            storage.objects.clear()
+            return await pending
+
+        run(store_while_collected())
+        assert blob_key(digest(b"a")) in storage.objects
+        blob = mock_db.blobs.find_one({"hash": digest(b"a")})
+        assert (blob["state"], blob["ref_count"]) == (ACTIVE, 1)
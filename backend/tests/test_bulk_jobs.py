@@ -0,0 +1,152 @@
+"""
+Test resumable background bulk jobs (bulk_jobs.py)
+
+Tests:
+1. A job walks every matching row in batches and writes them with bulk_write
+2. Rows of a batch run concurrently, bounded by the handler's concurrency
+3. Enqueueing again returns the active job; an empty job completes at once
+4. Failing rows are counted and skipped; the job still completes
+5. A job interrupted mid-way resumes from its saved cursor
+
+Uses mongomock (`pip install mongomock`); skipped otherwise.
+"""
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pymongo import UpdateOne
+
+import bulk_jobs as bulk_jobs_module
+from bulk_jobs import BulkHandler, BulkJobRunner, COMPLETED, PENDING, RUNNING
+
+
+class MarkDone(BulkHandler):
+    """Sets done=True on a user's pages; page_ids in `fail` raise"""
+
+    kind = "mark_done"
+    collection = "pages"
+    batch_size = 4
+    concurrency = 2
+
+    def __init__(self, fail=()):
+        self.fail = set(fail)
+        self.in_flight = self.max_in_flight = 0
+        self.batches = []
+
+    def query(self, user_id):
+        return {"user_id": user_id, "done": {"$ne": True}}
+
+    async def process(self, job, row):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(0)
+        self.in_flight -= 1
+        if row["page_id"] in self.fail:
+            raise ValueError("broken image")
+        return UpdateOne({"_id": row["_id"], "done": {"$ne": True}}, {"$set": {"done": True}})
+
+    async def after_batch(self, job, rows):
+        self.batches.append([row["page_id"] for row in rows])
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+@pytest.fixture
+def mock_db(mock_db):
+    mock_db.pages.insert_many([{"user_id": "u1", "page_id": f"p{i}"} for i in range(10)])
+    mock_db.pages.insert_one({"user_id": "u2", "page_id": "other"})
+    return mock_db
+
+
+def make_runner(db, handler):
+    runner = BulkJobRunner(db)
+    runner.register(handler)
+    return runner
+
+
+async def enqueue_and_drain(runner, kind="mark_done", user_id="u1"):
+    job = await runner.enqueue(kind, user_id)
+    claimed = await runner._claim()
+    if claimed:
+        await runner.process(claimed)
+    return await runner.get_job(job["job_id"])
+
+
+class TestProcessing:
+    """Test batching, concurrency and progress"""
+
+    def test_walks_all_rows(self, mock_db, db):
+        handler = MarkDone()
+        job = run(enqueue_and_drain(make_runner(db, handler)))
+        assert job["status"] == COMPLETED and not job["active"]
+        assert (job["total"], job["processed"], job["updated"], job["failed"]) == (10, 10, 10, 0)
+        assert [len(batch) for batch in handler.batches] == [4, 4, 2]
+        assert mock_db.pages.count_documents({"done": True}) == 10
+        assert mock_db.pages.find_one({"user_id": "u2"}).get("done") is None
+
+    def test_concurrency_is_bounded(self, db):
+        handler = MarkDone()
+        run(enqueue_and_drain(make_runner(db, handler)))
+        assert handler.max_in_flight == 2
+
+    def test_failed_rows_are_skipped(self, mock_db, db):
+        handler = MarkDone(fail={"p3"})
+        job = run(enqueue_and_drain(make_runner(db, handler)))
+        assert job["status"] == COMPLETED and (job["updated"], job["failed"]) == (9, 1)
+        assert "broken image" in job["last_error"]
+        assert mock_db.pages.find_one({"page_id": "p3"}).get("done") is None
+
+
+class TestQueue:
+    """Test enqueueing and resuming"""
+
+    def test_enqueue_returns_active_job(self, mock_db, db):
+        runner = make_runner(db, MarkDone())
+
+        async def scenario():
+            first = await runner.enqueue("mark_done", "u1")
+            second = await runner.enqueue("mark_done", "u1")
+            return first, second
+        first, second = run(scenario())
+        assert first["job_id"] == second["job_id"] and first["status"] == PENDING
+        assert mock_db.bulk_jobs.count_documents({}) == 1
+
+    def test_empty_job_completes_at_once(self, db):
+        runner = make_runner(db, MarkDone())
+        job = run(runner.enqueue("mark_done", "nobody"))
+        assert job["status"] == COMPLETED and job["total"] == 0
+        assert run(runner._claim()) is None
+
+    def test_resume_after_interruption(self, mock_db, make_db, monkeypatch):
+        calls = {"n": 0}
+
+        def flaky(name):
+            # The second batch's bulk_write fails once (e.g. a primary step-down)
+            if name == "bulk_write":
+                calls["n"] += 1
+                if calls["n"] == 2:
+                    raise ConnectionError("not primary")
+
+        handler = MarkDone()
+        runner = make_runner(make_db(hook=flaky), handler)
+        monkeypatch.setattr(bulk_jobs_module, "RETRY_BASE_SECONDS", 0)
+
+        job = run(enqueue_and_drain(runner))
+        assert job["status"] == PENDING and job["processed"] == 4 and job["attempts"] == 1
+        stored = mock_db.bulk_jobs.find_one({"job_id": job["job_id"]})
+        assert stored["cursor"] == mock_db.pages.find_one({"page_id": "p3"})["_id"]
+
+        async def resume():
+            claimed = await runner._claim()
+            assert claimed["status"] == RUNNING
+            await runner.process(claimed)
+            return await runner.get_job(job["job_id"])
+        job = run(resume())
+        assert job["status"] == COMPLETED and job["processed"] == 10
+        assert mock_db.pages.count_documents({"done": True}) == 10
@@ -0,0 +1,175 @@
+"""
+Test background storage deletion (deletion.py)
+
+Tests:
+1. Jobs are claimed once; a running job is claimed again only after its lease expires
+2. A job deletes its keys and prefixes in batches and records progress
+3. Keys that fail to delete are retried on the next attempt, after a backoff
+4. A job fails for good after MAX_ATTEMPTS
+5. The purge prefixes used by the admin resets remove what they should
+6. Without object storage nothing is queued
+
+Uses mongomock (`pip install mongomock`); skipped otherwise.
+"""
+import asyncio
+import os
+import sys
+from datetime import timedelta
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from deletion import COMPLETED, FAILED, MAX_ATTEMPTS, PENDING, RETRY_BASE_SECONDS, RUNNING, DeletionWorker, _now
+from storage import MemoryStorage, avatar_key, document_prefix, user_prefix
+
+
+class FlakyStorage(MemoryStorage):
+    """In-memory backend that records batch sizes and fails deletes of `failing` keys"""
+
+    def __init__(self):
+        super().__init__()
+        self.failing = set()
+        self.list_error = None
+        self.batches = []
+
+    async def delete_objects(self, keys):
+        self.batches.append(len(keys))
+        await super().delete_objects([key for key in keys if key not in self.failing])
+        return [key for key in keys if key in self.failing]
+
+    async def iter_keys(self, prefix="", page_size=1000):
+        if self.list_error:
+            raise self.list_error
+        async for batch in super().iter_keys(prefix, page_size):
+            yield batch
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def put(storage, *keys):
+    for key in keys:
+        run(storage.put_object(key, b"x"))
+
+
+@pytest.fixture
+def storage():
+    return FlakyStorage()
+
+
+@pytest.fixture
+def worker(db, storage):
+    return DeletionWorker(db, storage, batch_size=2)
+
+
+def job(mock_db, job_id):
+    return mock_db.deletion_jobs.find_one({"job_id": job_id})
+
+
+def make_due(mock_db, job_id):
+    """Skip the retry backoff"""
+    mock_db.deletion_jobs.update_one({"job_id": job_id}, {"$set": {"next_attempt_at": _now()}})
+
+
+def drain(worker):
+    """Process every due job, like the worker loop does"""
+    async def loop():
+        while True:
+            claimed = await worker._claim()
+            if not claimed:
+                return
+            await worker.process(claimed)
+    run(loop())
+
+
+class TestClaim:
+    """Test taking jobs off the queue"""
+
+    def test_claim_once(self, mock_db, worker):
+        first = run(worker.enqueue("document", "u1", "d1", prefixes=["users/u1/documents/d1/"]))
+        second = run(worker.enqueue("document", "u1", "d2", prefixes=["users/u1/documents/d2/"]))
+        claimed = run(worker._claim())
+        assert (claimed["job_id"], claimed["status"]) == (first, RUNNING)
+        assert run(worker._claim())["job_id"] == second
+        assert run(worker._claim()) is None
+
+    def test_expired_lease(self, mock_db, worker):
+        job_id = run(worker.enqueue("user", "u1", prefixes=["users/u1/"]))
+        run(worker._claim())
+        assert run(worker._claim()) is None
+        # The worker holding it died: once the lease runs out another one takes over
+        mock_db.deletion_jobs.update_one({"job_id": job_id}, {"$set": {"lease_until": _now() - timedelta(seconds=1)}})
+        assert run(worker._claim())["job_id"] == job_id
+
+    def test_no_storage(self, mock_db, db):
+        worker = DeletionWorker(db, None)
+        assert run(worker.enqueue("user", "u1", prefixes=["users/u1/"])) is None
+        assert mock_db.deletion_jobs.count_documents({}) == 0
+
+
+class TestProcess:
+    """Test draining jobs"""
+
+    def test_keys_and_prefixes(self, mock_db, storage, worker):
+        put(storage, avatar_key("u1"), avatar_key("u2"), *(f"{user_prefix('u1')}p{i}.jpg" for i in range(5)))
+        job_id = run(worker.enqueue("user", "u1", prefixes=[user_prefix("u1")], keys=[avatar_key("u1")]))
+        drain(worker)
+        assert list(storage.objects) == [avatar_key("u2")]
+        assert storage.batches == [1, 2, 2, 1]
+        finished = job(mock_db, job_id)
+        assert (finished["status"], finished["deleted_objects"]) == (COMPLETED, 6)
+        assert (finished["keys"], finished["prefixes"], finished["lease_until"]) == ([], [], None)
+
+    def test_partial_batch_failure(self, mock_db, storage, worker):
+        prefix = document_prefix("u1", "d1")
+        put(storage, *(f"{prefix}p{i}.jpg" for i in range(4)))
+        storage.failing.add(f"{prefix}p1.jpg")
+        job_id = run(worker.enqueue("document", "u1", "d1", prefixes=[prefix]))
+        drain(worker)
+
+        retrying = job(mock_db, job_id)
+        assert (retrying["status"], retrying["attempts"], retrying["deleted_objects"]) == (PENDING, 1, 3)
+        assert retrying["keys"] == retrying["failed_keys"] == [f"{prefix}p1.jpg"]
+        assert retrying["prefixes"] == []
+        delay = (retrying["next_attempt_at"] - _now()).total_seconds()
+        assert RETRY_BASE_SECONDS - 1 < delay <= RETRY_BASE_SECONDS
+        # Not due yet
+        drain(worker)
+        assert job(mock_db, job_id)["attempts"] == 1
+
+        storage.failing.clear()
+        make_due(mock_db, job_id)
+        drain(worker)
+        finished = job(mock_db, job_id)
+        assert (finished["status"], finished["deleted_objects"], finished["failed_keys"]) == (COMPLETED, 4, [])
+        assert storage.objects == {}
+
+    def test_backoff_and_max_attempts(self, mock_db, storage, worker):
+        storage.list_error = RuntimeError("listing failed")
+        job_id = run(worker.enqueue("user", "u1", prefixes=[user_prefix("u1")]))
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            make_due(mock_db, job_id)
+            drain(worker)
+            retrying = job(mock_db, job_id)
+            assert (retrying["attempts"], retrying["last_error"]) == (attempt, "listing failed")
+            if attempt < MAX_ATTEMPTS:
+                delay = (retrying["next_attempt_at"] - _now()).total_seconds()
+                assert delay > RETRY_BASE_SECONDS * 2 ** (attempt - 1) - 1
+        assert job(mock_db, job_id)["status"] == FAILED
+        make_due(mock_db, job_id)
+        assert run(worker._claim()) is None
+
+    def test_purge_prefixes(self, mock_db, storage, worker):
+        keys = [f"{user_prefix('u1')}p.jpg", "blobs/sha256/ab/abc.jpg", avatar_key("u1")]
+        put(storage, *keys)
+        # clear-documents: document images only
+        run(worker.enqueue("purge", prefixes=["users/", "blobs/"]))
+        drain(worker)
+        assert list(storage.objects) == [avatar_key("u1")]
+        # full reset: everything in the bucket
+        put(storage, *keys)
+        run(worker.enqueue("purge", prefixes=[""]))
+        drain(worker)
+        assert storage.objects == {}
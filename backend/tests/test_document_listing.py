@@ -0,0 +1,112 @@
+"""
+Test keyset-paginated document summaries (document_listing.py)
+
+Tests:
+1. Cursors round-trip and reject garbage
+2. Field selection always keeps the cursor key and rejects unknown fields
+3. Walking all pages returns every document once, newest first, including
+   documents that share an updated_at
+
+Pagination tests use mongomock (`pip install mongomock`); skipped otherwise.
+"""
+import asyncio
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from document_listing import build_query, decode_cursor, encode_cursor, list_summaries, select_fields
+
+
+@pytest.fixture
+def documents(mock_db, db):
+    base = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    for i in range(25):
+        mock_db.documents.insert_one({
+            "document_id": f"doc_{i:02d}",
+            "user_id": "u1" if i < 23 else "u2",
+            "name": f"Doc {i}",
+            "page_count": i,
+            "tags": ["a"],
+            "pages": [{"image_base64": "x" * 100}],
+            # Pairs of documents share a timestamp to exercise the tie-breaker
+            "updated_at": base + timedelta(minutes=i // 2),
+            "created_at": base,
+        })
+    return db.documents
+
+
+class TestCursor:
+    """Test cursor encoding and validation"""
+
+    def test_round_trip(self):
+        """A cursor decodes to the row it was built from"""
+        updated_at = datetime(2025, 3, 1, 12, 30, 15, 123000, tzinfo=timezone.utc)
+        cursor = encode_cursor({"updated_at": updated_at, "document_id": "doc_1"})
+        assert decode_cursor(cursor) == (updated_at, "doc_1")
+
+    def test_naive_timestamps_are_utc(self):
+        """Naive datetimes from MongoDB are treated as UTC"""
+        cursor = encode_cursor({"updated_at": datetime(2025, 3, 1), "document_id": "d"})
+        assert decode_cursor(cursor)[0] == datetime(2025, 3, 1, tzinfo=timezone.utc)
+
+    @pytest.mark.parametrize("cursor", ["not-a-cursor", "", "e30", "eyJ1IjoieCIsImQiOiJ5In0"])
+    def test_invalid_cursor(self, cursor):
+        """Garbage and tampered cursors raise ValueError"""
+        with pytest.raises(ValueError):
+            decode_cursor(cursor)
+
+    def test_query_bounds(self):
+        """Cursor queries bound updated_at and break ties on document_id"""
+        updated_at = datetime(2025, 3, 1, tzinfo=timezone.utc)
+        query = build_query("u1", encode_cursor({"updated_at": updated_at, "document_id": "d"}), folder_id="f")
+        assert query["user_id"] == "u1" and query["folder_id"] == "f"
+        assert query["updated_at"] == {"$lte": updated_at}
+        assert {"updated_at": updated_at, "document_id": {"$lt": "d"}} in query["$or"]
+
+
+class TestFieldSelection:
+    """Test the fields parameter"""
+
+    def test_default_is_all_fields(self):
+        assert "thumbnail_url" in select_fields(None)
+        assert "pages" not in select_fields(None)
+
+    def test_key_fields_always_included(self):
+        assert select_fields(["name"]) == ["document_id", "updated_at", "name"]
+
+    def test_unknown_field(self):
+        with pytest.raises(ValueError):
+            select_fields(["name", "pages"])
+
+
+class TestPagination:
+    """Test walking the listing with cursors"""
+
+    def test_walk_all_pages(self, documents):
+        """Every document of the user appears once, newest first"""
+        seen, cursor = [], None
+        while True:
+            page = asyncio.run(list_summaries(documents, "u1", cursor=cursor, limit=4))
+            seen.extend(page["documents"])
+            cursor = page["next_cursor"]
+            if not page["has_more"]:
+                assert cursor is None
+                break
+        ids = [row["document_id"] for row in seen]
+        assert len(ids) == 23 and len(set(ids)) == 23
+        keys = [(row["updated_at"], row["document_id"]) for row in seen]
+        assert keys == sorted(keys, reverse=True)
+
+    def test_summaries_exclude_pages(self, documents):
+        """Summaries never carry page data or the internal _id"""
+        page = asyncio.run(list_summaries(documents, "u1", limit=2))
+        assert all("pages" not in row and "_id" not in row for row in page["documents"])
+
+    def test_field_selection(self, documents):
+        """Only requested fields (plus the cursor key) are returned"""
+        page = asyncio.run(list_summaries(documents, "u1", limit=2, fields=["name"]))
+        assert set(page["documents"][0]) == {"document_id", "updated_at", "name"}
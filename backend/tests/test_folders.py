@@ -0,0 +1,177 @@
+"""
+Test nested folders and folder listing (folders.py)
+
+Tests:
+1. Every folder gets its document count from one aggregation
+2. Empty folders count 0; root documents and other users are not counted
+3. Subfolders record their ancestors; totals include subfolders
+4. Moving a folder rewrites the ancestors of its whole subtree
+5. Moves into the folder's own subtree or beyond MAX_DEPTH are rejected
+6. A move that races another move of the same folder fails with FolderConflict
+7. Deleting a folder moves documents to its parent, then deletes its subtree
+8. Ancestors are backfilled from parent_id, breaking cycles and dangling parents
+
+Uses mongomock (`pip install mongomock`); skipped otherwise.
+"""
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import folders as folders_module
+from folders import FolderConflict, FolderNotFound, FolderTree, FolderTreeError, ancestor_paths, list_folders
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+@pytest.fixture
+def library(mock_db):
+    """Three folders and some documents for u1, one of each for u2"""
+    mock_db.folders.insert_many([
+        {"folder_id": f"f{i}", "user_id": "u1", "name": f"Folder {i}"} for i in range(3)
+    ] + [{"folder_id": "other", "user_id": "u2", "name": "Other"}])
+    mock_db.documents.insert_many(
+        [{"document_id": f"a{i}", "user_id": "u1", "folder_id": "f0"} for i in range(4)]
+        + [{"document_id": "b", "user_id": "u1", "folder_id": "f1"}]
+        + [{"document_id": f"r{i}", "user_id": "u1", "folder_id": None} for i in range(2)]
+        + [{"document_id": "c", "user_id": "u2", "folder_id": "f0"}]
+    )
+    return mock_db
+
+
+class TestListFolders:
+    """Test folders with document counts"""
+
+    def test_counts(self, library, db):
+        folders = run(list_folders(db, "u1"))
+        assert {f["folder_id"]: f["document_count"] for f in folders} == {"f0": 4, "f1": 1, "f2": 0}
+        assert sorted(db.calls) == ["aggregate", "find"]
+
+    def test_user_without_folders(self, library, db):
+        assert run(list_folders(db, "nobody")) == []
+
+
+async def make_folder(tree, folder_id, parent_id=None, user_id="u1"):
+    ancestors = await tree.ancestors_for(user_id, parent_id)
+    await tree.db.folders.insert_one({
+        "folder_id": folder_id, "user_id": user_id, "name": folder_id,
+        "parent_id": parent_id, "ancestors": ancestors, "depth": len(ancestors),
+    })
+
+
+def build(db, spec):
+    """spec: [(folder_id, parent_id)] in creation order"""
+    tree = FolderTree(db)
+
+    async def create():
+        for folder_id, parent_id in spec:
+            await make_folder(tree, folder_id, parent_id)
+    run(create())
+    return tree
+
+
+def ancestors(mock_db):
+    return {f["folder_id"]: f["ancestors"] for f in mock_db.folders.find()}
+
+
+# a
+# +- b
+# |  +- c
+# |     +- d
+# +- e
+TREE = [("a", None), ("b", "a"), ("c", "b"), ("d", "c"), ("e", "a")]
+
+
+class TestFolderTree:
+    """Test nested folders"""
+
+    def test_ancestors_and_totals(self, mock_db, db):
+        tree = build(db, TREE)
+        assert ancestors(mock_db) == {"a": [], "b": ["a"], "c": ["a", "b"], "d": ["a", "b", "c"], "e": ["a"]}
+        mock_db.documents.insert_many([
+            {"document_id": "x1", "user_id": "u1", "folder_id": "d"},
+            {"document_id": "x2", "user_id": "u1", "folder_id": "b"},
+            {"document_id": "x3", "user_id": "u1", "folder_id": "e"},
+        ])
+        listed = {f["folder_id"]: (f["document_count"], f["total_document_count"]) for f in run(list_folders(tree.db, "u1"))}
+        assert listed == {"a": (0, 3), "b": (1, 2), "c": (0, 1), "d": (1, 1), "e": (1, 1)}
+        assert sorted(run(tree.subtree_ids("u1", "b"))) == ["b", "c", "d"]
+        folders, documents = run(tree.subtree("u1", "b"))
+        assert len(folders) == 3 and documents == 2
+        with pytest.raises(FolderNotFound):
+            run(tree.ancestors_for("u2", "a"))
+
+    def test_move_subtree(self, mock_db, db):
+        tree = build(db, TREE)
+        moved = run(tree.move("u1", "b", "e"))
+        assert sorted(moved) == ["b", "c", "d"]
+        assert ancestors(mock_db) == {"a": [], "b": ["a", "e"], "c": ["a", "e", "b"], "d": ["a", "e", "b", "c"], "e": ["a"]}
+        run(tree.move("u1", "c", None))
+        assert ancestors(mock_db)["d"] == ["c"] and mock_db.folders.find_one({"folder_id": "c"})["parent_id"] is None
+        assert mock_db.folders.find_one({"folder_id": "d"})["depth"] == 1
+
+    def test_invalid_moves(self, mock_db, db, monkeypatch):
+        tree = build(db, TREE)
+        with pytest.raises(FolderTreeError):
+            run(tree.move("u1", "a", "d"))
+        with pytest.raises(FolderTreeError):
+            run(tree.move("u1", "b", "b"))
+        monkeypatch.setattr(folders_module, "MAX_DEPTH", 4)
+        with pytest.raises(FolderTreeError):
+            run(tree.move("u1", "b", "e"))
+        with pytest.raises(FolderTreeError):
+            run(tree.ancestors_for("u1", "d"))
+        assert ancestors(mock_db)["d"] == ["a", "b", "c"]
+
+    def test_concurrent_move(self, mock_db, db, monkeypatch):
+        tree = build(db, TREE)
+        ancestors_for = tree.ancestors_for
+
+        async def moved_meanwhile(user_id, parent_id):
+            # Another request moves c to the top level while this one plans its move
+            mock_db.folders.update_one({"folder_id": "c"}, {"$set": {"parent_id": None, "ancestors": [], "depth": 0}})
+            return await ancestors_for(user_id, parent_id)
+
+        monkeypatch.setattr(tree, "ancestors_for", moved_meanwhile)
+        with pytest.raises(FolderConflict):
+            run(tree.move("u1", "c", "e"))
+        # The descendants were left alone
+        assert ancestors(mock_db)["d"] == ["a", "b", "c"]
+
+    def test_delete_subtree(self, mock_db, db):
+        tree = build(db, TREE)
+        mock_db.documents.insert_many([
+            {"document_id": "x1", "user_id": "u1", "folder_id": "d"},
+            {"document_id": "x2", "user_id": "u1", "folder_id": "b"},
+            {"document_id": "x3", "user_id": "u1", "folder_id": "e"},
+        ])
+        tree.db.calls.clear()
+        deleted, moved = run(tree.delete("u1", "b"))
+        assert sorted(deleted) == ["b", "c", "d"] and sorted(moved) == ["x1", "x2"]
+        # Documents leave the subtree before its folders are deleted
+        assert tree.db.calls.index("update_many") < tree.db.calls.index("delete_many")
+        assert sorted(ancestors(mock_db)) == ["a", "e"]
+        assert {d["document_id"]: d["folder_id"] for d in mock_db.documents.find()} == {"x1": "a", "x2": "a", "x3": "e"}
+
+    def test_backfill(self, mock_db, db):
+        mock_db.folders.insert_many([
+            {"folder_id": "a", "user_id": "u1", "parent_id": None},
+            {"folder_id": "b", "user_id": "u1", "parent_id": "a"},
+            {"folder_id": "c", "user_id": "u1", "parent_id": "b"},
+            {"folder_id": "orphan", "user_id": "u1", "parent_id": "gone"},
+            {"folder_id": "x", "user_id": "u2", "parent_id": "y"},
+            {"folder_id": "y", "user_id": "u2", "parent_id": "x"},
+        ])
+        tree = FolderTree(db)
+        assert run(tree.backfill_ancestors()) == 6
+        paths = ancestors(mock_db)
+        assert paths["c"] == ["a", "b"] and paths["orphan"] == []
+        assert mock_db.folders.find_one({"folder_id": "orphan"})["parent_id"] is None
+        # The cycle is broken: one of the two becomes top level
+        assert sorted([paths["x"], paths["y"]], key=len)[0] == []
+        assert ancestor_paths({"c": "b", "b": "a", "a": "gone"}) == {"a": [], "b": ["a"], "c": ["a", "b"]}
@@ -0,0 +1,64 @@
+"""
+Test conditional GET helpers (http_cache.py)
+
+Tests:
+1. ETags are strong, stable and change with any part
+2. If-None-Match matching: lists, weak prefixes and *
+3. not_modified() returns a bodiless 304 with the cache headers
+4. Fallback responses lose their ETag
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi import Request, Response
+
+from http_cache import PUBLIC, etag_matches, make_etag, not_modified, set_cache_headers, set_uncacheable
+
+
+def request_with(if_none_match=None):
+    headers = [(b"if-none-match", if_none_match.encode())] if if_none_match else []
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": headers})
+
+
+class TestEtags:
+    """Test ETag generation and matching"""
+
+    def test_strong_and_stable(self):
+        etag = make_etag("document", "d1", 3)
+        assert etag.startswith('"') and etag.endswith('"') and not etag.startswith("W/")
+        assert etag == make_etag("document", "d1", 3)
+        assert etag != make_etag("document", "d1", 4)
+
+    def test_dict_order_does_not_matter(self):
+        assert make_etag({"a": 1, "b": 2}) == make_etag({"b": 2, "a": 1})
+
+    def test_matching(self):
+        etag = make_etag("x")
+        assert etag_matches(etag, etag)
+        assert etag_matches(f'"other", {etag}', etag)
+        assert etag_matches(f"W/{etag}", etag)
+        assert etag_matches("*", etag)
+        assert not etag_matches('"other"', etag)
+        assert not etag_matches(None, etag)
+
+
+class TestResponses:
+    """Test 304 responses and header handling"""
+
+    def test_not_modified(self):
+        etag = make_etag("x")
+        response = not_modified(request_with(etag), etag, PUBLIC)
+        assert response.status_code == 304 and response.body == b""
+        assert response.headers["etag"] == etag and response.headers["cache-control"] == PUBLIC
+
+    def test_changed_resource_is_served(self):
+        assert not_modified(request_with('"stale"'), make_etag("x")) is None
+        assert not_modified(request_with(), make_etag("x")) is None
+
+    def test_uncacheable_fallback(self):
+        response = Response()
+        set_cache_headers(response, make_etag("x"))
+        set_uncacheable(response)
+        assert "etag" not in response.headers and response.headers["cache-control"] == "no-store"
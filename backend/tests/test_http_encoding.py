@@ -0,0 +1,125 @@
+"""
+Test response serialization and compression (http_encoding.py)
+
+Tests:
+1. FastJSONResponse renders compact UTF-8 JSON (orjson or stdlib)
+2. Accept-Encoding negotiation honours q-values and brotli availability
+3. Large JSON is gzip-compressed; small and binary responses are not
+4. Streaming responses are compressed chunk by chunk; small ones are not
+5. Compressed responses get a weak ETag and Vary: Accept-Encoding
+"""
+import gzip
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from starlette.applications import Starlette
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+import http_encoding
+from http_encoding import CompressionMiddleware, FastJSONResponse, choose_encoding
+
+BIG = {"documents": [{"document_id": f"doc_{i}", "name": "Rechnung März"} for i in range(200)]}
+
+
+def make_client():
+    async def big(request):
+        return FastJSONResponse(BIG, headers={"ETag": '"abc"'})
+
+    async def small(request):
+        return FastJSONResponse({"ok": True})
+
+    async def image(request):
+        return Response(b"\xff\xd8" * 5000, media_type="image/jpeg")
+
+    async def not_modified(request):
+        return Response(status_code=304, headers={"ETag": '"abc"'})
+
+    async def stream(request):
+        async def chunks():
+            for _ in range(50):
+                yield b"line of text\n" * 20
+        return StreamingResponse(chunks(), media_type="text/plain")
+
+    async def small_stream(request):
+        async def chunks():
+            yield b"{"
+            yield b"}"
+        return StreamingResponse(chunks(), media_type="application/json")
+
+    app = Starlette(routes=[
+        Route("/big", big), Route("/small", small), Route("/image", image),
+        Route("/304", not_modified), Route("/stream", stream), Route("/small-stream", small_stream),
+    ])
+    app.add_middleware(CompressionMiddleware)
+    return TestClient(app)
+
+
+class TestSerialization:
+    """Test FastJSONResponse rendering"""
+
+    def test_compact_utf8(self):
+        body = FastJSONResponse({"name": "März", "n": [1, 2]}).body
+        assert body == '{"name":"März","n":[1,2]}'.encode("utf-8")
+
+    def test_stdlib_fallback(self, monkeypatch):
+        monkeypatch.setattr(http_encoding, "orjson", None)
+        assert json.loads(FastJSONResponse(BIG).body) == BIG
+
+
+class TestNegotiation:
+    """Test Accept-Encoding parsing"""
+
+    def test_gzip(self, monkeypatch):
+        monkeypatch.setattr(http_encoding, "brotli", None)
+        assert choose_encoding("gzip, deflate, br") == "gzip"
+        assert choose_encoding("br;q=1.0, gzip;q=0") is None
+        assert choose_encoding("*") == "gzip"
+        assert choose_encoding("identity") is None
+        assert choose_encoding(None) is None
+
+    def test_brotli_preferred_when_available(self, monkeypatch):
+        monkeypatch.setattr(http_encoding, "brotli", object())
+        assert choose_encoding("gzip, br") == "br"
+        assert choose_encoding("gzip, br;q=0") == "gzip"
+
+
+class TestCompression:
+    """Test the compression middleware end to end (gzip)"""
+
+    @pytest.fixture(autouse=True)
+    def gzip_only(self, monkeypatch):
+        monkeypatch.setattr(http_encoding, "brotli", None)
+
+    def get(self, path):
+        # Read the raw bytes so the client does not transparently decode them
+        with make_client().stream("GET", path, headers={"Accept-Encoding": "gzip"}) as response:
+            return response, b"".join(response.iter_raw())
+
+    def test_large_json_is_compressed(self):
+        response, raw = self.get("/big")
+        assert response.headers["content-encoding"] == "gzip"
+        assert int(response.headers["content-length"]) == len(raw)
+        assert json.loads(gzip.decompress(raw)) == BIG
+        assert response.headers["etag"] == 'W/"abc"'
+        assert "Accept-Encoding" in response.headers["vary"]
+
+    @pytest.mark.parametrize("path", ["/small", "/image", "/304", "/small-stream"])
+    def test_passthrough(self, path):
+        response, _ = self.get(path)
+        assert "content-encoding" not in response.headers
+
+    def test_streaming(self):
+        response, raw = self.get("/stream")
+        assert response.headers["content-encoding"] == "gzip"
+        assert gzip.decompress(raw) == b"line of text\n" * 20 * 50
+
+    def test_no_accept_encoding(self):
+        response = make_client().get("/big", headers={"Accept-Encoding": "identity"})
+        assert "content-encoding" not in response.headers and response.json() == BIG
@@ -0,0 +1,118 @@
+"""
+Test the read-through image cache (image_cache.py)
+
+Tests:
+1. Second read of an unchanged object is a hit
+2. Overwritten objects (new ETag) are refetched
+3. LRU eviction keeps the cache under its byte limit
+4. Concurrent reads of one object share a single download
+5. Memory-mapped reads
+"""
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from image_cache import DiskImageCache
+from storage import MemoryStorage
+
+
+class CountingStorage(MemoryStorage):
+    """In-memory backend that counts downloads and adds a little latency"""
+
+    def __init__(self):
+        super().__init__()
+        self.downloads = 0
+
+    async def get_object(self, key):
+        self.downloads += 1
+        await asyncio.sleep(0.01)
+        return await super().get_object(key)
+
+
+@pytest.fixture
+def storage():
+    return CountingStorage()
+
+
+class TestDiskImageCache:
+    """Test cache hits, invalidation, eviction and coalescing"""
+
+    def test_hit_after_miss(self, storage, tmp_path):
+        """Unchanged objects are downloaded once"""
+        cache = DiskImageCache(storage, str(tmp_path))
+        asyncio.run(storage.put_object("a.jpg", b"a" * 100))
+        assert asyncio.run(cache.get("a.jpg")) == b"a" * 100
+        assert asyncio.run(cache.get("a.jpg")) == b"a" * 100
+        assert storage.downloads == 1
+        stats = cache.stats()
+        assert stats["hits"] == 1 and stats["misses"] == 1
+        assert stats["bytes_saved"] == 100
+        assert stats["hit_rate"] == 0.5
+
+    def test_new_etag_refetches(self, storage, tmp_path):
+        """Overwriting a key invalidates the cached version"""
+        cache = DiskImageCache(storage, str(tmp_path))
+        asyncio.run(storage.put_object("a.jpg", b"old"))
+        asyncio.run(cache.get("a.jpg"))
+        asyncio.run(storage.put_object("a.jpg", b"new"))
+        assert asyncio.run(cache.get("a.jpg")) == b"new"
+        assert storage.downloads == 2
+
+    def test_missing_object(self, storage, tmp_path):
+        """Missing objects raise KeyError like the storage backend"""
+        cache = DiskImageCache(storage, str(tmp_path))
+        with pytest.raises(KeyError):
+            asyncio.run(cache.get("missing.jpg"))
+
+    def test_lru_eviction(self, storage, tmp_path):
+        """Least recently used entries are evicted first"""
+        cache = DiskImageCache(storage, str(tmp_path), max_bytes=250)
+        for name in ("a", "b", "c"):
+            asyncio.run(storage.put_object(name, name.encode() * 100))
+        asyncio.run(cache.get("a"))
+        asyncio.run(cache.get("b"))
+        asyncio.run(cache.get("a"))  # a is now more recent than b
+        asyncio.run(cache.get("c"))  # evicts b
+        assert cache.stats()["size_bytes"] <= 250
+        assert cache.stats()["evictions"] == 1
+        downloads = storage.downloads
+        asyncio.run(cache.get("a"))
+        assert storage.downloads == downloads
+        asyncio.run(cache.get("b"))
+        assert storage.downloads == downloads + 1
+
+    def test_concurrent_reads_coalesce(self, storage, tmp_path):
+        """Parallel reads of one object trigger one download"""
+        cache = DiskImageCache(storage, str(tmp_path))
+        asyncio.run(storage.put_object("a.jpg", b"x" * 10))
+
+        async def read_many():
+            return await asyncio.gather(*(cache.get("a.jpg") for _ in range(5)))
+
+        assert asyncio.run(read_many()) == [b"x" * 10] * 5
+        assert storage.downloads == 1
+        assert cache.stats()["coalesced"] == 4
+
+    def test_mapped_view(self, storage, tmp_path):
+        """mapped() yields a zero-copy view of the cached file"""
+        cache = DiskImageCache(storage, str(tmp_path))
+        asyncio.run(storage.put_object("a.jpg", b"mapped-bytes"))
+
+        async def read():
+            async with cache.mapped("a.jpg") as view:
+                return bytes(view[:6])
+
+        assert asyncio.run(read()) == b"mapped"
+
+    def test_survives_restart(self, storage, tmp_path):
+        """Files from a previous process are reused"""
+        asyncio.run(storage.put_object("a.jpg", b"a" * 10))
+        asyncio.run(DiskImageCache(storage, str(tmp_path)).get("a.jpg"))
+        cache = DiskImageCache(storage, str(tmp_path))
+        asyncio.run(cache.get("a.jpg"))
+        assert storage.downloads == 1
+        assert cache.stats()["hits"] == 1
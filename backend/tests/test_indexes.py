@@ -0,0 +1,172 @@
+"""
+Test that hot queries are served by indexes (indexes.py)
+
+Builds the registered indexes in a scratch database and runs explain() on
+every hot query shape. A COLLSCAN anywhere in the winning plan fails the
+test; queries that sort must not need an in-memory SORT stage either.
+
+Requires a MongoDB server: set MONGO_TEST_URL (e.g. mongodb://localhost:27017);
+skipped otherwise. The scratch database is dropped afterwards.
+
+Tests:
+1. Every registered index builds
+2. No hot query uses a collection scan
+3. Sorted listings read the index in order (no blocking sort)
+"""
+import asyncio
+import os
+import sys
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+MONGO_TEST_URL = os.environ.get("MONGO_TEST_URL")
+if not MONGO_TEST_URL:
+    pytest.skip("MONGO_TEST_URL not set", allow_module_level=True)
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import MongoClient
+
+from document_listing import build_query, encode_cursor
+from indexes import ensure_indexes
+
+NOW = datetime.now(timezone.utc)
+
+# (collection, filter, sort, description); sort=None means unsorted
+HOT_QUERIES = [
+    ("users", {"user_id": "u1"}, None, "user by id"),
+    ("users", {"email": "u1@example.com"}, None, "login by email"),
+    ("users", {"apple_id": "apple-1"}, None, "Sign in with Apple"),
+    ("users", {"push_token": "ExponentPushToken[x]", "user_id": {"$ne": "u1"}}, None, "push token re-assignment"),
+    ("users", {}, [("created_at", -1)], "admin user list"),
+    ("user_sessions", {"session_token": "t1"}, None, "cookie session auth"),
+    ("web_access_sessions", {"session_id": "s1", "user_id": "u1"}, None, "web session status"),
+    ("web_access_sessions", {"user_id": "u1", "status": "pending", "expires_at": {"$gt": NOW}}, None, "pending web sessions"),
+    ("documents", {"document_id": "d1", "user_id": "u1"}, None, "document by id"),
+    ("documents", {"user_id": "u1"}, [("updated_at", -1)], "document list"),
+    ("documents", {"user_id": "u1", "folder_id": "f1"}, [("updated_at", -1)], "folder listing"),
+    ("documents", {"user_id": "u1", "tags": "work"}, [("updated_at", -1)], "tag listing"),
+    ("documents", {"user_id": "u1", "updated_at": {"$gt": NOW - timedelta(days=1)}}, [("updated_at", -1)], "manifest since"),
+    (
+        "documents",
+        build_query("u1", encode_cursor({"updated_at": NOW, "document_id": "d5"})),
+        [("updated_at", -1), ("document_id", -1)],
+        "summaries after cursor",
+    ),
+    ("documents", {"user_id": "u1", "search_grams": {"$all": ["inv", "nvo"]}}, None, "partial-word search"),
+    ("documents", {"user_id": "u1", "$text": {"$search": "invoice"}}, None, "full-text search"),
+    ("documents", {"user_id": "u1", "client_id": {"$in": ["c1", "c2"], "$type": "string"}}, None, "bulk create idempotency keys"),
+    ("pages", {"document_id": "d1"}, [("order", 1)], "pages of a document"),
+    ("pages", {"document_id": "d1", "page_id": "p1"}, None, "single page"),
+    ("pages", {"user_id": "u1", "has_watermark": True}, None, "watermarked pages"),
+    ("pages", {"user_id": "u1", "has_watermark": True, "_id": {"$gt": ObjectId("0" * 24)}}, [("_id", 1)], "watermark job batch"),
+    ("folders", {"user_id": "u1"}, None, "folders of a user"),
+    ("documents", {"user_id": "u1", "folder_id": {"$type": "string"}}, None, "folder document counts"),
+    ("folders", {"folder_id": "f1", "user_id": "u1"}, None, "folder by id"),
+    ("folders", {"user_id": "u1", "ancestors": "f1"}, [("depth", -1)], "folder descendants"),
+    ("folders", {"user_id": "u1", "$or": [{"folder_id": "f1"}, {"ancestors": "f1"}]}, None, "folder subtree"),
+    ("upload_sessions", {"upload_id": "up1", "user_id": "u1"}, None, "upload session"),
+    ("upload_sessions", {"status": "pending", "expires_at": {"$lte": NOW}}, None, "expired upload sweep"),
+    ("sync_changes", {"user_id": "u1", "seq": {"$gt": 10, "$lte": 50}}, [("seq", 1)], "sync changes since"),
+    ("sync_changes", {"user_id": "u1", "kind": "page", "document_id": {"$in": ["d1"]}}, None, "sync rows of a document"),
+    ("sync_changes", {"deleted": True, "changed_at": {"$lt": NOW}}, None, "sync tombstone purge"),
+    ("blobs", {"hash": "h1", "state": "active"}, None, "blob dedup lookup"),
+    ("blobs", {"state": "active", "ref_count": {"$lte": 0}, "last_used_at": {"$lt": NOW}}, None, "blob GC candidates"),
+    ("blob_refs", {"ref_id": "d1:p1:page"}, None, "blob reference"),
+    ("blob_refs", {"document_id": "d1"}, None, "release document blobs"),
+    ("storage_usage", {"user_id": "u1"}, None, "storage counter"),
+    ("storage_usage", {"user_id": {"$ne": "__global__"}}, [("bytes", -1)], "largest users"),
+    (
+        "deletion_jobs",
+        {"$or": [
+            {"status": "pending", "next_attempt_at": {"$lte": NOW}},
+            {"status": "running", "lease_until": {"$lte": NOW}},
+        ]},
+        None,
+        "deletion job claim",
+    ),
+    (
+        "bulk_jobs",
+        {"$or": [
+            {"status": "pending", "next_attempt_at": {"$lte": NOW}},
+            {"status": "running", "lease_until": {"$lte": NOW}},
+        ]},
+        None,
+        "bulk job claim",
+    ),
+    ("bulk_jobs", {"kind": "remove_watermarks", "user_id": "u1", "active": True}, None, "active bulk job"),
+    ("translations", {"language_code": "en"}, None, "translations"),
+    ("legal_pages", {"page_type": "privacy", "language_code": "en"}, None, "legal page"),
+    ("settings", {"key": "app_settings"}, None, "settings"),
+]
+
+
+def plan_stages(plan):
+    """All stage names in an explain() winning plan (classic and SBE formats)"""
+    stages = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        for value in plan.values():
+            stages.extend(plan_stages(value))
+    elif isinstance(plan, list):
+        for item in plan:
+            stages.extend(plan_stages(item))
+    return stages
+
+
+@pytest.fixture(scope="module")
+def db():
+    name = f"scanup_index_test_{uuid.uuid4().hex[:8]}"
+    sync_client = MongoClient(MONGO_TEST_URL, serverSelectionTimeoutMS=3000, tz_aware=True)
+    database = sync_client[name]
+
+    # A few rows per collection so the planner has real candidates to choose from
+    for i in range(20):
+        user_id = f"u{i % 3}"
+        database.users.insert_one({
+            "user_id": user_id + f"-{i}", "email": f"{i}@example.com", "created_at": NOW.isoformat(),
+        })
+        database.documents.insert_one({
+            "document_id": f"d{i}", "user_id": user_id, "folder_id": f"f{i % 2}", "tags": ["work", f"t{i}"],
+            "name": f"Invoice {i}", "ocr_full_text": "invoice total", "search_grams": ["inv", "nvo", "voi"],
+            "page_count": 1, "updated_at": NOW - timedelta(minutes=i), "created_at": NOW,
+        })
+        database.pages.insert_one({
+            "document_id": f"d{i}", "page_id": f"p{i}", "user_id": user_id, "order": 0, "has_watermark": i % 2 == 0,
+        })
+
+    async def build():
+        motor_client = AsyncIOMotorClient(MONGO_TEST_URL, tz_aware=True)
+        try:
+            return await ensure_indexes(motor_client[name])
+        finally:
+            motor_client.close()
+
+    result = asyncio.run(build())
+    yield database, result
+    sync_client.drop_database(name)
+    sync_client.close()
+
+
+class TestIndexes:
+    """Test the index registry against a real server"""
+
+    def test_all_indexes_build(self, db):
+        _, result = db
+        assert result["failed"] == 0
+
+    @pytest.mark.parametrize("collection, query, sort, description", HOT_QUERIES, ids=[q[3] for q in HOT_QUERIES])
+    def test_no_collection_scan(self, db, collection, query, sort, description):
+        database, _ = db
+        cursor = database[collection].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        stages = plan_stages(cursor.explain()["queryPlanner"]["winningPlan"])
+        assert "COLLSCAN" not in stages, f"{description}: {stages}"
+        if sort:
+            assert "SORT" not in stages, f"{description} needs an in-memory sort: {stages}"
@@ -0,0 +1,163 @@
+"""
+Test moving inline base64 page images to object storage (migration.py)
+
+Tests:
+1. Base64 images move to storage, keeping their sizes; the document follows
+2. Identical images are uploaded once through the blob store
+3. Pages stay untouched when their upload fails, and the error is recorded
+4. A restarted migration resumes after the last processed page
+5. A page edited during its upload keeps the edit, and the upload's blob
+   reference is released
+
+Uses mongomock (`pip install mongomock`); skipped otherwise.
+"""
+import asyncio
+import base64
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from blob_store import BlobStore
+from migration import MIGRATION_ID, PageStorageMigrator
+from page_store import PageStore
+from storage import MemoryStorage, page_key
+
+
+class HookedStorage(MemoryStorage):
+    """In-memory backend that can fail uploads or run a callback during one"""
+
+    def __init__(self):
+        super().__init__()
+        self.fail = False
+        self.during_upload = None
+
+    async def put_object(self, key, data, content_type="image/jpeg"):
+        if self.fail:
+            raise ConnectionError("storage unavailable")
+        if self.during_upload:
+            self.during_upload()
+        return await super().put_object(key, data, content_type)
+
+
+def b64(data):
+    return base64.b64encode(data).decode()
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+@pytest.fixture
+def mock_db(mock_db):
+    mock_db.blobs.create_index("hash", unique=True)
+    mock_db.blob_refs.create_index("ref_id", unique=True)
+    return mock_db
+
+
+@pytest.fixture
+def storage():
+    return HookedStorage()
+
+
+def migrator(db, storage, blobs=False):
+    blob_store = BlobStore(db, storage) if blobs else None
+    migration = PageStorageMigrator(db, storage, PageStore(db), blob_store, batch_size=2)
+    migration.images_per_second = 10_000
+    return migration
+
+
+def add_pages(mock_db, document_id, *images):
+    mock_db.documents.insert_one(
+        {"document_id": document_id, "user_id": "u1", "storage_type": "mongodb", "pages_split": True}
+    )
+    mock_db.pages.insert_many([
+        {"document_id": document_id, "user_id": "u1", "page_id": f"{document_id}p{i}", "order": i, "image_base64": b64(image)}
+        for i, image in enumerate(images)
+    ])
+
+
+def migrate(mock_db, migration):
+    mock_db.migrations.update_one(
+        {"migration_id": MIGRATION_ID}, {"$set": {"status": "running"}}, upsert=True
+    )
+    run(migration._run())
+    return mock_db.migrations.find_one({"migration_id": MIGRATION_ID})
+
+
+class TestMigrate:
+    """Test moving pages to object storage"""
+
+    def test_moves_base64(self, mock_db, db, storage):
+        add_pages(mock_db, "d1", b"one", b"two")
+        mock_db.pages.update_one({"page_id": "d1p0"}, {"$set": {"thumbnail_base64": b64(b"t")}})
+        state = migrate(mock_db, migrator(db, storage))
+
+        assert state["status"] == "completed"
+        assert (state["pages_migrated"], state["images_migrated"], state["bytes_moved"]) == (2, 3, 7)
+        page = mock_db.pages.find_one({"page_id": "d1p0"})
+        assert "image_base64" not in page and "thumbnail_base64" not in page
+        assert page["image_url"] == storage.public_url(page_key("u1", "d1", "d1p0", "page"))
+        assert (page["image_bytes"], page["thumbnail_bytes"]) == (3, 1)
+        assert storage.objects[page_key("u1", "d1", "d1p1", "page")]["data"] == b"two"
+        document = mock_db.documents.find_one({"document_id": "d1"})
+        assert document["storage_type"] == "memory"
+        assert document["thumbnail_url"] == storage.public_url(page_key("u1", "d1", "d1p0", "thumbnail"))
+
+    def test_dedup(self, mock_db, db, storage):
+        add_pages(mock_db, "d1", b"same", b"same")
+        add_pages(mock_db, "d2", b"same")
+        migrate(mock_db, migrator(db, storage, blobs=True))
+        assert len(storage.objects) == 1
+        urls = {page["image_url"] for page in mock_db.pages.find()}
+        assert len(urls) == 1
+        assert mock_db.blobs.find_one()["ref_count"] == 3
+
+    def test_upload_failure(self, mock_db, db, storage):
+        add_pages(mock_db, "d1", b"one")
+        storage.fail = True
+        state = migrate(mock_db, migrator(db, storage))
+        assert (state["pages_migrated"], state["images_migrated"], state["errors"]) == (1, 0, 1)
+        assert "storage unavailable" in state["last_error"]
+        page = mock_db.pages.find_one({"page_id": "d1p0"})
+        assert page["image_base64"] == b64(b"one")
+        assert "image_url" not in page
+        assert mock_db.documents.find_one({"document_id": "d1"})["storage_type"] == "mongodb"
+
+    def test_resume(self, mock_db, db, storage):
+        add_pages(mock_db, "d1", b"one", b"two", b"three")
+        done = mock_db.pages.find_one({"page_id": "d1p1"})["_id"]
+        # Stopped after the second page last time
+        mock_db.migrations.insert_one(
+            {"migration_id": MIGRATION_ID, "status": "running", "last_id": done, "pages_migrated": 2}
+        )
+        state = migrate(mock_db, migrator(db, storage))
+        assert state["pages_migrated"] == 3
+        assert list(storage.objects) == [page_key("u1", "d1", "d1p2", "page")]
+        assert "image_base64" in mock_db.pages.find_one({"page_id": "d1p0"})
+
+
+class TestConcurrentEdit:
+    """Test pages edited while being migrated"""
+
+    def test_edit_wins(self, mock_db, db, storage):
+        add_pages(mock_db, "d1", b"old")
+        storage.during_upload = lambda: mock_db.pages.update_one(
+            {"page_id": "d1p0"}, {"$set": {"image_base64": b64(b"edited")}}
+        )
+        state = migrate(mock_db, migrator(db, storage, blobs=True))
+        # The edit is left alone (and migrated on a later run)
+        assert state["images_migrated"] == 0
+        page = mock_db.pages.find_one({"page_id": "d1p0"})
+        assert (page["image_base64"], page.get("image_url")) == (b64(b"edited"), None)
+        assert mock_db.blob_refs.count_documents({}) == 0
+        assert mock_db.blobs.find_one()["ref_count"] == 0
+
+    def test_deleted_page(self, mock_db, db, storage):
+        add_pages(mock_db, "d1", b"old")
+        storage.during_upload = lambda: mock_db.pages.delete_one({"page_id": "d1p0"})
+        migrate(mock_db, migrator(db, storage, blobs=True))
+        assert mock_db.blob_refs.count_documents({}) == 0
+        assert mock_db.blobs.find_one()["ref_count"] == 0
@@ -0,0 +1,75 @@
+"""
+Test OCR word geometry (ocr_geometry.py)
+
+Tests:
+1. Building geometry from Tesseract image_to_data output
+2. Round trip through the stored compact format
+3. Word / phrase lookup with normalized highlight boxes
+4. Invisible PDF text layer rendering
+"""
+import os
+import sys
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ocr_geometry import WordGeometry, draw_text_layer
+
+TESSERACT_DATA = {
+    "text": ["", "Invoice", "No.", "", "Total:", "42,00"],
+    "conf": ["-1", "96.5", "90", "-1", "80", "70"],
+    "page_num": [1] * 6,
+    "block_num": [1] * 6,
+    "par_num": [1] * 6,
+    "line_num": [0, 1, 1, 0, 2, 2],
+    "left": [0, 10, 60, 0, 10, 80],
+    "top": [0, 10, 10, 0, 40, 40],
+    "width": [0, 40, 50, 0, 60, 30],
+    "height": [0, 20, 20, 0, 20, 20],
+}
+
+
+class TestWordGeometry:
+    """Test compact OCR geometry"""
+
+    def test_from_tesseract_skips_non_words(self):
+        """Only real words (conf >= 0, non-empty text) are kept"""
+        geometry = WordGeometry.from_tesseract(TESSERACT_DATA, 200, 100)
+        assert geometry.words == ["Invoice", "No.", "Total:", "42,00"]
+        assert geometry.text() == "Invoice No.\nTotal: 42,00"
+        assert geometry.mean_confidence() == 0.84
+
+    def test_round_trip(self):
+        """Stored dict decodes to the same arrays"""
+        geometry = WordGeometry.from_tesseract(TESSERACT_DATA, 200, 100)
+        restored = WordGeometry.from_dict(geometry.to_dict())
+        assert restored.words == geometry.words
+        assert restored.boxes.tolist() == geometry.boxes.tolist()
+        assert restored.conf.tolist() == geometry.conf.tolist()
+        assert restored.lines.tolist() == geometry.lines.tolist()
+
+    def test_from_dict_rejects_malformed(self):
+        """Mismatched arrays or unknown versions are ignored"""
+        stored = WordGeometry.from_tesseract(TESSERACT_DATA, 200, 100).to_dict()
+        assert WordGeometry.from_dict({**stored, "words": "one"}) is None
+        assert WordGeometry.from_dict({**stored, "v": 99}) is None
+        assert WordGeometry.from_dict(None) is None
+
+    def test_find_word_and_phrase(self):
+        """Lookups are case-insensitive and ignore surrounding punctuation"""
+        geometry = WordGeometry.from_tesseract(TESSERACT_DATA, 200, 100)
+        assert geometry.find("total") == [[2]]
+        assert geometry.find("invoice no") == [[0, 1]]
+        assert geometry.find("missing") == []
+        assert geometry.normalized_boxes([0]) == [[0.05, 0.1, 0.2, 0.2]]
+
+    def test_draw_text_layer(self):
+        """Text layer renders into a valid PDF"""
+        from reportlab.pdfgen import canvas
+
+        geometry = WordGeometry.from_tesseract(TESSERACT_DATA, 200, 100)
+        buffer = BytesIO()
+        pdf = canvas.Canvas(buffer)
+        draw_text_layer(pdf, geometry, 10, 10, 400, 200)
+        pdf.save()
+        assert buffer.getvalue().startswith(b"%PDF")
@@ -0,0 +1,235 @@
+"""
+Test page patch planning (page_patch.py) and the PATCH /documents/{id}/pages endpoint
+
+Tests:
+1. Reorder, insert and delete produce the right final order
+2. Only pages with image changes get steps
+3. Steps on one page accumulate; replace resets them
+4. Invalid patches are rejected before anything is written
+5. Filters render from the original: they never compound and "original" restores it
+6. Rotations turn the original with the image; pages without one fall back to the image
+7. A patch with a page missing its image is refused before any image is stored
+8. A patch whose write fails leaves blob refs matching the stored pages
+9. Page writers wait their turn: a held page lease makes them return 409
+
+The endpoint tests run the app over mongomock and MemoryStorage (see conftest.py).
+"""
+import base64
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+from io import BytesIO
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from page_patch import MAX_OPERATIONS, PagePatchError, plan_patch, render_page
+
+PAGES = ["p0", "p1", "p2", "p3"]
+
+
+class TestPlanPatch:
+    """Test the final order and touched pages of a plan"""
+
+    def test_reorder_touches_no_images(self):
+        plan = plan_patch(PAGES, [{"op": "reorder", "order": ["p3", "p2", "p1", "p0"]}])
+        assert plan.order == ["p3", "p2", "p1", "p0"]
+        assert plan.touched == [] and plan.deleted == []
+
+    def test_insert_and_delete(self):
+        plan = plan_patch(PAGES, [
+            {"op": "insert", "index": 1, "page": {"image_base64": "x"}},
+            {"op": "delete", "page_id": "p2"},
+            {"op": "insert", "page": {"image_base64": "y"}},
+        ])
+        first, last = plan.inserted
+        assert plan.order == ["p0", first, "p1", "p3", last]
+        assert plan.deleted == ["p2"]
+        assert plan.touched == [first, last]
+        assert plan.steps[first] == [("insert", {"image_base64": "x"})]
+
+    def test_inserted_then_deleted_page_disappears(self, monkeypatch):
+        monkeypatch.setattr("page_patch.new_page_id", lambda: "p_new")
+        plan = plan_patch(PAGES, [
+            {"op": "insert", "page": {}},
+            {"op": "delete", "page_id": "p_new"},
+        ])
+        assert plan.order == PAGES
+        assert plan.inserted == [] and plan.deleted == [] and plan.steps == {}
+
+    def test_steps_accumulate(self):
+        plan = plan_patch(PAGES, [
+            {"op": "rotate", "page_id": "p1", "degrees": 90},
+            {"op": "set_filter", "page_id": "p1", "filter": "bw"},
+            {"op": "rotate", "page_id": "p1", "degrees": -90},
+        ])
+        assert plan.steps == {"p1": [("rotate", 90), ("filter", "bw"), ("rotate", 270)]}
+
+    def test_full_turn_is_a_no_op(self):
+        plan = plan_patch(PAGES, [{"op": "rotate", "page_id": "p1", "degrees": 360}])
+        assert plan.touched == []
+
+    def test_replace_resets_steps(self):
+        plan = plan_patch(PAGES, [
+            {"op": "rotate", "page_id": "p1", "degrees": 90},
+            {"op": "replace", "page_id": "p1", "page": {"image_base64": "new"}},
+            {"op": "rotate", "page_id": "p1", "degrees": 180},
+        ])
+        assert plan.steps["p1"] == [("replace", {"image_base64": "new"}), ("rotate", 180)]
+
+    def test_delete_drops_pending_steps(self):
+        plan = plan_patch(PAGES, [
+            {"op": "rotate", "page_id": "p1", "degrees": 90},
+            {"op": "delete", "page_id": "p1"},
+        ])
+        assert plan.steps == {} and plan.deleted == ["p1"]
+
+
+class TestInvalidPatches:
+    """Test that bad patches raise PagePatchError"""
+
+    @pytest.mark.parametrize("operations", [
+        [],
+        [{"op": "explode"}],
+        [{"op": "delete", "page_id": "missing"}],
+        [{"op": "delete"}],
+        [{"op": "reorder", "order": ["p0", "p1"]}],
+        [{"op": "reorder", "order": ["p0", "p0", "p1", "p2"]}],
+        [{"op": "insert", "index": 9, "page": {}}],
+        [{"op": "insert"}],
+        [{"op": "rotate", "page_id": "p0", "degrees": 45}],
+        [{"op": "set_filter", "page_id": "p0", "filter": "sepia"}],
+        [{"op": "delete", "page_id": "p0"}, {"op": "rotate", "page_id": "p0", "degrees": 90}],
+        [{"op": "reorder", "order": PAGES}] * (MAX_OPERATIONS + 1),
+    ])
+    def test_rejected(self, operations):
+        with pytest.raises(PagePatchError):
+            plan_patch(PAGES, operations)
+
+
+def rotate(image, degrees):
+    return f"rot{degrees}({image})"
+
+
+def apply_filter(image, filter_type):
+    return f"{filter_type}({image})"
+
+
+def patch_page(page, operations):
+    """Plan and render one page the way PATCH /documents/{id}/pages does"""
+    plan = plan_patch(["p0"], [{**operation, "page_id": "p0"} for operation in operations])
+    steps = plan.steps["p0"]
+    image, original = render_page(page["original"], page["image"], page["filter"], steps, rotate, apply_filter)
+    filters = [value for kind, value in steps if kind == "filter"]
+    return {"image": image, "original": original, "filter": filters[-1] if filters else page["filter"]}
+
+
+class TestRenderPage:
+    """Test non-destructive rendering of rotate / set_filter steps"""
+
+    def test_filters_do_not_compound(self):
+        page = {"image": "src", "original": None, "filter": "original"}
+        page = patch_page(page, [{"op": "set_filter", "filter": "grayscale"}])
+        assert page == {"image": "grayscale(src)", "original": "src", "filter": "grayscale"}
+        page = patch_page(page, [{"op": "set_filter", "filter": "bw"}])
+        assert page["image"] == "bw(src)"
+        page = patch_page(page, [{"op": "set_filter", "filter": "original"}])
+        assert page["image"] == page["original"] == "src"
+
+    def test_rotation_keeps_original_aligned(self):
+        page = {"image": "grayscale(src)", "original": "src", "filter": "grayscale"}
+        page = patch_page(page, [{"op": "rotate", "degrees": 90}])
+        assert page == {"image": "grayscale(rot90(src))", "original": "rot90(src)", "filter": "grayscale"}
+        page = patch_page(page, [{"op": "set_filter", "filter": "original"}])
+        assert page["image"] == "rot90(src)"
+
+    def test_filtered_page_without_original(self):
+        # Filtered before originals were kept: the image is all there is
+        page = {"image": "bw(src)", "original": None, "filter": "bw"}
+        page = patch_page(page, [{"op": "rotate", "degrees": 180}])
+        assert page == {"image": "rot180(bw(src))", "original": None, "filter": "bw"}
+
+
+def jpeg(color) -> str:
+    from PIL import Image
+    buffer = BytesIO()
+    Image.new("RGB", (40, 60), color).save(buffer, format="JPEG")
+    return base64.b64encode(buffer.getvalue()).decode()
+
+
+def refs(mock_db):
+    return {row["ref_id"]: row["hash"] for row in mock_db.blob_refs.find()}
+
+
+def ref_counts(mock_db):
+    return {row["hash"]: row["ref_count"] for row in mock_db.blobs.find()}
+
+
+@pytest.fixture
+def document(api):
+    client, _ = api
+    response = client.post("/api/documents", json={
+        "name": "Scan", "pages": [{"image_base64": jpeg("white")}, {"image_base64": jpeg("black")}],
+    })
+    assert response.status_code == 200
+    return response.json()
+
+
+class TestPatchEndpoint:
+    """Test failures and concurrent writers around a page patch"""
+
+    def test_missing_image_stores_nothing(self, mock_db, api, document):
+        client, storage = api
+        before, objects = refs(mock_db), set(storage.objects)
+        first = document["pages"][0]["page_id"]
+        response = client.patch(f"/api/documents/{document['document_id']}/pages", json={"operations": [
+            {"op": "replace", "page_id": first, "page": {"image_base64": jpeg("red")}},
+            {"op": "insert", "page": {}},
+        ]})
+        assert response.status_code == 400
+        assert refs(mock_db) == before and set(storage.objects) == objects
+        assert "page_lease_until" not in mock_db.documents.find_one()
+
+    def test_failed_write_restores_refs(self, mock_db, api, document, monkeypatch):
+        import server
+        client, _ = api
+        before, counts = refs(mock_db), ref_counts(mock_db)
+        first, second = (page["page_id"] for page in document["pages"])
+
+        async def fail(*args, **kwargs):
+            raise ConnectionError("not primary")
+        monkeypatch.setattr(server.page_store, "apply_patch", fail)
+
+        with pytest.raises(ConnectionError):
+            client.patch(f"/api/documents/{document['document_id']}/pages", json={"operations": [
+                {"op": "replace", "page_id": first, "page": {"image_base64": jpeg("red")}},
+                {"op": "rotate", "page_id": second, "degrees": 90},
+                {"op": "insert", "page": {"image_base64": jpeg("green")}},
+            ]})
+        # Refs point at the stored images again; the new images are unreferenced
+        assert refs(mock_db) == before
+        assert {digest: count for digest, count in ref_counts(mock_db).items() if digest in counts} == counts
+        assert {count for digest, count in ref_counts(mock_db).items() if digest not in counts} == {0}
+        assert "page_lease_until" not in mock_db.documents.find_one()
+
+    def test_writers_respect_lease(self, mock_db, api, document):
+        client, _ = api
+        document_id, pages = document["document_id"], document["pages"]
+        held = datetime.now(timezone.utc) + timedelta(minutes=1)
+        mock_db.documents.update_one({}, {"$set": {"page_lease_id": "other", "page_lease_until": held}})
+
+        url = f"/api/documents/{document_id}"
+        assert client.patch(f"{url}/pages", json={"operations": [{"op": "delete", "page_id": pages[1]["page_id"]}]}).status_code == 409
+        assert client.put(url, json={"pages": pages[:1]}).status_code == 409
+        assert client.post(f"{url}/pages", json={"image_base64": jpeg("red")}).status_code == 409
+        assert client.post(f"{url}/ocr", params={"ocr_text": "text"}).status_code == 409
+        assert mock_db.pages.count_documents({}) == 2
+        # Edits that do not touch pages go ahead
+        assert client.put(url, json={"name": "Renamed"}).status_code == 200
+
+        # An expired lease is taken over
+        mock_db.documents.update_one({}, {"$set": {"page_lease_until": held - timedelta(minutes=2)}})
+        assert client.put(url, json={"pages": pages[:1]}).status_code == 200
+        assert mock_db.pages.count_documents({}) == 1
+        assert "page_lease_until" not in mock_db.documents.find_one()
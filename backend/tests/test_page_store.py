@@ -0,0 +1,132 @@
+"""
+Test pages stored in their own collection (page_store.py)
+
+Tests:
+1. insert numbers pages from `start`, fills content hashes and sets the cover
+2. replace rewrites pages in place and deletes only the pages it drops
+3. A read during replace never finds the document without its pages
+4. apply_patch inserts, rewrites, reorders and deletes in one bulk_write
+5. ensure_split moves embedded legacy pages on first access
+6. split_legacy moves every legacy document and records the migration
+
+Uses mongomock (`pip install mongomock`); skipped otherwise.
+"""
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from page_store import BACKFILL_ID, DOCUMENT_PROJECTION, PageStore, content_hash
+
+
+def page(page_id, image="aW1hZ2U=", **fields):
+    return {"page_id": page_id, "image_base64": image, **fields}
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+@pytest.fixture
+def mock_db(mock_db):
+    mock_db.pages.create_index([("document_id", 1), ("page_id", 1)], unique=True)
+    return mock_db
+
+
+@pytest.fixture
+def store(db):
+    return PageStore(db)
+
+
+def stored(mock_db, document_id="d1"):
+    return [row["page_id"] for row in mock_db.pages.find({"document_id": document_id}).sort("order", 1)]
+
+
+class TestWrites:
+    """Test page writes"""
+
+    def test_insert(self, mock_db, store):
+        mock_db.documents.insert_one({"document_id": "d1", "user_id": "u1"})
+        run(store.insert("d1", "u1", [page("p1", thumbnail_url="https://cdn/t1.jpg"), page("p2")]))
+        run(store.insert("d1", "u1", [page("p3")], start=2))
+        rows = list(mock_db.pages.find({"document_id": "d1"}).sort("order", 1))
+        assert [(row["page_id"], row["order"]) for row in rows] == [("p1", 0), ("p2", 1), ("p3", 2)]
+        assert rows[0]["user_id"] == "u1"
+        assert rows[0]["content_hash"] == content_hash(page("p1"))
+        assert mock_db.documents.find_one({"document_id": "d1"})["thumbnail_url"] == "https://cdn/t1.jpg"
+
+    def test_replace(self, mock_db, store):
+        mock_db.documents.insert_one({"document_id": "d1", "user_id": "u1", "page_count": 3})
+        run(store.insert("d1", "u1", [page("p1"), page("p2"), page("p3")]))
+        kept_id = mock_db.pages.find_one({"page_id": "p3"})["_id"]
+
+        removed = run(store.replace("d1", "u1", [page("p3", "bmV3"), page("p4")]))
+        assert removed == ["p1", "p2"]
+        assert stored(mock_db) == ["p3", "p4"]
+        row = mock_db.pages.find_one({"page_id": "p3"})
+        # Rewritten in place rather than deleted and inserted again
+        assert row["_id"] == kept_id
+        assert (row["image_base64"], row["order"]) == ("bmV3", 0)
+        assert mock_db.documents.find_one({"document_id": "d1"})["page_count"] == 2
+
+        assert run(store.replace("d1", "u1", [])) == ["p3", "p4"]
+        assert stored(mock_db) == []
+
+    def test_replace_never_empty(self, mock_db, make_db):
+        seen = []
+        store = PageStore(make_db(hook=lambda name: seen.append(len(stored(mock_db)))))
+        mock_db.documents.insert_one({"document_id": "d1", "user_id": "u1"})
+        mock_db.pages.insert_many([
+            {"document_id": "d1", "user_id": "u1", "page_id": f"p{i}", "order": i} for i in range(3)
+        ])
+        run(store.replace("d1", "u1", [page("p1"), page("p5")]))
+        assert seen and 0 not in seen
+        assert stored(mock_db) == ["p1", "p5"]
+
+    def test_apply_patch(self, mock_db, store):
+        mock_db.documents.insert_one({"document_id": "d1", "user_id": "u1"})
+        run(store.insert("d1", "u1", [page("p1"), page("p2"), page("p3")]))
+        run(store.apply_patch(
+            "d1", "u1",
+            order=["p3", "p4", "p1"],
+            pages={"p4": page("p4"), "p1": page("p1", "bmV3")},
+            deleted=["p2"],
+            current_order={"p1": 0, "p2": 1, "p3": 2},
+        ))
+        assert stored(mock_db) == ["p3", "p4", "p1"]
+        assert mock_db.pages.find_one({"page_id": "p1"})["image_base64"] == "bmV3"
+        assert mock_db.pages.find_one({"page_id": "p4"})["user_id"] == "u1"
+
+
+class TestLegacySplit:
+    """Test moving embedded pages of documents created before the split"""
+
+    def test_ensure_split(self, mock_db, store):
+        mock_db.documents.insert_one({
+            "document_id": "d1", "user_id": "u1",
+            "pages": [page("p1", thumbnail_url="https://cdn/t1.jpg"), page("p2")],
+        })
+        document = mock_db.documents.find_one({"document_id": "d1"}, DOCUMENT_PROJECTION)
+        run(store.ensure_split([document]))
+        assert (document["pages_split"], document["page_count"]) == (True, 2)
+        assert stored(mock_db) == ["p1", "p2"]
+        split = mock_db.documents.find_one({"document_id": "d1"})
+        assert "pages" not in split
+        assert (split["pages_split"], split["page_count"]) == (True, 2)
+        assert split["thumbnail_url"] == "https://cdn/t1.jpg"
+
+        # Already split: nothing moves twice
+        run(store.split_document("d1"))
+        assert mock_db.pages.count_documents({}) == 2
+
+    def test_split_legacy(self, mock_db, store):
+        mock_db.documents.insert_many([
+            {"document_id": f"d{i}", "user_id": "u1", "pages": [page(f"p{i}")]} for i in range(3)
+        ] + [{"document_id": "empty", "user_id": "u1", "pages": []}])
+        run(store._run())
+        assert mock_db.documents.count_documents({"pages_split": True}) == 4
+        assert [stored(mock_db, f"d{i}") for i in range(3)] == [["p0"], ["p1"], ["p2"]]
+        assert mock_db.migrations.find_one({"migration_id": BACKFILL_ID})["status"] == "completed"
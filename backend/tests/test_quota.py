@@ -0,0 +1,120 @@
+"""
+Test atomic scan / OCR quota reservations (quota.py)
+
+Tests:
+1. A reservation within the allowance counts it and is granted
+2. At the limit nothing is granted, with the daily or monthly message
+3. Counters from an earlier day / month roll over in the same update
+4. Partial reservations (bulk create) grant what is left
+5. Unlimited users are counted but never refused
+6. Release gives units back, but not into a day that has rolled over
+7. Concurrent reservations never spend more than the allowance
+
+Uses mongomock (`pip install mongomock`); skipped otherwise.
+"""
+import asyncio
+import os
+import sys
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from quota import Quota, Reservation, release, reserve
+
+
+QUOTA = Quota(
+    day_count="scans_today", day_key="last_scan_date", per_day=3, day_message="daily",
+    month_count="scans_this_month", month_key="scan_month", per_month=5, month_message="monthly",
+)
+
+NOW = datetime.now(timezone.utc)
+TODAY, MONTH = NOW.strftime("%Y-%m-%d"), NOW.strftime("%Y-%m")
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def add_user(mock_db, **counters):
+    mock_db.users.insert_one({"user_id": "u1", **counters})
+
+
+def counts(mock_db):
+    user = mock_db.users.find_one({"user_id": "u1"})
+    return user.get("scans_today"), user.get("scans_this_month")
+
+
+class TestReserve:
+    """Test reserving units of an allowance"""
+
+    def test_within_allowance(self, mock_db, db):
+        add_user(mock_db)
+        reservation = run(reserve(db, QUOTA, "u1"))
+        assert (reservation.granted, reservation.message) == (1, "")
+        assert counts(mock_db) == (1, 1)
+        user = mock_db.users.find_one({"user_id": "u1"})
+        assert (user["last_scan_date"], user["scan_month"]) == (TODAY, MONTH)
+
+    def test_refused_at_limit(self, mock_db, db):
+        add_user(mock_db, scans_today=3, last_scan_date=TODAY, scans_this_month=3, scan_month=MONTH)
+        reservation = run(reserve(db, QUOTA, "u1"))
+        assert (reservation.granted, reservation.message) == (0, "daily")
+        assert counts(mock_db) == (3, 3)
+
+        mock_db.users.update_one({"user_id": "u1"}, {"$set": {"scans_today": 0, "scans_this_month": 5}})
+        assert run(reserve(db, QUOTA, "u1")).message == "monthly"
+        assert counts(mock_db) == (0, 5)
+        # Two more do not fit today, though one would
+        mock_db.users.update_one({"user_id": "u1"}, {"$set": {"scans_today": 2, "scans_this_month": 2}})
+        assert run(reserve(db, QUOTA, "u1", 2)).granted == 0
+        assert run(reserve(db, QUOTA, "missing")).message == "User not found"
+
+    def test_rollover(self, mock_db, db):
+        add_user(mock_db, scans_today=3, last_scan_date="2020-01-01", scans_this_month=5, scan_month="2020-01")
+        assert run(reserve(db, QUOTA, "u1", 2)).granted == 2
+        assert counts(mock_db) == (2, 2)
+
+    def test_partial(self, mock_db, db):
+        add_user(mock_db, scans_today=1, last_scan_date=TODAY, scans_this_month=4, scan_month=MONTH)
+        reservation = run(reserve(db, QUOTA, "u1", 5, partial=True))
+        assert (reservation.granted, reservation.message) == (1, "monthly")
+        assert counts(mock_db) == (2, 5)
+        assert run(reserve(db, QUOTA, "u1", 5, partial=True)).granted == 0
+        assert counts(mock_db) == (2, 5)
+
+    def test_unlimited(self, mock_db, db):
+        add_user(mock_db, scans_today=3, last_scan_date=TODAY, scans_this_month=5, scan_month=MONTH)
+        assert run(reserve(db, QUOTA, "u1", 4, unlimited=True)).granted == 4
+        assert counts(mock_db) == (7, 9)
+
+
+class TestRelease:
+    """Test giving unused units back"""
+
+    def test_release(self, mock_db, db):
+        add_user(mock_db)
+        reservation = run(reserve(db, QUOTA, "u1", 3))
+        run(release(db, QUOTA, "u1", reservation, 2))
+        assert counts(mock_db) == (1, 1)
+        # Never more than was reserved
+        run(release(db, QUOTA, "u1", Reservation(1, TODAY, MONTH), 10))
+        assert counts(mock_db) == (0, 0)
+
+    def test_release_after_rollover(self, mock_db, db):
+        add_user(mock_db, scans_today=1, last_scan_date=TODAY, scans_this_month=4, scan_month=MONTH)
+        run(release(db, QUOTA, "u1", Reservation(2, "2020-01-01", MONTH)))
+        assert counts(mock_db) == (1, 2)
+
+
+class TestConcurrency:
+    """Test that racing requests cannot overspend"""
+
+    def test_concurrent_reservations(self, mock_db, db):
+        add_user(mock_db)
+
+        async def burst():
+            return await asyncio.gather(*(reserve(db, QUOTA, "u1") for _ in range(20)))
+
+        reservations = run(burst())
+        assert sum(r.granted for r in reservations) == 3
+        assert counts(mock_db) == (3, 3)
@@ -0,0 +1,102 @@
+"""
+Test document search helpers (search.py)
+
+Tests:
+1. Trigrams are case- and accent-insensitive and capped
+2. Snippets center on the first match and report highlight offsets
+3. Regex metacharacters in queries are matched literally
+4. Partial-word matches are verified, scoped per user and ranked
+
+Partial-match tests use mongomock (`pip install mongomock`); skipped otherwise.
+"""
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from search import DocumentSearch, highlight, normalize, query_terms, search_fields, snippet, trigrams
+
+
+@pytest.fixture
+def search(mock_db, db):
+    rows = [
+        ("d1", "u1", "Invoice March", "Total due 120 EUR"),
+        ("d2", "u1", "Notes", "See attached invoices for details"),
+        ("d3", "u1", "Receipt", "Café Zürich"),
+        ("d4", "u2", "Invoice April", ""),
+    ]
+    for document_id, user_id, name, text in rows:
+        mock_db.documents.insert_one({
+            "document_id": document_id, "user_id": user_id, "name": name,
+            "ocr_full_text": text, **search_fields(name, text),
+        })
+    return DocumentSearch(db)
+
+
+class TestTrigrams:
+    """Test trigram extraction"""
+
+    def test_case_and_accents(self):
+        assert normalize("Zürich CAFÉ") == "zurich cafe"
+        assert "zur" in trigrams("Zürich")
+
+    def test_words_are_not_joined(self):
+        """Grams never span two words"""
+        assert "ab " not in trigrams("ab cd") and trigrams("ab cd") == []
+
+    def test_cap(self):
+        assert len(trigrams(" ".join(f"w{i:05d}" for i in range(5000)), limit=100)) == 100
+
+
+class TestSnippets:
+    """Test snippet extraction and highlighting"""
+
+    def test_highlight_offsets(self):
+        text, marks = snippet("Total amount due: 120 EUR", ["due"])
+        assert [text[start:end] for start, end in marks] == ["due"]
+
+    def test_long_text_is_windowed(self):
+        body = "lorem " * 100 + "needle " + "ipsum " * 100
+        text, marks = snippet(body, ["needle"], width=80)
+        assert text.startswith("…") and text.endswith("…")
+        assert len(text) <= 82
+        assert [text[start:end] for start, end in marks] == ["needle"]
+
+    def test_no_match_starts_at_beginning(self):
+        text, marks = snippet("Hello world", ["absent"])
+        assert text == "Hello world" and marks == []
+
+    def test_empty_text(self):
+        assert snippet(None, ["x"]) == (None, [])
+
+    def test_metacharacters_are_literal(self):
+        """Regex syntax in queries is escaped"""
+        assert query_terms("a.*b (c") == ["a", "b", "c"]
+        assert highlight("cost (net) 5.00", ["(net)", "5.00"]) == [[5, 10], [11, 15]]
+
+
+class TestPartialMatches:
+    """Test trigram-backed partial-word search"""
+
+    def test_prefix_match(self, search):
+        results = asyncio.run(search._partial_matches({"user_id": "u1"}, ["invo"], [], 10))
+        assert [r["document_id"] for r in results] == ["d1", "d2"]  # name hit ranks first
+
+    def test_scoped_to_user(self, search):
+        results = asyncio.run(search._partial_matches({"user_id": "u2"}, ["invo"], [], 10))
+        assert [r["document_id"] for r in results] == ["d4"]
+
+    def test_all_terms_required(self, search):
+        results = asyncio.run(search._partial_matches({"user_id": "u1"}, ["invo", "marc"], [], 10))
+        assert [r["document_id"] for r in results] == ["d1"]
+
+    def test_accent_insensitive(self, search):
+        results = asyncio.run(search._partial_matches({"user_id": "u1"}, ["zuri"], [], 10))
+        assert [r["document_id"] for r in results] == ["d3"]
+
+    def test_excluded_and_short_terms(self, search):
+        assert asyncio.run(search._partial_matches({"user_id": "u1"}, ["invo"], ["d1", "d2"], 10)) == []
+        assert asyncio.run(search._partial_matches({"user_id": "u1"}, ["in"], [], 10)) == []
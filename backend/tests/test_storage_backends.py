@@ -0,0 +1,139 @@
+"""
+Test storage backends (storage.py)
+
+Tests:
+1. Key layout helpers
+2. Local-disk and in-memory backends share the same behaviour
+   (put/get/head, streaming, listing, prefix deletes)
+3. Presigned URL signatures for the local backends
+4. Mapping stored URLs back to keys
+"""
+import asyncio
+import os
+import sys
+import time
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage import (
+    LocalDiskStorage, MemoryStorage, S3Storage, create_storage,
+    avatar_key, document_prefix, page_key, user_prefix,
+)
+
+
+async def _chunks(*parts):
+    for part in parts:
+        yield part
+
+
+async def _collect(stream):
+    return b"".join([chunk async for chunk in stream])
+
+
+@pytest.fixture(params=["memory", "disk"])
+def storage(request, tmp_path):
+    if request.param == "memory":
+        return MemoryStorage(base_url="http://api.test/api/storage", signing_secret="secret")
+    return LocalDiskStorage(str(tmp_path), base_url="http://api.test/api/storage", signing_secret="secret")
+
+
+class TestKeyLayout:
+    """Test centralized key helpers"""
+
+    def test_keys(self):
+        """Page keys live under the document prefix, which lives under the user prefix"""
+        key = page_key("u1", "d1", "p1", "thumbnail")
+        assert key == "users/u1/documents/d1/thumbnail_p1.jpg"
+        assert key.startswith(document_prefix("u1", "d1"))
+        assert document_prefix("u1", "d1").startswith(user_prefix("u1"))
+        assert avatar_key("u1") == "avatars/u1/avatar.jpg"
+
+
+class TestBackends:
+    """Test behaviour shared by the local backends"""
+
+    def test_put_get_head(self, storage):
+        """Stored bytes read back with matching metadata"""
+        etag = asyncio.run(storage.put_object("a/b.jpg", b"hello", "image/jpeg"))
+        assert asyncio.run(storage.get_object("a/b.jpg")) == b"hello"
+        head = asyncio.run(storage.head_object("a/b.jpg"))
+        assert head == {"ContentLength": 5, "ContentType": "image/jpeg", "ETag": etag}
+        assert asyncio.run(storage.head_object("a/missing.jpg")) is None
+        with pytest.raises(KeyError):
+            asyncio.run(storage.get_object("a/missing.jpg"))
+
+    def test_streaming(self, storage):
+        """Streams written in chunks read back in chunks"""
+        asyncio.run(storage.put_stream("s/big.bin", _chunks(b"ab", b"cd", b"e")))
+        assert asyncio.run(_collect(storage.open_stream("s/big.bin", chunk_size=2))) == b"abcde"
+
+    def test_list_and_delete_prefix(self, storage):
+        """Prefix deletes remove every key under the prefix and nothing else"""
+        for page in range(5):
+            asyncio.run(storage.put_object(page_key("u1", "d1", str(page)), b"x"))
+        asyncio.run(storage.put_object(page_key("u2", "d2", "p"), b"y"))
+
+        async def list_all(prefix):
+            return [key async for keys in storage.iter_keys(prefix, page_size=2) for key in keys]
+
+        assert len(asyncio.run(list_all(user_prefix("u1")))) == 5
+        assert asyncio.run(storage.delete_prefix(user_prefix("u1"))) == 5
+        assert asyncio.run(list_all("")) == [page_key("u2", "d2", "p")]
+
+    def test_get_many(self, storage):
+        """Batch reads return None for missing keys"""
+        asyncio.run(storage.put_object("k1", b"1"))
+        assert asyncio.run(storage.get_many(["k1", "k2"])) == {"k1": b"1", "k2": None}
+
+    def test_presigned_put_signature(self, storage):
+        """Signatures bind method, key and expiry"""
+        url = storage.presigned_put_url("a/b.jpg", expires_in=60)
+        query = parse_qs(urlparse(url).query)
+        expires, signature = int(query["expires"][0]), query["signature"][0]
+        assert storage.verify_signature("PUT", "a/b.jpg", expires, signature)
+        assert not storage.verify_signature("GET", "a/b.jpg", expires, signature)
+        assert not storage.verify_signature("PUT", "a/c.jpg", expires, signature)
+        assert not storage.verify_signature("PUT", "a/b.jpg", int(time.time()) - 1, signature)
+
+    def test_key_from_url(self, storage):
+        """Public URLs map back to keys; foreign URLs do not"""
+        assert storage.key_from_url(storage.public_url("a/b.jpg")) == "a/b.jpg"
+        assert storage.key_from_url("https://elsewhere.test/a/b.jpg") is None
+        assert storage.key_from_url(None) is None
+
+
+class TestLocalDisk:
+    """Test local-disk specifics"""
+
+    def test_rejects_path_traversal(self, tmp_path):
+        """Keys cannot escape the storage root"""
+        disk = LocalDiskStorage(str(tmp_path / "root"), base_url="http://api.test", signing_secret="s")
+        with pytest.raises(ValueError):
+            asyncio.run(disk.put_object("../escape.jpg", b"x"))
+
+
+class TestS3Urls:
+    """Test S3 URL mapping without network access"""
+
+    def test_key_from_legacy_url(self):
+        """Both current and older region-less bucket URLs map back to keys"""
+        s3 = create_storage(
+            "s3", bucket="scanup", region="eu-west-1",
+            access_key_id="x", secret_access_key="x",
+        )
+        try:
+            assert isinstance(s3, S3Storage)
+            assert s3.key_from_url(s3.public_url("users/u/a.jpg")) == "users/u/a.jpg"
+            assert s3.key_from_url("https://scanup.s3.amazonaws.com/users/u/a.jpg?t=1") == "users/u/a.jpg"
+            assert s3.key_from_url("https://other.s3.amazonaws.com/users/u/a.jpg") is None
+        finally:
+            s3.close()
+
+    def test_no_backend(self):
+        """No backend configured means MongoDB storage"""
+        assert create_storage("") is None
+        with pytest.raises(ValueError):
+            create_storage("ftp")
@@ -0,0 +1,135 @@
+"""
+Test per-user and global storage accounting (storage_usage.py, page_store.py)
+
+Tests:
+1. base64_size is the decoded length, for plain base64 and data URLs
+2. Inserting pages records their sizes and counts them per user and globally
+3. Updating an image counts only the difference; moving it to storage keeps its size
+4. Replacing, patching and deleting pages subtract what they remove
+5. Deleting a user drops their counter and subtracts it from the total
+6. The reconciler sizes old pages and corrects drifted counters
+
+Uses mongomock (`pip install mongomock`); skipped otherwise.
+"""
+import asyncio
+import base64
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from page_store import PageStore
+from storage_usage import GLOBAL, StorageUsage, base64_size
+
+
+def b64(size):
+    return base64.b64encode(b"x" * size).decode()
+
+
+def page(page_id, image=1000, thumbnail=100):
+    return {"page_id": page_id, "image_base64": b64(image), "thumbnail_base64": b64(thumbnail)}
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+@pytest.fixture
+def stores(db):
+    usage = StorageUsage(db)
+    return PageStore(db, usage), usage
+
+
+def counters(mock_db):
+    return {row["user_id"]: (row["bytes"], row["pages"]) for row in mock_db.storage_usage.find()}
+
+
+class TestSizes:
+    """Test byte sizes of inline images"""
+
+    def test_base64_size(self):
+        for size in (0, 1, 2, 3, 1000, 1001):
+            assert base64_size(b64(size)) == size
+        assert base64_size("data:image/jpeg;base64," + b64(10)) == 10
+        assert base64_size(None) == 0
+
+
+class TestCounters:
+    """Test counters maintained by page writes"""
+
+    def test_insert(self, mock_db, stores):
+        pages, usage = stores
+        run(pages.insert("d1", "u1", [page("p1"), page("p2")]))
+        run(pages.insert_documents([{"document_id": "d2", "user_id": "u2", "pages": [page("p3", 500, 50)]}]))
+        row = mock_db.pages.find_one({"page_id": "p1"})
+        assert (row["image_bytes"], row["thumbnail_bytes"]) == (1000, 100)
+        assert counters(mock_db) == {"u1": (2200, 2), "u2": (550, 1), GLOBAL: (2750, 3)}
+        assert run(usage.get("u1")) == {"bytes": 2200, "pages": 2}
+        assert run(usage.totals()) == {"bytes": 2750, "pages": 3}
+
+    def test_update_counts_difference(self, mock_db, stores):
+        pages, _ = stores
+        run(pages.insert("d1", "u1", [page("p1")]))
+        assert run(pages.update("d1", "p1", {"image_base64": b64(3000)}))
+        assert counters(mock_db)["u1"] == (3100, 1)
+        # Moved to object storage: same image, same size
+        run(pages.update("d1", "p1", {"image_url": "https://cdn/p1.jpg"}, unset=["image_base64"]))
+        assert mock_db.pages.find_one({"page_id": "p1"})["image_bytes"] == 3000
+        assert counters(mock_db)["u1"] == (3100, 1)
+        # Thumbnail removed altogether
+        run(pages.update("d1", "p1", unset=["thumbnail_base64"]))
+        assert "thumbnail_bytes" not in mock_db.pages.find_one({"page_id": "p1"})
+        assert counters(mock_db)["u1"] == (3000, 1)
+        assert not run(pages.update("d1", "missing", {"image_base64": b64(10)}))
+        assert counters(mock_db)[GLOBAL] == (3000, 1)
+
+    def test_replace_patch_delete(self, mock_db, stores):
+        pages, _ = stores
+        run(pages.insert("d1", "u1", [page("p1"), page("p2")]))
+        run(pages.replace("d1", "u1", [page("p1", 2000)]))
+        assert counters(mock_db)["u1"] == (2100, 1)
+        run(pages.apply_patch(
+            "d1", "u1", order=["p3", "p1"], pages={"p3": page("p3", 400, 0)}, deleted=[], current_order={"p1": 0},
+        ))
+        assert counters(mock_db)["u1"] == (2500, 2)
+        run(pages.apply_patch(
+            "d1", "u1", order=["p1"], pages={"p1": page("p1", 100, 0)}, deleted=["p3"], current_order={"p3": 0, "p1": 1},
+        ))
+        assert counters(mock_db)["u1"] == (100, 1)
+        run(pages.delete_document("d1"))
+        assert counters(mock_db) == {"u1": (0, 0), GLOBAL: (0, 0)}
+
+    def test_delete_user(self, mock_db, stores):
+        pages, _ = stores
+        run(pages.insert("d1", "u1", [page("p1")]))
+        run(pages.insert("d2", "u2", [page("p2")]))
+        run(pages.delete_user("u1"))
+        assert counters(mock_db) == {"u2": (1100, 1), GLOBAL: (1100, 1)}
+
+
+class TestReconcile:
+    """Test the reconciler"""
+
+    def test_backfill_and_correct(self, mock_db, stores):
+        pages, usage = stores
+        run(pages.insert("d1", "u1", [page("p1")]))
+        # Written before sizes were recorded: inline base64, and a deduplicated blob
+        mock_db.pages.insert_many([
+            {"document_id": "d0", "user_id": "u1", "page_id": "old", "image_base64": b64(700)},
+            {"document_id": "d0", "user_id": "u2", "page_id": "blob",
+             "image_url": "https://cdn/blobs/sha256/ab/" + "ab" * 32 + ".jpg"},
+        ])
+        mock_db.blobs.insert_one({"hash": "ab" * 32, "size": 4096})
+        mock_db.storage_usage.insert_one({"user_id": "gone", "bytes": 5, "pages": 1})
+
+        class Storage:
+            def key_from_url(self, url):
+                return url.split("https://cdn/", 1)[1]
+
+        usage.storage = Storage()
+        result = run(usage.reconcile())
+        assert result == {"users": 2, "corrected": 3, "backfilled": 2}
+        assert mock_db.pages.find_one({"page_id": "old"})["image_bytes"] == 700
+        assert counters(mock_db) == {"u1": (1800, 2), "u2": (4096, 1), GLOBAL: (5896, 3)}
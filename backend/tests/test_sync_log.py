@@ -0,0 +1,185 @@
+"""
+Test the sync change feed (sync_log.py)
+
+Tests:
+1. Changes get increasing sequence numbers; a rewritten entity moves to the newest
+2. Changes page by `since` / `next_seq` with has_more
+3. Deleting a document leaves one tombstone and drops its page rows
+4. Reads stop below a pending (allocated but unwritten) sequence number
+5. The first sync seeds existing documents and pages with content hashes
+6. Purged tombstones raise the floor and send older cursors into a reset
+7. content_hash is the same for inline base64 and the blob URL of the same bytes
+8. Folder changes are logged without their password hash
+9. Documents created in bulk are logged with their pages in one allocation
+10. A client reading while changes are being recorded never skips one
+
+Uses mongomock (`pip install mongomock`); skipped otherwise.
+"""
+import asyncio
+import base64
+import hashlib
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sync_log as sync_log_module
+from page_store import PageStore, content_hash
+from sync_log import SyncLog
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+@pytest.fixture
+def log(mock_db, db):
+    feed = SyncLog(db, PageStore(db))
+    # Mark the user as seeded so tests start from an empty log
+    mock_db.sync_counters.insert_one({"user_id": "u1", "seq": 0, "floor_seq": 0, "seeded": True, "pending": []})
+    for document_id in ("d1", "d2"):
+        mock_db.documents.insert_one({"document_id": document_id, "user_id": "u1", "name": document_id, "page_count": 1})
+        mock_db.pages.insert_one({
+            "document_id": document_id, "user_id": "u1", "page_id": "p1", "order": 0,
+            "image_url": "https://cdn/x.jpg", "content_hash": "h", "image_base64": "never-sent",
+        })
+    return feed
+
+
+class TestRecording:
+    """Test sequence numbers and compaction"""
+
+    def test_sequence_and_compaction(self, log, mock_db):
+        run(log.documents_changed("u1", ["d1"]))
+        run(log.documents_changed("u1", ["d2"]))
+        run(log.documents_changed("u1", ["d1"]))
+        result = run(log.changes_since("u1", 0))
+        assert [(c["document_id"], c["seq"]) for c in result["changes"]] == [("d2", 2), ("d1", 3)]
+        assert result["current_seq"] == 3 and mock_db.sync_changes.count_documents({}) == 2
+
+    def test_page_data_has_hash_but_no_images(self, log):
+        run(log.pages_changed("u1", "d1", ["p1"]))
+        changes = run(log.changes_since("u1", 0))["changes"]
+        page = next(c for c in changes if c["kind"] == "page")
+        assert page["data"]["content_hash"] == "h" and "image_base64" not in page["data"]
+        assert "user_id" not in page["data"]
+
+    def test_pagination(self, log):
+        for _ in range(3):
+            run(log.pages_changed("u1", "d1", ["p1"]))
+            run(log.pages_changed("u1", "d2", ["p1"]))
+        first = run(log.changes_since("u1", 0, limit=3))
+        assert first["has_more"] and len(first["changes"]) == 3
+        second = run(log.changes_since("u1", first["next_seq"], limit=3))
+        assert not second["has_more"] and len(second["changes"]) == 1
+        assert second["next_seq"] == second["current_seq"]
+        assert run(log.changes_since("u1", second["next_seq"]))["changes"] == []
+
+    def test_document_tombstone(self, log, mock_db):
+        run(log.pages_changed("u1", "d1", ["p1"]))
+        mock_db.documents.delete_one({"document_id": "d1"})
+        run(log.documents_deleted("u1", ["d1"]))
+        changes = run(log.changes_since("u1", 0))["changes"]
+        assert changes == [{"seq": 3, "kind": "document", "document_id": "d1", "deleted": True}]
+
+    def test_folder_changes(self, log, mock_db):
+        mock_db.folders.insert_one({"folder_id": "f1", "user_id": "u1", "name": "Tax", "password_hash": "secret"})
+        run(log.folders_changed("u1", ["f1"]))
+        run(log.folders_changed("u1", ["f2"], deleted=True))
+        first, second = run(log.changes_since("u1", 0))["changes"]
+        assert first["kind"] == "folder" and first["data"] == {"folder_id": "f1", "name": "Tax"}
+        assert second == {"seq": 2, "kind": "folder", "folder_id": "f2", "deleted": True}
+        assert run(log.current_seq("u1")) == 2
+
+    def test_documents_created(self, log, mock_db):
+        run(log.documents_created("u1", {"d1": ["p1"], "d2": ["p1"]}))
+        changes = run(log.changes_since("u1", 0))["changes"]
+        assert [(c["kind"], c["document_id"]) for c in changes] == [
+            ("document", "d1"), ("page", "d1"), ("document", "d2"), ("page", "d2"),
+        ]
+        assert mock_db.sync_counters.find_one({"user_id": "u1"})["seq"] == 4
+
+    def test_page_tombstone(self, log):
+        run(log.pages_changed("u1", "d1", [], ["p9"]))
+        changes = run(log.changes_since("u1", 0))["changes"]
+        assert {"kind": "page", "page_id": "p9", "deleted": True}.items() <= changes[-1].items()
+
+
+class TestConsistency:
+    """Test pending allocations, seeding and tombstone retention"""
+
+    def test_pending_sequence_holds_back_reads(self, log, mock_db):
+        run(log.documents_changed("u1", ["d1"]))
+        now = datetime.now(timezone.utc)
+        # seq 2 allocated but not written yet; seq 3 already written
+        mock_db.sync_counters.update_one({"user_id": "u1"}, {"$set": {"seq": 3, "pending": [{"seq": 2, "at": now}]}})
+        mock_db.sync_changes.insert_one({
+            "user_id": "u1", "entity_id": "d2", "kind": "document", "document_id": "d2",
+            "page_id": None, "seq": 3, "deleted": False, "changed_at": now,
+        })
+        result = run(log.changes_since("u1", 0))
+        assert [c["seq"] for c in result["changes"]] == [1] and result["next_seq"] == 1
+
+        # Abandoned allocations stop blocking after PENDING_TIMEOUT
+        stale = now - sync_log_module.PENDING_TIMEOUT - timedelta(seconds=1)
+        mock_db.sync_counters.update_one({"user_id": "u1"}, {"$set": {"pending": [{"seq": 2, "at": stale}]}})
+        assert [c["seq"] for c in run(log.changes_since("u1", 1))["changes"]] == [3]
+
+    def test_reads_interleaved_with_recording(self, log, mock_db, make_db):
+        documents = ["d1", "d2", "d3", "d4"]
+        mock_db.documents.insert_many([{"document_id": d, "user_id": "u1", "name": d} for d in documents[2:]])
+        client = {"since": 0, "seen": []}
+
+        async def sync(call=None):
+            # A client following the feed between any two database calls of the writers
+            result = await log.changes_since("u1", client["since"])
+            client["seen"] += [change["seq"] for change in result["changes"]]
+            client["since"] = result["next_seq"]
+
+        db = make_db(hook=sync)
+        writer = SyncLog(db, PageStore(db))
+
+        async def write():
+            await asyncio.gather(*(writer.documents_changed("u1", [d]) for d in documents))
+            await sync()
+
+        run(write())
+        assert sorted(client["seen"]) == [1, 2, 3, 4] and client["since"] == 4
+
+    def test_first_sync_seeds_log(self, log, mock_db):
+        mock_db.sync_counters.delete_many({})
+        mock_db.pages.update_many({}, {"$unset": {"content_hash": ""}})
+        result = run(log.changes_since("u1", 0))
+        kinds = sorted((c["kind"], c["document_id"]) for c in result["changes"])
+        assert kinds == [("document", "d1"), ("document", "d2"), ("page", "d1"), ("page", "d2")]
+        page = next(c for c in result["changes"] if c["kind"] == "page")
+        assert page["data"]["content_hash"] == content_hash({"image_base64": "never-sent"})
+        assert mock_db.pages.count_documents({"content_hash": {"$exists": True}}) == 2
+
+    def test_purge_raises_floor(self, log, mock_db):
+        run(log.documents_changed("u1", ["d1"]))
+        run(log.documents_deleted("u1", ["d2"]))
+        old = datetime.now(timezone.utc) - sync_log_module.TOMBSTONE_RETENTION - timedelta(days=1)
+        mock_db.sync_changes.update_many({"deleted": True}, {"$set": {"changed_at": old}})
+        assert run(log.purge_tombstones()) == 1
+        assert run(log.changes_since("u1", 1))["reset"]
+        assert not run(log.changes_since("u1", 2))["reset"]
+        assert not run(log.changes_since("u1", 0))["reset"]
+
+
+class TestContentHash:
+    """Test page content hashes"""
+
+    def test_inline_and_blob_url_match(self):
+        data = b"jpeg bytes"
+        digest = hashlib.sha256(data).hexdigest()
+        inline = {"image_base64": base64.b64encode(data).decode()}
+        stored = {"image_url": f"https://cdn.example.com/blobs/sha256/{digest[:2]}/{digest}.jpg"}
+        assert content_hash(inline) == content_hash(stored) == digest
+
+    def test_legacy_url_and_empty_page(self):
+        assert content_hash({"image_url": "https://cdn/users/u1/d1/p1.jpg"}) != content_hash({"image_url": "https://cdn/users/u1/d1/p2.jpg"})
+        assert content_hash({}) is None
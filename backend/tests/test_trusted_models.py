@@ -0,0 +1,101 @@
+"""
+Test unvalidated responses for database rows (trusted_models.py)
+
+Tests:
+1. A shaped row renders to the same JSON as the validated model
+2. Missing fields get their defaults; mutable defaults are not shared
+3. Fields outside the model (_id, search fields, nested extras) are dropped
+4. Lists of rows and the stdlib fallback render the same
+"""
+import json
+import os
+import sys
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pydantic import BaseModel, Field
+
+import http_encoding
+from trusted_models import shape, trusted_response
+
+
+# Same shape as server.PageData / server.Document
+class Page(BaseModel):
+    page_id: str = Field(default_factory=lambda: "generated")
+    image_url: Optional[str] = None
+    ocr_words: Optional[Dict[str, Any]] = None
+    rotation: int = 0
+    created_at: datetime = Field(default_factory=lambda: datetime(2024, 1, 1, tzinfo=timezone.utc))
+
+
+class Doc(BaseModel):
+    document_id: str
+    name: str
+    folder_id: Optional[str] = None
+    tags: List[str] = []
+    pages: List[Page] = []
+    cover: Optional[Page] = None
+    updated_at: datetime
+
+
+NOW = datetime(2024, 5, 6, 7, 8, 9, 123000, tzinfo=timezone.utc)
+
+
+def row():
+    return {
+        "_id": "mongo-id", "document_id": "d1", "name": "Rechnung März", "tags": ["tax"],
+        "search_grams": ["rec", "ech"], "pages_split": True, "updated_at": NOW,
+        "pages": [
+            {"page_id": "p1", "image_url": "https://cdn/p1.jpg", "ocr_words": {"v": 1, "w": [[1, 2]]},
+             "created_at": NOW, "content_hash": "abc", "user_id": "u1"},
+            {"page_id": "p2", "rotation": 90, "created_at": datetime(2024, 5, 6, 7, 8, 9)},
+        ],
+    }
+
+
+def validated(model, data):
+    return json.loads(model(**data).model_dump_json())
+
+
+class TestShape:
+    """Test shaping rows to a model"""
+
+    def test_same_json_as_validated_model(self):
+        body = json.loads(trusted_response(Doc, row()).body)
+        assert body == validated(Doc, row())
+
+    def test_defaults(self):
+        shaped = shape(Doc, {"document_id": "d1", "name": "x", "updated_at": NOW, "pages": [{}]})
+        assert shaped["tags"] == [] and shaped["folder_id"] is None and shaped["cover"] is None
+        assert shaped["pages"][0]["page_id"] == "generated" and shaped["pages"][0]["rotation"] == 0
+        shaped["tags"].append("mutated")
+        assert shape(Doc, {"document_id": "d2", "name": "y", "updated_at": NOW})["tags"] == []
+
+    def test_extras_dropped(self):
+        shaped = shape(Doc, row())
+        assert "_id" not in shaped and "search_grams" not in shaped and "pages_split" not in shaped
+        assert set(shaped["pages"][0]) == set(Page.model_fields)
+
+    def test_nested_optional_model(self):
+        shaped = shape(Doc, {**row(), "cover": {"page_id": "c", "extra": 1}})
+        assert shaped["cover"] == {"page_id": "c", "image_url": None, "ocr_words": None, "rotation": 0,
+                                   "created_at": datetime(2024, 1, 1, tzinfo=timezone.utc)}
+
+
+class TestResponse:
+    """Test trusted_response rendering"""
+
+    def test_list(self):
+        response = trusted_response(Doc, [row(), row()], headers={"ETag": '"x"'})
+        assert json.loads(response.body) == [validated(Doc, row())] * 2
+        assert response.headers["etag"] == '"x"'
+
+    def test_stdlib_fallback(self, monkeypatch):
+        monkeypatch.setattr(http_encoding, "orjson", None)
+        body = json.loads(trusted_response(Doc, row()).body)
+        expected = validated(Doc, row())
+        # jsonable_encoder writes UTC as +00:00 where pydantic writes Z
+        assert body["updated_at"].replace("+00:00", "Z") == expected["updated_at"]
+        assert body["pages"][1] == expected["pages"][1]
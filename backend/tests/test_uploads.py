@@ -0,0 +1,212 @@
+"""
+Test direct-to-storage uploads (uploads.py and the /documents/uploads endpoints)
+
+Tests:
+1. check_objects reports missing, oversized and non-image objects
+2. read_upload checks the bytes it read, not what the client declared
+3. The sweeper expires overdue pending sessions and queues their objects,
+   but never touches committed or live sessions; stale commit claims are
+   handed back
+4. create -> PUT -> commit creates the document from server-owned copies,
+   counts one scan, and queues every staging object; a retry returns the
+   same document
+5. Only JPEG and PNG uploads are accepted, and oversized objects fail the commit
+6. A commit over the scan allowance is refused without using the session
+7. A page that fails its read check leaves the session pending and holds
+   no blob refs
+
+Uses mongomock (`pip install mongomock`); skipped otherwise. The endpoint
+tests run the app with MemoryStorage and mongomock in place of S3 / MongoDB.
+"""
+import asyncio
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+from io import BytesIO
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from deletion import DeletionWorker
+from storage import MemoryStorage
+from uploads import MAX_PAGE_BYTES, UploadRejected, UploadSweeper, check_objects, read_upload
+
+
+NOW = datetime.now(timezone.utc)
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def jpeg() -> bytes:
+    from PIL import Image
+    buffer = BytesIO()
+    Image.new("RGB", (40, 60), "white").save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+class TestCheckObjects:
+    """Test validation of uploaded objects"""
+
+    def test_check_objects(self):
+        ok = {"ContentLength": 10, "ContentType": "image/jpeg"}
+        assert check_objects(["p1", "p2"], [ok, {**ok, "ContentType": "image/png"}]) is None
+        assert check_objects(["p1", "p2"], [ok, None]) == (400, "Pages not uploaded: ['p2']")
+        assert check_objects(["p1"], [{**ok, "ContentLength": MAX_PAGE_BYTES + 1}])[0] == 413
+        assert check_objects(["p1"], [{**ok, "ContentType": "text/html"}])[0] == 415
+        assert check_objects(["p1"], [{"ContentLength": 10}])[0] == 415
+
+    def test_read_upload(self):
+        storage = MemoryStorage()
+        run(storage.put_object("k", jpeg()))
+        assert run(read_upload(storage, "p1", "k")) == (jpeg(), "image/jpeg")
+        run(storage.put_object("k", b"\x89PNG\r\n\x1a\n...", "image/jpeg"))
+        assert run(read_upload(storage, "p1", "k"))[1] == "image/png"
+
+        # Declared as JPEG, but is not; too large; gone
+        for data, status_code in [(b"<html>", 415), (b"\xff\xd8\xff" + bytes(MAX_PAGE_BYTES), 413)]:
+            run(storage.put_object("k", data, "image/jpeg"))
+            with pytest.raises(UploadRejected) as rejected:
+                run(read_upload(storage, "p1", "k"))
+            assert rejected.value.status_code == status_code
+        with pytest.raises(UploadRejected) as rejected:
+            run(read_upload(storage, "p1", "missing"))
+        assert rejected.value.status_code == 400
+
+
+class TestSweep:
+    """Test cleanup of uploads that were never committed"""
+
+    def test_sweep(self, mock_db, db):
+        storage = MemoryStorage()
+        sweeper = UploadSweeper(db, DeletionWorker(db, storage))
+        mock_db.upload_sessions.insert_many([
+            {"upload_id": upload_id, "user_id": "u1", "document_id": f"doc_{upload_id}", "status": status,
+             "expires_at": expires_at, "pages": [{"page_id": "p1", "key": f"users/u1/{upload_id}.jpg"}]}
+            for upload_id, status, expires_at in [
+                ("old", "pending", NOW - timedelta(minutes=1)),
+                ("live", "pending", NOW + timedelta(minutes=10)),
+                ("done", "committed", NOW - timedelta(minutes=1)),
+                ("stuck", "committing", NOW + timedelta(minutes=10)),
+            ]
+        ])
+        mock_db.upload_sessions.update_one(
+            {"upload_id": "stuck"}, {"$set": {"commit_lease_until": NOW - timedelta(minutes=1)}}
+        )
+        assert run(sweeper.sweep()) == 1
+        assert run(sweeper.sweep()) == 0
+        statuses = {row["upload_id"]: row["status"] for row in mock_db.upload_sessions.find()}
+        assert statuses == {"old": "expired", "live": "pending", "done": "committed", "stuck": "pending"}
+        job = mock_db.deletion_jobs.find_one()
+        assert (job["kind"], job["keys"], job["document_id"]) == ("upload", ["users/u1/old.jpg"], "doc_old")
+
+
+def upload(storage, session, data: bytes, content_type: str = "image/jpeg"):
+    """PUT every page of a session (MemoryStorage: straight into the store)"""
+    for page in session["pages"]:
+        key = storage.key_from_url(page["upload_url"])
+        run(storage.put_object(key, data, content_type))
+
+
+class TestEndpoints:
+    """Test create / commit against MemoryStorage"""
+
+    def test_create_and_commit(self, mock_db, api):
+        client, storage = api
+        session = client.post("/api/documents/uploads", json={"page_count": 2}).json()
+        assert len(session["pages"]) == 2
+        assert mock_db.upload_sessions.find_one()["status"] == "pending"
+        upload(storage, session, jpeg())
+
+        response = client.post(f"/api/documents/uploads/{session['upload_id']}/commit", json={"name": "Scan"})
+        assert response.status_code == 200
+        document = response.json()
+        assert document["document_id"] == session["document_id"]
+        assert [page["page_id"] for page in document["pages"]] == [page["page_id"] for page in session["pages"]]
+        assert mock_db.users.find_one({"user_id": "u1"})["scans_today"] == 1
+        assert mock_db.pages.count_documents({"document_id": session["document_id"]}) == 2
+        assert mock_db.upload_sessions.find_one()["status"] == "committed"
+
+        # Pages point at blobs, not at the keys the client can still write to
+        keys = [storage.key_from_url(page["upload_url"]) for page in session["pages"]]
+        for page in document["pages"]:
+            assert storage.key_from_url(page["image_url"]).startswith("blobs/")
+        job = mock_db.deletion_jobs.find_one({"kind": "upload"})
+        assert job["keys"] == keys
+        upload(storage, session, b"<html>", "image/jpeg")
+        assert storage.objects[storage.key_from_url(document["pages"][0]["image_url"])]["data"] == jpeg()
+
+        # A retried commit returns the same document without counting again
+        retry = client.post(f"/api/documents/uploads/{session['upload_id']}/commit", json={"name": "Scan"})
+        assert retry.status_code == 200
+        assert retry.json()["document_id"] == document["document_id"]
+        assert [page["image_url"] for page in retry.json()["pages"]] == [page["image_url"] for page in document["pages"]]
+        assert mock_db.users.find_one({"user_id": "u1"})["scans_today"] == 1
+        assert mock_db.documents.count_documents({}) == 1
+
+    def test_commit_some_pages(self, mock_db, api):
+        client, storage = api
+        session = client.post("/api/documents/uploads", json={"page_count": 2}).json()
+        upload(storage, session, jpeg())
+        first = session["pages"][0]["page_id"]
+        response = client.post(
+            f"/api/documents/uploads/{session['upload_id']}/commit", json={"name": "Scan", "pages": [{"page_id": first}]}
+        )
+        assert [page["page_id"] for page in response.json()["pages"]] == [first]
+        # The page left out is queued for deletion with the rest
+        job = mock_db.deletion_jobs.find_one({"kind": "upload"})
+        assert len(job["keys"]) == 2
+
+    def test_limits(self, mock_db, api):
+        client, storage = api
+        response = client.post("/api/documents/uploads", json={"page_count": 1, "content_type": "text/html"})
+        assert response.status_code == 422
+        png = client.post("/api/documents/uploads", json={"page_count": 1, "content_type": "image/png"})
+        assert png.json()["pages"][0]["headers"] == {"Content-Type": "image/png"}
+
+        session = client.post("/api/documents/uploads", json={"page_count": 1}).json()
+        commit = f"/api/documents/uploads/{session['upload_id']}/commit"
+        assert client.post(commit, json={"name": "Scan"}).status_code == 400
+        upload(storage, session, b"\xff" * (MAX_PAGE_BYTES + 1))
+        assert client.post(commit, json={"name": "Scan"}).status_code == 413
+        upload(storage, session, b"<html>", "text/html")
+        assert client.post(commit, json={"name": "Scan"}).status_code == 415
+        # Nothing was counted and the session can still be committed
+        assert "scans_today" not in mock_db.users.find_one({"user_id": "u1"})
+        upload(storage, session, jpeg())
+        assert client.post(commit, json={"name": "Scan"}).status_code == 200
+
+    def test_quota(self, mock_db, api):
+        client, storage = api
+        session = client.post("/api/documents/uploads", json={"page_count": 1}).json()
+        upload(storage, session, jpeg())
+        # The allowance is spent between starting the upload and committing it
+        today, month = NOW.strftime("%Y-%m-%d"), NOW.strftime("%Y-%m")
+        mock_db.users.update_one({"user_id": "u1"}, {"$set": {
+            "scans_today": 10_000, "last_scan_date": today, "scans_this_month": 10_000, "scan_month": month,
+        }})
+        response = client.post(f"/api/documents/uploads/{session['upload_id']}/commit", json={"name": "Scan"})
+        assert response.status_code == 403
+        assert mock_db.upload_sessions.find_one()["status"] == "pending"
+        assert mock_db.documents.count_documents({}) == 0
+
+    def test_failed_read(self, mock_db, api):
+        client, storage = api
+        session = client.post("/api/documents/uploads", json={"page_count": 2}).json()
+        upload(storage, session, jpeg())
+        # Passes the HEAD check, but the bytes are not an image
+        bad = storage.key_from_url(session["pages"][1]["upload_url"])
+        run(storage.put_object(bad, b"<html>", "image/jpeg"))
+        commit = f"/api/documents/uploads/{session['upload_id']}/commit"
+        assert client.post(commit, json={"name": "Scan"}).status_code == 415
+
+        assert mock_db.upload_sessions.find_one()["status"] == "pending"
+        assert mock_db.documents.count_documents({}) == 0
+        assert mock_db.blob_refs.count_documents({}) == 0
+        assert mock_db.users.find_one({"user_id": "u1"})["scans_today"] == 0
+        assert mock_db.deletion_jobs.count_documents({}) == 0
+
+        run(storage.put_object(bad, jpeg(), "image/jpeg"))
+        assert client.post(commit, json={"name": "Scan"}).status_code == 200
@@ -0,0 +1,86 @@
+"""
+Trusted Models
+Response bodies for rows that come from our own database, without pydantic.
+
+Returning `Document(**row)` from a route with response_model=Document
+validates every field twice (constructor, then FastAPI's response check)
+and then serializes it, which is most of the CPU of a large read (every
+base64 page string is copied and checked twice). Rows we wrote ourselves
+have already been validated on the way in, so read endpoints return
+trusted_response() instead: the row is shaped to the model (its fields only,
+defaults filled in, nested models shaped recursively) and rendered straight
+to JSON by FastJSONResponse.
+
+Never use this for data that did not come from the database (request
+bodies, third-party responses): those still go through the models.
+"""
+import typing
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Mapping, Optional, Tuple, Type
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel
+from pydantic_core import PydanticUndefined
+
+import http_encoding
+from http_encoding import FastJSONResponse
+
+# (name, default, default_factory, nested model, is list)
+FieldSpec = Tuple[str, Any, Optional[Callable[[], Any]], Optional[Type[BaseModel]], bool]
+
+
+def _nested(annotation: Any) -> Tuple[Optional[Type[BaseModel]], bool]:
+    """The model inside Model, List[Model] or Optional[...] of them"""
+    origin = typing.get_origin(annotation)
+    if origin is typing.Union:
+        for arg in typing.get_args(annotation):
+            if arg is not type(None):
+                return _nested(arg)
+        return None, False
+    if origin in (list, List):
+        inner, _ = _nested(typing.get_args(annotation)[0])
+        return inner, True
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return annotation, False
+    return None, False
+
+
+@lru_cache(maxsize=None)
+def _fields(model: Type[BaseModel]) -> Tuple[FieldSpec, ...]:
+    specs = []
+    for name, field in model.model_fields.items():
+        nested, is_list = _nested(field.annotation)
+        default = None if field.default is PydanticUndefined else field.default
+        specs.append((name, default, field.default_factory, nested, is_list))
+    return tuple(specs)
+
+
+def shape(model: Type[BaseModel], row: Mapping[str, Any]) -> Dict[str, Any]:
+    """`row` reduced to the fields of `model`, with defaults for missing ones"""
+    out: Dict[str, Any] = {}
+    for name, default, factory, nested, is_list in _fields(model):
+        if name in row:
+            value = row[name]
+        elif factory is not None:
+            value = factory()
+        else:
+            # Mutable defaults ([] / {}) are fresh per row, as in pydantic
+            value = default.copy() if isinstance(default, (list, dict)) else default
+        if nested is not None and value is not None:
+            value = [shape(nested, item) for item in value] if is_list else shape(nested, value)
+        out[name] = value
+    return out
+
+
+def trusted_response(
+    model: Type[BaseModel],
+    rows: Any,
+    status_code: int = 200,
+    headers: Optional[Mapping[str, str]] = None,
+) -> FastJSONResponse:
+    """JSON response for one database row or a list of rows, shaped as `model`"""
+    content = [shape(model, row) for row in rows] if isinstance(rows, list) else shape(model, rows)
+    if http_encoding.orjson is None:
+        # The stdlib encoder needs datetimes converted first
+        content = jsonable_encoder(content)
+    return FastJSONResponse(content, status_code=status_code, headers=headers)
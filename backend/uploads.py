@@ -0,0 +1,174 @@
+"""
+Direct Uploads
+Bookkeeping for page images that clients PUT straight to object storage.
+
+POST /documents/uploads records an upload session with one staging key per
+page (storage.upload_key) and hands out presigned PUT URLs; the commit
+endpoint turns the uploaded objects into a document. Presigned PUTs cannot
+bound the body size, so the commit checks every object before accepting it:
+
+- size: at most MAX_PAGE_BYTES per page
+- type: one of CONTENT_TYPES (signed into the URL, and sniffed from the bytes)
+
+A PUT URL stays valid until the session expires, so an object can be
+replaced after the commit looked at it. check_objects (HEAD) is only a quick
+reject; the commit then reads each object once (read_upload), checks the
+bytes it read, and stores that copy through the blob store under a
+server-owned key. The document never points at a staging key, and the
+staging keys are queued for deletion once the document exists, including
+those of pages the commit left out.
+
+Session status: pending -> committing -> committed. A failed commit puts
+the session back to pending so the client can retry; a commit that died
+holding the session loses it after COMMIT_LEASE_SECONDS.
+
+Sessions that are never committed leave their objects behind. The sweeper
+runs every SWEEP_INTERVAL_SECONDS and, for pending sessions past their
+expiry, flips the session to "expired" (conditionally, so it cannot race a
+commit) and queues the keys on the DeletionWorker. The TTL index on
+upload_sessions.expires_at (see indexes.py) removes the session rows a day
+after expiry, long after the sweep has run.
+"""
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPES = ("image/jpeg", "image/png")
+MAX_PAGE_BYTES = 25 * 1024 * 1024
+# Leading bytes of each accepted type
+SIGNATURES = {"image/jpeg": b"\xff\xd8\xff", "image/png": b"\x89PNG\r\n\x1a\n"}
+
+COMMIT_LEASE_SECONDS = 300
+
+SWEEP_INTERVAL_SECONDS = 600
+SWEEP_BATCH_SIZE = 100
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def check_objects(page_ids: List[str], heads: List[Optional[Dict[str, Any]]]) -> Optional[tuple]:
+    """(status_code, detail) for the first problem with uploaded objects, or None if all are fine"""
+    missing = [page_id for page_id, head in zip(page_ids, heads) if head is None]
+    if missing:
+        return 400, f"Pages not uploaded: {missing}"
+    too_large = [
+        page_id for page_id, head in zip(page_ids, heads) if (head.get("ContentLength") or 0) > MAX_PAGE_BYTES
+    ]
+    if too_large:
+        return 413, f"Pages larger than {MAX_PAGE_BYTES // (1024 * 1024)} MB: {too_large}"
+    wrong_type = [
+        page_id for page_id, head in zip(page_ids, heads)
+        if (head.get("ContentType") or "").split(";", 1)[0].strip().lower() not in CONTENT_TYPES
+    ]
+    if wrong_type:
+        return 415, f"Pages must be JPEG or PNG images: {wrong_type}"
+    return None
+
+
+class UploadRejected(Exception):
+    """An uploaded object failed the commit checks"""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def sniff_type(data: bytes) -> Optional[str]:
+    """Content type from the leading bytes, or None if it is not an accepted image"""
+    for content_type, signature in SIGNATURES.items():
+        if data.startswith(signature):
+            return content_type
+    return None
+
+
+async def read_upload(storage, page_id: str, key: str) -> Tuple[bytes, str]:
+    """
+    Read one uploaded object and check the bytes that were read. Returns
+    (data, content_type); raises UploadRejected. Stops reading as soon as the
+    object passes MAX_PAGE_BYTES, whatever its HEAD said.
+    """
+    chunks, size = [], 0
+    try:
+        async for chunk in storage.open_stream(key):
+            size += len(chunk)
+            if size > MAX_PAGE_BYTES:
+                raise UploadRejected(413, f"Pages larger than {MAX_PAGE_BYTES // (1024 * 1024)} MB: {[page_id]}")
+            chunks.append(chunk)
+    except KeyError:
+        raise UploadRejected(400, f"Pages not uploaded: {[page_id]}")
+    data = b"".join(chunks)
+    content_type = sniff_type(data)
+    if not content_type:
+        raise UploadRejected(415, f"Pages must be JPEG or PNG images: {[page_id]}")
+    return data, content_type
+
+
+class UploadSweeper:
+    """Deletes the objects of upload sessions that expired without a commit"""
+
+    def __init__(self, db, deletion_worker):
+        self.db = db
+        self.deletion_worker = deletion_worker
+        self._task: Optional[asyncio.Task] = None
+
+    async def sweep(self) -> int:
+        """Expire overdue pending sessions and queue their objects. Returns how many were expired."""
+        # Commits that died holding a session hand it back, to be retried or expired
+        await self.db.upload_sessions.update_many(
+            {"status": "committing", "commit_lease_until": {"$lte": _now()}},
+            {"$set": {"status": "pending"}, "$unset": {"commit_lease_until": ""}},
+        )
+        expired = 0
+        while True:
+            sessions = await self.db.upload_sessions.find(
+                {"status": "pending", "expires_at": {"$lte": _now()}},
+                {"_id": 0, "upload_id": 1, "user_id": 1, "document_id": 1, "pages": 1},
+            ).limit(SWEEP_BATCH_SIZE).to_list(None)
+            if not sessions:
+                break
+            for session in sessions:
+                # Conditional: a commit that claimed the session first keeps its objects
+                claimed = await self.db.upload_sessions.update_one(
+                    {"upload_id": session["upload_id"], "status": "pending"},
+                    {"$set": {"status": "expired", "expired_at": _now()}},
+                )
+                if not claimed.modified_count:
+                    continue
+                keys = [page["key"] for page in session.get("pages") or []]
+                if keys:
+                    await self.deletion_worker.enqueue(
+                        "upload", user_id=session["user_id"], document_id=session["document_id"], keys=keys
+                    )
+                expired += 1
+        if expired:
+            logger.info(f"✅ Expired {expired} uncommitted uploads")
+        return expired
+
+    def start(self) -> None:
+        if not self._task:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.sweep()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Upload sweep error: {e}")
+            await asyncio.sleep(SWEEP_INTERVAL_SECONDS)